@@ -157,9 +157,10 @@ def usage(text=None, retcode=2, full=False):
 Usage: /usr/lib/pkg.depotd [-a address] [-d inst_root] [-p port] [-s threads]
            [-t socket_timeout] [--cfg] [--content-root]
            [--disable-ops op[/1][,...]] [--debug feature_list]
-           [--image-root dir] [--log-access dest] [--log-errors dest]
-           [--mirror] [--nasty] [--nasty-sleep] [--proxy-base url]
-           [--readonly] [--ssl-cert-file] [--ssl-dialog] [--ssl-key-file]
+           [--image-root dir] [--index-workers count] [--log-access dest]
+           [--log-errors dest] [--mirror] [--nasty] [--nasty-sleep]
+           [--proxy-base url] [--readonly] [--ssl-cert-file] [--ssl-dialog]
+           [--ssl-key-file]
            [--sort-file-max-size size] [--writable-root dir]
 
         -a address      The IP address on which to listen for connections.  The
@@ -197,6 +198,9 @@ Usage: /usr/lib/pkg.depotd [-a address] [-d inst_root] [-p port] [-s threads]
                         hash=sha256, hash=sha1+sha512t_256, hash=sha512t_256
         --image-root    The path to the image whose file information will be
                         used as a cache for file data.
+        --index-workers The number of processes used to index packages when
+                        search indexes are built or rebuilt.  The default
+                        value is 1.
         --log-access    The destination for any access related information
                         logged by the depot process.  Possible values are:
                         stderr, stdout, none, or an absolute pathname.  The
@@ -295,8 +299,9 @@ if __name__ == "__main__":
         try:
                 long_opts = ["add-content", "cfg=", "cfg-file=",
                     "content-root=", "debug=", "disable-ops=", "exit-ready",
-                    "help", "image-root=", "log-access=", "log-errors=",
-                    "llmirror", "mirror", "nasty=", "nasty-sleep=",
+                    "help", "image-root=", "index-workers=", "log-access=",
+                    "log-errors=", "llmirror", "mirror", "nasty=",
+                    "nasty-sleep=",
                     "proxy-base=", "readonly", "rebuild", "refresh-index",
                     "set-property=", "ssl-cert-file=", "ssl-dialog=",
                     "ssl-key-file=", "sort-file-max-size=", "writable-root="]
@@ -379,6 +384,8 @@ if __name__ == "__main__":
                                 exit_ready = True
                         elif opt == "--image-root":
                                 ivalues["pkg"]["image_root"] = arg
+                        elif opt == "--index-workers":
+                                ivalues["pkg"]["index_workers"] = arg
                         elif opt.startswith("--log-"):
                                 prop = "log_{0}".format(opt.lstrip("--log-"))
                                 ivalues["pkg"][prop] = arg
@@ -856,12 +863,16 @@ if __name__ == "__main__":
         try:
                 sort_file_max_size = dconf.get_property("pkg",
                     "sort_file_max_size")
+                index_workers = dconf.get_property("pkg", "index_workers")
+                search_cache_size = dconf.get_property("pkg",
+                    "search_cache_size")
 
                 repo = sr.Repository(cfgpathname=repo_config_file,
                     log_obj=cherrypy, mirror=mirror, properties=repo_props,
                     read_only=readonly, root=inst_root,
                     sort_file_max_size=sort_file_max_size,
-                    writable_root=writable_root)
+                    writable_root=writable_root, index_workers=index_workers,
+                    search_cache_size=search_cache_size)
         except (RuntimeError, sr.RepositoryError) as _e:
                 emsg("pkg.depotd: {0}".format(_e))
                 sys.exit(1)
@@ -957,6 +968,9 @@ if __name__ == "__main__":
         if ll_mirror:
                 ds.DNSSD_Plugin(cherrypy.engine, gconf).subscribe()
 
+        # Send files, manifests and catalog parts using sendfile(2).
+        ds.Sendfile_Plugin(cherrypy.engine).subscribe()
+
         if reindex:
                 # Tell depot to update search indexes when possible;
                 # this is done as a background task so that packages
@@ -125,8 +125,106 @@ class FileAction(generic.Action):
                             hash_attr_val)
                         return lambda: data
                 finally:
-                        pkgplan.image.cleanup_downloads()
+                        pkgplan.image.imageplan.cleanup_downloads()
+
+        def __install_content(self, pkgplan, tfilefd, hash_val, hash_func):
+                """Private helper function to decompress the content of the
+                action into the file open as 'tfilefd' (which is closed), and
+                verify it against 'hash_val' using 'hash_func'."""
+
+                if not self.data:
+                        # The state of the filesystem changed after the
+                        # plan was prepared; attempt a one-off
+                        # retrieval of the data.
+                        self.data = self.__set_data(pkgplan)
+                stream = self.data()
+                tfile = os.fdopen(tfilefd, "wb")
+                try:
+                        shasum = misc.gunzip_from_stream(stream, tfile,
+                            hash_func)
+                except zlib.error as e:
+                        raise ActionExecutionError(self,
+                            details=_("Error decompressing payload: "
+                                "{0}").format(
+                                " ".join([str(a) for a in e.args])),
+                                error=e)
+                finally:
+                        tfile.close()
+                        stream.close()
+
+                if shasum != hash_val:
+                        raise ActionExecutionError(self,
+                            details=_("Action data hash verification "
+                            "failure: expected: {expected} computed: "
+                            "{actual} action: {action}").format(
+                                expected=hash_val,
+                                actual=shasum,
+                                action=self
+                           ))
+
+        def __clone_content(self, cpath, temp, tfilefd, hash_val, hash_func,
+            cached=True):
+                """Private helper function to create the content of the file
+                'temp' (open as 'tfilefd') by cloning the uncompressed content
+                at 'cpath', and verify it against 'hash_val' using
+                'hash_func'.  Returns False if that isn't possible, in which
+                case 'temp' is left empty.
+
+                'cached' indicates whether 'cpath' is in the clone cache,
+                rather than a file installed in another image.  Since the
+                cache may be shared, content in it which isn't a regular file
+                owned by the current user, or which can be written by other
+                users, is never used."""
+
+                try:
+                        st = os.lstat(cpath)
+                        size = self.attrs.get("pkg.size")
+                        if stat.S_ISREG(st.st_mode) and \
+                            (size is None or st.st_size == int(size)) and \
+                            (not cached or
+                            (st.st_uid == portable.get_userid() and
+                            not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))):
+                                portable.clonefile(cpath, temp)
+                                size = os.fstat(tfilefd).st_size
+                                shasum = misc.get_data_digest(temp,
+                                    length=size, hash_func=hash_func)[0]
+                                if shasum == hash_val:
+                                        return True
+                except EnvironmentError:
+                        pass
 
+                if os.fstat(tfilefd).st_size:
+                        os.ftruncate(tfilefd, 0)
+                return False
+
+        @staticmethod
+        def __cache_content(path, cpath):
+                """Private helper function to add the verified content of the
+                file 'path' to the clone cache as 'cpath'.  Failures are
+                ignored since the cache is only used to avoid decompressing
+                the same content again."""
+
+                cdir = os.path.dirname(cpath)
+                try:
+                        os.makedirs(cdir, misc.PKG_DIR_MODE)
+                except EnvironmentError as e:
+                        if e.errno != errno.EEXIST:
+                                return
+                try:
+                        fd, ctemp = tempfile.mkstemp(dir=cdir)
+                        os.close(fd)
+                except EnvironmentError:
+                        return
+
+                try:
+                        portable.clonefile(path, ctemp)
+                        os.chmod(ctemp, misc.PKG_RO_FILE_MODE)
+                        portable.rename(ctemp, cpath)
+                except EnvironmentError:
+                        try:
+                                portable.remove(ctemp)
+                        except EnvironmentError:
+                                pass
 
         def install(self, pkgplan, orig):
                 """Client-side method that installs a file."""
@@ -219,38 +317,28 @@ class FileAction(generic.Action):
                 if do_content and self.needsdata(orig, pkgplan):
                         tfilefd, temp = tempfile.mkstemp(dir=os.path.dirname(
                             final_path))
-                        if not self.data:
-                                # The state of the filesystem changed after the
-                                # plan was prepared; attempt a one-off
-                                # retrieval of the data.
-                                self.data = self.__set_data(pkgplan)
-                        stream = self.data()
-                        tfile = os.fdopen(tfilefd, "wb")
-                        try:
-                                # Always verify using the most preferred hash
-                                hash_attr, hash_val, hash_func  = \
-                                    digest.get_preferred_hash(self)
-                                shasum = misc.gunzip_from_stream(stream, tfile,
-                                    hash_func)
-                        except zlib.error as e:
-                                raise ActionExecutionError(self,
-                                    details=_("Error decompressing payload: "
-                                        "{0}").format(
-                                        " ".join([str(a) for a in e.args])),
-                                        error=e)
-                        finally:
-                                tfile.close()
-                                stream.close()
-
-                        if shasum != hash_val:
-                                raise ActionExecutionError(self,
-                                    details=_("Action data hash verification "
-                                    "failure: expected: {expected} computed: "
-                                    "{actual} action: {action}").format(
-                                        expected=hash_val,
-                                        actual=shasum,
-                                        action=self
-                                   ))
+                        # Always verify using the most preferred hash
+                        hash_attr, hash_val, hash_func  = \
+                            digest.get_preferred_hash(self)
+                        cpath = pkgplan.image.get_clone_cache_path(hash_attr,
+                            hash_val)
+                        if cpath and self.__clone_content(cpath, temp,
+                            tfilefd, hash_val, hash_func):
+                                os.close(tfilefd)
+                        else:
+                                # Try the same file in other images before
+                                # decompressing the content.
+                                if any(self.__clone_content(ipath, temp,
+                                    tfilefd, hash_val, hash_func, cached=False)
+                                    for ipath in
+                                    pkgplan.image.get_clone_image_paths(
+                                    self.attrs["path"])):
+                                        os.close(tfilefd)
+                                else:
+                                        self.__install_content(pkgplan,
+                                            tfilefd, hash_val, hash_func)
+                                if cpath:
+                                        self.__cache_content(temp, cpath)
 
                 else:
                         temp = final_path
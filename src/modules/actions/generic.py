@@ -692,6 +692,11 @@ class Action(object):
                         try:
                                 os.mkdir(p, fs.st_mode)
                         except OSError as e:
+                                if e.errno == errno.EEXIST and \
+                                    self.__is_dir(p):
+                                        # Created by an action being
+                                        # executed concurrently.
+                                        continue
                                 if e.errno != errno.ENOTDIR:
                                         raise
                                 err_txt = _("Unable to create {path}; a "
@@ -715,7 +720,11 @@ class Action(object):
                 mode = kw.get("mode", fs.st_mode)
                 uid = kw.get("uid", fs.st_uid)
                 gid = kw.get("gid", fs.st_gid)
-                os.mkdir(path, mode)
+                try:
+                        os.mkdir(path, mode)
+                except OSError as e:
+                        if e.errno != errno.EEXIST or not self.__is_dir(path):
+                                raise
                 os.chmod(path, mode)
                 try:
                         portable.chown(path, uid, gid)
@@ -723,6 +732,15 @@ class Action(object):
                         if e.errno != errno.EPERM:
                                 raise
 
+        @staticmethod
+        def __is_dir(path):
+                """Returns whether 'path' is a directory and not a link."""
+
+                try:
+                        return stat.S_ISDIR(os.lstat(path).st_mode)
+                except OSError:
+                        return False
+
         def get_varcet_keys(self):
                 """Return the names of any facet or variant tags in this
                 action."""
@@ -33,9 +33,11 @@ import datetime
 import errno
 import fnmatch
 import hashlib
+import mmap
 import os
 import six
 import stat
+import struct
 import threading
 import types
 
@@ -199,6 +201,287 @@ class _JSONWriter(object):
                         self.__sha_1.update(l)
 
 
+class _BinaryPartWriter(object):
+        """Private helper class used to serialize catalog part data into the
+        compact binary sidecar format read by _BinaryPart.
+
+        The sidecar consists of a fixed header, a publisher table, a stem
+        table, an entry table, a string table and a blob area.  Publisher
+        and stem records are sorted so that lookups can be done by binary
+        search, and each entry record references the version string and
+        the JSON-encoded remainder of the catalog entry so that only the
+        entries actually requested need to be decoded."""
+
+        def __init__(self, data, pathname, json_pathname):
+                self.__data = data
+                self.pathname = pathname
+                self.json_pathname = json_pathname
+
+        def save(self):
+                """Serializes and stores the provided data in binary format."""
+
+                strtab = bytearray()
+                blobs = bytearray()
+                pub_recs = []
+                stem_recs = []
+                entry_recs = []
+
+                def add_str(s):
+                        b = s.encode("utf-8")
+                        off = len(strtab)
+                        strtab.extend(b)
+                        return off, len(b)
+
+                # Any entries starting with "_" are part of the reserved
+                # catalog namespace and are not recorded in the sidecar.
+                pubs = sorted(
+                    (pub.encode("utf-8"), pub)
+                    for pub in self.__data
+                    if not pub[0] == "_"
+                )
+                for bpub, pub in pubs:
+                        pkg_list = self.__data[pub]
+                        off, slen = add_str(pub)
+                        pub_recs.append((off, slen, len(stem_recs),
+                            len(pkg_list)))
+
+                        for bstem, stem in sorted(
+                            (stem.encode("utf-8"), stem) for stem in pkg_list):
+                                ver_list = pkg_list[stem]
+                                off, slen = add_str(stem)
+                                stem_recs.append((off, slen, len(entry_recs),
+                                    len(ver_list)))
+
+                                for entry in ver_list:
+                                        voff, vlen = add_str(entry["version"])
+                                        blob = json.dumps(dict(
+                                            (k, v)
+                                            for k, v in six.iteritems(entry)
+                                            if k != "version"
+                                        )).encode("utf-8")
+                                        entry_recs.append((voff, vlen,
+                                            len(blobs), len(blob)))
+                                        blobs.extend(blob)
+
+                st = os.stat(self.json_pathname)
+                pubs_off = _BinaryPart.HEADER.size
+                stems_off = pubs_off + len(pub_recs) * _BinaryPart.PUB.size
+                entries_off = stems_off + \
+                    len(stem_recs) * _BinaryPart.STEM.size
+                strtab_off = entries_off + \
+                    len(entry_recs) * _BinaryPart.ENTRY.size
+                blobs_off = strtab_off + len(strtab)
+
+                # Write to a temporary file first and then rename it into
+                # place so that concurrent readers never see a partial file.
+                tmp_pathname = self.pathname + ".new"
+                try:
+                        with open(tmp_pathname, "wb") as bfile:
+                                bfile.write(_BinaryPart.HEADER.pack(
+                                    _BinaryPart.MAGIC, _BinaryPart.VERSION,
+                                    st.st_size, st.st_mtime, st.st_ino,
+                                    len(pub_recs), len(stem_recs),
+                                    len(entry_recs), pubs_off, stems_off,
+                                    entries_off, strtab_off, blobs_off))
+                                for rec in pub_recs:
+                                        bfile.write(_BinaryPart.PUB.pack(*rec))
+                                for rec in stem_recs:
+                                        bfile.write(_BinaryPart.STEM.pack(*rec))
+                                for rec in entry_recs:
+                                        bfile.write(
+                                            _BinaryPart.ENTRY.pack(*rec))
+                                bfile.write(strtab)
+                                bfile.write(blobs)
+                        portable.rename(tmp_pathname, self.pathname)
+                except EnvironmentError as e:
+                        if e.errno == errno.EACCES:
+                                raise api_errors.PermissionsException(
+                                    e.filename)
+                        if e.errno == errno.EROFS:
+                                raise api_errors.ReadOnlyFileSystemException(
+                                    e.filename)
+                        raise
+
+
+class _BinaryPart(object):
+        """Private helper class providing read-only, memory-mapped access to
+        the binary sidecar of a catalog part written by _BinaryPartWriter.
+
+        Instances should be obtained using open(), which returns None if the
+        sidecar does not exist, is unreadable, or is stale with respect to
+        the JSON catalog part it was generated from."""
+
+        MAGIC = b"PKG5CATB"
+        VERSION = 1
+
+        # magic, version, json size, json mtime, json inode, publisher count,
+        # stem count, entry count, and the offsets of the publisher table,
+        # stem table, entry table, string table, and blob area.
+        HEADER = struct.Struct("<8sIQdQIIIQQQQQ")
+        # name offset, name length, first stem index, stem count
+        PUB = struct.Struct("<IIII")
+        # name offset, name length, first entry index, entry count
+        STEM = struct.Struct("<IIII")
+        # version offset, version length, blob offset, blob length
+        ENTRY = struct.Struct("<IIQI")
+
+        def __init__(self, mm, header):
+                self.__mm = mm
+                (self.__npubs, self.__nstems, self.__nentries, self.__pubs_off,
+                    self.__stems_off, self.__entries_off, self.__strtab_off,
+                    self.__blobs_off) = header
+                self.__pubs = None
+
+        @classmethod
+        def open(cls, pathname, json_pathname):
+                """Returns a _BinaryPart for the sidecar at 'pathname' or None
+                if it cannot be used in place of the JSON catalog part stored
+                at 'json_pathname'."""
+
+                try:
+                        st = os.stat(json_pathname)
+                        with open(pathname, "rb") as bfile:
+                                mm = mmap.mmap(bfile.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+                except (EnvironmentError, ValueError):
+                        # Missing, unreadable, or empty sidecar; the caller
+                        # will fall back to the JSON catalog part.
+                        return None
+
+                try:
+                        header = cls.HEADER.unpack_from(mm, 0)
+                except struct.error:
+                        mm.close()
+                        return None
+
+                magic, version, json_size, json_mtime, json_ino = header[:5]
+                if magic != cls.MAGIC or version != cls.VERSION or \
+                    json_size != st.st_size or json_mtime != st.st_mtime or \
+                    json_ino != st.st_ino or header[-1] > len(mm):
+                        # Sidecar is from another format version or was
+                        # generated for a different copy of the JSON part.
+                        mm.close()
+                        return None
+                return cls(mm, header[5:])
+
+        def close(self):
+                """Releases the mapping of the sidecar file."""
+
+                if self.__mm is not None:
+                        self.__mm.close()
+                        self.__mm = None
+
+        def __str(self, off, slen):
+                start = self.__strtab_off + off
+                return self.__mm[start:start + slen].decode("utf-8")
+
+        def __get_pubs(self):
+                if self.__pubs is None:
+                        pubs = OrderedDict()
+                        for i in range(self.__npubs):
+                                off, slen, first, cnt = self.PUB.unpack_from(
+                                    self.__mm, self.__pubs_off +
+                                    i * self.PUB.size)
+                                pubs[self.__str(off, slen)] = (first, cnt)
+                        self.__pubs = pubs
+                return self.__pubs
+
+        def __stem_name(self, idx):
+                off, slen, first, cnt = self.STEM.unpack_from(self.__mm,
+                    self.__stems_off + idx * self.STEM.size)
+                start = self.__strtab_off + off
+                return self.__mm[start:start + slen]
+
+        def find(self, pub, stem):
+                """Returns the index of the record for the given publisher and
+                package stem, or None if the sidecar has no entries for it."""
+
+                prange = self.__get_pubs().get(pub, None)
+                if prange is None:
+                        return None
+
+                key = stem.encode("utf-8")
+                lo, hi = prange[0], prange[0] + prange[1]
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        if self.__stem_name(mid) < key:
+                                lo = mid + 1
+                        else:
+                                hi = mid
+                if lo < prange[0] + prange[1] and self.__stem_name(lo) == key:
+                        return lo
+                return None
+
+        def publishers(self):
+                """Returns the list of publisher prefixes in the sidecar."""
+
+                return list(self.__get_pubs().keys())
+
+        def stems(self, pub):
+                """A generator function that produces tuples of the form
+                (stem, index) for each package stem of the given publisher."""
+
+                prange = self.__get_pubs().get(pub, None)
+                if prange is None:
+                        return
+                for idx in range(prange[0], prange[0] + prange[1]):
+                        yield self.__stem_name(idx).decode("utf-8"), idx
+
+        def __entry_range(self, idx, last=False):
+                off, slen, first, cnt = self.STEM.unpack_from(self.__mm,
+                    self.__stems_off + idx * self.STEM.size)
+                if last and cnt:
+                        return first + cnt - 1, 1
+                return first, cnt
+
+        def versions(self, idx, last=False):
+                """Returns the list of version strings for the stem record at
+                the given index, in catalog order.  If 'last' is True, only
+                the last version is returned."""
+
+                first, cnt = self.__entry_range(idx, last=last)
+                esize = self.ENTRY.size
+                eoff = self.__entries_off
+                vers = []
+                for i in range(first, first + cnt):
+                        voff, vlen, boff, blen = self.ENTRY.unpack_from(
+                            self.__mm, eoff + i * esize)
+                        vers.append(self.__str(voff, vlen))
+                return vers
+
+        def entries(self, idx, last=False):
+                """Returns the list of catalog entries for the stem record at
+                the given index, in catalog order.  If 'last' is True, only
+                the last entry is returned."""
+
+                first, cnt = self.__entry_range(idx, last=last)
+                esize = self.ENTRY.size
+                eoff = self.__entries_off
+                entries = []
+                for i in range(first, first + cnt):
+                        voff, vlen, boff, blen = self.ENTRY.unpack_from(
+                            self.__mm, eoff + i * esize)
+                        start = self.__blobs_off + boff
+                        entry = json.loads(
+                            self.__mm[start:start + blen].decode("utf-8"))
+                        entry["version"] = self.__str(voff, vlen)
+                        entries.append(entry)
+                return entries
+
+        def get_package_counts(self, pub):
+                """Returns a tuple of integer values (package_count,
+                package_version_count) for the given publisher."""
+
+                prange = self.__get_pubs().get(pub, None)
+                if not prange or not prange[1]:
+                        return 0, 0
+
+                first, cnt = prange
+                start = self.__entry_range(first)[0]
+                lfirst, lcnt = self.__entry_range(first + cnt - 1)
+                return cnt, lfirst + lcnt - start
+
+
 class CatalogPartBase(object):
         """A CatalogPartBase object is an abstract class containing core
         functionality shared between CatalogPart and CatalogAttrs."""
@@ -335,7 +618,7 @@ class CatalogPartBase(object):
                         return None
                 return os.path.join(self.meta_root, self.name)
 
-        def save(self, data, single_pass=False):
+        def save(self, data, single_pass=False, signatures=None):
                 """Serialize and store the transformed catalog part's 'data' in
                 a file using the pathname <self.meta_root>/<self.name>.
 
@@ -345,18 +628,40 @@ class CatalogPartBase(object):
                 should be serialized in a single pass.  This is significantly
                 faster, but requires that the entire set of data be serialized
                 in-memory instead of iteratively writing it to the target
-                storage object."""
+                storage object.
+
+                'signatures' is an optional dict of the signature data that the
+                serialized data is expected to match.  If provided, the data
+                is stored in a pending file (if its signatures match) that
+                only replaces the existing file once commit() is called;
+                otherwise the exception named 'BadCatalogSignatures' is raised
+                and the existing file is left unchanged.  This avoids having
+                to serialize the data twice to validate and then store it."""
+
+                pathname = self.pathname
+                if signatures is not None:
+                        pathname = self.pending_pathname
+                        if signatures and not self.sign and \
+                            self._gen_signatures(data) != signatures:
+                                # Signature data is only generated during
+                                # storage if the part is signed.
+                                raise api_errors.BadCatalogSignatures(
+                                    self.pathname)
 
                 f = _JSONWriter(data, single_pass=single_pass,
-                    pathname=self.pathname, sign=self.sign)
+                    pathname=pathname, sign=self.sign)
                 f.save()
 
+                if signatures and self.sign and f.signatures() != signatures:
+                        portable.remove(pathname)
+                        raise api_errors.BadCatalogSignatures(self.pathname)
+
                 # Update in-memory copy to reflect stored data.
                 self.signatures = f.signatures()
 
                 # Ensure the permissions on the new file are correct.
                 try:
-                        os.chmod(self.pathname, self.__file_mode)
+                        os.chmod(pathname, self.__file_mode)
                 except EnvironmentError as e:
                         if e.errno == errno.EACCES:
                                 raise api_errors.PermissionsException(
@@ -370,7 +675,32 @@ class CatalogPartBase(object):
                 if self.last_modified:
                         mtime = calendar.timegm(
                             self.last_modified.utctimetuple())
-                        os.utime(self.pathname, (mtime, mtime))
+                        os.utime(pathname, (mtime, mtime))
+
+        def commit(self):
+                """Moves the data stored by save() into place if it was stored
+                pending validation, discarding the previous file."""
+
+                pathname = self.pending_pathname
+                if pathname and os.path.exists(pathname):
+                        portable.rename(pathname, self.pathname)
+
+        def discard(self):
+                """Removes any data stored by save() pending validation."""
+
+                pathname = self.pending_pathname
+                if pathname and os.path.exists(pathname):
+                        portable.remove(pathname)
+
+        @property
+        def pending_pathname(self):
+                """The absolute path of the file used to store the data for
+                this part pending validation, or None if meta_root or name is
+                not set."""
+
+                if not self.pathname:
+                        return None
+                return "{0}.new".format(self.pathname)
 
         meta_root = property(__get_meta_root, __set_meta_root)
 
@@ -379,13 +709,22 @@ class CatalogPart(CatalogPartBase):
         """A CatalogPart object is the representation of a subset of the package
         FMRIs available from a package repository."""
 
+        __bin = None
         __data = None
+        binary = False
         ordered = None
 
-        def __init__(self, name, meta_root=None, ordered=True, sign=True):
-                """Initializes a CatalogPart object."""
+        def __init__(self, name, meta_root=None, ordered=True, sign=True,
+            binary=False):
+                """Initializes a CatalogPart object.
+
+                'binary' is an optional boolean value indicating that a binary
+                sidecar should be written whenever the part is saved, and used
+                in place of the JSON data for read operations whenever it is
+                current."""
 
                 self.__data = {}
+                self.binary = binary
                 self.ordered = ordered
                 if not name.startswith("catalog."):
                         raise UnrecognizedCatalogPart(name)
@@ -410,6 +749,13 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to."""
 
+                if not self.loaded:
+                        bpart = self.__get_binary_part()
+                        if bpart is not None:
+                                return self.__iter_binary(bpart,
+                                    self.__get_binary_entries, last=last,
+                                    ordered=ordered, pubs=pubs)
+
                 self.load()
                 if ordered:
                         stems = self.pkg_names(pubs=pubs)
@@ -438,6 +784,153 @@ class CatalogPart(CatalogPartBase):
                     for entry in self.__data[pub][stem]
                 )
 
+        def __iter_binary(self, bpart, get_items, last=False, ordered=False,
+            pubs=EmptyI):
+                """Private generator function to iterate over the contents of
+                the binary sidecar 'bpart'.  Produces tuples of the form (pub,
+                stem, item) where item is one of the values returned by
+                'get_items' for each package stem.
+
+                'get_items' is a function that must accept the arguments 'pub',
+                'stem', 'idx' (the sidecar index of the package stem), and
+                'last' and return a list of items in ascending version order
+                (or only the last item if 'last' is True).
+
+                'last', 'ordered', and 'pubs' are as for __iter_entries."""
+
+                stems = (
+                    (pub, stem, idx)
+                    for pub in bpart.publishers()
+                    if not pubs or pub in pubs
+                    for stem, idx in bpart.stems(pub)
+                )
+
+                if ordered:
+                        # Results have to be sorted by stem first, and by
+                        # publisher second (as for pkg_names).
+                        if pubs:
+                                pos = dict((p, i) for (i, p) in enumerate(pubs))
+                                key = lambda t: (t[1], pos[t[0]])
+                        else:
+                                key = lambda t: (t[1], t[0])
+                        stems = sorted(stems, key=key)
+
+                for pub, stem, idx in stems:
+                        items = get_items(pub, stem, idx, last)
+                        if last:
+                                yield pub, stem, items[-1]
+                        elif ordered:
+                                for item in reversed(items):
+                                        yield pub, stem, item
+                        else:
+                                for item in items:
+                                        yield pub, stem, item
+
+        def __iter_versions(self, last=False, ordered=False, pubs=EmptyI):
+                """Private generator function to iterate over the versions of
+                catalog entries.  Produces tuples of the form (pub, stem,
+                version); if a binary sidecar is in use, the related catalog
+                entries are not loaded.
+
+                'last', 'ordered', and 'pubs' are as for __iter_entries."""
+
+                if not self.loaded:
+                        bpart = self.__get_binary_part()
+                        if bpart is not None:
+                                return self.__iter_binary(bpart,
+                                    lambda pub, stem, idx, last:
+                                        bpart.versions(idx, last=last),
+                                    last=last, ordered=ordered, pubs=pubs)
+
+                return (
+                    (pub, stem, entry["version"])
+                    for pub, stem, entry in self.__iter_entries(last=last,
+                        ordered=ordered, pubs=pubs)
+                )
+
+        def __get_binary_entries(self, pub, stem, idx, last=False):
+                """Returns the list of entries for the given package stem at
+                sidecar index 'idx', preferring any entries that have already
+                been loaded into memory as they may have been updated."""
+
+                pkg_list = self.__data.get(pub, None)
+                if pkg_list and stem in pkg_list:
+                        return pkg_list[stem]
+                return self.__bin.entries(idx, last=last)
+
+        def __get_binary_part(self):
+                """Returns the _BinaryPart object for this catalog part, or
+                None if binary sidecars are not enabled, the part has already
+                been loaded, or the sidecar is unavailable or stale."""
+
+                if self.loaded or not self.binary or not self.meta_root:
+                        return None
+                if self.__bin is None:
+                        # False is stored on failure so that the sidecar
+                        # is only checked once.
+                        self.__bin = _BinaryPart.open(self.binary_pathname,
+                            self.pathname) or False
+                return self.__bin or None
+
+        def __get_ver_list(self, pub, stem):
+                """Returns the list of version entries for the given publisher
+                and package stem, or None if there are none.  If the part has
+                not been loaded and a binary sidecar is available, only the
+                entries for the requested package stem are loaded."""
+
+                if not self.loaded:
+                        bpart = self.__get_binary_part()
+                        if bpart is not None:
+                                pkg_list = self.__data.get(pub, None)
+                                if pkg_list and stem in pkg_list:
+                                        return pkg_list[stem]
+
+                                idx = bpart.find(pub, stem)
+                                if idx is None:
+                                        return None
+
+                                # Keep the loaded entries so that callers
+                                # can update them in-place; they are merged
+                                # with the full set of entries by load().
+                                ver_list = bpart.entries(idx)
+                                self.__data.setdefault(pub, {})[stem] = \
+                                    ver_list
+                                return ver_list
+                        self.load()
+
+                pkg_list = self.__data.get(pub, None)
+                if not pkg_list:
+                        return None
+                return pkg_list.get(stem, None)
+
+        def __pkg_names(self, pubs=EmptyI):
+                """Private function returning an unordered iterable of package
+                tuples of the form (pub, stem), using the binary sidecar if
+                the part has not been loaded."""
+
+                if not self.loaded:
+                        bpart = self.__get_binary_part()
+                        if bpart is not None:
+                                return (
+                                    (pub, stem)
+                                    for pub in self.publishers(pubs=pubs)
+                                    for stem, idx in bpart.stems(pub)
+                                )
+
+                self.load()
+                return (
+                    (pub, stem)
+                    for pub in self.publishers(pubs=pubs)
+                    for stem in self.__data[pub]
+                )
+
+        def __reset_binary_part(self):
+                """Discards the _BinaryPart object for this catalog part."""
+
+                if self.__bin:
+                        self.__bin.close()
+                self.__bin = None
+
         def add(self, pfmri=None, metadata=None, op_time=None, pub=None,
             stem=None, ver=None):
                 """Add a catalog entry for a given FMRI or FMRI components.
@@ -494,6 +987,19 @@ class CatalogPart(CatalogPartBase):
                 discards all content."""
 
                 self.__data = {}
+                self.__reset_binary_part()
+                bpath = self.binary_pathname
+                if bpath and os.path.exists(bpath):
+                        try:
+                                portable.remove(bpath)
+                        except EnvironmentError as e:
+                                if e.errno == errno.EACCES:
+                                        raise api_errors.PermissionsException(
+                                            e.filename)
+                                if e.errno == errno.EROFS:
+                                        raise api_errors.ReadOnlyFileSystemException(
+                                            e.filename)
+                                raise
                 return CatalogPartBase.destroy(self)
 
         def entries(self, cb=None, last=False, ordered=False, pubs=EmptyI):
@@ -543,12 +1049,10 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to."""
 
-                self.load()
-
                 versions = {}
                 entries = {}
                 for pub in self.publishers(pubs=pubs):
-                        ver_list = self.__data[pub].get(name, ())
+                        ver_list = self.__get_ver_list(pub, name) or ()
                         for entry in ver_list:
                                 sver = entry["version"]
                                 pfmri = fmri.PkgFmri(name=name, publisher=pub,
@@ -587,16 +1091,15 @@ class CatalogPart(CatalogPartBase):
                 publisher, per-stem basis."""
 
                 if objects:
-                        for pub, stem, entry in self.__iter_entries(last=last,
+                        for pub, stem, ver in self.__iter_versions(last=last,
                             ordered=ordered, pubs=pubs):
                                 yield fmri.PkgFmri(name=stem, publisher=pub,
-                                    version=entry["version"])
+                                    version=ver)
                         return
 
-                for pub, stem, entry in self.__iter_entries(last=last,
+                for pub, stem, ver in self.__iter_versions(last=last,
                     ordered=ordered, pubs=pubs):
-                        yield "pkg://{0}/{1}@{2}".format(pub,
-                            stem, entry["version"])
+                        yield "pkg://{0}/{1}@{2}".format(pub, stem, ver)
                 return
 
         def fmris_by_version(self, name, pubs=EmptyI):
@@ -607,12 +1110,10 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to."""
 
-                self.load()
-
                 versions = {}
                 entries = {}
                 for pub in self.publishers(pubs=pubs):
-                        ver_list = self.__data[pub].get(name, None)
+                        ver_list = self.__get_ver_list(pub, name)
                         if not ver_list:
                                 continue
 
@@ -636,20 +1137,16 @@ class CatalogPart(CatalogPartBase):
                 if pfmri and not pfmri.publisher:
                         raise api_errors.AnarchicalCatalogFMRI(str(pfmri))
 
-                # Since this is a hot path, this function checks for loaded
-                # status before attempting to call the load function.
-                if not self.loaded:
-                        self.load()
-
                 if pfmri:
                         pub, stem, ver = pfmri.tuple()
                         ver = str(ver)
 
-                pkg_list = self.__data.get(pub, None)
-                if not pkg_list:
+                # Since this is a hot path, only the entries for the requested
+                # package stem are loaded if possible.
+                ver_list = self.__get_ver_list(pub, stem)
+                if not ver_list:
                         return
 
-                ver_list = pkg_list.get(stem, ())
                 for entry in ver_list:
                         if entry["version"] == ver:
                                 return entry
@@ -661,14 +1158,11 @@ class CatalogPart(CatalogPartBase):
                 number of unique package versions (per-publisher and
                 stem)."""
 
-                self.load()
                 package_count = 0
                 package_version_count = 0
-                for pub in self.publishers():
-                        for stem in self.__data[pub]:
-                                package_count += 1
-                                package_version_count += \
-                                    len(self.__data[pub][stem])
+                for pub, pcount, pvcount in self.get_package_counts_by_pub():
+                        package_count += pcount
+                        package_version_count += pvcount
                 return (package_count, package_version_count)
 
         def get_package_counts_by_pub(self, pubs=EmptyI):
@@ -679,6 +1173,15 @@ class CatalogPart(CatalogPartBase):
                 package versions for the publisher.
                 """
 
+                if not self.loaded:
+                        bpart = self.__get_binary_part()
+                        if bpart is not None:
+                                for pub in self.publishers(pubs=pubs):
+                                        pcount, pvcount = \
+                                            bpart.get_package_counts(pub)
+                                        yield pub, pcount, pvcount
+                                return
+
                 self.load()
                 for pub in self.publishers(pubs=pubs):
                         package_count = 0
@@ -696,7 +1199,27 @@ class CatalogPart(CatalogPartBase):
                 if self.loaded:
                         # Already loaded, or only in-memory.
                         return
-                self.__data = CatalogPartBase.load(self)
+
+                struct = CatalogPartBase.load(self)
+
+                # Entries for any package stems that were loaded from the
+                # binary sidecar must be retained as they may have been
+                # updated in-place by callers.
+                for pub, pkg_list in six.iteritems(self.__data):
+                        struct.setdefault(pub, {}).update(pkg_list)
+                self.__data = struct
+                self.__reset_binary_part()
+
+        @property
+        def binary_pathname(self):
+                """The absolute path of the file used to store the binary
+                sidecar for this part or None if meta_root or name is not
+                set."""
+
+                pathname = self.pathname
+                if not pathname:
+                        return None
+                return pathname + ".bin"
 
         def names(self, pubs=EmptyI):
                 """Returns a set containing the names of all the packages in
@@ -705,12 +1228,7 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to."""
 
-                self.load()
-                return set((
-                    stem
-                    for pub in self.publishers(pubs=pubs)
-                    for stem in self.__data[pub]
-                ))
+                return set((stem for pub, stem in self.__pkg_names(pubs=pubs)))
 
         def pkg_names(self, pubs=EmptyI):
                 """A generator function that produces package tuples of the form
@@ -723,14 +1241,11 @@ class CatalogPart(CatalogPartBase):
                 Results are always returned sorted by stem and then by
                 publisher."""
 
-                self.load()
-
                 # Results have to be sorted by stem first, and by
                 # publisher prefix second.
                 pkg_list = [
                         "{0}!{1}".format(stem, pub)
-                        for pub in self.publishers(pubs=pubs)
-                        for stem in self.__data[pub]
+                        for pub, stem in self.__pkg_names(pubs=pubs)
                 ]
 
                 pub_sort = None
@@ -752,6 +1267,14 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list that contains the prefixes of the
                 publishers to restrict the results to."""
 
+                if not self.loaded:
+                        bpart = self.__get_binary_part()
+                        if bpart is not None:
+                                for pub in bpart.publishers():
+                                        if not pubs or pub in pubs:
+                                                yield pub
+                                return
+
                 self.load()
                 for pub in self.__data:
                         # Any entries starting with "_" are part of the
@@ -796,7 +1319,7 @@ class CatalogPart(CatalogPartBase):
                 self.last_modified = op_time
                 self.signatures = {}
 
-        def save(self, single_pass=False):
+        def save(self, single_pass=False, signatures=None):
                 """Transform and store the catalog part's data in a file using
                 the pathname <self.meta_root>/<self.name>.
 
@@ -804,16 +1327,49 @@ class CatalogPart(CatalogPartBase):
                 should be serialized in a single pass.  This is significantly
                 faster, but requires that the entire set of data be serialized
                 in-memory instead of iteratively writing it to the target
-                storage object."""
+                storage object.
+
+                'signatures' is an optional dict of the signature data that the
+                stored data must match; see CatalogPartBase.save()."""
 
                 if not self.meta_root:
                         # Assume this is in-memory only.
+                        if signatures:
+                                self.validate(signatures=signatures)
                         return
 
                 # Ensure content is loaded before attempting save.
                 self.load()
 
-                CatalogPartBase.save(self, self.__data, single_pass=single_pass)
+                CatalogPartBase.save(self, self.__data, single_pass=single_pass,
+                    signatures=signatures)
+                if signatures is None:
+                        self.__save_binary()
+
+        def commit(self):
+                """Moves the data stored by save() into place if it was stored
+                pending validation, discarding the previous file."""
+
+                pending = self.pending_pathname
+                if not pending or not os.path.exists(pending):
+                        return
+                CatalogPartBase.commit(self)
+                self.__save_binary()
+
+        def __save_binary(self):
+                """Writes the binary sidecar for the part if enabled."""
+
+                if not self.binary:
+                        return
+
+                # The sidecar must be written after the JSON data has been
+                # stored, as it records the state of the JSON file so that
+                # readers can detect when it is stale.
+                f = _BinaryPartWriter(self.__data, self.binary_pathname,
+                    self.pathname)
+                f.save()
+                os.chmod(self.binary_pathname,
+                    stat.S_IMODE(os.stat(self.pathname).st_mode))
 
         def sort(self, pfmris=None, pubs=None):
                 """Re-sorts the contents of the CatalogPart such that version
@@ -878,11 +1434,8 @@ class CatalogPart(CatalogPartBase):
                 'pubs' is an optional list of publisher prefixes to restrict
                 the results to."""
 
-                return (
-                    (pub, stem, entry["version"])
-                    for pub, stem, entry in self.__iter_entries(last=last,
-                        ordered=ordered, pubs=pubs)
-                )
+                return self.__iter_versions(last=last, ordered=ordered,
+                    pubs=pubs)
 
         def tuple_entries(self, cb=None, last=False, ordered=False, pubs=EmptyI):
                 """A generator function that produces tuples of the form ((pub,
@@ -1332,6 +1885,7 @@ class Catalog(object):
         # found near the end of the class definition.
         _attrs = None
         __batch_mode = None
+        __binary = None
         __lock = None
         __manifest_cb = None
         __meta_root = None
@@ -1347,7 +1901,7 @@ class Catalog(object):
         DEPENDENCY, SUMMARY = range(2)
 
         def __init__(self, batch_mode=False, meta_root=None, log_updates=False,
-            manifest_cb=None, read_only=False, sign=True):
+            manifest_cb=None, read_only=False, sign=True, binary=False):
                 """Initializes a Catalog object.
 
                 'batch_mode' is an optional boolean value that indicates that
@@ -1382,9 +1936,16 @@ class Catalog(object):
                 the catalog data should have signature data generated and
                 embedded when serialized.  This option is primarily a matter
                 of convenience for callers that wish to trade integrity checks
-                for improved catalog serialization performance."""
+                for improved catalog serialization performance.
+
+                'binary' is an optional boolean value that indicates that a
+                compact, memory-mapped binary sidecar should be written for
+                each catalog part when saved, and used for read operations
+                whenever it is current.  This allows consumers to retrieve
+                individual entries without parsing the entire JSON part."""
 
                 self.__batch_mode = batch_mode
+                self.__binary = binary
                 self.__manifest_cb = manifest_cb
                 self.__parts = {}
                 self.__updates = {}
@@ -1871,9 +2432,15 @@ class Catalog(object):
                                 error = e
                         yield (pat, error, npat, matcher)
 
-        def __save(self):
+        def __save(self, signatures=None):
                 """Private save function.  Caller is responsible for locking
-                the catalog."""
+                the catalog.
+
+                'signatures' is an optional dict, indexed by part name, of the
+                signature data that each in-memory CatalogPart must match when
+                stored.  If any part does not match, BadCatalogSignatures will
+                be raised before any of the parts or the catalog attributes
+                have been replaced."""
 
                 attrs = self._attrs
                 if self.log_updates:
@@ -1891,6 +2458,26 @@ class Catalog(object):
                 # Save any CatalogParts that are currently in-memory,
                 # updating their related information in catalog.attrs
                 # as they are saved.
+                try:
+                        self.__save_parts(signatures=signatures)
+                except api_errors.BadCatalogSignatures:
+                        for part in self.__parts.values():
+                                part.discard()
+                        raise
+
+                if signatures is not None:
+                        # All parts are valid, so move them into place.
+                        for part in self.__parts.values():
+                                part.commit()
+
+                # Finally, save the catalog attributes.
+                attrs.save()
+
+        def __save_parts(self, signatures=None):
+                """Private helper function for __save that stores any
+                CatalogParts that are currently in-memory."""
+
+                attrs = self._attrs
                 for name, part in six.iteritems(self.__parts):
                         # Must save first so that signature data is
                         # current.
@@ -1901,7 +2488,11 @@ class Catalog(object):
                         # detectable for other parts though.
                         single_pass = name in (self.__BASE_PART,
                             self.__DEPS_PART)
-                        part.save(single_pass=single_pass)
+                        if signatures is not None:
+                                part.save(single_pass=single_pass,
+                                    signatures=signatures[name])
+                        else:
+                                part.save(single_pass=single_pass)
 
                         # Now replace the existing signature data with
                         # the new signature data.
@@ -1911,9 +2502,6 @@ class Catalog(object):
                         for n, v in six.iteritems(part.signatures):
                                 entry["signature-{0}".format(n)] = v
 
-                # Finally, save the catalog attributes.
-                attrs.save()
-
         def __set_batch_mode(self, value):
                 self.__batch_mode = value
                 for part in self.__parts.values():
@@ -2241,6 +2829,11 @@ class Catalog(object):
                 # as a basis for determining whether to apply specific
                 # updates.
                 old_parts = self._attrs.parts
+
+                # The FMRIs of the package entries changed by incremental
+                # updates; only their stems need to be re-sorted.
+                changed = set()
+
                 def apply_incremental(name):
                         # Load the CatalogUpdate from the path specified.
                         # (Which is why __get_update is not used.)
@@ -2270,6 +2863,7 @@ class Catalog(object):
                                         else:
                                                 raise api_errors.UnknownUpdateType(
                                                     op_type)
+                                        changed.add(pfmri)
 
                 def apply_full(name):
                         src = os.path.join(path, name)
@@ -2307,16 +2901,18 @@ class Catalog(object):
                                         new_sigs[name][sig] = mdata[key]
 
                         # This must be done to ensure that the catalog
-                        # signature matches that of the source.
+                        # signature matches that of the source.  Parts are
+                        # kept sorted on-disk, so only the stems of changed
+                        # entries need to be re-sorted.
                         self.batch_mode = old_batch_mode
-                        self.finalize()
-
-                        for name, part in six.iteritems(self.__parts):
-                                part.validate(signatures=new_sigs[name])
+                        self.__finalize(pfmris=changed)
 
                         # Finally, save the catalog, and then copy the new
                         # catalog attributes file into place and reload it.
-                        self.__save()
+                        # The updated parts are validated as they are stored
+                        # so that each is only serialized once; a part that
+                        # fails validation won't replace the existing one.
+                        self.__save(signatures=new_sigs)
                         apply_full(self._attrs.name)
 
                         self._attrs = CatalogAttrs(meta_root=self.meta_root)
@@ -3407,7 +4003,8 @@ class Catalog(object):
                 # Next, since the part hasn't been cached, create an object
                 # for it and add it to catalog attributes.
                 part = CatalogPart(name, meta_root=self.meta_root,
-                    ordered=not self.__batch_mode, sign=self.__sign)
+                    ordered=not self.__batch_mode, sign=self.__sign,
+                    binary=self.__binary)
                 if must_exist and self.meta_root and not part.exists:
                         # This is a double-check for the client case where
                         # there is a part that is known to the catalog but
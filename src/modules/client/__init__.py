@@ -96,6 +96,53 @@ class GlobalSettings(object):
                 except ValueError:
                         pass
 
+                # Whether catalog data for all publishers being refreshed is
+                # retrieved at once rather than one publisher at a time.
+                self.client_concurrent_refresh = os.environ.get(
+                    "PKG_CLIENT_CONCURRENT_REFRESH", "1") != "0"
+
+                # Whether the package data used by the solver is cached in the
+                # image between operations.
+                self.client_solver_cache = os.environ.get(
+                    "PKG_CLIENT_SOLVER_CACHE", "1") != "0"
+
+                # Number of threads used to install and update the filesystem
+                # objects of an image plan; 1 executes all actions serially.
+                self.client_action_threads_default = 4
+                try:
+                        self.client_action_threads = max(1, int(
+                            os.environ.get("PKG_CLIENT_ACTION_THREADS",
+                            self.client_action_threads_default)))
+                except ValueError:
+                        self.client_action_threads = \
+                            self.client_action_threads_default
+
+                # Maximum number of actions parsed from the cache files of
+                # factored manifests which are kept in memory for reuse; 0
+                # disables the cache.
+                self.client_manifest_cache_size_default = 50000
+                try:
+                        self.client_manifest_cache_size = max(0, int(
+                            os.environ.get("PKG_CLIENT_MANIFEST_CACHE_SIZE",
+                            self.client_manifest_cache_size_default)))
+                except ValueError:
+                        self.client_manifest_cache_size = \
+                            self.client_manifest_cache_size_default
+
+                # Whether transfers over https are multiplexed over HTTP/2
+                # connections, when both libcurl and the server support it,
+                # and the maximum number of concurrent streams per origin.
+                self.client_http2 = os.environ.get(
+                    "PKG_CLIENT_HTTP2", "0") != "0"
+                self.client_http2_max_streams_default = 100
+                try:
+                        self.client_http2_max_streams = max(1, int(
+                            os.environ.get("PKG_CLIENT_HTTP2_MAX_STREAMS",
+                            self.client_http2_max_streams_default)))
+                except ValueError:
+                        self.client_http2_max_streams = \
+                            self.client_http2_max_streams_default
+
                 self.client_name = None
                 self.client_args = sys.argv[:]
                 # Default maximum number of redirects received before
@@ -624,7 +624,8 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 self.__cert_verify()
                 try:
                         self._img.refresh_publishers(immediate=True,
-                            progtrack=self.__progresstracker)
+                            progtrack=self.__progresstracker,
+                            ccancel=self.__check_cancel)
                 except apx.ImageFormatUpdateNeeded:
                         # If image format update is needed to perform refresh,
                         # continue on and allow failure to happen later since
@@ -3137,7 +3138,8 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 self._img.refresh_publishers(full_refresh=full_refresh,
                     ignore_unreachable=ignore_unreachable,
                     immediate=immediate, pubs=pubs,
-                    progtrack=self.__progresstracker)
+                    progtrack=self.__progresstracker,
+                    ccancel=self.__check_cancel)
 
         def __licenses(self, pfmri, mfst, alt_pub=None):
                 """Private function. Returns the license info from the
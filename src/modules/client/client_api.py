@@ -55,6 +55,7 @@ import pkg.client.publisher as publisher
 import pkg.client.options as options
 import pkg.fmri as fmri
 import pkg.json as json
+import pkg.manifest as manifest
 import pkg.misc as misc
 import pkg.pipeutils as pipeutils
 import pkg.portable as portable
@@ -1238,6 +1239,8 @@ def __api_plan(_op, _api_inst, _accept=False, _li_ignore=None, _noexecute=False,
                         # the first plan description is always for ourself.
                         planned_self = True
                         pkg_timer.record("planning", logger=logger)
+                        logger.debug(str(
+                            manifest.FactoredManifest.action_cache))
 
                         # if we're in parsable mode don't display anything
                         # until after we finish planning for all children
@@ -32,11 +32,13 @@ import copy
 import datetime
 import errno
 import hashlib
+import mmap
 import os
 import platform
 import shutil
 import six
 import stat
+import struct
 import sys
 import tempfile
 import time
@@ -56,6 +58,7 @@ import pkg.client.imageplan             as imageplan
 import pkg.client.linkedimage           as li
 import pkg.client.pkgdefs               as pkgdefs
 import pkg.client.pkgplan               as pkgplan
+import pkg.client.pkg_solver            as pkg_solver
 import pkg.client.plandesc              as plandesc
 import pkg.client.progress              as progress
 import pkg.client.publisher             as publisher
@@ -81,7 +84,8 @@ logger = global_settings.logger
 
 from pkg.client.debugvalues import DebugValues
 from pkg.client.imagetypes import IMG_USER, IMG_ENTIRE
-from pkg.client.transport.exception import InvalidContentException
+from pkg.client.transport.exception import InvalidContentException, \
+    TransportException
 from pkg.misc import EmptyI, EmptyDict
 
 img_user_prefix = ".org.opensolaris,pkg"
@@ -89,6 +93,132 @@ img_root_prefix = "var/pkg"
 
 IMG_PUB_DIR = "publisher"
 
+
+class ActionOffsets(object):
+        """The index of the actions.stripped file of an image, which maps an
+        action name and key attribute value to the offset of the first line
+        of the corresponding actions in that file and the number of lines.
+
+        After the version and timestamp lines the file contains the number of
+        entries N, then, as little-endian 64-bit integers, N+1 offsets into
+        the pool of keys, the N offsets into actions.stripped and the N line
+        counts, and finally the pool of keys.  Each key is the action name
+        and the key attribute value, encoded as UTF-8 and separated by a NUL,
+        and the keys are sorted so that an entry can be found by a binary
+        search.
+
+        The file is mapped into memory rather than read, so that the cost of
+        loading it doesn't depend on the number of installed actions."""
+
+        VERSION = "VERSION 3"
+
+        __count = struct.Struct("<Q")
+
+        def __init__(self, path):
+                with open(path, "rb") as f:
+                        self.version = misc.force_str(f.readline()).rstrip()
+                        self.timestamp = misc.force_str(f.readline()).rstrip()
+                        self.__map = None
+                        self.__n = 0
+                        if self.version != self.VERSION:
+                                return
+                        start = f.tell()
+                        self.__map = mmap.mmap(f.fileno(), 0,
+                            access=mmap.ACCESS_READ)
+
+                # A truncated or corrupt file raises struct.error here, rather
+                # than when it is searched, so that callers can rebuild it.
+                try:
+                        n, = self.__count.unpack_from(self.__map, start)
+                        keyoff = start + self.__count.size
+                        pool = keyoff + 8 * (3 * n + 1)
+                        poolsize, = self.__count.unpack_from(self.__map,
+                            keyoff + 8 * n)
+                        if pool + poolsize != len(self.__map):
+                                raise struct.error("actions.offsets has "
+                                    "the wrong size")
+                except struct.error:
+                        self.__map.close()
+                        raise
+
+                self.__n = n
+                self.__keys = struct.Struct("<{0:d}Q".format(n + 1))
+                self.__vals = struct.Struct("<{0:d}Q".format(n))
+                self.__keyoff = keyoff
+                self.__offoff = self.__keyoff + self.__keys.size
+                self.__cntoff = self.__offoff + self.__vals.size
+                self.__pool = pool
+
+        @staticmethod
+        def __encode(name, key):
+                return misc.force_bytes(name) + b"\0" + misc.force_bytes(key)
+
+        @classmethod
+        def write(cls, f, entries):
+                """Write the index of 'entries', a list of tuples of action
+                name, key attribute value, offset and line count, to the file
+                object 'f', after the version and timestamp lines."""
+
+                entries = sorted((cls.__encode(name, key), off, cnt)
+                    for name, key, off, cnt in entries)
+                n = len(entries)
+                keyoffs = [0]
+                for k, off, cnt in entries:
+                        keyoffs.append(keyoffs[-1] + len(k))
+                f.write(cls.__count.pack(n))
+                f.write(struct.pack("<{0:d}Q".format(n + 1), *keyoffs))
+                f.write(struct.pack("<{0:d}Q".format(n),
+                    *(e[1] for e in entries)))
+                f.write(struct.pack("<{0:d}Q".format(n),
+                    *(e[2] for e in entries)))
+                f.write(b"".join(e[0] for e in entries))
+
+        def __key(self, i):
+                start, end = struct.unpack_from("<2Q", self.__map,
+                    self.__keyoff + 8 * i)
+                return self.__map[self.__pool + start:self.__pool + end]
+
+        def __entry(self, i):
+                return struct.unpack_from("<Q", self.__map,
+                    self.__offoff + 8 * i)[0], struct.unpack_from("<Q",
+                    self.__map, self.__cntoff + 8 * i)[0]
+
+        def __len__(self):
+                return self.__n
+
+        def __iter__(self):
+                """Yield tuples of action name, key attribute value, offset
+                and line count, in the order of actions.stripped."""
+
+                if not self.__n:
+                        return
+                keyoffs = self.__keys.unpack_from(self.__map, self.__keyoff)
+                offs = self.__vals.unpack_from(self.__map, self.__offoff)
+                cnts = self.__vals.unpack_from(self.__map, self.__cntoff)
+                pool = self.__pool
+                for i in range(self.__n):
+                        name, key = misc.force_str(self.__map[
+                            pool + keyoffs[i]:pool + keyoffs[i + 1]]).split(
+                            "\0", 1)
+                        yield name, key, offs[i], cnts[i]
+
+        def get(self, k, default=None):
+                """Return the offset and line count of the actions with the
+                action name and key attribute value given by 'k', or
+                'default' if there are none."""
+
+                target = self.__encode(*k)
+                lo, hi = 0, self.__n
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        if self.__key(mid) < target:
+                                lo = mid + 1
+                        else:
+                                hi = mid
+                if lo < self.__n and self.__key(lo) == target:
+                        return self.__entry(lo)
+                return default
+
 class Image(object):
         """An Image object is a directory tree containing the laid-down contents
         of a self-consistent graph of Packages.
@@ -193,6 +323,15 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 # instead of a flat cache.
                 self.__write_cache_root = None
 
+                # Content addressed cache of uncompressed file content that
+                # installed files are cloned from, if enabled, and the roots
+                # of other images whose installed files may be cloned.
+                self.__clone_cache_dir = None
+                self.__clone_images = []
+                # Whether content can be cloned at all; determined once.
+                self.__clone_lock = pkg.nrlock.NRLock()
+                self.__clone_supported = None
+
                 self.__lock = pkg.nrlock.NRLock()
                 self.__lockfile = None
                 self.__sig_policy = None
@@ -387,6 +526,68 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 return self.__user_cache_dir or \
                     os.path.join(self.imgdir, IMG_PUB_DIR)
 
+        def __can_clone(self):
+                """Returns whether file content can be cloned into this image,
+                as determined by cloning a small file from the clone cache
+                (or, if there is none, this image's temporary directory) the
+                first time this is called.  Where cloning isn't supported at
+                all, this avoids a failed attempt for every file installed."""
+
+                with self.__clone_lock:
+                        if self.__clone_supported is None:
+                                self.__clone_supported = self.__probe_clone()
+                        return self.__clone_supported
+
+        def __probe_clone(self):
+                tmpdir = self.temporary_dir()
+                srcdir = self.__clone_cache_dir or tmpdir
+                src = dst = None
+                try:
+                        try:
+                                os.makedirs(srcdir, misc.PKG_DIR_MODE)
+                        except EnvironmentError as e:
+                                if e.errno != errno.EEXIST:
+                                        raise
+                        fd, src = tempfile.mkstemp(dir=srcdir)
+                        os.write(fd, b"pkg")
+                        os.close(fd)
+                        fd, dst = tempfile.mkstemp(dir=tmpdir)
+                        os.close(fd)
+                        portable.clonefile(src, dst)
+                        with open(dst, "rb") as f:
+                                return f.read() == b"pkg"
+                except EnvironmentError:
+                        return False
+                finally:
+                        if src:
+                                portable.remove(src)
+                        shutil.rmtree(tmpdir, True)
+
+        def get_clone_cache_path(self, hash_attr, hash_val):
+                """Returns the path of the uncompressed file content with the
+                hash value 'hash_val' for the hash attribute 'hash_attr' in the
+                clone cache (see PKG_CLONE_CACHEDIR), or None if the clone
+                cache is not in use or content can't be cloned."""
+
+                if not self.__clone_cache_dir or not hash_val or \
+                    not self.__can_clone():
+                        return None
+                return os.path.join(self.__clone_cache_dir,
+                    hash_attr or "hash", hash_val[:2], hash_val)
+
+        def get_clone_image_paths(self, path):
+                """Returns the list of the paths of the files installed at
+                'path' (relative to the image root) in the images listed in
+                PKG_CLONE_IMAGES, whose content may be cloned instead of being
+                decompressed, or an empty list if content can't be cloned."""
+
+                if not self.__clone_images or not self.__can_clone():
+                        return []
+                return [
+                    os.path.join(root, path)
+                    for root in self.__clone_images
+                ]
+
         @contextmanager
         def locked_op(self, op, allow_unprivileged=False, new_history_op=True):
                 """Helper method for executing an image-modifying operation
@@ -946,6 +1147,23 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         # Since the cache structure is flat, add it to the
                         # list of global read caches.
                         self.__read_cache_dirs.append(self.__user_cache_dir)
+                # If set, the uncompressed content of installed files is kept
+                # in (and cloned from) this directory; it should be on the
+                # same filesystem as the images that share it.
+                self.__clone_cache_dir = None
+                if "PKG_CLONE_CACHEDIR" in os.environ:
+                        self.__clone_cache_dir = os.path.normpath(
+                            os.environ["PKG_CLONE_CACHEDIR"])
+                # If set, a list of the roots of other images, separated by
+                # colons, whose installed files are cloned if their content
+                # matches that of files being installed.
+                self.__clone_images = [
+                    os.path.normpath(root)
+                    for root in os.environ.get("PKG_CLONE_IMAGES",
+                        "").split(os.pathsep)
+                    if root and os.path.normpath(root) != self.root
+                ]
+                self.__clone_supported = None
                 if self.__user_cache_dir:
                         self._incoming_cache_dir = os.path.join(
                             self.__user_cache_dir,
@@ -2876,7 +3094,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 # the catalogs (add or remove entries) are only done during an
                 # image upgrade or metadata refresh.  In both cases, the catalog
                 # is resorted and finalized so this is always safe to use.
-                cat = pkg.catalog.Catalog(batch_mode=True,
+                cat = pkg.catalog.Catalog(batch_mode=True, binary=True,
                     manifest_cb=self._manifest_cb, meta_root=croot, sign=False)
                 return cat
 
@@ -2982,6 +3200,32 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                 return [var_call, fac_call]
 
+        def get_solver_cache(self, excludes, new_variants=None,
+            new_facets=None):
+                """Returns a SolverCache object for the known catalog that
+                the solver can use when evaluating packages with 'excludes',
+                which must have been returned by list_excludes() for the
+                same 'new_variants' and 'new_facets'.  None is returned if
+                the solver cache has been disabled."""
+
+                if not global_settings.client_solver_cache:
+                        return None
+
+                if new_variants:
+                        variants = self.cfg.variants.copy()
+                        variants.update(new_variants)
+                else:
+                        variants = self.cfg.variants
+                if new_facets is None:
+                        new_facets = self.cfg.facets
+
+                # The order of facets is significant as it determines which
+                # wildcard facets take precedence.
+                key = [sorted(variants.items()), list(new_facets.items())]
+                return pkg_solver.SolverCache(os.path.join(
+                    self.__action_cache_dir, "solver.cache"),
+                    self.get_catalog(self.IMG_CATALOG_KNOWN), excludes, key)
+
         def get_variants(self):
                 """ return a copy of the current image variants"""
                 return self.cfg.variants.copy()
@@ -3090,7 +3334,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                 kcat = pkg.catalog.Catalog(batch_mode=True,
                     meta_root=os.path.join(tmp_state_root,
-                    self.IMG_CATALOG_KNOWN), sign=False)
+                    self.IMG_CATALOG_KNOWN), sign=False, binary=True)
 
                 # XXX if any of the below fails for any reason, the old 'known'
                 # catalog needs to be re-loaded so the client is in a consistent
@@ -3146,7 +3390,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 # Create the new installed catalog in a temporary location.
                 icat = pkg.catalog.Catalog(batch_mode=True,
                     meta_root=os.path.join(tmp_state_root,
-                    self.IMG_CATALOG_INSTALLED), sign=False)
+                    self.IMG_CATALOG_INSTALLED), sign=False, binary=True)
 
                 excludes = self.list_excludes()
 
@@ -3371,7 +3615,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 self.history.log_operation_end()
 
         def refresh_publishers(self, full_refresh=False, immediate=False,
-            pubs=None, progtrack=None, ignore_unreachable=True):
+            pubs=None, progtrack=None, ignore_unreachable=True, ccancel=None):
                 """Refreshes the metadata (e.g. catalog) for one or more
                 publishers.  Callers are responsible for locking the image.
 
@@ -3394,7 +3638,10 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 whether unreachable repositories should be ignored. If True,
                 errors contacting this repository are stored in the transport
                 but no exception is raised, allowing an operation to continue
-                if an unneeded repository is not online."""
+                if an unneeded repository is not online.
+
+                'ccancel' is an optional function used to determine whether
+                the operation has been canceled."""
 
                 if self.version < 3:
                         raise apx.ImageFormatUpdateNeeded(self.root)
@@ -3452,13 +3699,25 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 total = 0
                 succeeded = set()
                 updated = self.__start_state_update()
+
+                refreshed = {}
+                if global_settings.client_concurrent_refresh and \
+                    len(pubs_to_refresh) > 1:
+                        refreshed = self.__refresh_publishers_concurrently(
+                            pubs_to_refresh, full_refresh, immediate,
+                            progtrack, ccancel)
+
                 for pub in pubs_to_refresh:
                         total += 1
                         progtrack.refresh_start_pub(pub)
                         try:
-                                changed, e = pub.refresh(
-                                    full_refresh=full_refresh,
-                                    immediate=immediate, progtrack=progtrack)
+                                if pub.prefix in refreshed:
+                                        changed, e = refreshed[pub.prefix]
+                                else:
+                                        changed, e = pub.refresh(
+                                            full_refresh=full_refresh,
+                                            immediate=immediate,
+                                            progtrack=progtrack)
                                 if changed:
                                         updated = True
 
@@ -3500,6 +3759,75 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         return
                 self.history.log_operation_end()
 
+        def __refresh_publishers_concurrently(self, pubs, full_refresh,
+            immediate, progtrack, ccancel):
+                """Private helper function that refreshes the publishers in
+                'pubs' by retrieving the catalog data for all of them at
+                once, processing the data for each publisher as soon as it
+                has been retrieved.  Returns a dictionary mapping the prefix
+                of each publisher that was refreshed to the result of its
+                refresh.  Publishers that couldn't be refreshed this way are
+                omitted, so that the caller can refresh them individually;
+                this also takes care of reporting any errors."""
+
+                refreshed = {}
+                # Publishers for which requests are outstanding, mapped to
+                # the number of such requests.
+                started = {}
+                reqs = []
+                for pub in pubs:
+                        try:
+                                preqs = pub.begin_refresh(
+                                    full_refresh=full_refresh,
+                                    immediate=immediate)
+                                if preqs is None:
+                                        # No refresh needed.
+                                        refreshed[pub.prefix] = (False, None)
+                                        continue
+                                if not preqs:
+                                        # No origins to retrieve data from.
+                                        refreshed[pub.prefix] = \
+                                            pub.end_refresh()
+                                        continue
+                        except apx.ApiException:
+                                continue
+
+                        started[pub] = len(preqs)
+                        reqs.extend(preqs)
+
+                def complete(req, exc):
+                        pub = req.pub
+                        if pub not in started:
+                                # A previous request for this publisher
+                                # failed.
+                                return None
+
+                        try:
+                                more = pub.continue_refresh(req, exc)
+                                started[pub] += len(more or EmptyI) - 1
+                                if started[pub]:
+                                        return more
+                                refreshed[pub.prefix] = pub.end_refresh()
+                        except (apx.ApiException, TransportException):
+                                pub.abort_refresh()
+                        del started[pub]
+                        return None
+
+                try:
+                        if reqs:
+                                self.transport.get_catalogs1(reqs, complete,
+                                    progtrack=progtrack, ccancel=ccancel)
+                except apx.CanceledException:
+                        raise
+                except (apx.ApiException, TransportException):
+                        # Any publishers with outstanding requests will be
+                        # refreshed individually instead.
+                        pass
+                finally:
+                        for pub in started:
+                                pub.abort_refresh()
+                return refreshed
+
         def _get_publisher_meta_dir(self):
                 if self.version >= 3:
                         return IMG_PUB_DIR
@@ -3654,12 +3982,6 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                 self.__actdict = None
                 self.__actdict_timestamp = None
-                stripped_path = os.path.join(self.__action_cache_dir,
-                    "actions.stripped")
-                offsets_path = os.path.join(self.__action_cache_dir,
-                    "actions.offsets")
-                conflicting_keys_path = os.path.join(self.__action_cache_dir,
-                    "keys.conflicting")
 
                 excludes = self.list_excludes()
                 heap = []
@@ -3693,23 +4015,214 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                 progtrack.job_add_progress(progtrack.JOB_FAST_LOOKUP)
 
+                def gen_entries():
+                        while heap:
+                                item = heappop(heap)
+                                name, key, fmri, act = item
+                                yield name, key, "{0} {1}".format(fmri, act)
+
+                return self.__write_fast_lookups(gen_entries(),
+                    lambda actdict, sp: imageplan.ImagePlan._check_actions(nsd),
+                    progtrack)
+
+        def _open_fast_lookups(self):
+                """Open the on-disk database created by _create_fast_lookups so
+                that it can be passed to _update_fast_lookups after it has been
+                removed by _remove_fast_lookups.  Returns None if the database
+                doesn't exist or isn't consistent."""
+
+                sf = None
+                try:
+                        sf = open(os.path.join(self.__action_cache_dir,
+                            "actions.stripped"), "r")
+                        offsets = ActionOffsets(os.path.join(
+                            self.__action_cache_dir, "actions.offsets"))
+                except (IOError, struct.error) as e:
+                        if isinstance(e, IOError) and e.errno != errno.ENOENT:
+                                raise
+                        if sf:
+                                sf.close()
+                        return None
+
+                bad_keys = self._load_conflicting_keys()
+                if sf.readline().rstrip() != "VERSION 1" or \
+                    offsets.version != ActionOffsets.VERSION or \
+                    sf.readline().rstrip() != offsets.timestamp or \
+                    bad_keys is None:
+                        sf.close()
+                        return None
+                return sf, offsets, bad_keys
+
+        def _update_fast_lookups(self, old, pkg_pairs, progtrack=None):
+                """Update the on-disk database described in
+                _create_fast_lookups, as opened by _open_fast_lookups and
+                passed in 'old', for the packages installed and removed by an
+                operation.  'pkg_pairs' is an iterable of tuples of the form
+                (added, removed), as for update_pkg_installed_state.
+
+                Only the manifests of the packages added are read, and only
+                the keys of the actions added or removed are checked for
+                conflicts; the rest of the database is copied as is, so that
+                the cost is mostly proportional to the size of the change.
+                The files of 'old' are closed."""
+
+                if not progtrack:
+                        progtrack = progress.NullProgressTracker()
+
+                self.__actdict = None
+                self.__actdict_timestamp = None
+
+                sf, offsets, bad_keys = old
+                excludes = self.list_excludes()
+                gone = set()
+                new = []
+
+                progtrack.job_start(progtrack.JOB_FAST_LOOKUP)
+
+                for add_pkg, rem_pkg in pkg_pairs:
+                        if add_pkg == rem_pkg:
+                                continue
+                        if rem_pkg:
+                                gone.add(str(rem_pkg))
+                        if not add_pkg:
+                                continue
+                        progtrack.job_add_progress(progtrack.JOB_FAST_LOOKUP)
+                        m = self.get_manifest(add_pkg, ignore_excludes=True)
+                        for act in m.gen_actions(excludes=excludes):
+                                if not act.globally_identical:
+                                        continue
+                                act.strip()
+                                new.append((act.name,
+                                    act.attrs[act.key_attr], add_pkg, act))
+                new.sort()
+
+                progtrack.job_add_progress(progtrack.JOB_FAST_LOOKUP)
+
+                # The keys of all of the actions added or removed.
+                touched = set(item[1] for item in new)
+
+                def gen_entries():
+                        # Merge the actions added into the groups of actions
+                        # with the same name and key in the existing database,
+                        # both of which are sorted, leaving out the actions of
+                        # the packages removed.
+                        i = 0
+                        for name, key, offset, cnt in offsets:
+                                lines = []
+                                for j in range(cnt):
+                                        l = sf.readline().rstrip("\n")
+                                        if l.split(" ", 1)[0] in gone:
+                                                touched.add(key)
+                                        else:
+                                                lines.append(l)
+
+                                while i < len(new) and \
+                                    new[i][:2] < (name, key):
+                                        yield new[i][0], new[i][1], \
+                                            "{2} {3}".format(*new[i])
+                                        i += 1
+
+                                if i < len(new) and new[i][:2] == (name, key):
+                                        # Keep the group in the order in
+                                        # which _create_fast_lookups would
+                                        # have written it.
+                                        items = []
+                                        for l in lines:
+                                                fmristr, actstr = \
+                                                    l.split(" ", 1)
+                                                items.append((
+                                                    pkg.fmri.PkgFmri(fmristr),
+                                                    pkg.actions.fromstr(
+                                                    actstr), l))
+                                        while i < len(new) and \
+                                            new[i][:2] == (name, key):
+                                                items.append((new[i][2],
+                                                    new[i][3],
+                                                    "{0} {1}".format(
+                                                    *new[i][2:])))
+                                                i += 1
+                                        items.sort()
+                                        lines = [item[2] for item in items]
+
+                                for l in lines:
+                                        yield name, key, l
+
+                        for item in new[i:]:
+                                yield item[0], item[1], \
+                                    "{2} {3}".format(*item)
+
+                def get_bad_keys(actdict, sp):
+                        # Keys which weren't touched conflict as much as they
+                        # did before; all of the actions with the touched keys
+                        # are checked again.
+                        nsd = {}
+                        with open(sp, "rb") as f:
+                                for key in touched:
+                                        for name in pkg.actions.types:
+                                                off = actdict.get((name, key))
+                                                if off is None:
+                                                        continue
+                                                f.seek(off[0])
+                                                for j in range(off[1]):
+                                                        fmristr, actstr = \
+                                                            misc.force_str(
+                                                            f.readline()
+                                                            ).rstrip(
+                                                            "\n").split(
+                                                            " ", 1)
+                                                        act = pkg.actions.fromstr(
+                                                            actstr)
+                                                        nsd.setdefault(
+                                                            act.namespace_group,
+                                                            {}).setdefault(key,
+                                                            []).append((act,
+                                                            pkg.fmri.PkgFmri(
+                                                            fmristr)))
+                        return (bad_keys - touched) | \
+                            imageplan.ImagePlan._check_actions(nsd)
+
+                try:
+                        return self.__write_fast_lookups(gen_entries(),
+                            get_bad_keys, progtrack)
+                finally:
+                        sf.close()
+
+        def __write_fast_lookups(self, entries, get_bad_keys, progtrack):
+                """Write the files of the database described in
+                _create_fast_lookups, and return the ActionOffsets object
+                mapping action name and key value to offset and count, and the
+                timestamp of the files.  'entries' is an iterable of tuples of
+                action name, key value and line, sorted by action name and key
+                value, and 'get_bad_keys' is a function which is passed the
+                ActionOffsets object and the path of the stripped actions file
+                once it has been written, and returns the keys which have
+                conflicting actions."""
+
+                stripped_path = os.path.join(self.__action_cache_dir,
+                    "actions.stripped")
+                offsets_path = os.path.join(self.__action_cache_dir,
+                    "actions.offsets")
+                conflicting_keys_path = os.path.join(self.__action_cache_dir,
+                    "keys.conflicting")
+
                 # If we can't write the temporary files, then there's no point
                 # in producing actdict because it depends on a synchronized
                 # stripped actions file.
                 try:
-                        actdict = {}
+                        offsets = []
                         sf, sp = self.temporary_file(close=False)
                         of, op = self.temporary_file(close=False)
                         bf, bp = self.temporary_file(close=False)
 
                         sf = os.fdopen(sf, "w")
-                        of = os.fdopen(of, "w")
+                        of = os.fdopen(of, "wb")
                         bf = os.fdopen(bf, "w")
 
                         # We need to make sure the files are coordinated.
                         timestamp = int(time.time())
                         sf.write("VERSION 1\n{0}\n".format(timestamp))
-                        of.write("VERSION 2\n{0}\n".format(timestamp))
+                        of.write(misc.force_bytes("{0}\n{1}\n".format(
+                            ActionOffsets.VERSION, timestamp)))
                         # The conflicting keys file doesn't need a timestamp
                         # because it's not coordinated with the stripped or
                         # offsets files and the result of loading it isn't
@@ -3718,52 +4231,47 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                         last_name, last_key, last_offset = None, None, sf.tell()
                         cnt = 0
-                        while heap:
+                        for i, (name, key, line) in enumerate(entries):
                                 # This is a tight loop, so try to avoid burning
                                 # CPU calling into the progress tracker
                                 # excessively.
-                                if len(heap) % 100 == 0:
+                                if i % 100 == 0:
                                         progtrack.job_add_progress(
                                             progtrack.JOB_FAST_LOOKUP)
-                                item = heappop(heap)
-                                fmri, act = item[2:]
-                                key = act.attrs[act.key_attr]
-                                if act.name != last_name or key != last_key:
+                                if name != last_name or key != last_key:
                                         if last_name is None:
                                                 assert last_key is None
                                                 cnt += 1
-                                                last_name = act.name
+                                                last_name = name
                                                 last_key = key
                                         else:
                                                 assert cnt > 0
-                                                of.write("{0} {1} {2} {3}\n".format(
-                                                    last_name, last_offset,
-                                                    cnt, last_key))
-                                                actdict[(last_name, last_key)] = last_offset, cnt
+                                                offsets.append((last_name,
+                                                    last_key, last_offset, cnt))
                                                 last_name, last_key, last_offset = \
-                                                    act.name, key, sf.tell()
+                                                    name, key, sf.tell()
                                                 cnt = 1
                                 else:
                                         cnt += 1
-                                sf.write("{0} {1}\n".format(fmri, act))
+                                sf.write("{0}\n".format(line))
                         if last_name is not None:
                                 assert last_key is not None
                                 assert last_offset is not None
                                 assert cnt > 0
-                                of.write("{0} {1} {2} {3}\n".format(
-                                    last_name, last_offset, cnt, last_key))
-                                actdict[(last_name, last_key)] = \
-                                    last_offset, cnt
+                                offsets.append((last_name, last_key,
+                                    last_offset, cnt))
 
                         progtrack.job_add_progress(progtrack.JOB_FAST_LOOKUP)
 
-                        bad_keys = imageplan.ImagePlan._check_actions(nsd)
+                        sf.close()
+                        ActionOffsets.write(of, offsets)
+                        of.close()
+                        actdict = ActionOffsets(op)
+                        bad_keys = get_bad_keys(actdict, sp)
                         for k in sorted(bad_keys):
                                 bf.write("{0}\n".format(k))
 
                         progtrack.job_add_progress(progtrack.JOB_FAST_LOOKUP)
-                        sf.close()
-                        of.close()
                         bf.close()
                         os.chmod(sp, misc.PKG_FILE_MODE)
                         os.chmod(op, misc.PKG_FILE_MODE)
@@ -3831,15 +4339,16 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                                 raise apx._convert_error(e)
 
         def _load_actdict(self, progtrack):
-                """Read the file of offsets created in _create_fast_lookups()
-                and return the dictionary mapping action name and key value to
-                offset."""
+                """Open the index of offsets created in _create_fast_lookups()
+                and return the ActionOffsets object mapping action name and key
+                value to offset."""
 
                 try:
-                        of = open(os.path.join(self.__action_cache_dir,
-                            "actions.offsets"), "r")
-                except IOError as e:
-                        if e.errno != errno.ENOENT:
+                        actdict = ActionOffsets(os.path.join(
+                            self.__action_cache_dir, "actions.offsets"))
+                except (IOError, struct.error) as e:
+                        # A missing, truncated or corrupt file is rebuilt.
+                        if isinstance(e, IOError) and e.errno != errno.ENOENT:
                                 raise
                         actdict, otimestamp = self._create_fast_lookups()
                         assert actdict is not None
@@ -3847,14 +4356,11 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         self.__actdict_timestamp = otimestamp
                         return actdict
 
-                # Make sure the files are paired, and try to create them if not.
-                oversion = of.readline().rstrip()
-                otimestamp = of.readline().rstrip()
-
                 # The original action.offsets file existed and had the same
                 # timestamp as the stored actdict, so that actdict can be
                 # reused.
-                if self.__actdict and otimestamp == self.__actdict_timestamp:
+                if self.__actdict and \
+                    actdict.timestamp == self.__actdict_timestamp:
                         return self.__actdict
 
                 sversion, stimestamp = self._get_stripped_actions_file(
@@ -3862,9 +4368,9 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                 # If we recognize neither file's version or their timestamps
                 # don't match, then we blow them away and try again.
-                if oversion != "VERSION 2" or sversion != "VERSION 1" or \
-                    stimestamp != otimestamp:
-                        of.close()
+                if actdict.version != ActionOffsets.VERSION or \
+                    sversion != "VERSION 1" or \
+                    stimestamp != actdict.timestamp:
                         actdict, otimestamp = self._create_fast_lookups()
                         assert actdict is not None
                         self.__actdict = actdict
@@ -3874,27 +4380,11 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 # At this point, the original actions.offsets file existed, no
                 # actdict was saved in the image, the versions matched what was
                 # expected, and the timestamps of the actions.offsets and
-                # actions.stripped files matched, so the actions.offsets file is
-                # parsed to generate actdict.
-                actdict = {}
-
-                for line in of:
-                        actname, offset, cnt, key_attr = \
-                            line.rstrip().split(None, 3)
-                        off = int(offset)
-                        actdict[(actname, key_attr)] = (off, int(cnt))
-
-                        # This is a tight loop, so try to avoid burning
-                        # CPU calling into the progress tracker excessively.
-                        # Since we are already using the offset, we use that
-                        # to damp calls back into the progress tracker.
-                        if off % 500 == 0:
-                                progtrack.plan_add_progress(
-                                    progtrack.PLAN_ACTION_CONFLICT)
-
-                of.close()
+                # actions.stripped files matched; the index is mapped rather
+                # than parsed, so there's nothing more to do.
+                progtrack.plan_add_progress(progtrack.PLAN_ACTION_CONFLICT)
                 self.__actdict = actdict
-                self.__actdict_timestamp = otimestamp
+                self.__actdict_timestamp = actdict.timestamp
                 return actdict
 
         def _get_stripped_actions_file(self, internal=False):
@@ -40,12 +40,14 @@ import six
 import stat
 import sys
 import tempfile
+import threading
 import time
 import traceback
 import weakref
 import re as relib
 
 from functools import cmp_to_key, reduce
+from six.moves import queue
 
 from pkg.client import global_settings
 logger = global_settings.logger
@@ -115,6 +117,183 @@ def _reorder_hardlinks(hardlinks):
         return reordered
 
 
+def _action_batches(actions):
+        """Partition the list of action plans 'actions', which must be in
+        execution order, into batches of actions which can be executed
+        concurrently with each other.  A generator of lists of (index, action
+        plan) tuples is returned, where 'index' is the position of the action
+        plan in 'actions'; the batches must be executed in order.
+
+        Only directories, files, and links are ever executed concurrently,
+        since installing them only affects the filesystem object at their
+        path; all other actions (users and groups, whose files must be updated
+        before any object owned by them is installed, and hardlinks, which have
+        been ordered after their targets) are placed in batches of their own.
+        Directories are further partitioned by the depth of their path so that
+        parent directories are always created before their contents."""
+
+        def flush(name, run):
+                if name != "dir":
+                        yield run
+                        return
+                depths = defaultdict(list)
+                for i, ap in run:
+                        depths[ap.dst.attrs["path"].strip("/").count(
+                            "/")].append((i, ap))
+                for depth in sorted(depths):
+                        yield depths[depth]
+
+        run = []
+        name = None
+        for i, ap in enumerate(actions):
+                act = ap.dst
+                if act.name not in ("dir", "file", "link") or \
+                    "salvage-from" in act.attrs or "save_file" in act.attrs:
+                        # These actions may operate on paths other than
+                        # their own.
+                        if run:
+                                for batch in flush(name, run):
+                                        yield batch
+                                run = []
+                        name = None
+                        yield [(i, ap)]
+                        continue
+
+                if act.name != name and run:
+                        for batch in flush(name, run):
+                                yield batch
+                        run = []
+                name = act.name
+                run.append((i, ap))
+
+        if run:
+                for batch in flush(name, run):
+                        yield batch
+
+
+class _ActionExecutor(object):
+        """Executes action plans in the batches returned by _action_batches(),
+        using a pool of worker threads for any batch of more than one
+        action."""
+
+        def __init__(self, nthreads, cleanup_downloads):
+                self.__nthreads = nthreads
+                self.__threads = []
+                self.__work = queue.Queue()
+                self.__done = queue.Queue()
+                # The function which removes the image's download cache, and
+                # whether a worker thread has asked for that to be done.
+                self.__cleanup_downloads = cleanup_downloads
+                self.__cleanup_pending = False
+                self.__local = threading.local()
+
+        def cleanup_downloads(self):
+                """Remove the image's download cache.  If this is called by a
+                worker thread, it is done by the executing thread once the
+                worker threads are idle instead, as other action plans may be
+                using the cache."""
+
+                if getattr(self.__local, "worker", False):
+                        self.__cleanup_pending = True
+                else:
+                        self.__cleanup_downloads()
+
+        def __worker(self):
+                self.__local.worker = True
+                while True:
+                        item = self.__work.get()
+                        if item is None:
+                                return
+                        i, func, ap = item
+                        try:
+                                func(*ap)
+                        except Exception:
+                                self.__done.put((i, sys.exc_info()))
+                        else:
+                                self.__done.put((i, None))
+
+        def __start(self):
+                while len(self.__threads) < self.__nthreads:
+                        t = threading.Thread(target=self.__worker,
+                            name="action-executor")
+                        t.daemon = True
+                        t.start()
+                        self.__threads.append(t)
+
+        def __cancel(self):
+                """Discard any queued work; returns the number of work items
+                discarded."""
+
+                count = 0
+                while True:
+                        try:
+                                self.__work.get_nowait()
+                        except queue.Empty:
+                                return count
+                        count += 1
+
+        def execute(self, actions, func, progress, retries=None):
+                """Call 'func' with the package plan, source action, and
+                destination action of each action plan in 'actions' (which
+                must be in execution order), and 'progress' after each call
+                that completes.
+
+                If 'retries' is a list, the action plans for which 'func'
+                raises ActionRetry are appended to it in execution order; only
+                actions which are executed one at a time (such as user and
+                group actions) may raise it.  If 'func' raises any other
+                exception, no further action plans are executed and the
+                exception for the earliest failed action plan is re-raised
+                once the actions currently executing have completed."""
+
+                for batch in _action_batches(actions):
+                        if len(batch) == 1 or self.__nthreads < 2:
+                                for i, ap in batch:
+                                        try:
+                                                func(*ap)
+                                        except pkg.actions.ActionRetry:
+                                                if retries is None:
+                                                        raise
+                                                retries.append(ap)
+                                                continue
+                                        progress()
+                                continue
+
+                        self.__start()
+                        for i, ap in batch:
+                                self.__work.put((i, func, ap))
+
+                        failed = []
+                        pending = len(batch)
+                        while pending:
+                                i, exc_info = self.__done.get()
+                                pending -= 1
+                                if exc_info is None:
+                                        progress()
+                                else:
+                                        failed.append((i, exc_info))
+                                        pending -= self.__cancel()
+
+                        # The worker threads are now idle.
+                        if self.__cleanup_pending:
+                                self.__cleanup_pending = False
+                                self.__cleanup_downloads()
+
+                        if failed:
+                                six.reraise(*min(failed,
+                                    key=operator.itemgetter(0))[1])
+
+        def close(self):
+                """Stop the worker threads."""
+
+                self.__cancel()
+                for t in self.__threads:
+                        self.__work.put(None)
+                for t in self.__threads:
+                        t.join()
+                self.__threads = []
+
+
 class ImagePlan(object):
         """ImagePlan object contains the plan for changing the image...
         there are separate routines for planning the various types of
@@ -160,6 +339,7 @@ class ImagePlan(object):
 
                 self.__old_excludes = image.list_excludes()
                 self.__new_excludes = self.__old_excludes
+                self.__solver_cache = None
 
                 self.__preexecuted_indexing_error = None
                 self.__match_inst = {} # dict of fmri -> pattern
@@ -168,6 +348,8 @@ class ImagePlan(object):
 
                 self.__pkg_actuators = set()
                 self._retrieved = set()
+                # The _ActionExecutor used while the plan is executed.
+                self.__executor = None
 
                 self.pd = None
                 if pd is None:
@@ -257,6 +439,17 @@ class ImagePlan(object):
 
                 self.pd.state = plandesc.PREEXECUTED_OK
 
+        def cleanup_downloads(self):
+                """Remove the image's download cache.  While the plan is being
+                executed, actions must use this rather than
+                Image.cleanup_downloads(), as they may be executed by worker
+                threads which share the cache."""
+
+                if self.__executor:
+                        self.__executor.cleanup_downloads()
+                else:
+                        self.image.cleanup_downloads()
+
         @property
         def state(self):
                 return self.pd.state
@@ -499,6 +692,22 @@ class ImagePlan(object):
                         # restore original recursion limit
                         sys.setrecursionlimit(prlimit)
 
+                        # retain whatever package data the solver has
+                        # gathered, even if it failed to find a solution
+                        if self.__solver_cache:
+                                self.__solver_cache.save()
+
+        def __get_solver_cache(self):
+                """Returns the SolverCache to be used by the solver for this
+                plan, or None if the solver cache is disabled."""
+
+                if self.__solver_cache is None or \
+                    self.__solver_cache.excludes is not self.__new_excludes:
+                        self.__solver_cache = self.image.get_solver_cache(
+                            self.__new_excludes, self.pd._new_variants,
+                            self.pd._new_facets)
+                return self.__solver_cache
+
         def __add_actuator(self, trigger_fmri, trigger_op, exec_op, values,
             solver_inst, installed_dict):
                 """Add a single actuator to the solver 'solver_inst' and update
@@ -705,7 +914,8 @@ class ImagePlan(object):
                             variants,
                             avoid_set,
                             self.image.linked.parent_fmris(),
-                            self.__progtrack)
+                            self.__progtrack,
+                            cache=self.__get_solver_cache())
 
                         if reject_list:
                                 # use reject_list, not reject_set, to preserve
@@ -1294,7 +1504,8 @@ class ImagePlan(object):
                             self.image.get_variants(),
                             self.image.avoid_set_get(),
                             self.image.linked.parent_fmris(),
-                            self.__progtrack)
+                            self.__progtrack,
+                            cache=self.__get_solver_cache())
 
                         # check for triggered ops
                         self.__set_pkg_actuators(pkgs_to_uninstall,
@@ -1370,7 +1581,8 @@ class ImagePlan(object):
                             self.image.get_variants(),
                             self.image.avoid_set_get(),
                             self.image.linked.parent_fmris(),
-                            self.__progtrack)
+                            self.__progtrack,
+                            cache=self.__get_solver_cache())
 
                         if reject_list:
                                 # use reject_list, not reject_set, to preserve
@@ -5424,12 +5636,113 @@ class ImagePlan(object):
                 # image before the current operation is performed is desired.
                 empty_image = self.__is_image_empty()
 
+                old_lookups = None
                 if not empty_image:
+                        # Unless the variants or facets change, which changes
+                        # the actions of every installed package, keep the
+                        # fast lookups database open so that it only needs to
+                        # be updated for the packages changed.
+                        if not self.pd._varcets_change:
+                                old_lookups = self.image._open_fast_lookups()
                         # Before proceeding, remove fast lookups database so
                         # that if _create_fast_lookups is interrupted later the
                         # client isn't left with invalid state.
                         self.image._remove_fast_lookups()
 
+                try:
+                        executed_pp = self.__execute_actions()
+                        if old_lookups:
+                                self.image._update_fast_lookups(old_lookups,
+                                    executed_pp, progtrack=self.__progtrack)
+                        else:
+                                self.image._create_fast_lookups(
+                                    progtrack=self.__progtrack)
+                finally:
+                        # _update_fast_lookups() closes the files of
+                        # old_lookups, but isn't reached if execution fails;
+                        # closing them twice is harmless.
+                        if old_lookups:
+                                old_lookups[0].close()
+                self.__save_release_notes()
+
+                # success
+                self.pd.state = plandesc.EXECUTED_OK
+                self.pd._executed_ok()
+
+                # reduce memory consumption
+                self.saved_files = {}
+                self.valid_directories = set()
+                self.__cached_actions = {}
+
+                # Clear out the primordial user and group caches.
+                self.image._users = set()
+                self.image._groups = set()
+                self.image._usersbyname = {}
+                self.image._groupsbyname = {}
+
+                # Perform the incremental update to the search indexes
+                # for all changed packages
+                if self.update_index:
+                        self.image.update_index_dir()
+                        ind = indexer.Indexer(self.image,
+                            self.image.get_manifest,
+                            self.image.get_manifest_path,
+                            progtrack=self.__progtrack,
+                            excludes=self.__new_excludes)
+                        try:
+                                if empty_image:
+                                        ind.setup()
+                                if empty_image or ind.check_index_existence():
+                                        ind.client_update_index(([],
+                                            executed_pp), self.image)
+                        except KeyboardInterrupt:
+                                raise
+                        except se.ProblematicPermissionsIndexException:
+                                # ProblematicPermissionsIndexException
+                                # is included here as there's little
+                                # chance that trying again will fix this
+                                # problem.
+                                raise api_errors.WrapIndexingException(e,
+                                    traceback.format_exc(),
+                                    traceback.format_stack())
+                        except Exception as e:
+                                # It's important to delete and rebuild
+                                # from scratch rather than using the
+                                # existing indexer because otherwise the
+                                # state will become confused.
+                                del ind
+                                # XXX Once we have a framework for
+                                # emitting a message to the user in this
+                                # spot in the code, we should tell them
+                                # something has gone wrong so that we
+                                # continue to get feedback to allow
+                                # us to debug the code.
+                                try:
+                                        ind = indexer.Indexer(self.image,
+                                            self.image.get_manifest,
+                                            self.image.get_manifest_path,
+                                            progtrack=self.__progtrack,
+                                            excludes=self.__new_excludes)
+                                        ind.rebuild_index_from_scratch(
+                                            self.image.gen_installed_pkgs())
+                                except Exception as e:
+                                        raise api_errors.WrapIndexingException(
+                                            e, traceback.format_exc(),
+                                            traceback.format_stack())
+                                raise \
+                                    api_errors.WrapSuccessfulIndexingException(
+                                        e, traceback.format_exc(),
+                                        traceback.format_stack())
+                        if self.__preexecuted_indexing_error is not None:
+                                raise self.__preexecuted_indexing_error
+
+        def __execute_actions(self):
+                """Run the actuators and execute the actions of the plan,
+                updating the installed state of the image.  Returns a list of
+                tuples of (src, dest) for each package plan executed."""
+
+                pt = self.__progtrack
+
                 if not self.image.is_liveroot():
                         # Check if the child is a running zone. If so run the
                         # actuator in the zone.
@@ -5453,6 +5766,10 @@ class ImagePlan(object):
                 # List of tuples of (src, dest) used to track each pkgplan so
                 # that it can be discarded after execution.
                 executed_pp = []
+                executor = _ActionExecutor(
+                    global_settings.client_action_threads,
+                    self.image.cleanup_downloads)
+                self.__executor = executor
                 try:
                         try:
                                 pt.actions_set_goal(pt.ACTION_REMOVE,
@@ -5485,13 +5802,10 @@ class ImagePlan(object):
                                 # execute installs; if action throws a retry
                                 # exception try it again afterward.
                                 retries = []
-                                for p, src, dest in self.pd.install_actions:
-                                        try:
-                                                p.execute_install(src, dest)
-                                                pt.actions_add_progress(
-                                                    pt.ACTION_INSTALL)
-                                        except pkg.actions.ActionRetry:
-                                                retries.append((p, src, dest))
+                                executor.execute(self.pd.install_actions,
+                                    pkgplan.PkgPlan.execute_install,
+                                    lambda: pt.actions_add_progress(
+                                    pt.ACTION_INSTALL), retries=retries)
                                 for p, src, dest in retries:
                                         p.execute_retry(src, dest)
                                         pt.actions_add_progress(
@@ -5504,10 +5818,10 @@ class ImagePlan(object):
                                 self.pd.install_actions = []
 
                                 # execute updates
-                                for p, src, dest in self.pd.update_actions:
-                                        p.execute_update(src, dest)
-                                        pt.actions_add_progress(
-                                            pt.ACTION_UPDATE)
+                                executor.execute(self.pd.update_actions,
+                                    pkgplan.PkgPlan.execute_update,
+                                    lambda: pt.actions_add_progress(
+                                    pt.ACTION_UPDATE))
 
                                 pt.actions_done(pt.ACTION_UPDATE)
                                 pt.actions_all_done()
@@ -5610,80 +5924,11 @@ class ImagePlan(object):
 
                 else:
                         self.pd._actuators.exec_post_actuators(self.image)
+                finally:
+                        executor.close()
+                        self.__executor = None
 
-                self.image._create_fast_lookups(progtrack=self.__progtrack)
-                self.__save_release_notes()
-
-                # success
-                self.pd.state = plandesc.EXECUTED_OK
-                self.pd._executed_ok()
-
-                # reduce memory consumption
-                self.saved_files = {}
-                self.valid_directories = set()
-                self.__cached_actions = {}
-
-                # Clear out the primordial user and group caches.
-                self.image._users = set()
-                self.image._groups = set()
-                self.image._usersbyname = {}
-                self.image._groupsbyname = {}
-
-                # Perform the incremental update to the search indexes
-                # for all changed packages
-                if self.update_index:
-                        self.image.update_index_dir()
-                        ind = indexer.Indexer(self.image,
-                            self.image.get_manifest,
-                            self.image.get_manifest_path,
-                            progtrack=self.__progtrack,
-                            excludes=self.__new_excludes)
-                        try:
-                                if empty_image:
-                                        ind.setup()
-                                if empty_image or ind.check_index_existence():
-                                        ind.client_update_index(([],
-                                            executed_pp), self.image)
-                        except KeyboardInterrupt:
-                                raise
-                        except se.ProblematicPermissionsIndexException:
-                                # ProblematicPermissionsIndexException
-                                # is included here as there's little
-                                # chance that trying again will fix this
-                                # problem.
-                                raise api_errors.WrapIndexingException(e,
-                                    traceback.format_exc(),
-                                    traceback.format_stack())
-                        except Exception as e:
-                                # It's important to delete and rebuild
-                                # from scratch rather than using the
-                                # existing indexer because otherwise the
-                                # state will become confused.
-                                del ind
-                                # XXX Once we have a framework for
-                                # emitting a message to the user in this
-                                # spot in the code, we should tell them
-                                # something has gone wrong so that we
-                                # continue to get feedback to allow
-                                # us to debug the code.
-                                try:
-                                        ind = indexer.Indexer(self.image,
-                                            self.image.get_manifest,
-                                            self.image.get_manifest_path,
-                                            progtrack=self.__progtrack,
-                                            excludes=self.__new_excludes)
-                                        ind.rebuild_index_from_scratch(
-                                            self.image.gen_installed_pkgs())
-                                except Exception as e:
-                                        raise api_errors.WrapIndexingException(
-                                            e, traceback.format_exc(),
-                                            traceback.format_stack())
-                                raise \
-                                    api_errors.WrapSuccessfulIndexingException(
-                                        e, traceback.format_exc(),
-                                        traceback.format_stack())
-                        if self.__preexecuted_indexing_error is not None:
-                                raise self.__preexecuted_indexing_error
+                return executed_pp
 
         def __is_image_empty(self):
                 try:
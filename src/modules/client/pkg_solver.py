@@ -27,7 +27,10 @@
 """Provides the interfaces and exceptions needed to determine which packages
 should be installed, updated, or removed to perform a requested operation."""
 
+import errno
 import operator
+import os
+import tempfile
 import time
 
 from collections import defaultdict
@@ -44,7 +47,9 @@ import pkg.catalog as catalog
 import pkg.client.api_errors as api_errors
 import pkg.client.image
 import pkg.fmri
+import pkg.json as json
 import pkg.misc as misc
+import pkg.portable as portable
 import pkg.solver
 import pkg.version as version
 
@@ -118,20 +123,225 @@ class DependencyException(Exception):
                 return self.__reason
 
 
+
+class SolverCache(object):
+        """A persistent cache of the package data that PkgSolver retrieves
+        from the image's known catalog; that is, the actions in the
+        Catalog.DEPENDENCY section of each package, which of those actions
+        are excluded by the image's variants and facets, and the variants
+        each package supports.
+
+        Retrieving, parsing, and filtering this data is a significant part
+        of the setup cost of each solver run.  The cache is stored in the
+        file 'pathname' and is only used if it was created for the same
+        catalog (as determined by its last modification time) and the same
+        excludes (as described by 'key'); otherwise, it is discarded and
+        replaced with a new one the next time it is saved.
+
+        The first line of the file is a JSON object describing the catalog
+        and key the cache was created for, and each following line is a
+        JSON list of the FMRI of a package and its entry.  Entries gathered
+        while the file is current are appended to it, so that the file
+        doesn't have to be rewritten for each plan; a later line for the
+        same FMRI replaces an earlier one.
+
+        'excludes' is the list of callables (see Image.list_excludes())
+        that determined which of the cached actions are excluded."""
+
+        # The version of the cache file format.
+        VERSION = 2
+
+        def __init__(self, pathname, cat, excludes, key):
+                self.__pathname = pathname
+                self.__current = False
+                self.__new = set()
+                self.__pkgs = None
+                self.excludes = excludes
+
+                # The key is stored as JSON, so it must be compared in the
+                # form that it will have once retrieved.
+                self.__key = json.loads(json.dumps(key))
+                lm = cat.last_modified
+                if lm:
+                        lm = catalog.datetime_to_basic_ts(lm)
+                self.__last_modified = lm
+
+        def __header(self):
+                return {
+                    "version": self.VERSION,
+                    "last-modified": self.__last_modified,
+                    "key": self.__key,
+                }
+
+        def __read_header(self, f):
+                """Returns True if the header line read from the file object
+                'f' matches the catalog and key of this cache."""
+
+                try:
+                        return json.loads(misc.force_str(f.readline())) == \
+                            self.__header()
+                except ValueError:
+                        return False
+
+        def __load(self):
+                """Loads the cache file if it is valid for the catalog and key
+                the cache was created with."""
+
+                self.__pkgs = {}
+                pkgs = {}
+                try:
+                        with open(self.__pathname, "rb") as f:
+                                if not self.__read_header(f):
+                                        return
+                                for l in f:
+                                        try:
+                                                pfmri, entry = json.loads(
+                                                    misc.force_str(l))
+                                        except (TypeError, ValueError):
+                                                # An incomplete append; the
+                                                # entries that follow, if
+                                                # any, can't be trusted.
+                                                break
+                                        pkgs[pfmri] = entry
+                except EnvironmentError as e:
+                        if e.errno in (errno.ENOENT, errno.EACCES):
+                                return
+                        raise api_errors._convert_error(e)
+                self.__pkgs = pkgs
+                self.__current = True
+
+        def __get_entry(self, pfmri):
+                if self.__pkgs is None:
+                        self.__load()
+                return self.__pkgs.get(pfmri.get_fmri(anarchy=False,
+                    include_scheme=False), None)
+
+        def __set_entry(self, pfmri, idx, value):
+                if self.__pkgs is None:
+                        self.__load()
+                k = pfmri.get_fmri(anarchy=False, include_scheme=False)
+                entry = self.__pkgs.setdefault(k, [None, None])
+                entry[idx] = value
+                self.__new.add(k)
+
+        def get_actions(self, pfmri):
+                """Returns a tuple of the list of action strings cached for
+                the Catalog.DEPENDENCY section of 'pfmri' and the list of
+                indices of those actions that are excluded, or None if they
+                are not cached."""
+
+                entry = self.__get_entry(pfmri)
+                if entry and entry[0] is not None:
+                        return entry[0]
+                return None
+
+        def set_actions(self, pfmri, acts, excluded):
+                """Caches the list of action strings 'acts' for the
+                Catalog.DEPENDENCY section of 'pfmri' and the list of indices
+                'excluded' of those actions that are excluded."""
+
+                self.__set_entry(pfmri, 0, [acts, excluded])
+
+        def get_variants(self, pfmri):
+                """Returns the dictionary of variants cached for 'pfmri' or
+                None if it is not cached."""
+
+                entry = self.__get_entry(pfmri)
+                if entry:
+                        return entry[1]
+                return None
+
+        def set_variants(self, pfmri, variants):
+                """Caches the dictionary of variants 'variants' for 'pfmri'."""
+
+                self.__set_entry(pfmri, 1, variants)
+
+        def __lines(self, keys):
+                return "".join(
+                    json.dumps([k, self.__pkgs[k]]) + "\n"
+                    for k in sorted(keys)
+                )
+
+        def __append(self):
+                """Appends the entries added since the cache was loaded or
+                saved to the cache file, if it is still current.  Returns
+                False if it isn't, in which case it must be rewritten."""
+
+                try:
+                        with open(self.__pathname, "ab+") as f:
+                                f.seek(0)
+                                if not self.__read_header(f):
+                                        return False
+                                # Appending to an incomplete line would lose
+                                # the entries appended.
+                                f.seek(-1, os.SEEK_END)
+                                if f.read(1) != b"\n":
+                                        return False
+                                f.write(misc.force_bytes(self.__lines(
+                                    self.__new)))
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise
+                        return False
+                return True
+
+        def __rewrite(self):
+                """Replaces the cache file with one containing all of the
+                entries of this cache."""
+
+                dirname = os.path.dirname(self.__pathname)
+                tmp_name = None
+                try:
+                        if not os.path.exists(dirname):
+                                os.makedirs(dirname)
+                        fd, tmp_name = tempfile.mkstemp(dir=dirname,
+                            prefix=".solver.")
+                        with os.fdopen(fd, "w") as f:
+                                f.write(json.dumps(self.__header()) + "\n")
+                                f.write(self.__lines(self.__pkgs))
+                        os.chmod(tmp_name, misc.PKG_FILE_MODE)
+                        portable.rename(tmp_name, self.__pathname)
+                        tmp_name = None
+                finally:
+                        if tmp_name:
+                                portable.remove(tmp_name)
+
+        def save(self):
+                """Writes the entries added to the cache to disk.  If the copy
+                on disk was created for the same catalog and key, they are
+                appended to it; otherwise, it is replaced.  As the cache is
+                only an optimization, failure to write it due to lack of
+                privileges or a read-only file system is not an error."""
+
+                if not self.__new:
+                        return
+
+                try:
+                        if not self.__current or not self.__append():
+                                self.__rewrite()
+                except EnvironmentError as e:
+                        if e.errno not in (errno.EACCES, errno.EROFS):
+                                raise api_errors._convert_error(e)
+                self.__current = True
+                self.__new = set()
+
+
 class PkgSolver(object):
         """Provides a SAT-based solution solver to determine which packages
         should be installed, updated, or removed to perform a requested
         operation."""
 
         def __init__(self, cat, installed_dict, pub_ranks, variants, avoids,
-            parent_pkgs, progtrack):
+            parent_pkgs, progtrack, cache=None):
                 """Create a PkgSolver instance; catalog should contain all
                 known pkgs, installed fmris should be a dict of fmris indexed
                 by name that define pkgs current installed in the image.
                 Pub_ranks dict contains (rank, stickiness, enabled) for each
                 publisher.  variants are the current image variants; avoids is
                 the set of pkg stems being avoided in the image due to
-                administrator action (e.g. --reject, uninstall)."""
+                administrator action (e.g. --reject, uninstall).  cache is an
+                optional SolverCache used to retrieve package data instead of
+                the catalog."""
 
                 # Value 'DebugValues' is unsubscriptable;
                 # pylint: disable=E1136
@@ -172,6 +382,8 @@ class PkgSolver(object):
                 self.__fmri2id = {}             # and reverse
 
                 self.__solver = pkg.solver.msat_solver()
+                self.__selectors = []           # active clause set selectors
+                self.__next_selector = None     # next selector variable id
 
                 self.__progtrack = progtrack    # progress tracker
                 self.__progitem = None          # progress tracker plan item
@@ -183,6 +395,9 @@ class PkgSolver(object):
 
                 self.__cache = {}
                 self.__actcache = {}
+                self.__solver_cache = cache     # persistent pkg data cache
+                self.__sections = {}            # fmri -> (dependency section
+                                                # actions, excluded indices)
                 self.__trimdone = False         # indicate we're finished
                                                 # trimming
                 self.__fmri_state = {}          # cache of obsolete, renamed
@@ -295,6 +510,8 @@ class PkgSolver(object):
                 self.__variants = None
                 self.__cache = None
                 self.__actcache = None
+                self.__solver_cache = None
+                self.__sections = None
                 self.__trimdone = None
                 self.__fmri_state = None
                 self.__start_time = None
@@ -1211,9 +1428,9 @@ class PkgSolver(object):
                 self.__progitem = pt.PLAN_SOLVE_SOLVER
                 pt.plan_start(pt.PLAN_SOLVE_SOLVER)
                 self.__start_subphase(13)
-                # save a solver instance so we can come back here
+                # start a set of clauses we can discard to come back here
                 # this is where errors happen...
-                saved_solver = self.__save_solver()
+                saved_solver = self.__push_solver()
                 try:
                         saved_solution = self.__solve()
                 except api_errors.PlanCreationException as exp:
@@ -1227,7 +1444,7 @@ class PkgSolver(object):
                 # while still keeping command line pkgs at their
                 # optimum level
 
-                self.__restore_solver(saved_solver)
+                self.__pop_solver(saved_solver)
 
                 # fix the fmris that were specified on the cmd line
                 # at their optimum (newest) level along with the
@@ -1241,7 +1458,7 @@ class PkgSolver(object):
 
                 self.__start_subphase(15)
                 # save context
-                saved_solver = self.__save_solver()
+                saved_solver = self.__push_solver()
 
                 saved_solution = self.__solve(older=True)
 
@@ -1251,7 +1468,7 @@ class PkgSolver(object):
                 # Since we want to move as far forward as possible
                 # when we have to move a package, fix the originals
                 # and drive forward again w/ the remainder
-                self.__restore_solver(saved_solver)
+                self.__pop_solver(saved_solver)
 
                 for fmri in saved_solution & self.__installed_fmris:
                         self.__addclauses(
@@ -1572,14 +1789,34 @@ class PkgSolver(object):
 
                 return ret
 
-        def __save_solver(self):
-                """Duplicate current current solver state and return it."""
-                return (self.__addclause_failure,
-                    pkg.solver.msat_solver(self.__solver))
-
-        def __restore_solver(self, solver):
-                """Set the current solver state to the previously saved one"""
-                self.__addclause_failure, self.__solver = solver
+        def __push_solver(self):
+                """Start a new set of clauses that can be discarded later
+                using __pop_solver() and return the state needed to do so.
+
+                Rather than copying the solver (and adding all of its clauses
+                to the copy), each clause added while the set is active is
+                guarded by a selector variable that is only assumed to be
+                true while solving; this allows the solver to retain what it
+                has learnt about the remaining clauses."""
+
+                if self.__next_selector is None:
+                        # Selector variables must not collide with the
+                        # ids assigned to package FMRIs.
+                        self.__next_selector = self.__variables + 1
+                sel = self.__next_selector
+                self.__next_selector += 1
+                self.__selectors.append(sel)
+                return (self.__addclause_failure, sel)
+
+        def __pop_solver(self, state):
+                """Discard the set of clauses started by the __push_solver()
+                call that returned 'state'."""
+
+                self.__addclause_failure, sel = state
+                assert self.__selectors[-1] == sel
+                self.__selectors.pop()
+                # Permanently disable the clauses guarded by the selector.
+                self.__solver.add_clause([-sel])
                 self.__iterations = 0
 
         def __solve(self, older=False, max_iterations=2000):
@@ -1588,7 +1825,9 @@ class PkgSolver(object):
                 solution_vector = []
                 self.__state = SOLVER_FAIL
                 eliminated = set()
-                while not self.__addclause_failure and self.__solver.solve([]):
+                examined = set()
+                while not self.__addclause_failure and \
+                    self.__solver.solve(self.__selectors):
                         self.__progress()
                         self.__iterations += 1
 
@@ -1601,7 +1840,9 @@ class PkgSolver(object):
 
                         # prevent the selection of any older pkgs except for
                         # those that are part of the set of allowed downgrades;
-                        for fid in solution_vector:
+                        # this only needs to be done once for each pkg, no
+                        # matter how many solutions it is part of
+                        for fid in solution_vector - examined:
                                 pfmri = self.__getfmri(fid)
                                 matching, remaining = \
                                     self.__comb_newer_fmris(pfmri)
@@ -1612,12 +1853,19 @@ class PkgSolver(object):
                                         # earlier versions of downgradeable
                                         # packages
                                         remove = remaining - \
-                                            self.__allowed_downgrades
+                                            self.__allowed_downgrades - \
+                                            eliminated
                                 else:
                                         remove = matching - set([pfmri]) - \
                                             eliminated
+                                # each is only excluded once; while a set of
+                                # clauses started by __push_solver() is
+                                # active, repeating them would add redundant
+                                # clauses instead of no-op unit clauses
+                                eliminated.update(remove)
                                 for f in remove:
                                         self.__addclauses([[-self.__getid(f)]])
+                        examined.update(solution_vector)
 
 
                         # prevent the selection of this exact combo;
@@ -1635,8 +1883,11 @@ class PkgSolver(object):
 
         def __get_solution_vector(self):
                 """Return solution vector from solver"""
+                # Selector variables (see __push_solver()) follow the ids
+                # assigned to package FMRIs and are not part of the solution.
                 return frozenset([
-                    (i + 1) for i in range(self.__solver.get_variables())
+                    (i + 1) for i in range(min(self.__variables,
+                        self.__solver.get_variables()))
                     if self.__solver.dereference(i)
                 ])
 
@@ -1770,8 +2021,8 @@ class PkgSolver(object):
                 try:
                         relevant = dict([
                                 (a.attrs["name"], a.attrs["value"])
-                                for a in self.__catalog.get_entry_actions(fmri,
-                                [catalog.Catalog.DEPENDENCY], excludes=excludes)
+                                for a in self.__get_dependency_section(fmri,
+                                excludes)
                                 if a.name == "set" and \
                                     a.attrs["name"] in ["pkg.renamed",
                                     "pkg.obsolete"]
@@ -1799,6 +2050,65 @@ class PkgSolver(object):
                         self.__fmri_loadstate(fmri, excludes)
                 return self.__fmri_state[fmri][1]
 
+        @staticmethod
+        def __include_action(fmri, a, excludes):
+                """Return True if action 'a' from the Catalog.DEPENDENCY
+                section for 'fmri' is not excluded by 'excludes'; this must
+                match the filtering performed by Catalog.get_entry_actions."""
+
+                if a.name == "set" and \
+                    (a.attrs["name"].startswith("facet") or
+                    a.attrs["name"].startswith("variant")):
+                        return True
+                return a.include_this(excludes, publisher=fmri.publisher)
+
+        def __get_dependency_section(self, fmri, excludes):
+                """Return list of actions in the Catalog.DEPENDENCY section
+                for this 'fmri' that are not excluded by 'excludes', using the
+                persistent solver cache if possible."""
+
+                sc = self.__solver_cache
+                if sc is None:
+                        return list(self.__catalog.get_entry_actions(fmri,
+                            [catalog.Catalog.DEPENDENCY], excludes=excludes))
+
+                try:
+                        acts, excluded = self.__sections[fmri]
+                except KeyError:
+                        cached = sc.get_actions(fmri)
+                        if cached is not None:
+                                acts = [
+                                    pkg.actions.fromstr(a)
+                                    for a in cached[0]
+                                ]
+                                excluded = frozenset(cached[1])
+                        else:
+                                acts = list(self.__catalog.get_entry_actions(
+                                    fmri, [catalog.Catalog.DEPENDENCY]))
+                                excluded = frozenset(
+                                    i
+                                    for i, a in enumerate(acts)
+                                    if not self.__include_action(fmri, a,
+                                        sc.excludes)
+                                )
+                                sc.set_actions(fmri, [str(a) for a in acts],
+                                    sorted(excluded))
+                        self.__sections[fmri] = (acts, excluded)
+
+                if not excludes or (excludes is sc.excludes and not excluded):
+                        return acts
+                if excludes is sc.excludes:
+                        return [
+                            a
+                            for i, a in enumerate(acts)
+                            if i not in excluded
+                        ]
+                return [
+                    a
+                    for a in acts
+                    if self.__include_action(fmri, a, excludes)
+                ]
+
         def __get_actions(self, fmri, name, excludes=EmptyI,
             trim_invalid=True):
                 """Return list of actions of type 'name' for this 'fmri' in
@@ -1812,8 +2122,8 @@ class PkgSolver(object):
                 try:
                         acts = [
                             a
-                            for a in self.__catalog.get_entry_actions(fmri,
-                            [catalog.Catalog.DEPENDENCY], excludes=excludes)
+                            for a in self.__get_dependency_section(fmri,
+                            excludes)
                             if a.name == name
                         ]
 
@@ -1856,8 +2166,8 @@ class PkgSolver(object):
                 """Return dictionary of variants suppported by fmri"""
                 try:
                         if fmri not in self.__variant_dict:
-                                self.__variant_dict[fmri] = dict(
-                                    self.__catalog.get_entry_all_variants(fmri))
+                                self.__variant_dict[fmri] = \
+                                    self.__load_variant_dict(fmri)
                 except api_errors.InvalidPackageErrors:
                         # Trim package entries that have unparseable action data
                         # so that they can be filtered out later.
@@ -1865,6 +2175,21 @@ class PkgSolver(object):
                         self.__trim_unsupported(fmri)
                 return self.__variant_dict[fmri]
 
+        def __load_variant_dict(self, fmri):
+                """Return dictionary of variants supported by fmri from the
+                persistent solver cache or, failing that, the catalog."""
+
+                sc = self.__solver_cache
+                if sc is not None:
+                        vd = sc.get_variants(fmri)
+                        if vd is not None:
+                                return vd
+
+                vd = dict(self.__catalog.get_entry_all_variants(fmri))
+                if sc is not None:
+                        sc.set_variants(fmri, vd)
+                return vd
+
         def __is_explicit_install(self, fmri):
                 """check if given fmri has explicit install actions."""
 
@@ -2843,6 +3168,12 @@ class PkgSolver(object):
         def __addclauses(self, clauses):
                 """add list of clause lists to solver"""
 
+                if self.__selectors:
+                        # Only in effect while the innermost set of clauses
+                        # started by __push_solver() is active.
+                        sel = -self.__selectors[-1]
+                        clauses = [list(c) + [sel] for c in clauses]
+
                 for c in clauses:
                         try:
                                 if not self.__solver.add_clause(c):
@@ -2925,8 +3256,7 @@ class PkgSolver(object):
 
                 installed_incs = []
                 for f in self.__installed_fmris - self.__removal_fmris:
-                        for d in self.__catalog.get_entry_actions(f,
-                            [catalog.Catalog.DEPENDENCY], excludes=excludes):
+                        for d in self.__get_dependency_section(f, excludes):
                                 if (d.name == "set" and d.attrs["name"] ==
                                     "pkg.depend.install-hold"):
                                         installed_incs.append(f)
@@ -2954,9 +3284,8 @@ class PkgSolver(object):
                 # dependencies, those packages that are depended on by explict
                 # version, and those that have pkg.depend.install-hold values.
                 for f in self.__installed_fmris - self.__removal_fmris:
-                        for d in self.__catalog.get_entry_actions(f,
-                            [catalog.Catalog.DEPENDENCY],
-                            excludes=excludes):
+                        for d in self.__get_dependency_section(f,
+                            excludes):
                                 if d.name == "depend":
                                         fmris = []
                                         for fl in d.attrlist("fmri"):
@@ -1275,6 +1275,10 @@ class Publisher(object):
                 # for those certificates we couldn't store on disk.
                 self.__issuers = {}
 
+                # Catalog retrievals in progress for refreshes started using
+                # begin_refresh(), keyed by CatalogRequest.
+                self.__refreshes = {}
+
                 # Must be done last.
                 self._catalog = catalog
 
@@ -2106,33 +2110,11 @@ pkg unset-publisher {0}
                         return self.__refresh_v0(croot, full_refresh, immediate,
                             repo)
 
-                # If a v0 catalog is present, remove it before proceeding to
-                # ensure transitions between catalog versions work correctly.
-                v0_cat = old_catalog.ServerCatalog(croot, read_only=True,
-                    publisher=self.prefix)
-                if v0_cat.exists:
-                        v0_cat.destroy(root=croot)
-
-                # If above succeeded, we now have a catalog.attrs file.  Parse
-                # this to determine what other constituent parts need to be
-                # downloaded.
-                flist = []
-                if not full_refresh and v1_cat.exists:
-                        flist = v1_cat.get_updates_needed(tempdir)
-                        if flist == None:
-                                return False, True
-                else:
-                        attrs = pkg.catalog.CatalogAttrs(meta_root=tempdir)
-                        for name in attrs.parts:
-                                locale = name.split(".", 2)[2]
-                                # XXX Skip parts that aren't in the C locale for
-                                # now.
-                                if locale != "C":
-                                        continue
-                                flist.append(name)
-                        if include_updates:
-                                for update in attrs.updates:
-                                        flist.append(update)
+                # If above succeeded, we now have a catalog.attrs file.
+                flist = self.__get_catalog_flist(croot, tempdir, full_refresh,
+                    include_updates)
+                if flist is None:
+                        return False, True
 
                 if flist:
                         # More catalog files to retrieve.
@@ -2148,6 +2130,47 @@ pkg unset-publisher {0}
                                 return self.__refresh_v0(croot, full_refresh,
                                     immediate, repo)
 
+                self.__apply_catalog(croot, tempdir, full_refresh)
+                return True, True
+
+        def __get_catalog_flist(self, croot, tempdir, full_refresh,
+            include_updates):
+                """Private helper method that determines which catalog files
+                need to be retrieved for the origin with catalog root 'croot'
+                based on the catalog.attrs file that was retrieved to
+                'tempdir'.  Returns None if the catalog is up to date."""
+
+                # If a v0 catalog is present, remove it before proceeding to
+                # ensure transitions between catalog versions work correctly.
+                v0_cat = old_catalog.ServerCatalog(croot, read_only=True,
+                    publisher=self.prefix)
+                if v0_cat.exists:
+                        v0_cat.destroy(root=croot)
+
+                # Parse the catalog.attrs file to determine what other
+                # constituent parts need to be downloaded.
+                flist = []
+                v1_cat = pkg.catalog.Catalog(meta_root=croot)
+                if not full_refresh and v1_cat.exists:
+                        return v1_cat.get_updates_needed(tempdir)
+
+                attrs = pkg.catalog.CatalogAttrs(meta_root=tempdir)
+                for name in attrs.parts:
+                        locale = name.split(".", 2)[2]
+                        # XXX Skip parts that aren't in the C locale for
+                        # now.
+                        if locale != "C":
+                                continue
+                        flist.append(name)
+                if include_updates:
+                        for update in attrs.updates:
+                                flist.append(update)
+                return flist
+
+        def __apply_catalog(self, croot, tempdir, full_refresh):
+                """Private helper method that updates or replaces the catalog
+                in 'croot' using the catalog files retrieved to 'tempdir'."""
+
                 # Clear _catalog, so we'll read in the new catalog.
                 self._catalog = None
                 v1_cat = pkg.catalog.Catalog(meta_root=croot)
@@ -2189,7 +2212,6 @@ pkg unset-publisher {0}
                                 # than the catalog parts being provided.
                                 v1_cat.destroy()
                                 raise api_errors.MismatchedCatalog(self.prefix)
-                return True, True
 
         def __refresh_origin(self, croot, full_refresh, immediate, mismatched,
             origin, progtrack=None, include_updates=False):
@@ -2240,16 +2262,10 @@ pkg unset-publisher {0}
                         # Cleanup tempdir.
                         shutil.rmtree(tempdir, True)
 
-        def __refresh(self, full_refresh, immediate, mismatched=False,
-	    progtrack=None, include_updates=False, ignore_errors=False):
-                """The method to handle the overall refresh process.  It
-                determines if a refresh is actually needed, and then calls
-                the first version-specific refresh method in the chain."""
-
-                assert self.transport
-
-                if full_refresh:
-                        immediate = True
+        def __check_refresh(self, full_refresh, immediate):
+                """Private helper method that prepares the publisher's
+                metadata directories for a refresh and returns a boolean
+                indicating whether a refresh is needed."""
 
                 for origin, opath in self.__gen_origin_paths():
                         misc.makedirs(opath)
@@ -2269,8 +2285,23 @@ pkg unset-publisher {0}
                 if not full_refresh and self.catalog.exists:
                         # If catalog is on disk, check if refresh is necessary.
                         if not immediate and not self.needs_refresh:
-                                # No refresh needed.
-                                return False, None
+                                return False
+                return True
+
+        def __refresh(self, full_refresh, immediate, mismatched=False,
+	    progtrack=None, include_updates=False, ignore_errors=False):
+                """The method to handle the overall refresh process.  It
+                determines if a refresh is actually needed, and then calls
+                the first version-specific refresh method in the chain."""
+
+                assert self.transport
+
+                if full_refresh:
+                        immediate = True
+
+                if not self.__check_refresh(full_refresh, immediate):
+                        # No refresh needed.
+                        return False, None
 
                 any_changed = False
                 any_refreshed = False
@@ -2390,6 +2421,120 @@ pkg unset-publisher {0}
                         # to a transient error.  So, retry at least once more.
                         return self.__refresh(True, True, progtrack=progtrack)
 
+        def begin_refresh(self, full_refresh=False, immediate=False,
+            include_updates=False):
+                """Starts a refresh of the publisher's metadata for which the
+                caller retrieves the catalog data of all origins at once,
+                possibly together with that of other publishers, using the
+                transport's get_catalogs1() method.  Returns a list of
+                CatalogRequest objects to retrieve, or None if no refresh is
+                needed.  The arguments are the same as for refresh().
+
+                Each request must be passed to continue_refresh() once it
+                has completed, and end_refresh() called once all requests
+                have completed.  If any step fails, abort_refresh() must be
+                called; refresh() can then be used to refresh the publisher
+                instead, as it handles v0 catalogs and retries."""
+
+                from pkg.client.transport.transport import CatalogRequest
+
+                assert self.transport
+                assert not self.__refreshes
+
+                if full_refresh:
+                        immediate = True
+
+                if not self.__check_refresh(full_refresh, immediate):
+                        return None
+
+                reqs = []
+                for origin, opath in self.__gen_origin_paths():
+                        # Create a copy of the current repository object that
+                        # only contains the origin specified.
+                        repo = copy.copy(self.repository)
+                        repo.origins = [origin]
+
+                        try:
+                                tempdir = tempfile.mkdtemp(dir=opath)
+                        except EnvironmentError as e:
+                                self.abort_refresh()
+                                raise api_errors._convert_error(e)
+
+                        req = CatalogRequest(self, ["catalog.attrs"], tempdir,
+                            alt_repo=repo, redownload=full_refresh)
+                        # opath, repo, tempdir, full_refresh, include_updates,
+                        # changed
+                        self.__refreshes[req] = [opath, repo, tempdir,
+                            full_refresh, include_updates, False]
+                        reqs.append(req)
+                return reqs
+
+        def continue_refresh(self, req, exc=None):
+                """Processes the catalog files retrieved for the
+                CatalogRequest 'req' returned by begin_refresh() or a previous
+                call to continue_refresh().  'exc' is the exception that
+                caused the retrieval to fail, if any, and is raised.  Returns
+                a list of further CatalogRequest objects to retrieve or
+                None."""
+
+                from pkg.client.transport.transport import CatalogRequest
+
+                if exc:
+                        raise exc
+
+                state = self.__refreshes[req]
+                opath, repo, tempdir, full_refresh, include_updates = state[:5]
+                if req.flist == ["catalog.attrs"]:
+                        flist = self.__get_catalog_flist(opath, tempdir,
+                            full_refresh, include_updates)
+                        if flist:
+                                # More catalog files to retrieve.
+                                nreq = CatalogRequest(self, flist, tempdir,
+                                    alt_repo=repo, redownload=full_refresh)
+                                self.__refreshes[nreq] = \
+                                    self.__refreshes.pop(req)
+                                return [nreq]
+
+                        if flist is None:
+                                # No updates available.
+                                self.__validate_metadata(opath, repo)
+                                return None
+
+                self.__apply_catalog(opath, tempdir, full_refresh)
+                state[5] = True
+
+                # Perform publisher metadata sanity checks.
+                self.__validate_metadata(opath, repo)
+                return None
+
+        def end_refresh(self):
+                """Completes a refresh started using begin_refresh().  Returns
+                a tuple of the same form as refresh()."""
+
+                any_refreshed = bool(self.__refreshes)
+                any_changed = any(
+                    state[5] for state in self.__refreshes.values()
+                )
+                self.abort_refresh()
+
+                if any_refreshed:
+                        # Update refresh time.
+                        self.last_refreshed = dt.datetime.utcnow()
+
+                # Finally, build a new catalog for this publisher based on a
+                # composite of the catalogs from all origins.
+                if self.__rebuild_catalog():
+                        any_changed = True
+                return any_changed, None
+
+        def abort_refresh(self):
+                """Discards the state of a refresh started using
+                begin_refresh()."""
+
+                for state in self.__refreshes.values():
+                        shutil.rmtree(state[2], True)
+                self.__refreshes.clear()
+
         def remove_meta_root(self):
                 """Removes the publisher's meta_root."""
 
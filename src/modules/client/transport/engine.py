@@ -54,6 +54,24 @@ from pkg.client.debugvalues import DebugValues
 
 pipelined_protocols = ()
 response_protocols = ("ftp", "http", "https")
+# Errors which cause an origin to be accessed using HTTP/1.1 from then on.
+http2_errors = frozenset(
+    getattr(pycurl, e) for e in ("E_HTTP2", "E_HTTP2_STREAM")
+    if hasattr(pycurl, e)
+)
+
+# The pycurl constants used to multiplex transfers over HTTP/2.
+http2_attrs = ("PIPE_MULTIPLEX", "VERSION_HTTP2", "INFO_HTTP_VERSION",
+    "CURL_HTTP_VERSION_2_0", "CURL_HTTP_VERSION_2TLS", "PIPEWAIT")
+
+def http2_supported():
+        """Return True if libcurl is able to multiplex transfers over HTTP/2
+        connections, and pycurl provides everything needed to do so."""
+
+        if not all(hasattr(pycurl, a) for a in http2_attrs):
+                return False
+        features = pycurl.version_info()[4]
+        return bool(features & pycurl.VERSION_HTTP2)
 
 class TransportEngine(object):
         """This is an abstract class.  It shouldn't implement any
@@ -72,6 +90,7 @@ class CurlTransportEngine(TransportEngine):
                 self.__mhandle = pycurl.CurlMulti()
                 self.__chandles = []
                 self.__active_handles = 0
+                self.__max_conn = max_conn
                 self.__max_handles = max_conn
                 # Request queue
                 self.__req_q = deque()
@@ -88,9 +107,35 @@ class CurlTransportEngine(TransportEngine):
                 self.__user_agent = None
                 self.__common_header = {}
                 self.__last_stall_check = 0
+                # HTTP/2 multiplexing is opt-in, and is only used if libcurl
+                # supports it.
+                self.__http2 = global_settings.client_http2 and \
+                    http2_supported()
+                self.__max_streams = global_settings.client_http2_max_streams
+                # Number of active handles for each (scheme, netloc) origin,
+                # the origins which have answered over HTTP/2, and those
+                # which have failed to and so are only accessed over HTTP/1.1.
+                self.__origin_active = {}
+                self.__h2_origins = set()
+                self.__h1_origins = set()
+                # The share of the requests that each origin may have in
+                # flight, as set by set_origin_share().
+                self.__origin_share = {}
 
                 # Set options on multi-handle
-                self.__mhandle.setopt(pycurl.M_PIPELINING, 0)
+                if self.__http2:
+                        # Multiplex transfers over a single connection to each
+                        # origin, with enough handles to keep 'max_streams'
+                        # streams in flight.
+                        self.__mhandle.setopt(pycurl.M_PIPELINING,
+                            pycurl.PIPE_MULTIPLEX)
+                        if hasattr(pycurl, "M_MAX_CONCURRENT_STREAMS"):
+                                self.__mhandle.setopt(
+                                    pycurl.M_MAX_CONCURRENT_STREAMS,
+                                    self.__max_streams)
+                        self.__max_handles = max(max_conn, self.__max_streams)
+                else:
+                        self.__mhandle.setopt(pycurl.M_PIPELINING, 0)
 
                 # initialize easy handles
                 for i in range(self.__max_handles):
@@ -105,6 +150,7 @@ class CurlTransportEngine(TransportEngine):
                         eh.filetime = -1
                         eh.starttime = -1
                         eh.uuid = None
+                        eh.origin = None
                         self.__chandles.append(eh)
 
                 # copy handles into handle freelist
@@ -312,6 +358,12 @@ class CurlTransportEngine(TransportEngine):
                                 repostats.record_error(decayable=ex.decayable,
                                     timeout=timeout)
                                 errors_seen += 1
+                                if self.__http2 and en in http2_errors:
+                                        # Fall back to HTTP/1.1 for this
+                                        # origin, and retry the request.
+                                        self.__h1_origins.add(h.origin)
+                                        self.__h2_origins.discard(h.origin)
+                                        ex.retryable = True
 
                         if ex and ex.retryable:
                                 failures.append(ex)
@@ -331,6 +383,13 @@ class CurlTransportEngine(TransportEngine):
                         conn_time = h.getinfo(pycurl.CONNECT_TIME)
                         h.filetime = h.getinfo(pycurl.INFO_FILETIME)
 
+                        # Once an origin has answered over HTTP/2, allow as
+                        # many requests to it as there may be streams.
+                        if self.__http2 and h.getinfo(
+                            pycurl.INFO_HTTP_VERSION) == \
+                            pycurl.CURL_HTTP_VERSION_2_0:
+                                self.__h2_origins.add(h.origin)
+
                         url = h.url
                         uuid = h.uuid
                         urlstem = h.repourl
@@ -630,11 +689,18 @@ class CurlTransportEngine(TransportEngine):
                         url, uuid = self.__orphans.pop()
                         self.remove_request(url, uuid)
 
+                deferred = []
                 while self.__freehandles and self.__req_q:
                         t = self.__req_q.pop()
+                        if not self.__origin_ready(t.url):
+                                # Keep the request queued, but start those
+                                # for other origins.
+                                deferred.append(t)
+                                continue
                         eh = self.__freehandles.pop(-1)
                         self.__setup_handle(eh, t)
                         self.__mhandle.add_handle(eh)
+                self.__req_q.extend(reversed(deferred))
 
                 self.__call_perform()
 
@@ -650,6 +716,27 @@ class CurlTransportEngine(TransportEngine):
                                 self.__last_stall_check = cur_clock
                                 self.__check_for_stalls()
 
+        def __origin_ready(self, url):
+                """Return True if another request may be started for the
+                origin of 'url'.  Until an origin is known to support HTTP/2,
+                it is limited to as many requests as there may be connections;
+                afterwards, to as many as there may be streams.  Either limit
+                is scaled by the origin's share, if one has been set."""
+
+                origin = urlsplit(url)[:2]
+                share = self.__origin_share.get(origin)
+                if not self.__http2 and share is None:
+                        return True
+
+                active = self.__origin_active.get(origin, 0)
+                if origin in self.__h2_origins:
+                        limit = self.__max_streams
+                else:
+                        limit = self.__max_conn
+                if share is not None:
+                        limit = max(1, int(limit * share))
+                return active < limit
+
         def orphaned_request(self, url, uuid):
                 """Add the URL to the list of orphaned requests.  Any URL in
                 list will be removed from the transport next time run() is
@@ -775,6 +862,18 @@ class CurlTransportEngine(TransportEngine):
 
                 self.__common_header = hdrdict
 
+        def set_origin_share(self, url, share):
+                """Limit the requests in flight to the origin of 'url' to
+                'share', a number between 0 and 1, of those it could otherwise
+                have; at least one request is always allowed.  A share of None
+                removes the limit."""
+
+                origin = urlsplit(url)[:2]
+                if share is None:
+                        self.__origin_share.pop(origin, None)
+                else:
+                        self.__origin_share[origin] = share
+
         def set_user_agent(self, ua_str):
                 """Supply a string str and the transport engine will
                 use this string as its User-Agent header.  This is
@@ -808,8 +907,21 @@ class CurlTransportEngine(TransportEngine):
                 hdl.setopt(pycurl.MAXREDIRS,
                     global_settings.PKG_CLIENT_MAX_REDIRECT)
 
-                # Use HTTP/1.1
-                hdl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_1_1)
+                origin = urlsplit(treq.url)[:2]
+                if self.__http2 and origin not in self.__h1_origins:
+                        # Use HTTP/2 for https if the server supports it, and
+                        # wait for a connection which can be multiplexed
+                        # rather than opening another one.
+                        hdl.setopt(pycurl.HTTP_VERSION,
+                            pycurl.CURL_HTTP_VERSION_2TLS)
+                        hdl.setopt(pycurl.PIPEWAIT, 1)
+                else:
+                        # Use HTTP/1.1
+                        hdl.setopt(pycurl.HTTP_VERSION,
+                            pycurl.CURL_HTTP_VERSION_1_1)
+                hdl.origin = origin
+                self.__origin_active[origin] = \
+                    self.__origin_active.get(origin, 0) + 1
 
                 # Store the proxy in the handle so it can be used to retrieve
                 # transport statistics later.
@@ -1010,13 +1122,15 @@ class CurlTransportEngine(TransportEngine):
                 self.__orphans = None
                 self.__active_handles = 0
 
-        @staticmethod
-        def __teardown_handle(hdl):
+        def __teardown_handle(self, hdl):
                 """Cleanup any state that we've associated with this handle.
                 After a handle has been torn down, it should still be valid
                 for use, but should have no previous state.  To remove
                 handles from use completely, use __shutdown."""
 
+                if hdl.origin:
+                        self.__origin_active[hdl.origin] -= 1
+                        hdl.origin = None
                 hdl.reset()
                 if hdl.fobj:
                         hdl.fobj.close()
@@ -31,6 +31,7 @@ import os
 import shutil
 import six
 import sys
+import tarfile
 import tempfile
 
 from email.utils import formatdate
@@ -50,7 +51,8 @@ import pkg.p5p
 import pkg.server.repository as svr_repo
 import pkg.server.query_parser as sqp
 
-from pkg.misc import N_, compute_compressed_attrs, EmptyDict
+from pkg.misc import N_, compute_compressed_attrs, EmptyDict, \
+    PKG_COMPRESS_LEVEL
 
 class TransportRepo(object):
         """The TransportRepo class handles transport requests.
@@ -69,6 +71,17 @@ class TransportRepo(object):
 
                 raise NotImplementedError
 
+        def add_catalog1(self, filelist, destloc, header=None, ts=None,
+            progtrack=None, pub=None, revalidate=False, redownload=False):
+                """Queue requests for the files that make up the catalog
+                components listed in 'filelist' with the transport engine
+                without waiting for them to complete, and return the list
+                of URLs that were queued.  Only repositories that are
+                accessed using the transport engine implement this; for
+                others, get_catalog1 must be used instead."""
+
+                raise NotImplementedError
+
         def get_catalog1(self, filelist, destloc, header=None, ts=None,
             progtrack=None, pub=None, revalidate=False, redownload=False):
                 """Get the files that make up the catalog components
@@ -90,6 +103,20 @@ class TransportRepo(object):
 
                 raise NotImplementedError
 
+        def add_files(self, filelist, dest, progtrack, version, header=None,
+            pub=None):
+                """Queue requests for multiple files without waiting for them
+                to complete.  Returns a list of URLs to pass to check_files
+                once the transport engine has run."""
+
+                raise NotImplementedError
+
+        def check_files(self, urllist):
+                """Return a tuple of the transient errors encountered and the
+                requests that succeeded for the URLs returned by add_files."""
+
+                raise NotImplementedError
+
         def get_files(self, filelist, dest, progtrack, version, header=None, pub=None):
                 """Get multiple files from the repo at once.
                 The files are named by hash and supplied in filelist.
@@ -98,6 +125,15 @@ class TransportRepo(object):
 
                 raise NotImplementedError
 
+        def get_filelist(self, filelist, dest, progtrack, header=None,
+            pub=None):
+                """Get multiple files from the repo using a single request.
+                The files are named by hash and supplied in filelist, and are
+                downloaded to the destination directory dest.  Progtrack is a
+                ProgressTracker"""
+
+                raise NotImplementedError
+
         def get_manifest(self, fmri, header=None, ccancel=None, pub=None):
                 """Get a manifest from repo.  The name of the
                 package is given in fmri.  If dest is set, download
@@ -231,6 +267,14 @@ class TransportRepo(object):
 
                 raise NotImplementedError
 
+        def get_compression(self, pub=None, header=None, ccancel=None):
+                """Returns a tuple of (level, probe) describing how the payloads
+                published to the repository should be compressed, as described
+                by misc.get_compress_level.  Unless the repository can tell,
+                the default compression is used."""
+
+                return PKG_COMPRESS_LEVEL, False
+
         def build_refetch_header(self, header):
                 """Based on existing header contents, build a header that
                 should be used for a subsequent retry when fetching content
@@ -529,20 +573,14 @@ class HTTPRepo(TransportRepo):
                 return self._fetch_url(requesturl, header, compress=True,
                     ccancel=ccancel)
 
-        def get_catalog1(self, filelist, destloc, header=None, ts=None,
+        def add_catalog1(self, filelist, destloc, header=None, ts=None,
             progtrack=None, pub=None, revalidate=False, redownload=False):
-                """Get the files that make up the catalog components
-                that are listed in 'filelist'.  Download the files to
-                the directory specified in 'destloc'.  The caller
-                may optionally specify a dictionary with header
-                elements in 'header'.  If a conditional get is
-                to be performed, 'ts' should contain a floating point
-                value of seconds since the epoch.
-
-                If 'redownload' or 'revalidate' is set, cache control
-                headers are appended to the request.  Re-download
-                uses http's no-cache header, while revalidate uses
-                max-age=0."""
+                """Queue requests for the files that make up the catalog
+                components listed in 'filelist' with the transport engine,
+                but don't wait for them to complete.  Returns the list of
+                URLs that were queued; callers are responsible for running
+                the engine and checking the status of the requests.  The
+                remaining arguments are the same as for get_catalog1."""
 
                 baseurl = self.__get_request_url("catalog/1/", pub=pub)
                 urllist = []
@@ -575,6 +613,27 @@ class HTTPRepo(TransportRepo):
                             compress=True, progtrack=progtrack,
                             progclass=progclass)
 
+                return urllist
+
+        def get_catalog1(self, filelist, destloc, header=None, ts=None,
+            progtrack=None, pub=None, revalidate=False, redownload=False):
+                """Get the files that make up the catalog components
+                that are listed in 'filelist'.  Download the files to
+                the directory specified in 'destloc'.  The caller
+                may optionally specify a dictionary with header
+                elements in 'header'.  If a conditional get is
+                to be performed, 'ts' should contain a floating point
+                value of seconds since the epoch.
+
+                If 'redownload' or 'revalidate' is set, cache control
+                headers are appended to the request.  Re-download
+                uses http's no-cache header, while revalidate uses
+                max-age=0."""
+
+                urllist = self.add_catalog1(filelist, destloc, header=header,
+                    ts=ts, progtrack=progtrack, pub=pub, revalidate=revalidate,
+                    redownload=redownload)
+
                 try:
                         while self._engine.pending:
                                 self._engine.run()
@@ -644,6 +703,21 @@ class HTTPRepo(TransportRepo):
                 requesturl = self.__get_request_url("status/0")
                 return self._fetch_url(requesturl, header, ccancel=ccancel)
 
+        def get_compression(self, pub=None, header=None, ccancel=None):
+                """Get compression/0 information from the repository, and
+                return it as a tuple of (level, probe).  The publisher prefix
+                is passed as part of the request instead of as part of the
+                repository URL, since the publisher may not yet be known to
+                the repository."""
+
+                requesturl = self.__get_request_url("compression/0/")
+                pub_prefix = getattr(pub, "prefix", pub)
+                if pub_prefix:
+                        requesturl = urljoin(requesturl, quote(pub_prefix))
+                resp = self._fetch_url(requesturl, header, ccancel=ccancel)
+                policy = json.loads(resp.read())
+                return int(policy["level"]), bool(policy["probe"])
+
         def get_manifest(self, fmri, header=None, ccancel=None, pub=None):
                 """Get a package manifest from repo.  The FMRI of the
                 package is given in fmri."""
@@ -710,13 +784,13 @@ class HTTPRepo(TransportRepo):
 
                 return self._annotate_exceptions(errors, urlmapping)
 
-        def get_files(self, filelist, dest, progtrack, version, header=None, pub=None):
-                """Get multiple files from the repo at once.
-                The files are named by hash and supplied in filelist.
-                If dest is specified, download to the destination
-                directory that is given.  If progtrack is not None,
-                it contains a ProgressTracker object for the
-                downloads."""
+        def add_files(self, filelist, dest, progtrack, version, header=None,
+            pub=None):
+                """Queue requests for multiple files, as get_files does,
+                without running the transport engine.  This allows requests
+                to several repos to be in flight at once.  The caller runs the
+                engine, and then passes the returned list of URLs to
+                check_files to obtain the results."""
 
                 baseurl = self.__get_request_url("file/{0}/".format(version),
                     pub=pub)
@@ -734,6 +808,28 @@ class HTTPRepo(TransportRepo):
                             progclass=progclass, progtrack=progtrack,
                             header=header)
 
+                return urllist
+
+        def check_files(self, urllist):
+                """Return a tuple of the list of transient errors, annotated
+                with the requests that failed, and the list of requests that
+                succeeded, for the URLs returned by add_files."""
+
+                errors, success = self._engine.check_status(urllist, True)
+                return self._annotate_exceptions(errors), \
+                    self._url_to_request(success)
+
+        def get_files(self, filelist, dest, progtrack, version, header=None, pub=None):
+                """Get multiple files from the repo at once.
+                The files are named by hash and supplied in filelist.
+                If dest is specified, download to the destination
+                directory that is given.  If progtrack is not None,
+                it contains a ProgressTracker object for the
+                downloads."""
+
+                urllist = self.add_files(filelist, dest, progtrack, version,
+                    header=header, pub=pub)
+
                 try:
                         while self._engine.pending:
                                 self._engine.run()
@@ -764,6 +860,86 @@ class HTTPRepo(TransportRepo):
 
                 return self._annotate_exceptions(errors)
 
+        def get_filelist(self, filelist, dest, progtrack, header=None,
+            pub=None):
+                """Get multiple files from the repo using a single request,
+                which returns a tar stream of the files.  The files are named
+                by hash and supplied in filelist, and are downloaded to the
+                destination directory dest.  If progtrack is not None, it
+                contains a ProgressTracker object for the downloads.
+
+                As for get_files, a list of transient errors is returned; any
+                file that the repository did not return is included in it, so
+                that the caller retries it."""
+
+                requesturl = self.__get_request_url("filelist/1/", pub=pub)
+                proto = urlsplit(requesturl)[0]
+                request_data = urlencode(
+                    [(i, f) for i, f in enumerate(filelist)])
+                ccancel = getattr(progtrack, "check_cancelation", None)
+
+                pending = set(filelist)
+                fobj = self._post_url(requesturl, request_data, header,
+                    ccancel=ccancel)
+                fpath = None
+                try:
+                        tar = tarfile.open(mode="r|", fileobj=fobj)
+                        for member in tar:
+                                if member.name not in pending or \
+                                    not member.isfile():
+                                        continue
+                                fpath = os.path.join(dest, member.name)
+                                with open(fpath, "wb") as f:
+                                        shutil.copyfileobj(
+                                            tar.extractfile(member), f)
+                                fpath = None
+                                pending.discard(member.name)
+                                if progtrack:
+                                        progtrack.download_add_progress(1,
+                                            member.size)
+                        tar.close()
+                except tx.ExcessiveTransientFailure as e:
+                        # Attach a list of failed and successful requests to
+                        # this exception.
+                        e.failures = [
+                            tx.TransportProtoError(proto, url=requesturl,
+                                reason=str(e), repourl=self._url, request=f)
+                            for f in pending
+                        ]
+                        e.success = [f for f in filelist if f not in pending]
+                        raise
+                except tx.TransportException as e:
+                        if not e.retryable:
+                                raise
+                        return [
+                            tx.TransportProtoError(proto, getattr(e, "code",
+                                None), url=requesturl, reason=str(e),
+                                repourl=self._url, request=f)
+                            for f in pending
+                        ]
+                except tarfile.TarError as e:
+                        return [
+                            tx.TransportProtoError(proto, url=requesturl,
+                                reason="Invalid tar stream: {0}".format(e),
+                                repourl=self._url, request=f)
+                            for f in pending
+                        ]
+                finally:
+                        if fpath:
+                                # Remove the file being written when the
+                                # transfer failed.
+                                try:
+                                        os.remove(fpath)
+                                except EnvironmentError:
+                                        pass
+                        fobj.close()
+
+                return [
+                    tx.TransportProtoError(proto, http_client.NOT_FOUND,
+                        url=requesturl, repourl=self._url, request=f)
+                    for f in pending
+                ]
+
         def get_url(self):
                 """Returns the repo's url."""
 
@@ -1401,17 +1577,13 @@ class _FilesystemRepo(TransportRepo):
                                                     i, return_type, fmri_str)
                 return output()
 
-        def get_catalog1(self, filelist, destloc, header=None, ts=None,
+        def add_catalog1(self, filelist, destloc, header=None, ts=None,
             progtrack=None, pub=None, revalidate=False, redownload=False):
-                """Get the files that make up the catalog components
-                that are listed in 'filelist'.  Download the files to
-                the directory specified in 'destloc'.  The caller
-                may optionally specify a dictionary with header
-                elements in 'header'.  If a conditional get is
-                to be performed, 'ts' should contain a floating point
-                value of seconds since the epoch.  This protocol
-                doesn't implment revalidate and redownload.  The options
-                are ignored."""
+                """Queue requests for the files that make up the catalog
+                components listed in 'filelist' with the transport engine,
+                but don't wait for them to complete.  Returns the list of
+                URLs that were queued.  The remaining arguments are the same
+                as for get_catalog1."""
 
                 urllist = []
                 progclass = None
@@ -1438,6 +1610,23 @@ class _FilesystemRepo(TransportRepo):
                         self._add_file_url(url, filepath=fn, header=header,
                             progtrack=progtrack, progclass=progclass)
 
+                return urllist
+
+        def get_catalog1(self, filelist, destloc, header=None, ts=None,
+            progtrack=None, pub=None, revalidate=False, redownload=False):
+                """Get the files that make up the catalog components
+                that are listed in 'filelist'.  Download the files to
+                the directory specified in 'destloc'.  The caller
+                may optionally specify a dictionary with header
+                elements in 'header'.  If a conditional get is
+                to be performed, 'ts' should contain a floating point
+                value of seconds since the epoch.  This protocol
+                doesn't implment revalidate and redownload.  The options
+                are ignored."""
+
+                urllist = self.add_catalog1(filelist, destloc, header=header,
+                    ts=ts, progtrack=progtrack, pub=pub)
+
                 try:
                         while self._engine.pending:
                                 self._engine.run()
@@ -1708,6 +1897,7 @@ class _FilesystemRepo(TransportRepo):
                     "append": ["0"],
                     "catalog": ["1"],
                     "close": ["0"],
+                    "compression": ["0"],
                     "file": ["0", "1"],
                     "manifest": ["0", "1"],
                     "open": ["0"],
@@ -1973,8 +2163,8 @@ class _FilesystemRepo(TransportRepo):
                         # see if repository has file
                         fpath = self._frepo.file(fhash, pub=pfx)
                         if hashes:
-                                csize, chashes = compute_compressed_attrs(fhash,
-                                    file_path=fpath)
+                                csize, chashes = self._frepo.file_attrs(fhash,
+                                    pub=pfx)
                         else:
                                 csize = os.stat(fpath).st_size
                                 chashes = EmptyDict
@@ -1985,6 +2175,14 @@ class _FilesystemRepo(TransportRepo):
                         # repository transport issue or does not have file
                         return (None, None)
 
+        def get_compression(self, pub=None, header=None, ccancel=None):
+                """Returns a tuple of (level, probe) describing how the payloads
+                published to the repository should be compressed, as described
+                by misc.get_compress_level."""
+
+                return self._frepo.get_compression(pub=getattr(pub, "prefix",
+                    pub))
+
         def build_refetch_header(self, header):
                 """Pointless to attempt refetch of corrupt content for
                 this protocol."""
@@ -32,6 +32,14 @@ import random
 from six.moves.urllib.parse import urlsplit
 import pkg.misc as misc
 
+# Bounds of the number of files requested from a repository in each chunk of
+# a multi-file transfer, and of the number of its requests in flight at once.
+# The connection bound matches the transport engine's default number of
+# connections.
+CHUNK_MIN = 10
+CHUNK_MAX = 1024
+CONN_MAX = 20
+
 
 class RepoChooser(object):
         """An object that contains repo statistics.  It applies algorithms
@@ -247,6 +255,11 @@ class RepoStats(object):
                 self.origin_factor = 1
                 self.origin_decay = 1
 
+                # Windows of the number of files per chunk and of concurrent
+                # requests, adjusted by record_chunk().
+                self.__chunk_window = CHUNK_MAX
+                self.__conn_window = CONN_MAX
+
         def clear_consecutive_errors(self):
                 """Set the count of consecutive errors to zero.  This is
                 done once we know a transaction has been successfully
@@ -254,6 +267,25 @@ class RepoStats(object):
 
                 self.__consecutive_errors = 0
 
+        def record_chunk(self, failed):
+                """Record that a chunk of files was requested from the
+                TransportRepoURI represented by this RepoStats object, and
+                adjust the chunk and connection windows accordingly: if any
+                of the requests failed, both are halved, otherwise they are
+                grown by CHUNK_MIN files and one connection, respectively.
+                Keeping the windows small for a repository that fails under
+                load limits the number of requests that must be retried."""
+
+                if failed:
+                        self.__chunk_window = max(CHUNK_MIN,
+                            self.__chunk_window // 2)
+                        self.__conn_window = max(1, self.__conn_window // 2)
+                else:
+                        self.__chunk_window = min(CHUNK_MAX,
+                            self.__chunk_window + CHUNK_MIN)
+                        self.__conn_window = min(CONN_MAX,
+                            self.__conn_window + 1)
+
         def record_connection(self, time):
                 """Record amount of time spent connecting."""
 
@@ -335,6 +367,22 @@ class RepoStats(object):
 
                 return self.__bytes_xfr
 
+        @property
+        def chunk_window(self):
+                """The number of files to request from this host in each chunk
+                of a multi-file transfer."""
+
+                return self.__chunk_window
+
+        @property
+        def conn_share(self):
+                """The share, between 0 and 1, of the requests that the
+                transport may have in flight that may be made to this host
+                at once."""
+
+                # old-division; pylint: disable=W1619
+                return self.__conn_window / CONN_MAX
+
         @property
         def connect_time(self):
                 """The average connection time for this host."""
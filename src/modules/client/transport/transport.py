@@ -29,7 +29,9 @@ from __future__ import  print_function
 import copy
 import datetime as dt
 import errno
+import itertools
 import os
+import shutil
 import six
 import tempfile
 import zlib
@@ -71,6 +73,10 @@ from pkg.client.debugvalues import DebugValues
 from pkg.misc import PKG_RO_FILE_MODE
 logger = global_settings.logger
 
+# Files no larger than this (over the wire) are retrieved together using a
+# single filelist request, if the repository supports it.
+FILE_BATCH_MAX_SIZE = 64 * 1024
+
 class TransportCfg(object):
         """Contains configuration needed by the transport for proper
         operations.  Clients must create one of these objects, and then pass
@@ -1051,6 +1057,214 @@ class Transport(object):
                                 tfailurex.append(f)
                         raise tfailurex
 
+        @LockedTransport()
+        def get_catalogs1(self, requests, callback, progtrack=None,
+            ccancel=None):
+                """Retrieve the catalog/1 files described by each of the
+                CatalogRequest objects in the list 'requests'.  Unlike
+                get_catalog1, the requests for all repositories accessed
+                using the transport engine are queued at once, so that the
+                files for several publishers or origins are transferred
+                concurrently.
+
+                'callback' is called as callback(request, exception) as soon
+                as each request completes, where 'exception' is None if all
+                of the request's files were retrieved and verified.  As the
+                transfers for the remaining requests stay queued while the
+                callback runs, it can be used to process the files of
+                completed requests while others are still in flight.  The
+                callback may return a list of additional CatalogRequest
+                objects to retrieve, or None.  The callback must not use
+                the transport itself.
+
+                Failed requests are not retried using other endpoints;
+                callers should fall back to get_catalog1 for those."""
+
+                if progtrack and ccancel:
+                        progtrack.check_cancelation = ccancel
+
+                # Call setup if the transport isn't configured or was shutdown.
+                if not self.__engine:
+                        self.__setup()
+
+                download_root = self.cfg.incoming_root
+                self._makedirs(download_root)
+                try:
+                        destvfs = os.statvfs(download_root)
+                        self.__engine.set_file_bufsz(destvfs.f_bsize)
+                except EnvironmentError as e:
+                        if e.errno == errno.EACCES:
+                                raise apx.PermissionsException(e.filename)
+                        else:
+                                raise tx.TransportOperationError(
+                                    "Unable to stat VFS: {0}".format(e))
+                except AttributeError as e:
+                        # os.statvfs is not available on Windows
+                        pass
+
+                # Requests that have been started and haven't completed yet;
+                # each maps to a list of [download dir, url -> file name
+                # mapping, number of outstanding files, failures].
+                active = {}
+                # Which requests are waiting for a given URL; the same URL
+                # may be queued by more than one request.
+                waiting = defaultdict(list)
+                queue = list(requests)
+
+                def finish(req, exc):
+                        ddir = active.pop(req)[0]
+                        if exc is None:
+                                try:
+                                        for s in req.flist:
+                                                self._verify_catalog(s, ddir)
+                                                self._makedirs(req.path)
+                                                portable.rename(
+                                                    os.path.join(ddir, s),
+                                                    os.path.join(req.path, s))
+                                except (apx.ApiException,
+                                    tx.TransportException) as e:
+                                        exc = e
+                        shutil.rmtree(ddir, True)
+                        more = callback(req, exc)
+                        if more:
+                                queue.extend(more)
+
+                try:
+                        while queue or active:
+                                # Select the endpoint for all new requests
+                                # before any of their files are queued, as
+                                # that may require version information to be
+                                # retrieved using the engine.
+                                new = []
+                                while queue:
+                                        req = queue.pop(0)
+                                        active[req] = [tempfile.mkdtemp(
+                                            dir=download_root), {}, 0, []]
+                                        try:
+                                                new.append((req,
+                                                    self.__get_catalogs1_repo(
+                                                    req, ccancel)))
+                                        except (apx.ApiException,
+                                            tx.TransportException) as e:
+                                                finish(req, e)
+
+                                for req, (d, header) in new:
+                                        state = active[req]
+                                        try:
+                                                urls = d.add_catalog1(req.flist,
+                                                    state[0], header,
+                                                    progtrack=progtrack,
+                                                    pub=req.pub,
+                                                    redownload=req.redownload,
+                                                    revalidate=req.revalidate)
+                                        except NotImplementedError:
+                                                urls = None
+                                        except (apx.ApiException,
+                                            tx.TransportException) as e:
+                                                finish(req, e)
+                                                continue
+
+                                        if urls is None:
+                                                # This repository can't be
+                                                # used with the engine
+                                                # directly, so retrieve the
+                                                # files now.
+                                                errlist = d.get_catalog1(
+                                                    req.flist, state[0], header,
+                                                    progtrack=progtrack,
+                                                    pub=req.pub)
+                                                exc = None
+                                                if errlist:
+                                                        exc = \
+                                                            tx.TransportFailures()
+                                                        for e in errlist:
+                                                                exc.append(e)
+                                                finish(req, exc)
+                                                continue
+
+                                        state[1] = dict(zip(urls, req.flist))
+                                        state[2] = len(urls)
+                                        for u in urls:
+                                                waiting[u].append(req)
+
+                                if queue or not active:
+                                        continue
+
+                                try:
+                                        self.__engine.run()
+                                except tx.TransportException as e:
+                                        # Something went wrong for the
+                                        # endpoint of one of the requests
+                                        # and it isn't clear which, so fail
+                                        # all outstanding requests.
+                                        self.__engine.reset()
+                                        waiting.clear()
+                                        for req in list(active):
+                                                finish(req, e)
+                                        continue
+
+                                errors, success = self.__engine.check_status(
+                                    list(waiting), True)
+                                done = []
+                                for e in errors:
+                                        req = waiting[e.url].pop(0)
+                                        e.request = active[req][1][e.url]
+                                        active[req][3].append(e)
+                                        done.append((req, e.url))
+                                for u in success:
+                                        done.append((waiting[u].pop(0), u))
+
+                                for req, u in done:
+                                        if not waiting[u]:
+                                                del waiting[u]
+                                        state = active[req]
+                                        state[2] -= 1
+                                        if state[2] > 0:
+                                                continue
+                                        if state[3]:
+                                                exc = tx.TransportFailures()
+                                                for e in state[3]:
+                                                        exc.append(e)
+                                                finish(req, exc)
+                                        else:
+                                                finish(req, None)
+
+                                if active and not queue and \
+                                    not self.__engine.pending:
+                                        # The status of the remaining
+                                        # transfers was claimed by another
+                                        # operation using the engine, so
+                                        # they can't be accounted for.
+                                        exc = tx.TransportOperationError(
+                                            "Unable to determine the status "
+                                            "of catalog retrieval")
+                                        waiting.clear()
+                                        for req in list(active):
+                                                finish(req, exc)
+                except:
+                        # Cancellation or an unexpected error; discard
+                        # everything that is still outstanding.
+                        self.__engine.reset()
+                        for ddir, urls, left, failures in active.values():
+                                shutil.rmtree(ddir, True)
+                        raise
+
+        def __get_catalogs1_repo(self, req, ccancel):
+                """Returns a tuple of the Repo object to use to retrieve the
+                files for CatalogRequest 'req' and the request header to
+                use."""
+
+                for d, retries, v in self.__gen_repo(req.pub, 1,
+                    origin_only=True, operation="catalog", versions=[1],
+                    ccancel=ccancel, alt_repo=req.alt_repo):
+                        break
+
+                repostats = self.stats[d.get_repouri_key()]
+                header = Transport.__get_request_header(
+                    self.__build_header(uuid=self.__get_uuid(req.pub)),
+                    repostats, retries, d)
+                return d, header
+
         @LockedTransport()
         def get_publisherdata(self, pub, ccancel=None):
                 """Given a publisher pub, return the publisher/0
@@ -1376,6 +1590,62 @@ class Transport(object):
                         return d.get_compressed_attrs(fhash, header,
                             pub=pub, trans_id=trans_id, hashes=hashes)
 
+        @LockedTransport()
+        def get_compression(self, pub):
+                """Returns a tuple of (level, probe) describing how the payloads
+                published to the origin of the publisher 'pub' should be
+                compressed, as described by misc.get_compress_level.  If the
+                origin doesn't support the compression operation, the default
+                compression is used."""
+
+                retry_count = global_settings.PKG_CLIENT_MAX_TIMEOUT
+                failures = tx.TransportFailures()
+                header = None
+
+                if isinstance(pub, publisher.Publisher):
+                        header = self.__build_header(uuid=self.__get_uuid(pub))
+
+                try:
+                        for d, retries, v in self.__gen_repo(pub, retry_count,
+                            origin_only=True, single_repository=True,
+                            operation="compression", versions=[0]):
+                                try:
+                                        repouri_key = d.get_repouri_key()
+                                        repostats = self.stats[repouri_key]
+                                        header = \
+                                            Transport.__get_request_header(
+                                            header, repostats, retries, d)
+                                        return d.get_compression(pub=pub,
+                                            header=header)
+                                except tx.ExcessiveTransientFailure as e:
+                                        # If an endpoint experienced so many
+                                        # failures that we just gave up, grab
+                                        # the list of failures that it contains
+                                        failures.extend(e.failures)
+
+                                except (KeyError, TypeError, ValueError) as e:
+                                        exc = tx.TransferContentException(
+                                            repouri_key[0],
+                                            "Invalid compression response: "
+                                            "{0}".format(e),
+                                            proxy=repouri_key[1])
+                                        repostats.record_error(content=True)
+                                        if exc.retryable:
+                                                failures.append(exc)
+                                        else:
+                                                raise exc
+
+                                except tx.TransportException as e:
+                                        if e.retryable:
+                                                failures.append(e)
+                                        else:
+                                                raise
+                except apx.UnsupportedRepositoryOperation:
+                        # Older depots and archives don't provide the policy.
+                        return misc.PKG_COMPRESS_LEVEL, False
+
+                raise failures
+
         @LockedTransport()
         def get_manifest(self, fmri, excludes=misc.EmptyI, intent=None,
             ccancel=None, pub=None, content_only=False, alt_repo=None):
@@ -1846,12 +2116,17 @@ class Transport(object):
                                 raise tx.TransportOperationError("Unable to "
                                     "make directory: {0}".format(e))
 
-        def _get_files_list(self, mfile, flist):
+        def _get_files_list(self, mfile, flist, batch=False):
                 """Download the files given in argument 'flist'.  This
                 allows us to break up download operations into multiple
                 chunks.  Since we re-evaluate our host selection after
                 each chunk, this gives us a better way of reacting to
-                changing conditions in the network."""
+                changing conditions in the network.
+
+                If 'batch' is True, the files are retrieved using a single
+                request from repositories which support it, until a request
+                fails; any files not retrieved are then retried one request
+                per file."""
 
                 retry_count = global_settings.PKG_CLIENT_MAX_TIMEOUT
                 failures = []
@@ -1866,14 +2141,6 @@ class Transport(object):
                 # download_dir is temporary download path.
                 download_dir = self.cfg.incoming_root
 
-                cache = self.cfg.get_caches(pub, readonly=False)
-                if cache:
-                        # For now, pick first cache in list, if any are
-                        # present.
-                        cache = cache[0]
-                else:
-                        cache = None
-
                 for d, retries, v in self.__gen_repo(pub, retry_count,
                     operation="file", versions=[0, 1],
                     alt_repo=mfile.get_alt_repo()):
@@ -1882,6 +2149,8 @@ class Transport(object):
                         repostats = self.stats[d.get_repouri_key()]
                         header = Transport.__get_request_header(header,
                             repostats, retries, d)
+                        self.__engine.set_origin_share(d.get_url(),
+                            repostats.conn_share)
 
                         gave_up = False
 
@@ -1890,8 +2159,15 @@ class Transport(object):
                         # An exception handler here isn't necessary
                         # unless we want to supress a permanant failure.
                         try:
-                                errlist = d.get_files(filelist, download_dir,
-                                    progtrack, v, header, pub=pub)
+                                if batch and not failures and \
+                                    d.supports_version("filelist", [1]) > -1:
+                                        errlist = d.get_filelist(filelist,
+                                            download_dir, progtrack, header,
+                                            pub=pub)
+                                else:
+                                        errlist = d.get_files(filelist,
+                                            download_dir, progtrack, v, header,
+                                            pub=pub)
                         except tx.ExcessiveTransientFailure as ex:
                                 # If an endpoint experienced so many failures
                                 # that we just gave up, record this for later
@@ -1908,6 +2184,8 @@ class Transport(object):
                                 else:
                                         raise e
 
+                        repostats.record_chunk(gave_up or bool(errlist))
+
                         if gave_up:
                                 # If the transport gave up due to excessive
                                 # consecutive errors, the caller is returned a
@@ -1933,28 +2211,12 @@ class Transport(object):
                                 success = filelist
                                 filelist = None
 
-                        for s in success:
-
-                                dl_path = os.path.join(download_dir, s)
-
-                                try:
-                                        self._verify_content(mfile[s][0],
-                                            dl_path)
-                                except tx.InvalidContentException as e:
-                                        mfile.subtract_progress(e.size)
-                                        e.request = s
-                                        repostats.record_error(content=True)
-                                        failedreqs.append(s)
-                                        failures.append(e)
-                                        if not filelist:
-                                                filelist = failedreqs
-                                        continue
-
-                                if cache:
-                                        cpath = cache.insert(s, dl_path)
-                                        mfile.file_done(s, cpath)
-                                else:
-                                        mfile.file_done(s, dl_path)
+                        for e in self.__files_done(mfile, success,
+                            repostats):
+                                failedreqs.append(e.request)
+                                failures.append(e)
+                        if failedreqs and not filelist:
+                                filelist = failedreqs
 
                         # Return if everything was successful
                         if not filelist and not errlist:
@@ -1970,6 +2232,127 @@ class Transport(object):
                                 tfailurex.append(f)
                         raise tfailurex
 
+        def __files_done(self, mfile, success, repostats):
+                """Verify the content of each of the files named in 'success',
+                which have been downloaded from the repository 'repostats'
+                describes, and tell 'mfile' that they have been retrieved,
+                moving them into the first writable cache, if there is one.
+                Return a list of the content errors for the files that failed
+                verification, annotated with their requests."""
+
+                download_dir = self.cfg.incoming_root
+                cache = self.cfg.get_caches(mfile.get_publisher(),
+                    readonly=False)
+                if cache:
+                        # For now, pick first cache in list, if any are
+                        # present.
+                        cache = cache[0]
+                else:
+                        cache = None
+
+                failures = []
+                for s in success:
+
+                        dl_path = os.path.join(download_dir, s)
+
+                        try:
+                                self._verify_content(mfile[s][0], dl_path)
+                        except tx.InvalidContentException as e:
+                                mfile.subtract_progress(e.size)
+                                e.request = s
+                                repostats.record_error(content=True)
+                                failures.append(e)
+                                continue
+
+                        if cache:
+                                cpath = cache.insert(s, dl_path)
+                                mfile.file_done(s, cpath)
+                        else:
+                                mfile.file_done(s, dl_path)
+
+                return failures
+
+        def _get_files_split(self, mfile, flist):
+                """Download the files given in argument 'flist' from all of
+                the HTTP repositories with an observed transfer speed at once,
+                giving each a share of the files in proportion to that speed.
+                Return the list of files that were not retrieved, which the
+                caller retries with _get_files_list; this is all of them
+                unless there are at least two such repositories."""
+
+                pub = mfile.get_publisher()
+                progtrack = mfile.get_progtrack()
+                header = None
+
+                if len(flist) < 2:
+                        return flist
+
+                repos = []
+                for d, retries, v in self.__gen_repo(pub, 1,
+                    operation="file", versions=[0, 1],
+                    alt_repo=mfile.get_alt_repo()):
+                        repostats = self.stats[d.get_repouri_key()]
+                        if isinstance(d, trepo.HTTPRepo) and \
+                            repostats.transfer_speed > 0 and \
+                            not repostats.consecutive_errors:
+                                repos.append((d, v, repostats))
+                if len(repos) < 2:
+                        return flist
+
+                # Assign each file, largest first, to the repository which
+                # would finish receiving its share soonest at its observed
+                # speed.
+                sizes = dict(
+                    (h, misc.get_pkg_otw_size(mfile[h][0]))
+                    for h in flist
+                )
+                shares = [[] for r in repos]
+                loads = [0] * len(repos)
+                for h in sorted(flist, key=sizes.get, reverse=True):
+                        i = min(range(len(repos)), key=lambda i:
+                            float(loads[i] + sizes[h]) /
+                            repos[i][2].transfer_speed)
+                        shares[i].append(h)
+                        loads[i] += sizes[h]
+
+                if isinstance(pub, publisher.Publisher):
+                        header = self.__build_header(uuid=self.__get_uuid(pub))
+
+                reqs = []
+                for (d, v, repostats), files in zip(repos, shares):
+                        if not files:
+                                continue
+                        self.__engine.set_origin_share(d.get_url(),
+                            repostats.conn_share)
+                        urllist = d.add_files(files, self.cfg.incoming_root,
+                            progtrack, v, Transport.__get_request_header(
+                            header, repostats, 1, d), pub=pub)
+                        reqs.append((d, repostats, files, urllist))
+
+                gave_up = None
+                try:
+                        while self.__engine.pending:
+                                self.__engine.run()
+                except tx.ExcessiveTransientFailure as ex:
+                        # Give up on all of the requests still outstanding;
+                        # the caller retries them.
+                        gave_up = ex.url
+
+                remaining = []
+                for d, repostats, files, urllist in reqs:
+                        errlist, success = d.check_files(urllist)
+                        repostats.record_chunk(bool(errlist) or
+                            gave_up == repostats.url)
+                        for e in self.__files_done(mfile, success,
+                            repostats):
+                                remaining.append(e.request)
+                        success = set(success)
+                        remaining.extend(f for f in files if f not in success)
+                if gave_up:
+                        self.__engine.reset()
+
+                return remaining
+
         @LockedTransport()
         def _get_files(self, mfile):
                 """Perform an operation that gets multiple files at once.
@@ -2011,16 +2394,15 @@ class Transport(object):
 
                 while mfile:
 
-                        filelist = []
                         chunksz = self.__chunk_size(pub,
                             alt_repo=mfile.get_alt_repo())
-
-                        for i, v in enumerate(mfile):
-                                if i >= chunksz:
-                                        break
-                                filelist.append(v)
-
-                        self._get_files_list(mfile, filelist)
+                        filelist, batch = mfile.get_chunk(chunksz)
+                        if not batch:
+                                filelist = self._get_files_split(mfile,
+                                    filelist)
+                        if filelist:
+                                self._get_files_list(mfile, filelist,
+                                    batch=batch)
 
         def __format_safe_read_crl(self, pth):
                 """CRLs seem to frequently come in DER format, so try reading
@@ -2475,11 +2857,10 @@ class Transport(object):
                 """Determine the chunk size based upon how many of the known
                 mirrors have been visited.  If not all mirrors have been
                 visited, choose a small size so that if it ends up being
-                a poor choice, the client doesn't transfer too much data."""
-
-                CHUNK_SMALL = 10
-                CHUNK_LARGE = 100
-                CHUNK_HUGE = 1024
+                a poor choice, the client doesn't transfer too much data.
+                Otherwise, the chunk holds as many files as the chunk windows
+                of the mirrors allow in total, which grow while requests
+                succeed and shrink when they fail."""
 
                 # Call setup if the transport isn't configured or was shutdown.
                 if not self.__engine:
@@ -2504,11 +2885,12 @@ class Transport(object):
                 repolist = _convert_repouris(repolist)
                 n = len(repolist)
                 m = self.stats.get_num_visited(repolist)
-                if n == 1:
-                        return CHUNK_HUGE
-                if m < n:
-                        return CHUNK_SMALL
-                return CHUNK_LARGE
+                if n > 1 and m < n:
+                        return tstats.CHUNK_MIN
+                return min(tstats.CHUNK_MAX, sum(
+                    self.stats[ruri.key()].chunk_window
+                    for ruri in repolist
+                ))
 
         @LockedTransport()
         def valid_publisher_test(self, pub, ccancel=None):
@@ -3510,6 +3892,23 @@ class MultiFile(MultiXfr):
 
                 self._hash.setdefault(hashval, []).append(item)
 
+        def get_chunk(self, chunksz):
+                """Return a tuple of a list of at most 'chunksz' of the hashes
+                still to be retrieved, and a boolean indicating whether they
+                may be retrieved together in a batch.  Small files are grouped
+                together in batches ahead of the other files."""
+
+                small = []
+                for h in self._hash:
+                        if misc.get_pkg_otw_size(self._hash[h][0]) <= \
+                            FILE_BATCH_MAX_SIZE:
+                                small.append(h)
+                                if len(small) >= chunksz:
+                                        break
+                if len(small) > 1:
+                        return small, True
+                return list(itertools.islice(self._hash, chunksz)), False
+
         def file_done(self, hashval, current_path):
                 """Tell MFile that the transfer completed successfully."""
 
@@ -3730,6 +4129,25 @@ class MultiFileNI(MultiFile):
 # The following two methods are to be used by clients without an Image that
 # need to configure a transport and or publishers.
 
+class CatalogRequest(object):
+        """Describes a set of catalog/1 files to be retrieved from a
+        publisher's repository by Transport.get_catalogs1()."""
+
+        def __init__(self, pub, flist, path, alt_repo=None, revalidate=False,
+            redownload=False):
+                """'pub' is the publisher the files belong to and 'flist'
+                the list of catalog files to retrieve.  Completed downloads
+                are placed in the directory 'path'.  The remaining arguments
+                have the same meaning as for Transport.get_catalog1()."""
+
+                self.pub = pub
+                self.flist = flist
+                self.path = path
+                self.alt_repo = alt_repo
+                self.revalidate = revalidate
+                self.redownload = redownload
+
+
 def setup_publisher(repo_uri, prefix, xport, xport_cfg,
     remote_prefix=False, remote_publishers=False, ssl_key=None,
     ssl_cert=None):
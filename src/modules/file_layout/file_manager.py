@@ -42,6 +42,8 @@ provides a way to generate all hashes stored by the FileManager."""
 import collections
 import errno
 import os
+import stat
+import tempfile
 
 import pkg.client.api_errors as apx
 import pkg.portable as portable
@@ -247,6 +249,53 @@ class FileManager(object):
                 "hashval".  Returns the path to the inserted file."""
                 return self.__place(hashval, src_path, portable.rename)
 
+        def link(self, hashval, src_path):
+                """Hard link the file at "src_path" to the files under the name
+                "hashval", leaving "src_path" in place.  Returns the path to
+                the file under the name "hashval", which is left as is if it
+                already exists."""
+
+                cur_full_path = self.lookup(hashval)
+                if cur_full_path:
+                        return cur_full_path
+                return self.__place(hashval, src_path, portable.link)
+
+        def clone(self, hashval, src_path):
+                """Copy the content at "src_path" to the files under the name
+                "hashval" using portable.clonefile(), so that the content is
+                shared with "src_path" where the filesystem supports it.
+                Returns the path to the file under the name "hashval", which
+                is left as is if it already exists."""
+
+                cur_full_path = self.lookup(hashval)
+                if cur_full_path:
+                        return cur_full_path
+
+                if self.readonly:
+                        raise NeedToModifyReadOnlyFileManager(hashval)
+                try:
+                        if not os.path.isdir(self.root):
+                                os.makedirs(self.root)
+                        fd, tmp_path = tempfile.mkstemp(dir=self.root,
+                            prefix=".clone-")
+                        os.close(fd)
+                except EnvironmentError as e:
+                        if e.errno == errno.EACCES or e.errno == errno.EROFS:
+                                raise FMPermissionsException(e.filename)
+                        raise
+
+                try:
+                        portable.clonefile(src_path, tmp_path)
+                        os.chmod(tmp_path,
+                            stat.S_IMODE(os.stat(src_path).st_mode))
+                        return self.insert(hashval, tmp_path)
+                except:
+                        try:
+                                portable.remove(tmp_path)
+                        except EnvironmentError:
+                                pass
+                        raise
+
         def __place(self, hashval, src_path, pfunc):
                 """Add the content at "src_path" to the files under the name
                 "hashval".  Returns the path to the inserted file."""
@@ -325,8 +374,8 @@ class FileManager(object):
                         try:
                                 os.removedirs(os.path.dirname(cur_full_path))
                         except EnvironmentError as e:
-                                if e.errno == errno.ENOENT or \
-                                    e.errno == errno.EEXIST:
+                                if e.errno in (errno.ENOENT, errno.EEXIST,
+                                    errno.ENOTEMPTY):
                                         pass
                                 elif e.errno == errno.EACCES or \
                                     e.errno == errno.EROFS:
@@ -351,8 +400,8 @@ class FileManager(object):
                                 portable.remove(cur_full_path)
                                 os.removedirs(os.path.dirname(cur_full_path))
                         except EnvironmentError as e:
-                                if e.errno == errno.ENOENT or \
-                                    e.errno == errno.EEXIST:
+                                if e.errno in (errno.ENOENT, errno.EEXIST,
+                                    errno.ENOTEMPTY):
                                         pass
                                 elif e.errno == errno.EACCES or \
                                     e.errno == errno.EROFS:
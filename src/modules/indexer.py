@@ -25,6 +25,8 @@
 #
 
 import errno
+import heapq
+import multiprocessing
 import os
 import platform
 import shutil
@@ -56,6 +58,11 @@ SORT_FILE_PREFIX = "sort."
 
 SORT_FILE_MAX_SIZE = 128 * 1024 * 1024
 
+# The number of groups of packages handed to each worker process when indexing
+# in parallel; more groups balance the load better, but each group produces at
+# least one temporary sort file which must be merged.
+WORKER_GROUPS = 4
+
 
 def makedirs(pathname):
         """Create a directory at the specified location if it does not
@@ -75,6 +82,50 @@ def makedirs(pathname):
                         raise
 
 
+def _index_manifests(args):
+        """Tokenizes the manifests of a group of packages into sorted
+        temporary sort files; run by the worker processes used by
+        Indexer._process_fmris.
+
+        'args' is a tuple of the list of (package id, manifest path) pairs to
+        tokenize, the variants to exclude, the path prefix for the sort files
+        and the maximum size of each sort file.
+
+        Returns the paths of the sort files written, in order, the messages
+        logged while reading the manifests and the number of packages."""
+
+        pkgs, excludes, prefix, max_size = args
+        paths = []
+        msgs = []
+        lines = []
+        nbytes = 0
+
+        def flush():
+                lines.sort()
+                path = prefix + str(len(paths))
+                with open(path, "w", buffering=PKG_FILE_BUFSIZ) as fh:
+                        fh.writelines((line for tok, line in lines))
+                paths.append(path)
+                del lines[:]
+
+        for p_id, mpath in pkgs:
+                new_dict = manifest.Manifest.search_dict(mpath, excludes,
+                    log=msgs.append)
+                for tok_tup, offs in new_dict.items():
+                        tok, action_type, subtype, fv = tok_tup
+                        s = ss.IndexStoreMainDict.transform_main_dict_line(tok,
+                            [(action_type, [(subtype, [(fv, [(p_id,
+                            list(offs))])])])])
+                        if lines and len(s) + nbytes >= max_size:
+                                flush()
+                                nbytes = 0
+                        lines.append((tok, s))
+                        nbytes += len(s)
+        if lines:
+                flush()
+        return paths, msgs, len(pkgs)
+
+
 class Indexer(object):
         """Indexer is a class designed to index a set of manifests or pkg plans
         and provide a compact representation on disk, which is quickly
@@ -84,7 +135,7 @@ class Indexer(object):
 
         def __init__(self, index_dir, get_manifest_func, get_manifest_path_func,
             progtrack=None, excludes=EmptyI, log=None,
-            sort_file_max_size=SORT_FILE_MAX_SIZE):
+            sort_file_max_size=SORT_FILE_MAX_SIZE, workers=1):
                 self._num_keys = 0
                 self._num_manifests = 0
                 self._num_entries = 0
@@ -96,6 +147,12 @@ class Indexer(object):
                 if self.sort_file_max_size <= 0:
                         raise search_errors.IndexingException(
                             _("sort_file_max_size must be greater than 0"))
+                # The number of processes used to tokenize manifests when
+                # packages are added to the index.
+                self.workers = workers
+                if self.workers <= 0:
+                        raise search_errors.IndexingException(
+                            _("workers must be greater than 0"))
 
                 # This structure was used to gather all index files into one
                 # location. If a new index structure is needed, the files can
@@ -131,6 +188,13 @@ class Indexer(object):
                     ss.InvertedDict(ss.FMRI_OFFSETS_FILE, self._data_manf)
                 self._data_fmri_offsets = self._data_dict["fmri_offsets"]
 
+                # The token index is kept out of _data_dict since it's only
+                # present in indexes written since it was introduced; it's
+                # added to an index which lacks it by setup() or the next
+                # update of that index.
+                self._data_token_index = \
+                    ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+
                 self._index_dir = index_dir
                 self._tmp_dir = os.path.join(self._index_dir, "TMP")
 
@@ -184,12 +248,84 @@ class Indexer(object):
 
                 return pkg.version.Version(unquote(vers), None)
 
+        def __index_files(self, directory):
+                """Returns the list of index files which must be consistent in
+                'directory'."""
+
+                data = list(self._data_dict.values())
+                if os.path.exists(os.path.join(directory,
+                    self._data_token_index.get_file_name())):
+                        data.append(self._data_token_index)
+                return data
+
+        def __has_token_index(self):
+                return os.path.exists(os.path.join(self._index_dir,
+                    self._data_token_index.get_file_name()))
+
+        @staticmethod
+        def __remove_old_token_indexes(directory):
+                """Removes any token index files in 'directory' which were
+                written in a format that is no longer read."""
+
+                for name in ss.OLD_TOKEN_INDEX_FILES:
+                        try:
+                                portable.remove(os.path.join(directory, name))
+                        except EnvironmentError as e:
+                                if e.errno != errno.ENOENT:
+                                        raise
+
+        def __write_token_index(self, out_dir, version_num):
+                """Writes the token index for the existing main dictionary,
+                whose version is 'version_num', to 'out_dir'."""
+
+                self._data_token_index.write_dict_file_from_main_dict(
+                    os.path.join(self._index_dir,
+                    self._data_main_dict.get_file_name()), out_dir,
+                    version_num)
+
+        def __add_token_index(self):
+                """Adds the token index to an existing index which was written
+                before the token index was introduced."""
+
+                try:
+                        self.lock()
+                except search_errors.IndexLockedException:
+                        # The index is being updated, which will write the
+                        # token index.
+                        return
+
+                try:
+                        if self.__has_token_index():
+                                return
+                        data = list(self._data_dict.values())
+                        try:
+                                version_num = ss.consistent_open(data,
+                                    self._index_dir, self._file_timeout_secs)
+                        finally:
+                                for d in data:
+                                        d.close_file_handle()
+                        if version_num is None:
+                                return
+
+                        if os.path.exists(self._tmp_dir):
+                                shutil.rmtree(self._tmp_dir)
+                        makedirs(self._tmp_dir)
+                        self.__write_token_index(self._tmp_dir, version_num)
+                        ti_name = self._data_token_index.get_file_name()
+                        shutil.move(os.path.join(self._tmp_dir, ti_name),
+                            os.path.join(self._index_dir, ti_name))
+                        self.__remove_old_token_indexes(self._index_dir)
+                        shutil.rmtree(self._tmp_dir)
+                finally:
+                        self.unlock()
+
         def _read_input_indexes(self, directory):
                 """ Opens all index files using consistent_open and reads all
                 of them into memory except the main dictionary file to avoid
                 inefficient memory usage."""
 
-                res = ss.consistent_open(self._data_dict.values(), directory,
+                data = self.__index_files(directory)
+                res = ss.consistent_open(data, directory,
                     self._file_timeout_secs)
                 pt = self._progtrack
                 if res == None:
@@ -213,7 +349,7 @@ class Indexer(object):
                                 self._data_dict["main_dict"].close_file_handle()
                                 raise
                 finally:
-                        for d in self._data_dict.values():
+                        for d in data:
                                 if d == self._data_main_dict:
                                         continue
                                 d.close_file_handle()
@@ -368,6 +504,14 @@ class Indexer(object):
                 """Takes a list of fmris and updates the internal storage to
                 reflect the new packages."""
 
+                if self.workers > 1 and len(fmris) > 1:
+                        return self.__process_fmris_parallel(fmris)
+
+                assert not self._sort_fh
+                self._sort_fh = open(os.path.join(self._tmp_dir,
+                    SORT_FILE_PREFIX + str(self._sort_file_num)), "w")
+                self._sort_file_num += 1
+
                 removed_paths = []
 
                 for added_fmri in fmris:
@@ -380,8 +524,54 @@ class Indexer(object):
 
                         self._progtrack.job_add_progress(
                             self._progtrack.JOB_REBUILD_SEARCH)
+                self.__close_sort_fh()
                 return removed_paths
 
+        def __process_fmris_parallel(self, fmris):
+                """Takes a list of fmris and updates the internal storage to
+                reflect the new packages, using self.workers processes to
+                tokenize the manifests.  Each process writes sorted temporary
+                sort files for a group of packages, which are numbered in the
+                order of the packages so that merging them gives the same
+                result as _process_fmris would."""
+
+                pkgs = []
+                for added_fmri in fmris:
+                        self._data_full_fmri.add_entity(
+                            added_fmri.get_fmri(anarchy=True))
+                        pkgs.append((self._data_manf.get_id_and_add(added_fmri),
+                            self.get_manifest_path_func(added_fmri)))
+
+                ngroups = self.workers * WORKER_GROUPS
+                size = (len(pkgs) + ngroups - 1) // ngroups
+                groups = [
+                    (pkgs[i:i + size], self.excludes,
+                    os.path.join(self._tmp_dir, "group.{0:d}.".format(i)),
+                    self.sort_file_max_size)
+                    for i in range(0, len(pkgs), size)
+                ]
+
+                pool = multiprocessing.Pool(self.workers)
+                try:
+                        for paths, msgs, npkgs in pool.imap(_index_manifests,
+                            groups):
+                                if self.__log:
+                                        for msg in msgs:
+                                                self.__log(msg)
+                                for path in paths:
+                                        portable.rename(path,
+                                            os.path.join(self._tmp_dir,
+                                            SORT_FILE_PREFIX +
+                                            str(self._sort_file_num)))
+                                        self._sort_file_num += 1
+                                self._progtrack.job_add_progress(
+                                    self._progtrack.JOB_REBUILD_SEARCH,
+                                    nitems=npkgs)
+                finally:
+                        pool.terminate()
+                        pool.join()
+                return []
+
         def _write_main_dict_line(self, file_handle, token,
             fv_fmri_pos_list_list, out_dir):
                 """Writes out the new main dictionary file and also adds the
@@ -409,6 +599,8 @@ class Indexer(object):
                 cur_location_int = file_handle.tell()
                 cur_location = str(cur_location_int)
                 self._data_token_offset.write_entity(token, cur_location)
+                self._data_token_index.write_entity(token, cur_location_int,
+                    fv_fmri_pos_list_list)
 
                 for at, st_list in fv_fmri_pos_list_list:
                         self._progtrack.job_add_progress(
@@ -481,63 +673,47 @@ class Indexer(object):
                     for i in range(self._sort_file_num)
                 ])
 
-                cur_toks = {}
-                # Seed cur_toks with the first token from each temporary file.
-                # The line may not exist since, for a empty repo, an empty file
+                # The heap holds the next token, the number of the file it
+                # came from and its information for each file which still has
+                # tokens to provide, so the smallest token is always first.
+                # Ties are broken by file number, so the information for a
+                # token is combined in the order the files were written.  The
+                # line may not exist since, for a empty repo, an empty file
                 # is created.
+                heap = []
                 for i in list(fh_dict.keys()):
                         line = get_line(fh_dict[i])
                         if line is None:
+                                fh_dict[i].close()
                                 del fh_dict[i]
                         else:
-                                cur_toks[i] = line
+                                heap.append((line[0], i, line[1]))
+                heapq.heapify(heap)
 
                 old_min_token = None
-                # cur_toks will have items deleted from it as files no longer
-                # have tokens to provide. When no files have tokens, the merge
-                # is done.
-                while cur_toks:
-                        min_token = None
-                        matches = []
-                        # Find smallest available token and the temporary files
-                        # which contain that token.
-                        for i in fh_dict.keys():
-                                cur_tok, info = cur_toks[i]
-                                if cur_tok is None:
-                                        continue
-                                if min_token is None or cur_tok < min_token:
-                                        min_token = cur_tok
-                                        matches = [i]
-                                elif cur_tok == min_token:
-                                        matches.append(i)
-                        assert min_token is not None
-                        assert len(matches) > 0
+                # When no files have tokens, the merge is done.
+                while heap:
+                        min_token = heap[0][0]
                         res = None
-                        for i in matches:
-                                new_tok, new_info = cur_toks[i]
-                                assert new_tok == min_token
-                                try:
-                                        # Continue pulling the next tokens from
-                                        # and adding them to the result list as
-                                        # long as the token matches min_token.
-                                        while new_tok == min_token:
-                                                if res is None:
-                                                        res = new_info
-                                                else:
-                                                        self.__splice(res,
-                                                            new_info)
-                                                new_tok, new_info = \
-                                                    ss.IndexStoreMainDict.parse_main_dict_line(next(fh_dict[i]))
-                                        cur_toks[i] = new_tok, new_info
-                                except StopIteration:
-                                        # When a StopIteration happens, the
-                                        # last line in the file has been read
-                                        # and processed. Delete all the
-                                        # information associated with that file
-                                        # so that we no longer check that file.
+                        # Pull every line for min_token from each file which
+                        # has it, replacing each line taken from the heap with
+                        # the next line from the same file.
+                        while heap and heap[0][0] == min_token:
+                                new_tok, i, new_info = heap[0]
+                                if res is None:
+                                        res = new_info
+                                else:
+                                        self.__splice(res, new_info)
+                                line = get_line(fh_dict[i])
+                                if line is None:
+                                        # The last line in the file has been
+                                        # read and processed.
+                                        heapq.heappop(heap)
                                         fh_dict[i].close()
                                         del fh_dict[i]
-                                        del cur_toks[i]
+                                else:
+                                        heapq.heapreplace(heap,
+                                            (line[0], i, line[1]))
                         assert res is not None
                         if old_min_token is not None and \
                             old_min_token >= min_token:
@@ -583,6 +759,8 @@ class Indexer(object):
 
                 self._data_token_offset.open_out_file(out_dir,
                     self.file_version_number)
+                self._data_token_index.open_out_file(out_dir,
+                    self.file_version_number)
 
                 new_toks_available = True
                 new_toks_it = self._gen_new_toks_from_files()
@@ -670,6 +848,9 @@ class Indexer(object):
                                             next(new_toks_it)
                                 except StopIteration:
                                         new_toks_available = False
+
+                        self._data_token_index.write_dict_file(out_dir,
+                            self.file_version_number)
                 finally:
                         if not self.empty_index:
                                 file_handle.close()
@@ -677,6 +858,7 @@ class Indexer(object):
 
                         out_main_dict_handle.close()
                         self._data_token_offset.close_file_handle()
+                        self._data_token_index.close_file_handle()
                         for fh in self.at_fh.values():
                                 fh.close()
                         for fh in self.st_fh.values():
@@ -753,6 +935,14 @@ class Indexer(object):
                                 #
                                 fast_update = self._fast_update(inputs)
 
+                                # A fast update leaves the main dictionary
+                                # alone, so add the token index if it
+                                # predates it.
+                                if fast_update and not self.empty_index and \
+                                    not self.__has_token_index():
+                                        self.__write_token_index(tmp_index_dir,
+                                            self.file_version_number)
+
                                 if not fast_update:
                                         self._data_main_dict.close_file_handle()
                                         self._data_fast_add.clear()
@@ -767,18 +957,11 @@ class Indexer(object):
                                             tmp_index_dir)
 
                         elif input_type == IDX_INPUT_TYPE_FMRI:
-                                assert not self._sort_fh
-                                self._sort_fh = open(os.path.join(self._tmp_dir,
-                                    SORT_FILE_PREFIX +
-                                    str(self._sort_file_num)), "w")
-                                self._sort_file_num += 1
-
                                 self._progtrack.job_start(
                                     self._progtrack.JOB_REBUILD_SEARCH,
                                     goal=len(inputs))
                                 dicts = self._process_fmris(inputs)
                                 # Update the main dictionary file
-                                self.__close_sort_fh()
                                 self._update_index(dicts, tmp_index_dir)
                                 self._progtrack.job_done(
                                     self._progtrack.JOB_REBUILD_SEARCH)
@@ -834,10 +1017,11 @@ class Indexer(object):
                 index exists. If an index exists but is inconsistent, an
                 exception is raised."""
 
+                data = self.__index_files(self._index_dir)
                 try:
                         try:
                                 res = \
-                                    ss.consistent_open(self._data_dict.values(),
+                                    ss.consistent_open(data,
                                         self._index_dir,
                                         self._file_timeout_secs)
                         except (KeyboardInterrupt,
@@ -846,7 +1030,7 @@ class Indexer(object):
                         except Exception:
                                 return False
                 finally:
-                        for d in self._data_dict.values():
+                        for d in data:
                                 d.close_file_handle()
                 assert res is not 0
                 return res
@@ -886,7 +1070,8 @@ class Indexer(object):
 
         def setup(self):
                 """Seeds the index directory with empty stubs if the directory
-                is consistently empty.  Does not overwrite existing indexes."""
+                is consistently empty.  Does not overwrite existing indexes,
+                but adds the token index to one which lacks it."""
 
                 absent = False
                 present = False
@@ -903,6 +1088,8 @@ class Indexer(object):
                                 raise search_errors.InconsistentIndexException(
                                         self._index_dir)
                 if present:
+                        if not self.__has_token_index():
+                                self.__add_token_index()
                         return
                 if self.file_version_number:
                         raise RuntimeError("Got file_version_number other than "
@@ -968,6 +1155,13 @@ class Indexer(object):
                                 shutil.move(os.path.join(source_dir,
                                     d.get_file_name()),
                                     os.path.join(dest_dir, d.get_file_name()))
+                # The token index is only present in source_dir if it was
+                # rewritten, or created for an index which lacked one.
+                ti_name = self._data_token_index.get_file_name()
+                if os.path.exists(os.path.join(source_dir, ti_name)):
+                        shutil.move(os.path.join(source_dir, ti_name),
+                            os.path.join(dest_dir, ti_name))
+                        self.__remove_old_token_indexes(dest_dir)
                 if not fast_update:
                         # Remove legacy index/pkg/ directory which is obsoleted
                         # by the fmri_offsets.v1 file.
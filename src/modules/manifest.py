@@ -25,16 +25,19 @@
 #
 
 from __future__ import print_function
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, OrderedDict
 from functools import reduce
 
 import errno
 import fnmatch
 import hashlib
+import marshal
 import os
 import re
 import six
+import sys
 import tempfile
+import threading
 from itertools import groupby, chain, product, repeat
 from operator import itemgetter
 from six.moves import zip
@@ -48,6 +51,7 @@ import pkg.portable as portable
 import pkg.variant as variant
 import pkg.version as version
 
+from pkg.client import global_settings
 from pkg.misc import EmptyDict, EmptyI, expanddirs, PKG_FILE_MODE, PKG_DIR_MODE
 from pkg.actions.attribute import AttributeAction
 from pkg.actions.directory import DirectoryAction
@@ -1535,6 +1539,74 @@ class Manifest(object):
 
 null = Manifest()
 
+class ActionCache(object):
+        """A bounded cache of the actions parsed from the cache files of
+        factored manifests, shared by all of the FactoredManifest objects of
+        the process, so that manifests which are walked several times, such
+        as the installed manifests during planning, are only parsed once.
+
+        Each entry is keyed by the pathname of a cache file and the inode,
+        size and modification time it had when it was parsed, so a file which
+        has been replaced since is parsed again.  The actions are kept as
+        tuples of their name, hash, attributes and the names of the attributes
+        with multiple values, from which new actions are built for each
+        caller, since callers may modify the actions they're given.  When the
+        total number of actions kept exceeds 'size', the least recently used
+        entries are dropped."""
+
+        def __init__(self, size):
+                self.size = size
+                self.hits = 0
+                self.misses = 0
+                self.__count = 0
+                self.__entries = OrderedDict()
+                self.__lock = threading.Lock()
+
+        def __str__(self):
+                total = self.hits + self.misses
+                return "manifest action cache: {0:d} hits, {1:d} misses " \
+                    "({2:.1%} hit ratio)".format(self.hits, self.misses,
+                    total and self.hits / float(total))
+
+        def clear(self):
+                """Drop all of the entries and reset the statistics."""
+
+                with self.__lock:
+                        self.__entries.clear()
+                        self.__count = 0
+                        self.hits = self.misses = 0
+
+        def get(self, key):
+                """Return the actions cached for 'key', or None."""
+
+                with self.__lock:
+                        try:
+                                ents = self.__entries.pop(key)
+                        except KeyError:
+                                self.misses += 1
+                                return None
+                        self.__entries[key] = ents
+                        self.hits += 1
+                        return ents
+
+        def add(self, key, ents):
+                """Cache the actions 'ents' for 'key'."""
+
+                # Empty lists are counted too so that the number of entries is
+                # bounded as well.
+                if len(ents) + 1 > self.size:
+                        return
+                with self.__lock:
+                        old = self.__entries.pop(key, None)
+                        if old is not None:
+                                self.__count -= len(old) + 1
+                        self.__entries[key] = ents
+                        self.__count += len(ents) + 1
+                        while self.__count > self.size:
+                                k, old = self.__entries.popitem(last=False)
+                                self.__count -= len(old) + 1
+
+
 class FactoredManifest(Manifest):
         """This class serves as a wrapper for the Manifest class for callers
         that need efficient access to package data on a per-action type basis.
@@ -1543,6 +1615,13 @@ class FactoredManifest(Manifest):
         explictly and implicitly referenced by the manifest each tagged with
         the appropriate variants/facets."""
 
+        # The actions parsed from the cache files of all factored manifests.
+        action_cache = ActionCache(global_settings.client_manifest_cache_size)
+
+        # The first line of the binary form of a cache file; see
+        # __load_actions.
+        __bin_header = "PKGMACT1 {0:d} {1:d} {2}\n"
+
         def __init__(self, fmri, cache_root, contents=None, excludes=EmptyI,
             pathname=None):
                 """Raises KeyError exception if factored manifest is not present
@@ -1736,6 +1815,88 @@ class FactoredManifest(Manifest):
                                 # cache directory not existing.
                                 raise apx._convert_error(e)
 
+        def __load_actions(self, name):
+                """Return the actions in the cache file 'name' as a list of
+                tuples, as described in ActionCache.
+
+                Actions which aren't in the action cache are loaded from a
+                binary form of the cache file, 'name'.bin, which holds the same
+                tuples, marshalled, and is ignored unless it was made from the
+                cache file as it is now and by the same version of Python.  If
+                it can't be used, the cache file is parsed, and the binary form
+                is written if possible.  Raises EnvironmentError if the cache
+                file can't be read and ActionError if it's malformed."""
+
+                mpath = self.__cache_path(name)
+                st = os.stat(mpath)
+                ident = "{0:d} {1:d} {2!r}".format(st.st_ino, st.st_size,
+                    st.st_mtime)
+                key = (mpath, ident)
+                ents = self.action_cache.get(key)
+                if ents is not None:
+                        return ents
+
+                header = misc.force_bytes(self.__bin_header.format(
+                    marshal.version, sys.version_info[0], ident))
+                bpath = mpath + ".bin"
+                try:
+                        with open(bpath, "rb") as f:
+                                if f.readline() == header:
+                                        ents = marshal.load(f)
+                except (EnvironmentError, EOFError, ValueError, TypeError):
+                        # Missing, unreadable or corrupt; ignore it.
+                        ents = None
+
+                if ents is None:
+                        ents = []
+                        with open(mpath, "r") as f:
+                                for l in f:
+                                        a = actions.fromstr(l.rstrip())
+                                        ents.append((a.name,
+                                            getattr(a, "hash", None), a.attrs,
+                                            tuple(k for k, v in
+                                            six.iteritems(a.attrs)
+                                            if isinstance(v, list))))
+
+                        try:
+                                fd, fn = tempfile.mkstemp(
+                                    dir=self.__cache_root,
+                                    prefix=os.path.basename(bpath) + ".")
+                        except EnvironmentError:
+                                # It's not fatal if the binary form can't be
+                                # written, e.g. when not running as root.
+                                fd = None
+                        if fd is not None:
+                                try:
+                                        with os.fdopen(fd, "wb") as f:
+                                                f.write(header)
+                                                marshal.dump(ents, f)
+                                        os.chmod(fn, PKG_FILE_MODE)
+                                        portable.rename(fn, bpath)
+                                except EnvironmentError:
+                                        try:
+                                                portable.remove(fn)
+                                        except EnvironmentError:
+                                                pass
+
+                self.action_cache.add(key, ents)
+                return ents
+
+        def __gen_cached_actions(self, name):
+                """Generate new actions for those in the cache file 'name'; see
+                __load_actions."""
+
+                types = actions.types
+                for aname, ahash, attrs, lists in self.__load_actions(name):
+                        if lists:
+                                attrs = attrs.copy()
+                                for k in lists:
+                                        attrs[k] = list(attrs[k])
+                        a = types[aname](None, **attrs)
+                        if ahash is not None:
+                                a.hash = ahash
+                        yield a
+
         def __load_cached_data(self, name):
                 """Private helper function for loading arbitrary cached manifest
                 data.
@@ -1745,17 +1906,13 @@ class FactoredManifest(Manifest):
                 if os.path.exists(mpath):
                         # we have cached copy on disk; use it
                         try:
-                                with open(mpath, "r") as f:
-                                        self._cache[name] = [
-                                            a for a in
-                                            (
-                                                actions.fromstr(s.rstrip())
-                                                for s in f
-                                            )
-                                            if not self.excludes or
-                                                a.include_this(self.excludes,
-                                                    publisher=self.publisher)
-                                        ]
+                                self._cache[name] = [
+                                    a for a in
+                                    self.__gen_cached_actions(name)
+                                    if not self.excludes or
+                                        a.include_this(self.excludes,
+                                            publisher=self.publisher)
+                                ]
                                 return
                         except EnvironmentError as e:
                                 raise apx._convert_error(e)
@@ -1824,25 +1981,22 @@ class FactoredManifest(Manifest):
 
                 # Assume a cached copy exists; if not, tag the action type to
                 # avoid pointless I/O later.
-                mpath = self.__cache_path("manifest.{0}".format(atype))
-
                 if attr_match:
                         attr_match = _compile_fnpats(attr_match)
 
                 try:
-                        with open(mpath, "r") as f:
-                                for l in f:
-                                        a = actions.fromstr(l.rstrip())
-                                        if (excludes and
-                                            not a.include_this(excludes,
-                                                publisher=self.publisher)):
-                                                continue
-                                        # These conditions are split by
-                                        # performance.
-                                        if not attr_match:
-                                                yield a
-                                        elif _attr_matches(a, attr_match):
-                                                yield a
+                        for a in self.__gen_cached_actions(
+                            "manifest.{0}".format(atype)):
+                                if (excludes and
+                                    not a.include_this(excludes,
+                                        publisher=self.publisher)):
+                                        continue
+                                # These conditions are split by
+                                # performance.
+                                if not attr_match:
+                                        yield a
+                                elif _attr_matches(a, attr_match):
+                                        yield a
 
                 except EnvironmentError as e:
                         if e.errno == errno.ENOENT:
@@ -668,6 +668,15 @@ def get_data_digest(data, length=None, return_content=False,
         return hash_results, content.read()
 
 
+# The level at which the payloads of packages are compressed by default, and,
+# when the compression of payloads is probed, the amount of their data which
+# is compressed to determine whether it is worth compressing and the ratio of
+# the size of that data compressed to its size above which it isn't.
+PKG_COMPRESS_LEVEL = 9
+PKG_COMPRESS_PROBE_SIZE = 64 * 1024
+PKG_COMPRESS_PROBE_RATIO = 0.95
+
+
 class _GZWriteWrapper(object):
         """Used by compute_compressed_attrs to calculate data size and compute
         hashes as the data is written instead of having to read the written data
@@ -710,17 +719,10 @@ class _GZWriteWrapper(object):
                             data) # pylint: disable=E1101
 
 
-def compute_compressed_attrs(fname, file_path=None, data=None, size=None,
-    compress_dir=None, bufsz=64*1024, chash_attrs=None, chash_algs=None):
-        """Returns the size and one or more hashes of the compressed data.  If
-        the file located at file_path doesn't exist or isn't gzipped, it creates
-        a file in compress_dir named fname.  If compress_dir is None, the
-        attributes are calculated but no data will be written.
-
-        'chash_attrs' is a list of the chash attributes we should compute, with
-        'chash_algs' being a dictionary that maps the attribute names to the
-        algorithms used to compute them.
-        """
+def _new_chashes(chash_attrs, chash_algs):
+        """Returns a dictionary mapping each of the chash attributes in
+        'chash_attrs' to a new object computing it, as described by
+        compute_compressed_attrs."""
 
         if chash_attrs is None:
                 chash_attrs = digest.DEFAULT_CHASH_ATTRS
@@ -738,6 +740,53 @@ def compute_compressed_attrs(fname, file_path=None, data=None, size=None,
                             digest.EXTRACT_GZIP, digest.PREFERRED_HASH)]()
                 else:
                         chashes[chash_attr] = chash_algs[chash_attr]()
+        return chashes
+
+
+def _finish_chashes(chashes):
+        """Replaces the objects in the dictionary returned by _new_chashes
+        with the values of the attributes they computed."""
+
+        for attr in chashes:
+                if attr == "pkg.content-hash":
+                        chashes[attr] = "{0}:{1}:{2}".format(
+                            digest.EXTRACT_GZIP, digest.PREFERRED_HASH,
+                            chashes[attr].hexdigest())
+                else:
+                        chashes[attr] = chashes[attr].hexdigest()
+
+
+def get_compress_level(data, level=PKG_COMPRESS_LEVEL, probe=False):
+        """Returns the level at which to compress a payload starting with
+        'data'.  If 'probe' is True and a sample of 'data' barely compresses,
+        this is 0, so that the payload is stored in gzip format without being
+        compressed; otherwise, it is 'level'."""
+
+        if probe and level > 0 and data:
+                sample = data[:PKG_COMPRESS_PROBE_SIZE]
+                if len(zlib.compress(sample, 1)) >= \
+                    len(sample) * PKG_COMPRESS_PROBE_RATIO:
+                        return 0
+        return level
+
+
+def compute_compressed_attrs(fname, file_path=None, data=None, size=None,
+    compress_dir=None, bufsz=64*1024, chash_attrs=None, chash_algs=None,
+    compress_level=PKG_COMPRESS_LEVEL, compress_probe=False):
+        """Returns the size and one or more hashes of the compressed data.  If
+        the file located at file_path doesn't exist or isn't gzipped, it creates
+        a file in compress_dir named fname.  If compress_dir is None, the
+        attributes are calculated but no data will be written.
+
+        'chash_attrs' is a list of the chash attributes we should compute, with
+        'chash_algs' being a dictionary that maps the attribute names to the
+        algorithms used to compute them.
+
+        'compress_level' and 'compress_probe' determine the level at which
+        the data is compressed, as described by get_compress_level.
+        """
+
+        chashes = _new_chashes(chash_attrs, chash_algs)
 
         #
         # This check prevents compressing a file which is already compressed.
@@ -762,10 +811,12 @@ def compute_compressed_attrs(fname, file_path=None, data=None, size=None,
                         opath = None
 
                 fobj = _GZWriteWrapper(opath, chashes)
-                ofile = PkgGzipFile(mode="wb", fileobj=fobj)
 
                 if isinstance(data, (six.string_types, bytes)):
                         # caller passed data in string
+                        ofile = PkgGzipFile(mode="wb", fileobj=fobj,
+                            compresslevel=get_compress_level(data,
+                            compress_level, compress_probe))
                         nbuf = size // bufsz
                         for n in range(0, nbuf):
                                 l = n * bufsz
@@ -779,22 +830,21 @@ def compute_compressed_attrs(fname, file_path=None, data=None, size=None,
                         if bufsz > size:
                                 bufsz = size
 
-                        while True:
-                                chunk = data.read(bufsz)
-                                if not chunk:
-                                        break
+                        chunk = data.read(bufsz)
+                        ofile = PkgGzipFile(mode="wb", fileobj=fobj,
+                            compresslevel=get_compress_level(chunk,
+                            compress_level, compress_probe))
+                        while chunk:
                                 ofile.write(chunk)
+                                chunk = data.read(bufsz)
+                else:
+                        ofile = PkgGzipFile(mode="wb", fileobj=fobj,
+                            compresslevel=compress_level)
 
                 ofile.close()
                 fobj.close()
                 csize = str(fobj.size)
-                for attr in chashes:
-                        if attr == "pkg.content-hash":
-                                chashes[attr] = "{0}:{1}:{2}".format(
-                                    digest.EXTRACT_GZIP, digest.PREFERRED_HASH,
-                                    chashes[attr].hexdigest())
-                        else:
-                                chashes[attr] = chashes[attr].hexdigest()
+                _finish_chashes(chashes)
                 return csize, chashes
 
         # Compute the SHA hash of the compressed file.  In order for this to
@@ -816,15 +866,73 @@ def compute_compressed_attrs(fname, file_path=None, data=None, size=None,
 
         # The returned dictionary can now be populated with the hexdigests
         # instead of the hash objects themselves.
-        for attr in chashes:
-                if attr == "pkg.content-hash":
-                        chashes[attr] = "{0}:{1}:{2}".format(
-                                digest.EXTRACT_GZIP, digest.PREFERRED_HASH,
-                                chashes[attr].hexdigest())
-                else:
-                        chashes[attr] = chashes[attr].hexdigest()
+        _finish_chashes(chashes)
         return csize, chashes
 
+
+def compute_data_attrs(data, size, hash_attrs, hash_algs, compress_path=None,
+    chash_attrs=None, chash_algs=None, tee=None,
+    compress_level=PKG_COMPRESS_LEVEL, compress_probe=False):
+        """Reads the data of a payload once and returns a tuple of (hashes,
+        csize, chashes), where 'hashes' is a dictionary of the hashes of the
+        data, as returned by get_data_digest, and 'csize' and 'chashes' are the
+        size and hashes of the compressed data, as returned by
+        compute_compressed_attrs.  This is equivalent to calling both, but
+        avoids reading the data twice.
+
+        'data' should be a file-like object, of 'size' bytes, which is closed
+        once it has been read.
+
+        'hash_attrs' and 'hash_algs' are as described by get_data_digest, and
+        'chash_attrs', 'chash_algs', 'compress_level' and 'compress_probe'
+        as described by compute_compressed_attrs.
+
+        'compress_path' is the pathname of a file to which the compressed data
+        is written; if it is None, the data is discarded.
+
+        'tee' is an optional callable which is passed each block of the data
+        as it is read."""
+
+        hashes = dict(
+            (attr, hash_algs[attr]())
+            for attr in hash_attrs
+            if attr != "pkg.content-hash"
+        )
+        chashes = _new_chashes(chash_attrs, chash_algs)
+
+        bufsz = PKG_FILE_BUFSIZ
+        fobj = _GZWriteWrapper(compress_path, chashes)
+        ofile = None
+        try:
+                length = size
+                while length > 0:
+                        buf = data.read(min(bufsz, length))
+                        if not buf:
+                                break
+                        for h in six.itervalues(hashes):
+                                h.update(buf) # pylint: disable=E1101
+                        if ofile is None:
+                                ofile = PkgGzipFile(mode="wb", fileobj=fobj,
+                                    compresslevel=get_compress_level(buf,
+                                    compress_level, compress_probe))
+                        ofile.write(buf)
+                        if tee:
+                                tee(buf)
+                        length -= len(buf)
+                if ofile is None:
+                        ofile = PkgGzipFile(mode="wb", fileobj=fobj,
+                            compresslevel=compress_level)
+        finally:
+                data.close()
+                if ofile is not None:
+                        ofile.close()
+                fobj.close()
+
+        for attr in hashes:
+                hashes[attr] = hashes[attr].hexdigest()
+        _finish_chashes(chashes)
+        return hashes, str(fobj.size), chashes
+
 class ProcFS(object):
         """This class is used as an interface to procfs."""
 
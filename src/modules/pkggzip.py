@@ -33,11 +33,37 @@ class PkgGzipFile(gzip.GzipFile):
         deterministic gzip files on compression, so that we can reliably
         use a cryptographic hash on the compressed content."""
 
+        # When data is stored without being compressed (compresslevel 0), the
+        # output of zlib depends on how the data is split between writes, so
+        # it is then written in blocks of this size.
+        STORED_BLOCK_SIZE = 64 * 1024
+
         def __init__(self, filename=None, mode=None, compresslevel=9,
             fileobj=None):
 
                gzip.GzipFile.__init__(self, filename, mode, compresslevel,
                     fileobj) 
+               self.__stored = compresslevel == 0
+               self.__pending = b""
+
+        def write(self, data):
+                if not self.__stored:
+                        return gzip.GzipFile.write(self, data)
+
+                length = len(data)
+                data = self.__pending + bytes(data)
+                end = len(data) - len(data) % self.STORED_BLOCK_SIZE
+                for i in range(0, end, self.STORED_BLOCK_SIZE):
+                        gzip.GzipFile.write(self,
+                            data[i:i + self.STORED_BLOCK_SIZE])
+                self.__pending = data[end:]
+                return length
+
+        def close(self):
+                if self.__pending:
+                        gzip.GzipFile.write(self, self.__pending)
+                        self.__pending = b""
+                gzip.GzipFile.close(self)
 
         #
         # This is a gzip header conforming to RFC1952.  The first two bytes
@@ -45,9 +71,12 @@ class PkgGzipFile(gzip.GzipFile):
         # compression method (8, deflate).  The fourth byte is the flag byte
         # (0), which indicates that no FNAME, FCOMMENT or other extended data
         # is present.  Bytes 5-8 are the MTIME field, zeroed in this case.
-        # Byte 9 is the XFL (Extra Flags) field, set to 2 (compressor used
-        # max compression).  The final bit is the OS type, set to 255 (for
-        # "unknown").
+        # Byte 9 is the XFL (Extra Flags) field, set to 2 (which RFC1952
+        # defines as "compressor used maximum compression").  XFL is only
+        # informational, and it is kept at 2 whatever the compression level
+        # is, even for stored (level 0) payloads, so that every payload has
+        # the same header and is recognized by test_is_pkggzipfile.  The
+        # final byte is the OS type, set to 255 (for "unknown").
         magic = b"\037\213\010\000\000\000\000\000\002\377"
 
         def _write_gzip_header(self):
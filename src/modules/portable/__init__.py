@@ -182,6 +182,17 @@ def copyfile(src, dst):
         Exceptions: IOError if the destination location is not writable"""
         raise NotImplementedError
 
+def clonefile(src, dst):
+        """ Create (or replace) the file named dst with the contents of the
+        file named src without copying the data through the caller, by sharing
+        the data blocks of src (a reflink) where the filesystem supports it,
+        and otherwise using an in-kernel copy.
+        Exceptions:
+            OSError (or subclass) if the source path does not exist, or if
+            neither operation is supported for the given files (e.g. they
+            are on different filesystems)"""
+        raise NotImplementedError
+
 def split_path(path):
         """ Splits a path and gives back the components of the path.  
         This is intended to hide platform-specific details about splitting
@@ -32,7 +32,7 @@ from .os_unix import \
     get_isainfo, get_release, get_platform, get_group_by_name, \
     get_user_by_name, get_name_by_gid, get_name_by_uid, get_usernames_by_gid, \
     is_admin, get_userid, get_username, chown, rename, remove, link, \
-    split_path, get_root, assert_mode
+    clonefile, split_path, get_root, assert_mode
 
 import macostools
 
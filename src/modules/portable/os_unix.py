@@ -34,6 +34,7 @@ these.
 import pwd
 import grp
 import errno
+import fcntl
 import os
 import platform
 import shutil
@@ -198,8 +199,10 @@ def load_passwd(dirpath):
         passwd_stamp = os.stat(passwd_file).st_mtime
         if passwd_stamp <= users_lastupdate.get(dirpath, -1):
                 return
-        users[dirpath] = user = {}
-        uids[dirpath] = uid = {}
+        # The tables are only published once complete, since they may
+        # be looked up concurrently (see ImagePlan.execute()).
+        user = {}
+        uid = {}
         f = open(passwd_file)
         for line in f:
                 arr = line.rstrip().split(":")
@@ -220,8 +223,10 @@ def load_passwd(dirpath):
                 # current pw_entry.
                 uid.setdefault(pw_entry.pw_uid, pw_entry)
 
-        users_lastupdate[dirpath] = passwd_stamp
         f.close()
+        users[dirpath] = user
+        uids[dirpath] = uid
+        users_lastupdate[dirpath] = passwd_stamp
 
 def load_groups(dirpath):
         # check if we need to reload cache
@@ -229,8 +234,8 @@ def load_groups(dirpath):
         group_stamp = os.stat(group_file).st_mtime
         if group_stamp <= groups_lastupdate.get(dirpath, -1):
                 return
-        groups[dirpath] = group = {}
-        gids[dirpath] = gid = {}
+        group = {}
+        gid = {}
         f = open(group_file)
         for line in f:
                 arr = line.rstrip().split(":")
@@ -250,8 +255,10 @@ def load_groups(dirpath):
                 # current pw_entry.
                 gid.setdefault(gr_entry.gr_gid, gr_entry)
 
-        groups_lastupdate[dirpath] = group_stamp
         f.close()
+        groups[dirpath] = group
+        gids[dirpath] = gid
+        groups_lastupdate[dirpath] = group_stamp
 
 def chown(path, owner, group):
         return os.chown(path, owner, group)
@@ -307,6 +314,46 @@ def assert_mode(path, mode):
 def copyfile(src, dst):
         shutil.copyfile(src, dst)
 
+# Linux ioctl(2) request which makes a file share the data blocks of another.
+_FICLONE = 0x40049409
+
+def clonefile(src, dst):
+        sfd = os.open(src, os.O_RDONLY)
+        try:
+                dfd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                    0o600)
+                try:
+                        if sys.platform.startswith("linux"):
+                                try:
+                                        fcntl.ioctl(dfd, _FICLONE, sfd)
+                                        return
+                                except (IOError, OSError) as e:
+                                        if e.errno not in (errno.EOPNOTSUPP,
+                                            errno.ENOTTY, errno.EINVAL,
+                                            errno.EXDEV):
+                                                raise
+
+                        copy_file_range = getattr(os, "copy_file_range", None)
+                        if not copy_file_range:
+                                raise OSError(errno.ENOTSUP,
+                                    os.strerror(errno.ENOTSUP), dst)
+                        size = os.fstat(sfd).st_size
+                        off = 0
+                        while off < size:
+                                n = copy_file_range(sfd, dfd, size - off, off,
+                                    off)
+                                if n == 0:
+                                        # The source was truncated while it
+                                        # was copied; don't leave a partial
+                                        # copy behind as if it were complete.
+                                        raise OSError(errno.EIO,
+                                            os.strerror(errno.EIO), dst)
+                                off += n
+                finally:
+                        os.close(dfd)
+        finally:
+                os.close(sfd)
+
 
 # Vim hints
 # vim:ts=8:sw=8:et:fdm=marker
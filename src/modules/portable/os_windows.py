@@ -241,5 +241,8 @@ def assert_mode(path, mode):
 def copyfile(src, dst):
         shutil.copyfile(src, dst)
 
+def clonefile(src, dst):
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS), dst)
+
 # Vim hints
 # vim:ts=8:sw=8:et:fdm=marker
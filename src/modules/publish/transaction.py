@@ -28,6 +28,8 @@
 repository.  Note that only the Transaction class should be used directly,
 though the other classes can be referred to for documentation purposes."""
 
+import collections
+import multiprocessing
 import os
 import shutil
 import six
@@ -50,6 +52,10 @@ import pkg.portable.util as os_util
 import pkg.server.repository as sr
 import pkg.client.api_errors as apx
 
+# The number of actions, per worker process, whose data may be processed ahead
+# of the actions being added by TransportTransaction.add_actions.
+PENDING_PAYLOADS = 8
+
 class TransactionError(Exception):
         """Base exception class for all Transaction exceptions."""
 
@@ -156,6 +162,14 @@ class NullTransaction(object):
                         raise TransactionOperationError("add",
                             trans_id=self.trans_id, msg=str(e))
 
+        def add_actions(self, actions, jobs=1):
+                """Adds each of the actions in 'actions', a sequence of
+                (action, source) tuples, to an in-flight transaction.  Returns
+                nothing."""
+
+                for action, source in actions:
+                        self.add(action)
+
         def add_file(self, pth):
                 """Adds an additional file to the inflight transaction so that
                 it will be available for retrieval once the transaction is
@@ -198,6 +212,129 @@ class NullTransaction(object):
                 pass
 
 
+class _ElfCopy(object):
+        """Used by _compute_payload as the 'tee' of
+        misc.compute_data_attrs to keep a copy of the data of an action if its
+        first bytes show that its ELF information is needed."""
+
+        def __init__(self, tmpdir, needed):
+                """'needed' is a callable which is given the first bytes of the
+                data and returns whether a copy should be kept; if so, it is
+                written to a new file in 'tmpdir'."""
+
+                self.__tmpdir = tmpdir
+                self.__needed = needed
+                self.__file = None
+                self.__started = False
+                self.path = None
+
+        def __call__(self, data):
+                if not self.__started:
+                        self.__started = True
+                        if self.__needed(data):
+                                fd, self.path = tempfile.mkstemp(
+                                    dir=self.__tmpdir, prefix=".temp-")
+                                self.__file = os.fdopen(fd, "wb")
+                if self.__file:
+                        self.__file.write(data)
+
+        def close(self):
+                """Close the copy, if any."""
+                if self.__file:
+                        self.__file.close()
+                        self.__file = None
+
+
+def _get_elf_attrs(elf_name, need_elf_info, need_elfhash):
+        """Returns a dictionary of the ELF information of 'elf_name', a copy of
+        the data of an action, of the kinds indicated by 'need_elf_info' and
+        'need_elfhash'.  'elf_name' is removed once it has been examined."""
+
+        attrs = {}
+        if need_elf_info:
+                try:
+                        elf_info = elf.get_info(elf_name)
+                except elf.ElfError as e:
+                        raise TransactionError(e)
+                attrs["elfbits"] = str(elf_info["bits"])
+                attrs["elfarch"] = elf_info["arch"]
+
+        # Check which content checksums to compute and add to the action
+        get_elfhash = (need_elfhash and "elfhash" in
+            digest.DEFAULT_GELF_HASH_ATTRS)
+        get_sha256 = (need_elfhash and
+            not digest.sha512_supported and
+            "pkg.content-hash" in
+            digest.DEFAULT_GELF_HASH_ATTRS)
+        get_sha512t_256 = (need_elfhash and
+            digest.sha512_supported and
+            "pkg.content-hash" in
+            digest.DEFAULT_GELF_HASH_ATTRS)
+
+        if get_elfhash or get_sha256 or get_sha512t_256:
+                try:
+                        attrs.update(elf.get_hashes(
+                            elf_name, elfhash=get_elfhash,
+                            sha256=get_sha256,
+                            sha512t_256=get_sha512t_256))
+                except elf.ElfError:
+                        pass
+
+        os.unlink(elf_name)
+        return attrs
+
+
+def _compute_payload(args):
+        """Reads the data of a payload once to compute its hashes, compress it
+        and determine its ELF information; run by
+        TransportTransaction._process_action, or by the worker processes used
+        by TransportTransaction.add_actions.
+
+        'args' is a tuple of the data (a file object or the pathname of a
+        file), its size, the directory in which to write the compressed data,
+        the hash attributes to compute, whether the ELF information and the
+        ELF hashes are needed if the data is an ELF file, and the level and
+        probe with which to compress it, as described by
+        misc.get_compress_level.
+
+        Returns a tuple of (hashes, csize, chashes, cpath, elf_attrs), where
+        'cpath' is the pathname of the compressed data."""
+
+        data, size, tmpdir, hash_attrs, need_elf_info, need_elfhash, \
+            compress_level, compress_probe = args
+
+        # This currently uses the presence of "elfhash" to indicate the need
+        # for *any* content hashes to be added. This will work as expected
+        # until elfhash is no longer generated by default, and then this logic
+        # will need to be updated accordingly.
+        def needed(magic):
+                return haveelf and need_elf_info and need_elfhash and \
+                    magic[:4] == b"\x7fELF"
+
+        if isinstance(data, six.string_types):
+                data = open(data, "rb")
+        fd, cpath = tempfile.mkstemp(dir=tmpdir, prefix=".compressed-")
+        os.close(fd)
+        elf_copy = _ElfCopy(tmpdir, needed)
+        try:
+                hashes, csize, chashes = misc.compute_data_attrs(data, size,
+                    hash_attrs, digest.HASH_ALGS, compress_path=cpath,
+                    tee=elf_copy, compress_level=compress_level,
+                    compress_probe=compress_probe)
+                elf_copy.close()
+                elf_attrs = {}
+                if elf_copy.path:
+                        elf_attrs = _get_elf_attrs(elf_copy.path,
+                            need_elf_info, need_elfhash)
+        except:
+                elf_copy.close()
+                for p in (cpath, elf_copy.path):
+                        if p and os.path.exists(p):
+                                os.unlink(p)
+                raise
+        return hashes, csize, chashes, cpath, elf_attrs
+
+
 class TransportTransaction(object):
         """Provides a publishing interface that uses client transport."""
 
@@ -217,6 +354,7 @@ class TransportTransaction(object):
                 self.progtrack = progtrack
                 self.transport = xport
                 self.publisher = pub
+                self.__compression = None
                 self.__local = False
                 self.__uploaded = 0
                 self.__uploads = {}
@@ -275,6 +413,62 @@ class TransportTransaction(object):
                 """Adds an action and its related content to an in-flight
                 transaction.  Returns nothing."""
 
+                self.__add(action, exact=exact, path=path)
+
+        def add_actions(self, actions, jobs=1):
+                """Adds each of the actions in 'actions', a sequence of
+                (action, source) tuples, and its related content to an
+                in-flight transaction, in order, as add does.  'source' is the
+                pathname of the file providing the data of the action, if
+                any.  Returns nothing.
+
+                If 'jobs' is greater than one, the data of the actions which
+                have a source is hashed and compressed by that many worker
+                processes, ahead of the actions being added."""
+
+                if jobs <= 1 or self.__transactions.get(self.trans_id) is None:
+                        for action, source in actions:
+                                self.add(action)
+                        return
+
+                pending = collections.deque()
+                pool = multiprocessing.Pool(jobs)
+                try:
+                        for action, source in actions:
+                                payload = None
+                                if action.has_payload and \
+                                    isinstance(source, six.string_types):
+                                        if int(action.attrs.get("pkg.size",
+                                            0)) <= 0:
+                                                source = os.devnull
+                                        payload = pool.apply_async(
+                                            _compute_payload,
+                                            (self.__payload_args(action,
+                                            source),))
+                                pending.append((action, payload))
+                                # Limit how far ahead the workers can get to
+                                # limit the compressed data waiting to be
+                                # uploaded.
+                                if len(pending) > jobs * PENDING_PAYLOADS:
+                                        self.__add_pending(*pending.popleft())
+                        while pending:
+                                self.__add_pending(*pending.popleft())
+                finally:
+                        pool.terminate()
+                        pool.join()
+
+        def __add_pending(self, action, payload):
+                """Adds an action queued by add_actions once the worker
+                processing its data, if any, has finished."""
+
+                if payload is not None:
+                        payload = payload.get()
+                self.__add(action, payload=payload)
+
+        def __add(self, action, exact=False, path=None, payload=None):
+                """Adds an action as add does; 'payload' is as described by
+                _process_action."""
+
                 try:
                         # Perform additional publication-time validation of
                         # actions before further processing is done.
@@ -289,7 +483,7 @@ class TransportTransaction(object):
                 if man is not None:
                         try:
                                 self._process_action(action, exact=exact,
-                                    path=path)
+                                    path=path, payload=payload)
                         except apx.TransportError as e:
                                 msg = str(e)
                                 raise TransactionOperationError("add",
@@ -308,75 +502,6 @@ class TransportTransaction(object):
                         raise TransactionOperationError("add",
                             trans_id=self.trans_id, msg=msg)
 
-        def __get_elf_attrs(self, action, fname, size):
-                """Helper function to get the ELF information."""
-
-                # This currently uses the presence of "elfhash" to indicate the
-                # need for *any* content hashes to be added. This will work as
-                # expected until elfhash is no longer generated by default, and
-                # then this logic will need to be updated accordingly.
-                need_elf_info = False
-                need_elfhash = False
-
-                bufsz = misc.PKG_FILE_BUFSIZ
-                if bufsz > size:
-                        bufsz = size
-
-                f = action.data()
-                magic = f.read(4)
-                if haveelf and magic == b"\x7fELF":
-                        need_elf_info = (
-                            "elfarch" not in action.attrs or
-                            "elfbits" not in action.attrs)
-                        need_elfhash = "elfhash" not in action.attrs
-                if not need_elf_info or not need_elfhash:
-                        f.close()
-                        return misc.EmptyDict
-
-                elf_name = os.path.join(self._tmpdir,
-                    ".temp-{0}".format(fname))
-                with open(elf_name, "wb") as elf_file:
-                        elf_file.write(magic)
-                        while True:
-                                data = f.read(bufsz)
-                                if not data:
-                                    break
-                                elf_file.write(data)
-                f.close()
-
-                attrs = {}
-                if need_elf_info:
-                        try:
-                                elf_info = elf.get_info(elf_name)
-                        except elf.ElfError as e:
-                                raise TransactionError(e)
-                        attrs["elfbits"] = str(elf_info["bits"])
-                        attrs["elfarch"] = elf_info["arch"]
-
-                # Check which content checksums to compute and add to the action
-                get_elfhash = (need_elfhash and "elfhash" in
-                    digest.DEFAULT_GELF_HASH_ATTRS)
-                get_sha256 = (need_elfhash and
-                    not digest.sha512_supported and
-                    "pkg.content-hash" in
-                    digest.DEFAULT_GELF_HASH_ATTRS)
-                get_sha512t_256 = (need_elfhash and
-                    digest.sha512_supported and
-                    "pkg.content-hash" in
-                    digest.DEFAULT_GELF_HASH_ATTRS)
-
-                if get_elfhash or get_sha256 or get_sha512t_256:
-                        try:
-                                attrs.update(elf.get_hashes(
-                                    elf_name, elfhash=get_elfhash,
-                                    sha256=get_sha256,
-                                    sha512t_256=get_sha512t_256))
-                        except elf.ElfError:
-                                pass
-
-                os.unlink(elf_name)
-                return attrs
-
         def __get_compressed_attrs(self, fhash):
                 """Given a fhash of a file, returns a tuple
                 of (csize, chashes) where 'csize' is the size of the file
@@ -406,7 +531,34 @@ class TransportTransaction(object):
                                         break
                 return csize, chashes
 
-        def _process_action(self, action, exact=False, path=None):
+        def __payload_args(self, action, data):
+                """Returns the arguments of _compute_payload for the action,
+                whose data is 'data'."""
+
+                hash_attrs = list(digest.DEFAULT_HASH_ATTRS)
+                # Add file content-hash when preferred_hash is SHA2 or higher.
+                if action.name != "signature" and \
+                    digest.PREFERRED_HASH != "sha1":
+                        hash_attrs.append("{0}:{1}".format(
+                            digest.EXTRACT_FILE, digest.PREFERRED_HASH))
+                if self.__compression is None:
+                        # Compress the data as the repository does.
+                        try:
+                                self.__compression = \
+                                    self.transport.get_compression(
+                                    self.publisher)
+                        except apx.TransportError as e:
+                                raise TransactionOperationError("add",
+                                    trans_id=self.trans_id, msg=str(e))
+                level, probe = self.__compression
+                return (data, int(action.attrs.get("pkg.size", 0)),
+                    self._tmpdir, hash_attrs,
+                    "elfarch" not in action.attrs or
+                    "elfbits" not in action.attrs,
+                    "elfhash" not in action.attrs, level, probe)
+
+        def _process_action(self, action, exact=False, path=None,
+            payload=None):
                 """Adds all expected attributes to the provided action and
                 upload the file for the action if needed.
 
@@ -416,6 +568,9 @@ class TransportTransaction(object):
                 If 'exact' is True and a 'path' is provided, the file of that
                 path will be uploaded as-is (it is assumed that the file is
                 already in repository format).
+
+                'payload', if provided, is the result of _compute_payload for
+                the action; otherwise, it is computed here.
                 """
 
                 if self._append_mode and action.name != "signature":
@@ -436,64 +591,59 @@ class TransportTransaction(object):
                                     progtrack=self.progtrack)
                         return
 
-                # Get all hashes for this action.
-                hashes, dummy = misc.get_data_digest(action.data(),
-                    length=size, hash_attrs=digest.DEFAULT_HASH_ATTRS,
-                    hash_algs=digest.HASH_ALGS)
-                # Set the hash member for backwards compatibility and
-                # remove it from the dictionary.
-                action.hash = hashes.pop("hash", None)
-                action.attrs.update(hashes)
+                if payload is None:
+                        payload = _compute_payload(
+                            self.__payload_args(action, action.data()))
+                hashes, csize, chashes, cpath, elf_attrs = payload
 
-                # Add file content-hash when preferred_hash is SHA2 or higher.
-                if action.name != "signature" and \
-                    digest.PREFERRED_HASH != "sha1":
-                        hash_attr = "{0}:{1}".format(digest.EXTRACT_FILE,
+                try:
+                        content_attr = "{0}:{1}".format(digest.EXTRACT_FILE,
                             digest.PREFERRED_HASH)
-                        file_content_hash, dummy = misc.get_data_digest(
-                            action.data(), length=size, return_content=False,
-                            hash_attrs=[hash_attr], hash_algs=digest.HASH_ALGS)
-                        action.attrs["pkg.content-hash"] = "{0}:{1}".format(
-                            hash_attr, file_content_hash[hash_attr])
-
-                # Now set the hash value that will be used for storing the file
-                # in the repository.
-                hash_attr, hash_val, hash_func = \
-                    digest.get_least_preferred_hash(action)
-                fname = hash_val
-
-                hdata = self.__uploads.get(fname)
-                if hdata is not None:
-                        elf_attrs, csize, chashes = hdata
-                else:
-                        # We haven't processed this file before, determine if
-                        # it needs to be uploaded and what information the
-                        # repository knows about it.
-                        elf_attrs = self.__get_elf_attrs(action, fname, size)
-                        csize, chashes = self.__get_compressed_attrs(fname)
-
-                        # 'csize' indicates that if file needs to be uploaded.
-                        fileneeded = csize is None
-                        if fileneeded:
-                                fpath = os.path.join(self._tmpdir, fname)
-                                csize, chashes = misc.compute_compressed_attrs(
-                                    fname, data=action.data(), size=size,
-                                    compress_dir=self._tmpdir)
-                                # Upload the compressed file for each action.
-                                self.add_file(fpath, basename=fname,
-                                    progtrack=self.progtrack)
-                                os.unlink(fpath)
-                                self.__uploaded += 1
-                        elif not chashes:
-                                # If not fileneeded, and repository can't
-                                # provide desired hashes, call
-                                # compute_compressed_attrs() in a way that
-                                # avoids writing the file to get the attributes
-                                # we need.
-                                csize, chashes = misc.compute_compressed_attrs(
-                                    fname, data=action.data(), size=size)
-
-                        self.__uploads[fname] = (elf_attrs, csize, chashes)
+                        if content_attr in hashes:
+                                action.attrs["pkg.content-hash"] = \
+                                    "{0}:{1}".format(content_attr,
+                                    hashes.pop(content_attr))
+                        # Set the hash member for backwards compatibility and
+                        # remove it from the dictionary.
+                        action.hash = hashes.pop("hash", None)
+                        action.attrs.update(hashes)
+
+                        # Now set the hash value that will be used for storing
+                        # the file in the repository.
+                        hash_attr, hash_val, hash_func = \
+                            digest.get_least_preferred_hash(action)
+                        fname = hash_val
+
+                        hdata = self.__uploads.get(fname)
+                        if hdata is not None:
+                                elf_attrs, csize, chashes = hdata
+                        else:
+                                rcsize, rchashes = \
+                                    self.__get_compressed_attrs(fname)
+
+                                # 'rcsize' indicates if the file needs to be
+                                # uploaded.
+                                if rcsize is None:
+                                        # Upload the compressed file for each
+                                        # action.
+                                        fpath = os.path.join(self._tmpdir,
+                                            fname)
+                                        os.rename(cpath, fpath)
+                                        self.add_file(fpath, basename=fname,
+                                            progtrack=self.progtrack)
+                                        os.unlink(fpath)
+                                        self.__uploaded += 1
+                                elif rchashes:
+                                        csize, chashes = rcsize, rchashes
+                                # If the repository has the file, but can't
+                                # provide the desired hashes, those of the
+                                # data just compressed are used.
+
+                                self.__uploads[fname] = (elf_attrs, csize,
+                                    chashes)
+                finally:
+                        if os.path.exists(cpath):
+                                os.unlink(cpath)
 
                 for k, v in six.iteritems(elf_attrs):
                         if isinstance(v, list):
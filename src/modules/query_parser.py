@@ -1058,6 +1058,7 @@ class TermQuery(object):
                 self._manifest_path_func = None
                 self._data_manf = None
                 self._data_token_offset = None
+                self._data_token_index = None
                 self._data_main_dict = None
 
         def __init_gdd(self, path):
@@ -1073,6 +1074,26 @@ class TermQuery(object):
                     "fmri_offsets": ss.InvertedDict(ss.FMRI_OFFSETS_FILE, None)
                 }
 
+        @staticmethod
+        def __use_token_index(tq_gdd, path):
+                """Arranges for the binary token index to be used in place of
+                the token byte offset file if the index at 'path' has one.
+                Indexes written before the token index was introduced don't
+                have one until they're next updated."""
+
+                if os.path.exists(os.path.join(path, ss.TOKEN_INDEX_FILE)):
+                        tq_gdd.pop("token_byte_offset", None)
+                        if "token_index" not in tq_gdd:
+                                tq_gdd["token_index"] = \
+                                    ss.IndexStoreTokenIndex(
+                                        ss.TOKEN_INDEX_FILE)
+                else:
+                        tq_gdd.pop("token_index", None)
+                        if "token_byte_offset" not in tq_gdd:
+                                tq_gdd["token_byte_offset"] = \
+                                    ss.IndexStoreDictMutable(
+                                        ss.BYTE_OFFSET_FILE)
+
         @classmethod
         def __lock_gdd(cls, index_dir):
                 # This lock is used so that only one instance of a term query
@@ -1198,6 +1219,7 @@ class TermQuery(object):
                         if "fmri_offsets" not in tq_gdd:
                                 tq_gdd["fmri_offsets"] = ss.InvertedDict(
                                     ss.FMRI_OFFSETS_FILE, None)
+                        self.__use_token_index(tq_gdd, self._dir_path)
                         # Create a temporary list of dictionaries we need to
                         # open consistently.
                         tmp = list(tq_gdd.values())
@@ -1270,7 +1292,10 @@ class TermQuery(object):
                                         d.close_file_handle()
                         self._data_manf = tq_gdd["manf"]
 
-                        self._data_token_offset = tq_gdd["token_byte_offset"]
+                        self._data_token_offset = tq_gdd.get(
+                            "token_byte_offset", None)
+                        self._data_token_index = tq_gdd.get("token_index",
+                            None)
                         self._data_fmri_offsets = tq_gdd.get("fmri_offsets",
                             None)
                 finally:
@@ -1346,6 +1371,32 @@ class TermQuery(object):
                         md_fh.seek(o)
                         yield md_fh.readline()
 
+        def __read_entries(self, offsets):
+                """Takes a group of byte offsets into the main dictionary, or
+                None for every token, and yields the token and entries for
+                each of them, using the token index if there is one."""
+
+                ti = self._data_token_index
+                if ti is not None:
+                        if offsets is None:
+                                idxs = range(ti.get_token_count())
+                        else:
+                                idxs = (
+                                    ti.index_of_offset(o)
+                                    for o in sorted(offsets)
+                                )
+                        for i in idxs:
+                                yield ti.get_token(i), ti.get_entries(i)
+                        return
+
+                if offsets is None:
+                        line_iter = self._data_main_dict.get_file_handle()
+                else:
+                        line_iter = self.__offset_line_read(offsets)
+                for line in line_iter:
+                        assert not line == '\n'
+                        yield self._data_main_dict.parse_main_dict_line(line)
+
         def _read_pkg_dirs(self, fmris):
                 """Legacy function used to search indexes which have a pkg
                 directory with fmri offset information instead of the
@@ -1397,7 +1448,23 @@ class TermQuery(object):
                 # match with no results is represented by an empty set.
                 offsets = None
 
-                if glob:
+                ti = self._data_token_index
+                if ti is not None:
+                        if glob:
+                                if TermQuery.has_non_wildcard_character.match(
+                                    term):
+                                        offsets = set([
+                                            ti.get_offset(i)
+                                            for i in ti.find_glob(term,
+                                                case_sensitive)
+                                        ])
+                        else:
+                                i = ti.lookup(term)
+                                if i is None:
+                                        self._close_dicts()
+                                        return
+                                offsets = set([ti.get_offset(i)])
+                elif glob:
                         # If the term has at least one non-wildcard character
                         # in it, do the glob search.
                         if TermQuery.has_non_wildcard_character.match(term):
@@ -1464,21 +1531,18 @@ class TermQuery(object):
                                 # If the file doesn't exist, then no actions
                                 # with that key were indexed.
                                 offsets = set()
-                line_iter = EmptyI
+                entry_iter = EmptyI
                 # If offsets isn't None, then the set of results has been
                 # restricted so iterate through those offsets.
                 if offsets is not None:
-                        line_iter = self.__offset_line_read(offsets)
+                        entry_iter = self.__read_entries(offsets)
                 # If offsets is None and the term was only wildcard search
                 # tokens, return results for every known token.
                 elif glob and \
                     not TermQuery.has_non_wildcard_character.match(term):
-                        line_iter = self._data_main_dict.get_file_handle()
+                        entry_iter = self.__read_entries(None)
 
-                for line in line_iter:
-                        assert not line == '\n'
-                        tok, at_lst = \
-                            self._data_main_dict.parse_main_dict_line(line)
+                for tok, at_lst in entry_iter:
                         # Check that the token was what was expected.
                         assert ((term == tok) or
                             (not case_sensitive and
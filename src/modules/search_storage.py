@@ -26,14 +26,19 @@
 
 import os
 import errno
+import fnmatch
+import mmap
+import re
+import struct
 import time
 import hashlib
+import itertools
 from six.moves.urllib.parse import quote, unquote
 
 import pkg.fmri as fmri
 import pkg.search_errors as search_errors
 import pkg.portable as portable
-from pkg.misc import PKG_FILE_BUFSIZ, force_bytes
+from pkg.misc import PKG_FILE_BUFSIZ, force_bytes, force_str
 
 FAST_ADD = 'fast_add.v1'
 FAST_REMOVE = 'fast_remove.v1'
@@ -43,6 +48,10 @@ MAIN_FILE = 'main_dict.ascii.v2'
 BYTE_OFFSET_FILE = 'token_byte_offset.v1'
 FULL_FMRI_HASH_FILE = 'full_fmri_list.hash'
 FMRI_OFFSETS_FILE = 'fmri_offsets.v1'
+TOKEN_INDEX_FILE = 'token_index.v2'
+# Token index files in formats which are no longer read; they're removed when
+# the current token index is written to an index.
+OLD_TOKEN_INDEX_FILES = ('token_index.v1',)
 
 def consistent_open(data_list, directory, timeout = 1):
         """Opens all data holders in data_list and ensures that the
@@ -75,7 +84,7 @@ def consistent_open(data_list, directory, timeout = 1):
                         # in the function is greater than timeout.
                         try:
                                 f = os.path.join(directory, d.get_file_name())
-                                fh = open(f, 'r')
+                                fh = open(f, d.get_file_mode())
                                 # If we get here, then the current index file
                                 # is present.
                                 if missing == None:
@@ -87,7 +96,7 @@ def consistent_open(data_list, directory, timeout = 1):
                                         cur_version = None
                                         break
                                 d.set_file_handle(fh, f)
-                                version_tmp = fh.readline()
+                                version_tmp = force_str(fh.readline())
                                 version_num = \
                                     int(version_tmp.split(' ')[1].rstrip('\n'))
                                 # Read the version. If this is the first file,
@@ -135,6 +144,9 @@ class IndexStoreBase(object):
         calls.
         """
 
+        # The mode in which consistent_open opens the file.
+        _file_mode = "r"
+
         def __init__(self, file_name):
                 self._name = file_name
                 self._file_handle = None
@@ -147,6 +159,9 @@ class IndexStoreBase(object):
         def get_file_name(self):
                 return self._name
 
+        def get_file_mode(self):
+                return self._file_mode
+
         def set_file_handle(self, f_handle, f_path):
                 if self._file_handle:
                         raise RuntimeError("setting an extant file handle, "
@@ -371,6 +386,519 @@ class IndexStoreMainDict(IndexStoreBase):
                 self._old_suffix = self._name + suffix
 
 
+class IndexStoreTokenIndex(IndexStoreBase):
+        """Binary companion to the main dictionary which allows a token to
+        be found, and its entries decoded, without reading the main
+        dictionary or the token byte offset file into memory.
+
+        After the usual version line the file contains, in order:
+
+            the magic string and a header giving the number of tokens, the
+            number of tokens which are pure ASCII, and the position in the
+            file of each of the following tables;
+
+            N+1 offsets into the token pool, then the pool of UTF-8
+            encoded tokens, in the order in which they appear in the main
+            dictionary;
+
+            N byte offsets into the main dictionary, one for each token;
+
+            N+1 offsets into the postings area;
+
+            N token numbers: first the ASCII tokens sorted by their lower
+            case form, which allows case insensitive prefix searches, then
+            the remaining tokens;
+
+            the sorted trigrams found in the lower case form of the ASCII
+            tokens, three bytes each, followed by offsets into, and then
+            the lists of, the sorted numbers of the tokens containing each
+            trigram, which allow the tokens which can match a glob pattern
+            without a literal prefix to be found;
+
+            the postings area, which holds the entries for each token, as
+            described by parse_main_dict_line, encoded as variable length
+            integers and length-prefixed strings.
+
+        The file is mapped into memory when it's read, so looking up a token
+        costs a binary search over the mapped tables."""
+
+        _file_mode = "rb"
+
+        MAGIC = b"PKGTIDX2"
+        HEADER = struct.Struct("<12Q")
+
+        # The length of the substrings of tokens which are indexed.
+        NGRAM = 3
+
+        __glob_chars = re.compile(r"[*?[]")
+
+        def __init__(self, file_name):
+                IndexStoreBase.__init__(self, file_name)
+                self._map = None
+                self._count = 0
+                self._tokens = None
+                # State used while writing the file.
+                self._out_tokens = []
+                self._out_offsets = []
+                self._out_postings = [0]
+                self._postings_path = None
+
+        @staticmethod
+        def __encode_uint(n, out):
+                while n >= 0x80:
+                        out.append((n & 0x7f) | 0x80)
+                        n >>= 7
+                out.append(n)
+
+        @staticmethod
+        def __encode_str(s, out):
+                s = force_bytes(s)
+                IndexStoreTokenIndex.__encode_uint(len(s), out)
+                out.extend(s)
+
+        @staticmethod
+        def __decode_uint(buf, pos):
+                res = 0
+                shift = 0
+                while True:
+                        b = buf[pos]
+                        pos += 1
+                        res |= (b & 0x7f) << shift
+                        if b < 0x80:
+                                return res, pos
+                        shift += 7
+
+        @staticmethod
+        def __decode_str(buf, pos):
+                l, pos = IndexStoreTokenIndex.__decode_uint(buf, pos)
+                return force_str(bytes(buf[pos:pos + l])), pos + l
+
+        def open_out_file(self, use_dir, version_num):
+                """Prepares this object to receive the entries for each token
+                via write_entity.  The entries are spooled to a temporary file
+                in use_dir until write_dict_file is called."""
+
+                self._out_tokens = []
+                self._out_offsets = []
+                self._out_postings = [0]
+                self._postings_path = os.path.join(use_dir,
+                    self._name + ".postings")
+                self._file_handle = open(self._postings_path, "wb",
+                    buffering=PKG_FILE_BUFSIZ)
+
+        def write_entity(self, token, offset, entries):
+                """Adds 'token', which starts at byte 'offset' in the main
+                dictionary and has the entries 'entries', to the index.  Tokens
+                must be added in the order in which they appear in the main
+                dictionary."""
+
+                assert self._file_handle is not None
+                enc_uint = self.__encode_uint
+                enc_str = self.__encode_str
+                out = bytearray()
+                enc_uint(len(entries), out)
+                for at, st_list in entries:
+                        enc_str(at, out)
+                        enc_uint(len(st_list), out)
+                        for st, fv_list in st_list:
+                                enc_str(st, out)
+                                enc_uint(len(fv_list), out)
+                                for fv, p_list in fv_list:
+                                        enc_str(fv, out)
+                                        enc_uint(len(p_list), out)
+                                        for p_id, m_off_set in p_list:
+                                                enc_uint(int(p_id), out)
+                                                enc_uint(len(m_off_set), out)
+                                                for o in m_off_set:
+                                                        enc_uint(int(o), out)
+                self._file_handle.write(out)
+                self._out_tokens.append(token)
+                self._out_offsets.append(int(offset))
+                self._out_postings.append(self._out_postings[-1] + len(out))
+
+        def write_dict_file(self, path, version_num):
+                """Writes out the index of the tokens added by write_entity.
+                If no tokens have been added, an empty index is written."""
+
+                if self._file_handle:
+                        self._file_handle.close()
+                        self._file_handle = None
+
+                toks = self._out_tokens
+                n = len(toks)
+                pool = bytearray()
+                tokoff = [0]
+                ascii_toks = []
+                other_toks = []
+                ng = self.NGRAM
+                grams = {}
+                for i, t in enumerate(toks):
+                        b = force_bytes(t)
+                        pool.extend(b)
+                        tokoff.append(len(pool))
+                        if len(b) == len(t):
+                                ascii_toks.append(i)
+                                lb = b.lower()
+                                for g in set(
+                                    lb[k:k + ng]
+                                    for k in range(len(lb) - ng + 1)
+                                ):
+                                        grams.setdefault(g, []).append(i)
+                        else:
+                                other_toks.append(i)
+                ascii_toks.sort(key=lambda i: toks[i].lower())
+                gram_keys = sorted(grams)
+                gram_off = [0]
+                for g in gram_keys:
+                        gram_off.append(gram_off[-1] + len(grams[g]))
+
+                version = force_bytes("VERSION: {0}\n".format(version_num))
+                tokoff_pos = len(version) + len(self.MAGIC) + self.HEADER.size
+                pool_pos = tokoff_pos + 4 * (n + 1)
+                mdoff_pos = pool_pos + len(pool)
+                postoff_pos = mdoff_pos + 8 * n
+                lower_pos = postoff_pos + 8 * (n + 1)
+                gkey_pos = lower_pos + 4 * n
+                goff_pos = gkey_pos + ng * len(gram_keys)
+                gpost_pos = goff_pos + 4 * (len(gram_keys) + 1)
+                post_pos = gpost_pos + 4 * gram_off[-1]
+
+                fh = open(os.path.join(path, self._name), "wb",
+                    buffering=PKG_FILE_BUFSIZ)
+                try:
+                        fh.write(version)
+                        fh.write(self.MAGIC)
+                        fh.write(self.HEADER.pack(n, len(ascii_toks),
+                            tokoff_pos, pool_pos, mdoff_pos, postoff_pos,
+                            lower_pos, post_pos, len(gram_keys), gkey_pos,
+                            goff_pos, gpost_pos))
+                        fh.write(struct.pack("<{0:d}I".format(n + 1),
+                            *tokoff))
+                        fh.write(pool)
+                        fh.write(struct.pack("<{0:d}Q".format(n),
+                            *self._out_offsets))
+                        fh.write(struct.pack("<{0:d}Q".format(n + 1),
+                            *self._out_postings))
+                        fh.write(struct.pack("<{0:d}I".format(n),
+                            *(ascii_toks + other_toks)))
+                        fh.write(b"".join(gram_keys))
+                        fh.write(struct.pack("<{0:d}I".format(
+                            len(gram_off)), *gram_off))
+                        for g in gram_keys:
+                                fh.write(struct.pack("<{0:d}I".format(
+                                    len(grams[g])), *grams[g]))
+                        if self._postings_path:
+                                with open(self._postings_path, "rb") as pfh:
+                                        while True:
+                                                buf = pfh.read(PKG_FILE_BUFSIZ)
+                                                if not buf:
+                                                        break
+                                                fh.write(buf)
+                finally:
+                        fh.close()
+
+        def write_dict_file_from_main_dict(self, main_dict_path, path,
+            version_num):
+                """Builds the index for the existing main dictionary at
+                'main_dict_path' and writes it to the directory 'path'.  This
+                is used to add the index to an index which predates it."""
+
+                self.open_out_file(path, version_num)
+                try:
+                        with open(main_dict_path, "rb") as fh:
+                                offset = len(fh.readline())
+                                for line in fh:
+                                        tok, entries = IndexStoreMainDict.\
+                                            parse_main_dict_line(
+                                            force_str(line))
+                                        self.write_entity(tok, offset,
+                                            entries)
+                                        offset += len(line)
+                        self.write_dict_file(path, version_num)
+                finally:
+                        self.close_file_handle()
+
+        def close_file_handle(self):
+                """Closes the file handle and removes the spooled entries, if
+                any.  The mapping of the file, if it has been read, remains
+                valid."""
+
+                IndexStoreBase.close_file_handle(self)
+                if self._postings_path:
+                        try:
+                                os.remove(self._postings_path)
+                        except EnvironmentError as e:
+                                if e.errno != errno.ENOENT:
+                                        raise
+                        self._postings_path = None
+                        self._out_tokens = []
+                        self._out_offsets = []
+                        self._out_postings = [0]
+
+        def __inconsistent(self):
+                return search_errors.InconsistentIndexException(
+                    os.path.dirname(self._file_path))
+
+        def read_dict_file(self):
+                """Maps the file into memory and reads its header."""
+
+                assert self._file_handle
+                start = self._file_handle.tell()
+                try:
+                        m = mmap.mmap(self._file_handle.fileno(), 0,
+                            access=mmap.ACCESS_READ)
+                except ValueError:
+                        raise self.__inconsistent()
+                hdr_pos = start + len(self.MAGIC)
+                if m[start:hdr_pos] != self.MAGIC or \
+                    len(m) < hdr_pos + self.HEADER.size:
+                        m.close()
+                        raise self.__inconsistent()
+                self._count, self._nascii, self._tokoff_pos, self._pool_pos, \
+                    self._mdoff_pos, self._postoff_pos, self._lower_pos, \
+                    self._post_pos, self._ngrams, self._gkey_pos, \
+                    self._goff_pos, self._gpost_pos = \
+                    self.HEADER.unpack_from(m, hdr_pos)
+                self._map = m
+                self._tokens = None
+                IndexStoreBase.read_dict_file(self)
+
+        def get_token_count(self):
+                return self._count
+
+        def __token_bytes(self, i):
+                s, e = struct.unpack_from("<2I", self._map,
+                    self._tokoff_pos + 4 * i)
+                return self._map[self._pool_pos + s:self._pool_pos + e]
+
+        def __lower(self, j):
+                return struct.unpack_from("<I", self._map,
+                    self._lower_pos + 4 * j)[0]
+
+        def get_token(self, i):
+                """Returns the i'th token."""
+
+                return force_str(self.__token_bytes(i))
+
+        def get_offset(self, i):
+                """Returns the byte offset of the i'th token's line in the main
+                dictionary."""
+
+                return struct.unpack_from("<Q", self._map,
+                    self._mdoff_pos + 8 * i)[0]
+
+        @staticmethod
+        def __bisect(key, get, lo, hi):
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        if get(mid) < key:
+                                lo = mid + 1
+                        else:
+                                hi = mid
+                return lo
+
+        def lookup(self, token):
+                """Returns the number of 'token' in the index or None if the
+                token isn't present."""
+
+                key = force_bytes(token)
+                i = self.__bisect(key, self.__token_bytes, 0, self._count)
+                if i < self._count and self.__token_bytes(i) == key:
+                        return i
+                return None
+
+        def index_of_offset(self, offset):
+                """Returns the number of the token whose line starts at byte
+                'offset' in the main dictionary."""
+
+                i = self.__bisect(offset, self.get_offset, 0, self._count)
+                if i == self._count or self.get_offset(i) != offset:
+                        raise self.__inconsistent()
+                return i
+
+        def get_entries(self, i):
+                """Returns the entries for the i'th token in the form produced
+                by IndexStoreMainDict.parse_main_dict_line."""
+
+                s, e = struct.unpack_from("<2Q", self._map,
+                    self._postoff_pos + 8 * i)
+                buf = bytearray(self._map[self._post_pos + s:
+                    self._post_pos + e])
+                dec_uint = self.__decode_uint
+                dec_str = self.__decode_str
+                res = []
+                n_at, pos = dec_uint(buf, 0)
+                for x in range(n_at):
+                        at, pos = dec_str(buf, pos)
+                        n_st, pos = dec_uint(buf, pos)
+                        at_res = []
+                        for y in range(n_st):
+                                st, pos = dec_str(buf, pos)
+                                n_fv, pos = dec_uint(buf, pos)
+                                st_res = []
+                                for z in range(n_fv):
+                                        fv, pos = dec_str(buf, pos)
+                                        n_p, pos = dec_uint(buf, pos)
+                                        fv_res = []
+                                        for w in range(n_p):
+                                                p_id, pos = dec_uint(buf, pos)
+                                                n_o, pos = dec_uint(buf, pos)
+                                                offsets = []
+                                                for v in range(n_o):
+                                                        o, pos = dec_uint(buf,
+                                                            pos)
+                                                        offsets.append(o)
+                                                fv_res.append((p_id, offsets))
+                                        st_res.append((fv, fv_res))
+                                at_res.append((st, st_res))
+                        res.append((at, at_res))
+                return res
+
+        @staticmethod
+        def __literal_runs(pat):
+                """Returns the lower case form of each run of ASCII characters
+                in the glob pattern 'pat' which must appear literally in any
+                matching token, following the rules of fnmatch.translate."""
+
+                runs = []
+                cur = []
+                i, n = 0, len(pat)
+                while i < n:
+                        c = pat[i]
+                        i += 1
+                        if c == "[":
+                                j = i
+                                if j < n and pat[j] == "!":
+                                        j += 1
+                                if j < n and pat[j] == "]":
+                                        j += 1
+                                while j < n and pat[j] != "]":
+                                        j += 1
+                                if j < n:
+                                        # A character class ends the run.
+                                        c = None
+                                        i = j + 1
+                        if c is None or c in "*?" or ord(c) >= 0x80:
+                                # Non-ASCII characters end the run since case
+                                # insensitive matching of them doesn't follow
+                                # lower().
+                                runs.append("".join(cur))
+                                cur = []
+                        else:
+                                cur.append(c.lower())
+                runs.append("".join(cur))
+                return runs
+
+        def __gram_postings(self, g):
+                """Returns the numbers of the ASCII tokens whose lower case
+                form contains the trigram 'g'."""
+
+                ng = self.NGRAM
+                get = lambda k: self._map[self._gkey_pos + ng * k:
+                    self._gkey_pos + ng * (k + 1)]
+                k = self.__bisect(g, get, 0, self._ngrams)
+                if k == self._ngrams or get(k) != g:
+                        return ()
+                s, e = struct.unpack_from("<2I", self._map,
+                    self._goff_pos + 4 * k)
+                return struct.unpack_from("<{0:d}I".format(e - s), self._map,
+                    self._gpost_pos + 4 * s)
+
+        def __ngram_candidates(self, pat):
+                """Returns the set of the numbers of the tokens which can match
+                the glob pattern 'pat', or None if the pattern has no literal
+                run long enough to narrow the tokens down."""
+
+                ng = self.NGRAM
+                grams = set()
+                for r in self.__literal_runs(pat):
+                        r = force_bytes(r)
+                        grams.update(
+                            r[k:k + ng] for k in range(len(r) - ng + 1))
+                if not grams:
+                        return None
+
+                res = None
+                for p in sorted((self.__gram_postings(g) for g in grams),
+                    key=len):
+                        if res is None:
+                                res = set(p)
+                        else:
+                                res.intersection_update(p)
+                        if not res:
+                                break
+                # The non-ASCII tokens aren't indexed, so they must always be
+                # checked.
+                res.update(
+                    self.__lower(j) for j in range(self._nascii, self._count))
+                return res
+
+        def find_glob(self, pat, case_sensitive):
+                """Returns the numbers of the tokens which match the glob
+                pattern 'pat', using the same rules as pkg.choose.  The
+                literal prefix of the pattern, if any, is used to narrow the
+                tokens which must be checked to those sharing that prefix.
+                If the prefix is too short to contain a trigram, the tokens
+                are narrowed to those containing every trigram of the
+                pattern's literal runs instead."""
+
+                m = self.__glob_chars.search(pat)
+                prefix = pat[:m.start()] if m else pat
+                bprefix = force_bytes(prefix)
+                # If cands is None, every token must be checked.
+                cands = None
+                if not prefix:
+                        pass
+                elif case_sensitive:
+                        # UTF-8 never contains 0xff, so every token starting
+                        # with the prefix sorts before this.
+                        lo = self.__bisect(bprefix, self.__token_bytes, 0,
+                            self._count)
+                        hi = self.__bisect(bprefix + b"\xff",
+                            self.__token_bytes, lo, self._count)
+                        cands = range(lo, hi)
+                elif len(bprefix) == len(prefix):
+                        # Only the ASCII tokens are sorted case insensitively;
+                        # the others are always checked since case
+                        # insensitive matching of non-ASCII characters doesn't
+                        # follow lower().
+                        get = lambda j: self.__token_bytes(
+                            self.__lower(j)).lower()
+                        bprefix = bprefix.lower()
+                        lo = self.__bisect(bprefix, get, 0, self._nascii)
+                        hi = self.__bisect(bprefix + b"\xff", get, lo,
+                            self._nascii)
+                        cands = [
+                            self.__lower(j)
+                            for j in itertools.chain(range(lo, hi),
+                                range(self._nascii, self._count))
+                        ]
+
+                if len(bprefix) < self.NGRAM:
+                        ngc = self.__ngram_candidates(pat)
+                        if ngc is not None:
+                                if cands is None:
+                                        cands = sorted(ngc)
+                                else:
+                                        cands = sorted(ngc.intersection(cands))
+
+                # Derived from pkg.choose.
+                flag = 0
+                if not case_sensitive:
+                        flag = re.I
+                match = re.compile(fnmatch.translate(pat), flag).match
+                if cands is not None:
+                        return [i for i in cands if match(self.get_token(i))]
+
+                # The decoded tokens are kept for later searches which must
+                # check every token.
+                if self._tokens is None:
+                        self._tokens = [
+                            self.get_token(i) for i in range(self._count)
+                        ]
+                return [i for i, t in enumerate(self._tokens) if match(t)]
+
+
 class IndexStoreListDict(IndexStoreBase):
         """Used when both a list and a dictionary are needed to
         store the information. Used for bidirectional lookup when
@@ -29,11 +29,18 @@ from __future__ import division
 
 import cherrypy
 from cherrypy._cptools import HandlerTool
+from cherrypy.lib import cptools, httputil
 from cherrypy.lib.static import serve_file
 from email.utils import formatdate
 from cherrypy.process.plugins import SimplePlugin
 from cherrypy._cperror import _HTTPErrorTemplate
 
+try:
+        import cheroot.wsgi
+except ImportError:
+        # Older versions of CherryPy include their own WSGI server.
+        cheroot = None
+
 try:
         import pybonjour
 except (OSError, ImportError):
@@ -86,6 +93,12 @@ import pkg.version
 
 from pkg.server.query_parser import Query, ParseError, BooleanQueryException
 
+# The key of the WSGI environment entry used to pass a file to be sent using
+# sendfile(2) from DepotHTTP to the server; see Sendfile_Plugin.  The entry is
+# a list to which the file is appended, as CherryPy passes a copy of the
+# environment to the application.
+SENDFILE_KEY = "pkg.depot.sendfile"
+
 class Dummy(object):
         """Dummy object used for dispatch method mapping."""
         pass
@@ -108,6 +121,7 @@ class DepotHTTP(_Depot):
             "info",
             "manifest",
             "file",
+            "filelist",
             "open",
             "append",
             "close",
@@ -118,6 +132,7 @@ class DepotHTTP(_Depot):
             "index",
             "status",
             "admin",
+            "compression",
         ]
 
         REPO_OPS_READONLY = [
@@ -127,6 +142,7 @@ class DepotHTTP(_Depot):
             "info",
             "manifest",
             "file",
+            "filelist",
             "p5i",
             "publisher",
             "status",
@@ -135,6 +151,7 @@ class DepotHTTP(_Depot):
         REPO_OPS_MIRROR = [
             "versions",
             "file",
+            "filelist",
             "publisher",
             "status",
         ]
@@ -320,6 +337,58 @@ class DepotHTTP(_Depot):
                         return req_pub
                 return None
 
+        @staticmethod
+        def __serve_file(fpath, content_type):
+                """Sets the status and headers of the response for sending the
+                file at 'fpath' (including a single byte range of it, if
+                requested), and returns the response body.
+
+                If the server supports it (see Sendfile_Plugin), the file is
+                sent by the server using sendfile(2) once the headers have
+                been sent, and an empty body is returned.  Otherwise, this is
+                the same as serve_file()."""
+
+                request = cherrypy.request
+                env = getattr(request, "wsgi_environ", None) or {}
+                sf = env.get(SENDFILE_KEY)
+                if request.method != "GET" or sf is None or sf:
+                        return serve_file(fpath, content_type)
+
+                try:
+                        st = os.stat(fpath)
+                except EnvironmentError:
+                        # Let serve_file() deal with it.
+                        return serve_file(fpath, content_type)
+
+                response = cherrypy.response
+                response.headers["Last-Modified"] = httputil.HTTPDate(
+                    st.st_mtime)
+                cptools.validate_since()
+
+                offset = 0
+                count = st.st_size
+                if request.protocol >= (1, 1):
+                        r = httputil.get_ranges(request.headers.get("Range"),
+                            st.st_size)
+                        if r is not None and len(r) != 1:
+                                # Unsatisfiable or multipart ranges.
+                                return serve_file(fpath, content_type)
+                        response.headers["Accept-Ranges"] = "bytes"
+                        if r:
+                                start, stop = r[0]
+                                stop = min(stop, st.st_size)
+                                response.status = "206 Partial Content"
+                                response.headers["Content-Range"] = \
+                                    "bytes {0:d}-{1:d}/{2:d}".format(start,
+                                    stop - 1, st.st_size)
+                                offset = start
+                                count = stop - start
+
+                response.headers["Content-Type"] = content_type
+                response.headers["Content-Length"] = count
+                sf.append((open(fpath, "rb"), offset, count))
+                return []
+
         def __set_response_expires(self, op_name, expires, max_age=None):
                 """Used to set expiration headers on a response dynamically
                 based on the name of the operation.
@@ -685,7 +754,7 @@ class DepotHTTP(_Depot):
                         raise cherrypy.HTTPError(http_client.NOT_FOUND, str(e))
 
                 self.__set_response_expires("catalog", 86400, 86400)
-                return serve_file(fpath, "text/plain; charset=utf-8")
+                return self.__serve_file(fpath, "text/plain; charset=utf-8")
 
         catalog_1._cp_config = { "response.stream": True }
 
@@ -733,7 +802,7 @@ class DepotHTTP(_Depot):
 
                 # Send manifest
                 self.__set_response_expires("manifest", 86400*365, 86400*365)
-                return serve_file(fpath, "text/plain; charset=utf-8")
+                return self.__serve_file(fpath, "text/plain; charset=utf-8")
 
         manifest_0._cp_config = { "response.stream": True }
 
@@ -807,7 +876,7 @@ class DepotHTTP(_Depot):
                         raise cherrypy.HTTPError(http_client.NOT_FOUND, str(e))
 
                 self.__set_response_expires("file", 86400*365, 86400*365)
-                return serve_file(fpath, "application/data")
+                return self.__serve_file(fpath, "application/data")
 
         file_0._cp_config = { "response.stream": True }
 
@@ -845,8 +914,10 @@ class DepotHTTP(_Depot):
                                 fhash = None
 
                         try:
-                                fpath = self.repo.file(fhash,
-                                    pub=self._get_req_pub())
+                                pub = self._get_req_pub()
+                                fpath = self.repo.file(fhash, pub=pub)
+                                csize, chashes = self.repo.file_attrs(fhash,
+                                    pub=pub)
                         except srepo.RepositoryFileNotFoundError as e:
                                 raise cherrypy.HTTPError(http_client.NOT_FOUND,
                                     str(e))
@@ -859,8 +930,6 @@ class DepotHTTP(_Depot):
                                 raise cherrypy.HTTPError(http_client.NOT_FOUND,
                                     str(e))
 
-                        csize, chashes = misc.compute_compressed_attrs(fhash,
-                            file_path=fpath)
                         response = cherrypy.response
                         for i, attr in enumerate(chashes):
                                 response.headers["X-Ipkg-Attr-{0}".format(i)] = \
@@ -875,6 +944,69 @@ class DepotHTTP(_Depot):
 
         file_2._cp_config = { "response.stream": True }
 
+        def filelist_1(self, *tokens, **params):
+                """Outputs a tar stream of the files named by the SHA hash
+                names in the POSTed request data directly to the client.  Each
+                member is named by the hash of the file and contains the file
+                as stored in the repository (i.e. compressed), just as for the
+                file operation.  Files which are not found are omitted from
+                the stream; the client retrieves those individually."""
+
+                method = cherrypy.request.method
+                if method != "POST":
+                        raise cherrypy.HTTPError(http_client.METHOD_NOT_ALLOWED,
+                            "{0} is not allowed".format(method))
+
+                hashes = list(params.values())
+                if not hashes or not all(
+                    isinstance(h, six.string_types) for h in hashes):
+                        raise cherrypy.HTTPError(http_client.BAD_REQUEST)
+
+                pub = self._get_req_pub()
+                response = cherrypy.response
+                response.headers["Content-Type"] = "application/x-tar"
+
+                def output():
+                        for fhash in hashes:
+                                try:
+                                        fpath = self.repo.file(fhash, pub=pub)
+                                        f = open(fpath, "rb")
+                                except (srepo.RepositoryError,
+                                    EnvironmentError):
+                                        continue
+
+                                with f:
+                                        st = os.fstat(f.fileno())
+                                        ti = tarfile.TarInfo(fhash)
+                                        ti.size = st.st_size
+                                        ti.mtime = int(st.st_mtime)
+                                        ti.mode = 0o444
+                                        yield ti.tobuf(
+                                            format=tarfile.USTAR_FORMAT)
+
+                                        # The member must be exactly as large
+                                        # as its header says.
+                                        left = ti.size
+                                        while left > 0:
+                                                data = f.read(min(left,
+                                                    65536))
+                                                if not data:
+                                                        break
+                                                left -= len(data)
+                                                yield data
+                                        if left > 0:
+                                                yield b"\0" * left
+
+                                pad = ti.size % tarfile.BLOCKSIZE
+                                if pad:
+                                        yield b"\0" * (tarfile.BLOCKSIZE - pad)
+
+                        # End of archive.
+                        yield b"\0" * (tarfile.BLOCKSIZE * 2)
+                return output()
+
+        filelist_1._cp_config = { "response.stream": True }
+
         @cherrypy.tools.response_headers(headers=[("Pragma", "no-cache"),
             ("Cache-Control", "no-cache, no-transform, must-revalidate"),
             ("Expires", 0)])
@@ -1572,6 +1704,28 @@ License:
                             "to generate statistics."))
                 return misc.force_bytes(out + "\n")
 
+        @cherrypy.tools.response_headers(headers=\
+            [("Content-Type", "application/json; charset=utf-8")])
+        def compression_0(self, *tokens):
+                """Return a JSON formatted dictionary containing the 'level' and
+                'probe' values of the payload compression policy of the
+                publisher named by the request, so that publication clients
+                can compress the payloads they send accordingly."""
+
+                try:
+                        pub = tokens[0]
+                except IndexError:
+                        pub = self._get_req_pub() or \
+                            self.repo.cfg.get_property("publisher", "prefix")
+                try:
+                        level, probe = self.repo.get_compression(pub=pub)
+                        out = json.dumps({ "level": level, "probe": probe },
+                            sort_keys=True)
+                except Exception as e:
+                        raise cherrypy.HTTPError(http_client.NOT_FOUND, _("Unable "
+                            "to retrieve compression policy."))
+                return misc.force_bytes(out + "\n")
+
 def nasty_before_handler(nasty_depot, maxroll=100):
         """Cherrypy Tool callable which generates various problems prior to a
         request.  Possible outcomes: retryable HTTP error, short nap."""
@@ -2197,6 +2351,64 @@ class DNSSD_Plugin(SimplePlugin):
                 self.bus.log("Service unregistration for DNS-SD complete.")
 
 
+class Sendfile_Plugin(SimplePlugin):
+        """Allow a depot to send files to clients using sendfile(2) instead of
+        reading and writing them in the server's worker threads.  This is
+        only possible when the depot is served by CherryPy's own WSGI server
+        (cheroot)."""
+
+        def start(self):
+                server = getattr(cherrypy.server, "httpserver", None)
+                if cheroot and server and \
+                    server.gateway is cheroot.wsgi.Gateway_10:
+                        server.gateway = _SendfileGateway
+        # Priority must be lower than the server's, so that it exists.
+        start.priority = 76
+
+
+if cheroot:
+        class _SendfileGateway(cheroot.wsgi.Gateway_10):
+                """WSGI gateway which sends any file passed by the application
+                through the SENDFILE_KEY environment entry after the response
+                headers, using sendfile(2) where the socket supports it."""
+
+                def get_environ(self):
+                        env = cheroot.wsgi.Gateway_10.get_environ(self)
+                        env[SENDFILE_KEY] = []
+                        return env
+
+                def respond(self):
+                        try:
+                                cheroot.wsgi.Gateway_10.respond(self)
+                                sf = self.env[SENDFILE_KEY]
+                                if not sf:
+                                        return
+                                f, offset, count = sf[0]
+                                # The application's body is empty, so the
+                                # status line and headers may not have been
+                                # written yet.
+                                self.req.ensure_headers_sent()
+                                conn = self.req.conn
+                                conn.wfile.flush()
+                                if hasattr(conn.socket, "sendfile"):
+                                        # This falls back to send() for
+                                        # sockets which can't use sendfile(2).
+                                        conn.socket.sendfile(f, offset, count)
+                                        return
+
+                                f.seek(offset)
+                                while count > 0:
+                                        chunk = f.read(min(count, 65536))
+                                        if not chunk:
+                                                break
+                                        self.req.write(chunk)
+                                        count -= len(chunk)
+                        finally:
+                                for f, offset, count in \
+                                    self.env[SENDFILE_KEY]:
+                                        f.close()
+
+
 class BackgroundTaskPlugin(SimplePlugin):
         """This class allows background task execution for the depot server.  It
         is designed in such a way as to only allow a few tasks to be queued
@@ -2297,6 +2509,8 @@ class DepotConfig(object):
                     cfg.PropList("disable_ops"),
                     cfg.PropDefined("image_root", allowed=["",
                         "<abspathname>"]),
+                    cfg.PropInt("index_workers", default=1, minimum=1,
+                        value_map={ "": 1 }),
                     cfg.PropDefined("inst_root", allowed=["", "<pathname>"]),
                     cfg.PropBool("ll_mirror"),
                     cfg.PropDefined("log_access", allowed=["", "stderr",
@@ -2309,6 +2523,9 @@ class DepotConfig(object):
                     cfg.PropInt("port"),
                     cfg.PropPubURI("proxy_base"),
                     cfg.PropBool("readonly"),
+                    cfg.PropInt("search_cache_size",
+                        default=srepo.SEARCH_CACHE_SIZE, minimum=0,
+                        value_map={ "": srepo.SEARCH_CACHE_SIZE }),
                     cfg.PropInt("socket_timeout"),
                     cfg.PropInt("sort_file_max_size",
                         default=indexer.SORT_FILE_MAX_SIZE,
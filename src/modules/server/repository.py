@@ -25,9 +25,11 @@
 from __future__ import print_function
 
 import codecs
+import collections
 import datetime
 import errno
 import hashlib
+import json
 import logging
 import os
 import os.path
@@ -61,6 +63,7 @@ import pkg.misc as misc
 import pkg.nrlock
 import pkg.search_errors as se
 import pkg.query_parser as qp
+import pkg.search_storage as ss
 import pkg.server.catalog as old_catalog
 import pkg.server.query_parser as sqp
 import pkg.server.transaction as trans
@@ -87,6 +90,12 @@ REPO_VERIFY_UNKNOWN = 99
 REPO_FIX_ITEM = 0
 REPO_FIX_FAILED = 1
 
+# The default number of search queries whose results are kept by each
+# repository storage object, and the largest number of results a query may
+# return and still have them kept.
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_MAX_RESULTS = 1000
+
 VERIFY_DEPENDENCY = "dependency"
 verify_default_checks = frozenset([
       VERIFY_DEPENDENCY,
@@ -384,19 +393,29 @@ class _RepoStore(object):
         def __init__(self, allow_invalid=False, file_layout=None,
             file_root=None, log_obj=None, mirror=False, pub=None,
             read_only=False, root=None,
-            sort_file_max_size=indexer.SORT_FILE_MAX_SIZE, writable_root=None):
+            sort_file_max_size=indexer.SORT_FILE_MAX_SIZE, writable_root=None,
+            index_workers=1, search_cache_size=SEARCH_CACHE_SIZE,
+            compress_level=misc.PKG_COMPRESS_LEVEL, compress_probe=False):
                 """Prepare the repository for use."""
 
                 self.__catalog = None
                 self.__catalog_root = None
+                self.__file_attrs_store = None
                 # FileManager supports multiple layouts, but realistically, it
                 # is desirable to only support one per repository format
                 # version.
                 self.__file_layout = file_layout
                 self.__file_root = None
                 self.__in_flight_trans = {}
+                self.__index_workers = index_workers
                 self.__read_only = read_only
                 self.__root = None
+                self.__search_cache = collections.OrderedDict()
+                self.__search_cache_gen = None
+                self.__search_cache_hits = 0
+                self.__search_cache_lock = pkg.nrlock.NRLock()
+                self.__search_cache_misses = 0
+                self.__search_cache_size = search_cache_size
                 self.__sort_file_max_size = sort_file_max_size
                 self.__tmp_root = None
                 self.__writable_root = None
@@ -405,6 +424,8 @@ class _RepoStore(object):
                 self.manifest_root = None
                 self.trans_root = None
 
+                self.compress_level = compress_level
+                self.compress_probe = compress_probe
                 self.log_obj = log_obj
                 self.mirror = mirror
                 self.publisher = pub
@@ -452,6 +473,8 @@ class _RepoStore(object):
                         self.__catalog.read_only = value
                 if self.cache_store:
                         self.cache_store.readonly = value
+                if self.__file_attrs_store and not self.writable_root:
+                        self.__file_attrs_store.readonly = value
                 if old_ro and not self.__read_only:
                         self.__lock_rstore(blocking=True)
                         try:
@@ -656,10 +679,18 @@ class _RepoStore(object):
                 else:
                         rstatus = "online"
 
+                with self.__search_cache_lock:
+                        search_cache = {
+                            "entries": len(self.__search_cache),
+                            "hits": self.__search_cache_hits,
+                            "misses": self.__search_cache_misses,
+                        }
+
                 return {
                     "package-count": pkg_count,
                     "package-version-count": pkg_ver_count,
                     "last-catalog-update": lcat_update,
+                    "search-cache": search_cache,
                     "status": rstatus,
                 }
 
@@ -1161,6 +1192,17 @@ class _RepoStore(object):
                         self.index_root = None
                 self.__writable_root = root
 
+                # The compressed attributes of the repository's files are
+                # cached in the writable root if there is one, so that they
+                # can be stored even if the repository is read-only.
+                aroot = root or self.root
+                if aroot:
+                        self.__file_attrs_store = file_manager.FileManager(
+                            os.path.join(aroot, "file-attrs"),
+                            self.read_only and not root)
+                else:
+                        self.__file_attrs_store = None
+
         def __unlock_rstore(self):
                 """Unlocks the repository so other consumers may modify it."""
 
@@ -1180,8 +1222,10 @@ class _RepoStore(object):
                         index_inst = indexer.Indexer(self.index_root,
                             self._get_manifest, self.manifest,
                             log=self.__index_log,
-                            sort_file_max_size=self.__sort_file_max_size)
+                            sort_file_max_size=self.__sort_file_max_size,
+                            workers=self.__index_workers)
                         index_inst.server_update_index(fmris)
+                        self.__clear_search_cache()
                         if not self.__search_available:
                                 self.__index_log("Search Available")
                         self.__search_available = True
@@ -1410,6 +1454,7 @@ class _RepoStore(object):
                         # Nothing to do.
                         return
                 sqp.TermQuery.clear_cache(self.index_root)
+                self.__clear_search_cache()
 
         def close(self, trans_id, add_to_catalog=True):
                 """Closes the transaction specified by 'trans_id'.
@@ -1484,6 +1529,101 @@ class _RepoStore(object):
                         return fp
                 raise RepositoryFileNotFoundError(fhash)
 
+        def file_attrs(self, fhash):
+                """Returns a tuple of (csize, chashes) for the file specified
+                by the provided hash name, where 'csize' is the size of the
+                file in the repository and 'chashes' is a dictionary of the
+                hashes of its compressed data.  The attributes are cached, so
+                they are only computed the first time they are requested (or
+                not at all, if the file was published to this repository)."""
+
+                fpath = self.file(fhash)
+                try:
+                        st = os.stat(fpath)
+                except EnvironmentError as e:
+                        if e.errno == errno.ENOENT:
+                                raise RepositoryFileNotFoundError(fhash)
+                        raise apx._convert_error(e)
+
+                attrs = self.__get_file_attrs(fhash, st)
+                if attrs is None:
+                        attrs = misc.compute_compressed_attrs(fhash,
+                            file_path=fpath)
+                        self.__set_file_attrs(fhash, st, *attrs)
+                return attrs
+
+        def set_file_attrs(self, fhash, csize, chashes):
+                """Caches the compressed attributes of the file specified by
+                the provided hash name, as computed by
+                misc.compute_compressed_attrs() before it was added to the
+                repository."""
+
+                try:
+                        st = os.stat(self.file(fhash))
+                except (EnvironmentError, RepositoryError):
+                        return
+                self.__set_file_attrs(fhash, st, csize, chashes)
+
+        def __get_file_attrs(self, fhash, st):
+                """Returns the cached (csize, chashes) tuple for the file
+                specified by the provided hash name, or None if there is no
+                cached entry or it is out of date.  'st' is the result of
+                os.stat() on the file."""
+
+                if not self.__file_attrs_store:
+                        return None
+
+                try:
+                        apath = self.__file_attrs_store.lookup(fhash)
+                        if apath is None:
+                                return None
+                        with open(apath, "r") as f:
+                                entry = json.load(f)
+                        csize = entry["csize"]
+                        chashes = entry["chashes"]
+                        if entry["size"] != st.st_size or \
+                            entry["mtime"] != st.st_mtime or \
+                            set(chashes) != set(digest.DEFAULT_CHASH_ATTRS):
+                                return None
+                except (EnvironmentError, ValueError, KeyError, TypeError,
+                    apx.ApiException):
+                        # The entry can't be used, so it will be replaced.
+                        return None
+                return csize, chashes
+
+        def __set_file_attrs(self, fhash, st, csize, chashes):
+                """Caches the (csize, chashes) tuple for the file specified by
+                the provided hash name.  'st' is the result of os.stat() on
+                the file before the attributes were computed."""
+
+                store = self.__file_attrs_store
+                if not store or store.readonly:
+                        return
+
+                entry = {
+                    "csize": csize,
+                    "chashes": chashes,
+                    "mtime": st.st_mtime,
+                    "size": st.st_size,
+                }
+                tpath = None
+                try:
+                        misc.makedirs(store.root)
+                        fd, tpath = tempfile.mkstemp(dir=store.root)
+                        with os.fdopen(fd, "w") as f:
+                                json.dump(entry, f)
+                        os.chmod(tpath, misc.PKG_FILE_MODE)
+                        store.insert(fhash, tpath)
+                except (EnvironmentError, apx.ApiException):
+                        # The cache is only an optimization; the attributes
+                        # will be computed again the next time they are
+                        # needed.
+                        if tpath:
+                                try:
+                                        portable.remove(tpath)
+                                except EnvironmentError:
+                                        pass
+
         def get_publisher(self):
                 """Return the Publisher object for this storage object or None
                 if not available.
@@ -1817,6 +1957,9 @@ class _RepoStore(object):
                                         portable.remove(fpath)
                                         progtrack.job_add_progress(
                                             progtrack.JOB_REPO_RM_FILES)
+                                if self.__file_attrs_store and \
+                                    not self.__file_attrs_store.readonly:
+                                        self.__file_attrs_store.remove(h)
                         progtrack.job_done(progtrack.JOB_REPO_RM_FILES)
 
                         # Finally, tidy up repository structure by discarding
@@ -1949,7 +2092,84 @@ class _RepoStore(object):
                                         query_lst.append(s)
                 except sqp.QueryException as e:
                         raise RepositoryError(e)
-                return [_search(q) for q in query_lst]
+                gen = None
+                if self.__search_cache_size > 0:
+                        gen = self.__search_generation()
+                if gen is None:
+                        return [_search(q) for q in query_lst]
+
+                res_list = []
+                for q in query_lst:
+                        key = (q.text, q.case_sensitive, q.return_type,
+                            q.num_to_return, q.start_point)
+                        with self.__search_cache_lock:
+                                if gen != self.__search_cache_gen:
+                                        # The index or catalog has been
+                                        # replaced, possibly by another
+                                        # process.
+                                        self.__search_cache.clear()
+                                        self.__search_cache_gen = gen
+                                res = self.__search_cache.pop(key, None)
+                                if res is not None:
+                                        # Mark as most recently used.
+                                        self.__search_cache[key] = res
+                                        self.__search_cache_hits += 1
+                                else:
+                                        self.__search_cache_misses += 1
+                        if res is not None:
+                                res_list.append(iter(res))
+                        else:
+                                res_list.append(self.__cache_search_results(
+                                    key, gen, _search(q)))
+                return res_list
+
+        def __search_generation(self):
+                """Returns a value which changes whenever the search index or
+                the catalog is replaced, and so the results of a search might
+                change."""
+
+                try:
+                        st = os.stat(os.path.join(self.index_root,
+                            ss.MAIN_FILE))
+                except EnvironmentError:
+                        return None
+                return (st.st_ino, st.st_mtime, st.st_size,
+                    self.catalog.last_modified)
+
+        def __cache_search_results(self, key, gen, results):
+                """Yields the search results 'results' and then, if there
+                weren't too many of them, keeps them in the search cache as
+                the results for 'key'.  'gen' is the search generation at the
+                time the search was started; the results are discarded if the
+                cache has been cleared since."""
+
+                kept = []
+                for r in results:
+                        if kept is not None:
+                                if len(kept) < SEARCH_CACHE_MAX_RESULTS:
+                                        kept.append(r)
+                                else:
+                                        kept = None
+                        yield r
+                if kept is None:
+                        return
+
+                with self.__search_cache_lock:
+                        if gen != self.__search_cache_gen:
+                                return
+                        self.__search_cache[key] = kept
+                        while len(self.__search_cache) > \
+                            self.__search_cache_size:
+                                self.__search_cache.popitem(last=False)
+
+        def __clear_search_cache(self):
+                """Discards all cached search results."""
+
+                with self.__search_cache_lock:
+                        self.__search_cache.clear()
+                        # No results are kept until the next search
+                        # determines the current generation.
+                        self.__search_cache_gen = None
 
         @property
         def search_available(self):
@@ -2718,7 +2938,8 @@ class Repository(object):
         def __init__(self, allow_invalid=False, cfgpathname=None, create=False,
             file_root=None, log_obj=None, mirror=False,
             properties=misc.EmptyDict, read_only=False, root=None,
-            sort_file_max_size=indexer.SORT_FILE_MAX_SIZE, writable_root=None):
+            sort_file_max_size=indexer.SORT_FILE_MAX_SIZE, writable_root=None,
+            index_workers=1, search_cache_size=SEARCH_CACHE_SIZE):
                 """Prepare the repository for use."""
 
                 # This lock is used to protect the repository from multiple
@@ -2748,9 +2969,11 @@ class Repository(object):
                 # Initialize.
                 self.__cfgpathname = cfgpathname
                 self.__cfg = None
+                self.__index_workers = index_workers
                 self.__mirror = mirror
                 self.__read_only = read_only
                 self.__rstores = None
+                self.__search_cache_size = search_cache_size
                 self.__sort_file_max_size = sort_file_max_size
                 self.log_obj = log_obj
                 self.version = -1
@@ -2888,9 +3111,11 @@ class Repository(object):
                         froot = self.file_root
                         if not froot:
                                 froot = os.path.join(self.root, "file")
+                        level, probe = self.get_compression()
                         rstore = _RepoStore(file_layout=layout.V1Layout(),
                             file_root=froot, log_obj=self.log_obj,
-                            mirror=self.mirror, read_only=self.read_only)
+                            mirror=self.mirror, read_only=self.read_only,
+                            compress_level=level, compress_probe=probe)
                         self.__rstores[rstore.publisher] = rstore
 
                         # ...and then one for each publisher if any are known.
@@ -3077,12 +3302,15 @@ class Repository(object):
                         # might use a mix of layouts.
                         file_layout = layout.V1Layout()
 
+                level, probe = self.get_compression(pub=pub)
                 rstore = _RepoStore(allow_invalid=allow_invalid,
                     file_layout=file_layout, file_root=froot,
                     log_obj=self.log_obj, mirror=self.mirror, pub=pub,
                     read_only=self.read_only, root=root,
                     sort_file_max_size=self.__sort_file_max_size,
-                    writable_root=writ_root)
+                    writable_root=writ_root, index_workers=self.__index_workers,
+                    search_cache_size=self.__search_cache_size,
+                    compress_level=level, compress_probe=probe)
                 self.__rstores[pub] = rstore
                 return rstore
 
@@ -3316,6 +3544,55 @@ class Repository(object):
                 # Not found in any repository store.
                 raise RepositoryFileNotFoundError(fhash)
 
+        def file_attrs(self, fhash, pub=None):
+                """Returns a tuple of (csize, chashes) for the file specified
+                by the provided hash name; see _RepoStore.file_attrs().
+
+                'pub' is the prefix of the publisher to return the attributes
+                for.  If not specified, every repository store is tried.
+                """
+
+                if pub:
+                        rstore = self.get_pub_rstore(pub)
+                        return rstore.file_attrs(fhash)
+
+                for rstore in self.rstores:
+                        try:
+                                return rstore.file_attrs(fhash)
+                        except RepositoryFileNotFoundError:
+                                # Ignore and try next repository store.
+                                pass
+
+                # Not found in any repository store.
+                raise RepositoryFileNotFoundError(fhash)
+
+        def get_compression(self, pub=None):
+                """Returns a tuple of (level, probe) describing how the payloads
+                of the packages of the given publisher are compressed, as
+                described by misc.get_compress_level.
+
+                These are the 'level' and 'probe' properties of the
+                'compression_<pub>' section of the repository configuration if
+                it exists, or else its 'repository/compression-level' and
+                'repository/compression-probe' properties.
+
+                'pub' is the optional prefix of the publisher.
+                """
+
+                if self.version < 4:
+                        return misc.PKG_COMPRESS_LEVEL, False
+
+                if pub:
+                        sname = "compression_{0}".format(pub)
+                        try:
+                                return (self.cfg.get_property(sname, "level"),
+                                    self.cfg.get_property(sname, "probe"))
+                        except cfg.UnknownPropertyError:
+                                pass
+                return (self.cfg.get_property("repository",
+                    "compression-level"), self.cfg.get_property("repository",
+                    "compression-probe"))
+
         def get_catalog(self, pub=None):
                 """Return the catalog object for the given publisher.
 
@@ -4414,7 +4691,16 @@ class RepositoryConfig(object):
                     cfg.Property("trust-anchor-directory",
                         default="/etc/certs/CA/"),
                     cfg.PropList("signature-required-names"),
-                    cfg.PropBool("check-certificate-revocation", default=False)
+                    cfg.PropBool("check-certificate-revocation",
+                        default=False),
+                    cfg.PropInt("compression-level",
+                        default=misc.PKG_COMPRESS_LEVEL, minimum=0, maximum=9),
+                    cfg.PropBool("compression-probe", default=False),
+                ]),
+                cfg.PropertySectionTemplate("^compression_.*", properties=[
+                    cfg.PropInt("level", default=misc.PKG_COMPRESS_LEVEL,
+                        minimum=0, maximum=9),
+                    cfg.PropBool("probe", default=False),
                 ]),
             ],
         }
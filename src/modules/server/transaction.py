@@ -149,6 +149,9 @@ class Transaction(object):
                 self.types_found = set()
                 self.append_trans = False
                 self.remaining_payload_cnt = 0
+                # The compressed attributes of the files added to the
+                # transaction, indexed by file hash.
+                self.file_attrs = {}
 
         def get_basename(self):
                 assert self.open_time
@@ -538,7 +541,11 @@ class Transaction(object):
                                 dst_path = None
 
                         csize, chashes = misc.compute_compressed_attrs(
-                            fname, dst_path, data, size, self.dir)
+                            fname, dst_path, data, size, self.dir,
+                            compress_level=self.rstore.compress_level,
+                            compress_probe=self.rstore.compress_probe)
+                        if dst_path is None:
+                                self.file_attrs[fname] = (csize, chashes)
                         for attr in chashes:
                                 action.attrs[attr] = chashes[attr]
                         action.attrs["pkg.csize"] = csize
@@ -619,19 +626,25 @@ class Transaction(object):
 
                         if isinstance(f, six.string_types):
                                 portable.copyfile(f, dst_path)
-                                return
-
-                        bufsz = 128 * 1024
-                        if bufsz > size:
-                                bufsz = size
-
-                        with open(dst_path, "wb") as wf:
-                                while True:
-                                        data = f.read(bufsz)
-                                        # data is bytes
-                                        if data == b"":
-                                                break
-                                        wf.write(data)
+                        else:
+                                bufsz = 128 * 1024
+                                if bufsz > size:
+                                        bufsz = size
+
+                                with open(dst_path, "wb") as wf:
+                                        while True:
+                                                data = f.read(bufsz)
+                                                # data is bytes
+                                                if data == b"":
+                                                        break
+                                                wf.write(data)
+
+                        # The file has already been compressed by the
+                        # publisher, so this just hashes it again while it is
+                        # likely to still be cached.
+                        self.file_attrs[basename] = \
+                            misc.compute_compressed_attrs(basename,
+                            file_path=dst_path)
                         return
 
                 hashes, data = misc.get_data_digest(f, length=size,
@@ -656,10 +669,14 @@ class Transaction(object):
                                 raise
                         dst_path = None
 
-                misc.compute_compressed_attrs(fname, dst_path,
+                attrs = misc.compute_compressed_attrs(fname, dst_path,
                     data, size, self.dir,
                     chash_attrs=digest.DEFAULT_CHASH_ATTRS,
-                    chash_algs=digest.CHASH_ALGS)
+                    chash_algs=digest.CHASH_ALGS,
+                    compress_level=self.rstore.compress_level,
+                    compress_probe=self.rstore.compress_probe)
+                if dst_path is None:
+                        self.file_attrs[fname] = attrs
 
                 self.remaining_payload_cnt -= 1
 
@@ -799,6 +816,11 @@ class Transaction(object):
                                 continue
                         src_path = os.path.join(self.dir, f)
                         self.rstore.cache_store.insert(f, src_path)
+                        if f in self.file_attrs:
+                                # Save the repository from computing these
+                                # again when they are requested.
+                                self.rstore.set_file_attrs(f,
+                                    *self.file_attrs[f])
 
 # Vim hints
 # vim:ts=8:sw=8:et:fdm=marker
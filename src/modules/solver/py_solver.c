@@ -455,15 +455,24 @@ msat_add_clause(msat_solver *self, PyObject *args)
 	Py_RETURN_NONE;
 }
 
+/*
+ * Attempt to satisfy the current clauses given the (optional) list of
+ * assumed literals.  If no solution exists without assumptions, the clauses
+ * themselves are unsatisfiable and the solver must be reset.  If assumptions
+ * were given, they only hold for this attempt; the solver (including any
+ * clauses it learnt) remains usable for subsequent attempts, which allows
+ * callers to enable and retire sets of clauses by guarding them with an
+ * assumed literal instead of copying the solver.
+ */
 static PyObject *
 msat_solve(msat_solver *self, PyObject *args, PyObject *keywds)
 {
 	int *as;
 	int *as_top;
-	int n;
-	PyObject *assume;
+	int n = 0;
+	PyObject *assume = NULL;
 	lbool ret;
-	int limit;
+	int limit = 0;
 
 	static char *kwlist[] = {"assume", "limit", NULL};
 
@@ -474,13 +483,14 @@ msat_solve(msat_solver *self, PyObject *args, PyObject *keywds)
 	&assume, &limit))
 		return (NULL);
 
-	if ((as = msat_unpack_integers(assume, &n)) == NULL)
+	if (assume != NULL && (as = msat_unpack_integers(assume, &n)) == NULL)
 		return (NULL);
 
 	if (n > 0) {
 		as_top = &(as[n]);
 	} else {
-		dec_refcntptr(as);
+		if (assume != NULL)
+			dec_refcntptr(as);
 		as = NULL;
 		as_top = NULL;
 	}
@@ -493,7 +503,8 @@ msat_solve(msat_solver *self, PyObject *args, PyObject *keywds)
 	if (ret)
 		Py_RETURN_TRUE;
 	else {
-		self->msat_needs_reset = 1;
+		if (n == 0)
+			self->msat_needs_reset = 1;
 		Py_RETURN_FALSE;
 	}
 }
@@ -538,7 +549,8 @@ PyMethodDef msat_methods[] = {
 		"Add another clause (as list of integers) to solution space"},
 	{ "solve", (PyCFunction) msat_solve,
 		METH_VARARGS | METH_KEYWORDS,
-		"Attempt to satisfy current clauses and assumptions."},
+		"Attempt to satisfy current clauses and assumptions; a failure "
+		"only requires a reset if no assumptions were given."},
 	{ "dereference", (PyCFunction) msat_dereference,
 		METH_VARARGS,
 		"Retrieve literal value in solution, if available after solve "
@@ -1177,13 +1177,27 @@ bool   solver_solve(solver* s, lit* begin, lit* end)
     double  nof_conflicts = 100;
     double  nof_learnts   = solver_nclauses(s) / 3;
     lbool   status        = l_Undef;
-    lbool*  values        = s->assigns;
+    lbool*  values;
     lit*    i;
+    int     maxvar        = -1;
     
 #ifdef VERBOSEDEBUG
     printf("solve: "); printlits(begin, end); printf("\n");
 #endif
 
+    // Assumptions may refer to variables which do not appear in any clause
+    // yet.
+    for (i = begin; i < end; i++)
+        maxvar = lit_var(*i) > maxvar ? lit_var(*i) : maxvar;
+    if (maxvar >= 0)
+        solver_setnvars(s,maxvar+1);
+    values = s->assigns;
+
+    // Unit clauses added since the last call are still queued; they must
+    // be propagated before any assumptions are made.
+    if (begin != end && solver_propagate(s) != 0)
+        return false;
+
     for (i = begin; i < end; i++){
         switch (lit_sign(*i) ? -values[lit_var(*i)] : values[lit_var(*i)]){
         case 1: /* l_True: */
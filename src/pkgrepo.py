@@ -167,8 +167,8 @@ Subcommands:
      pkgrepo contents [-m] [-t action_type ...] -s repo_uri_or_path
          [--key ssl_key ... --cert ssl_cert ...] [pkg_fmri_pattern ...]
 
-     pkgrepo rebuild [-p publisher ...] -s repo_uri_or_path [--key ssl_key ...
-         --cert ssl_cert ...] [--no-catalog] [--no-index]
+     pkgrepo rebuild [-j jobs] [-p publisher ...] -s repo_uri_or_path
+         [--key ssl_key ... --cert ssl_cert ...] [--no-catalog] [--no-index]
 
      pkgrepo refresh [-p publisher ...] -s repo_uri_or_path [--key ssl_key ...
          --cert ssl_cert ...] [--no-catalog] [--no-index]
@@ -279,11 +279,15 @@ def subcmd_remove(conf, args):
         return EXIT_OK
 
 
-def get_repo(conf, allow_invalid=False, read_only=True, subcommand=None):
+def get_repo(conf, allow_invalid=False, read_only=True, subcommand=None,
+    index_workers=1):
         """Return the repository object for current program configuration.
 
         'allow_invalid' specifies whether potentially corrupt repositories are
-        allowed; should only be True if performing a rebuild operation."""
+        allowed; should only be True if performing a rebuild operation.
+
+        'index_workers' is the number of processes used to index packages
+        when search indexes are rebuilt."""
 
         repo_uri = conf["repo_uri"]
         if repo_uri.scheme != "file":
@@ -295,7 +299,7 @@ def get_repo(conf, allow_invalid=False, read_only=True, subcommand=None):
                 # Bad URI?
                 raise sr.RepositoryInvalidError(str(repo_uri))
         return sr.Repository(allow_invalid=allow_invalid, read_only=read_only,
-            root=path)
+            root=path, index_workers=index_workers)
 
 
 def setup_transport(repo_uri, subcommand=None, prefix=None, verbose=False,
@@ -1182,13 +1186,14 @@ were found in the repository."""))
         return rval
 
 
-def __rebuild_local(subcommand, conf, pubs, build_catalog, build_index):
+def __rebuild_local(subcommand, conf, pubs, build_catalog, build_index,
+    jobs):
         """In an attempt to allow operations on potentially corrupt
         repositories, 'local' repositories (filesystem-basd ones) are handled
         separately."""
 
         repo = get_repo(conf, allow_invalid=build_catalog, read_only=False,
-            subcommand=subcommand)
+            subcommand=subcommand, index_workers=jobs)
 
         rpubs = set(repo.publishers)
         if not pubs:
@@ -1245,12 +1250,21 @@ def subcmd_rebuild(conf, args):
         build_index = True
         key = None
         cert = None
+        jobs = None
 
-        opts, pargs = getopt.getopt(args, "p:s:", ["no-catalog", "no-index",
-            "key=", "cert="])
+        opts, pargs = getopt.getopt(args, "j:p:s:", ["no-catalog",
+            "no-index", "key=", "cert="])
         pubs = set()
         for opt, arg in opts:
-                if opt == "-p":
+                if opt == "-j":
+                        try:
+                                jobs = int(arg)
+                        except ValueError:
+                                jobs = 0
+                        if jobs < 1:
+                                usage(_("-j must be a positive integer"),
+                                    cmd=subcommand)
+                elif opt == "-p":
                         if not misc.valid_pub_prefix(arg):
                                 error(_("Invalid publisher prefix '{0}'").format(
                                     arg), cmd=subcommand)
@@ -1280,7 +1294,11 @@ def subcmd_rebuild(conf, args):
 
         if conf["repo_uri"].scheme == "file":
                 return __rebuild_local(subcommand, conf, pubs, build_catalog,
-                    build_index)
+                    build_index, jobs or 1)
+
+        if jobs is not None:
+                usage(_("-j can only be used with filesystem-based "
+                    "repositories."), cmd=subcommand)
 
         return __rebuild_remote(subcommand, conf, pubs, key, cert,
             build_catalog, build_index)
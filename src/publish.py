@@ -103,9 +103,10 @@ Usage:
 
 Packager subcommands:
         pkgsend generate [-T pattern] [-u] [--target file] source ...
-        pkgsend publish [-b bundle ...] [-d source ...] [-s repo_uri_or_path]
-            [-T pattern] [--key ssl_key ... --cert ssl_cert ...]
-            [--no-catalog] [manifest ...]
+        pkgsend publish [-b bundle ...] [-d source ...] [-j jobs]
+            [-s repo_uri_or_path] [-T pattern]
+            [--key ssl_key ... --cert ssl_cert ...] [--no-catalog]
+            [manifest ...]
 
 Options:
         --help or -?    display usage message
@@ -316,7 +317,7 @@ def trans_publish(repo_uri, fargs):
 
         # --no-index is now silently ignored as the publication process no
         # longer builds search indexes automatically.
-        opts, pargs = getopt.getopt(fargs, "b:d:s:T:", ["fmri-in-manifest",
+        opts, pargs = getopt.getopt(fargs, "b:d:j:s:T:", ["fmri-in-manifest",
             "no-index", "no-catalog", "key=", "cert="])
 
         add_to_catalog = True
@@ -325,11 +326,20 @@ def trans_publish(repo_uri, fargs):
         timestamp_files = []
         key = None
         cert = None
+        jobs = 1
         for opt, arg in opts:
                 if opt == "-b":
                         bundles.append(arg)
                 elif opt == "-d":
                         basedirs.append(arg)
+                elif opt == "-j":
+                        try:
+                                jobs = int(arg)
+                                if jobs < 1:
+                                        raise ValueError()
+                        except ValueError:
+                                usage(_("-j must be a positive integer."),
+                                    cmd="publish")
                 elif opt == "-s":
                         repo_uri = arg
                         if repo_uri and not repo_uri.startswith("null:"):
@@ -430,7 +440,11 @@ def trans_publish(repo_uri, fargs):
             for bundle in bundles
         ]
 
+        # Actions are queued so that the data of several of them can be
+        # processed at once; they are added in order.
+        queued = []
         for a in m.gen_actions():
+                path = None
                 # don't publish these actions
                 if a.name == "signature":
                         msg(_("WARNING: Omitting signature action '{0}'".format(
@@ -462,11 +476,13 @@ def trans_publish(repo_uri, fargs):
                                             os.stat(path).st_mtime)
                                         a.attrs["timestamp"] = ts
                                         break
-                try:
-                        t.add(a)
-                except:
-                        t.close(abandon=True)
-                        raise
+                queued.append((a, path))
+
+        try:
+                t.add_actions(queued, jobs=jobs)
+        except:
+                t.close(abandon=True)
+                raise
 
         pkg_state, pkg_fmri = t.close(abandon=False,
             add_to_catalog=add_to_catalog)
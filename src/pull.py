@@ -33,8 +33,10 @@ import gettext
 import locale
 import os
 import shutil
+import six
 import sys
 import tempfile
+import threading
 import traceback
 import warnings
 
@@ -58,6 +60,7 @@ import pkg.version as version
 from pkg.client import global_settings
 from pkg.misc import emsg, get_pkg_otw_size, msg, PipeError
 from pkg.client.debugvalues import DebugValues
+from six.moves import queue
 from six.moves.urllib.parse import quote
 
 # Globals
@@ -99,7 +102,7 @@ def usage(usage_error=None, retcode=2):
         msg(_("""\
 Usage:
         pkgrecv [-aknrv] [-s src_uri] [-d (path|dest_uri)] [-c cache_dir]
-            [-m match] [--mog-file file_path ...] [--raw]
+            [-j jobs] [-m match] [--mog-file file_path ...] [--raw]
             [--key src_key --cert src_cert]
             [--dkey dest_key --dcert dest_cert]
             (fmri|pattern) ...
@@ -126,6 +129,10 @@ Options:
 
         -h              Display this usage message.
 
+        -j jobs         The number of packages to process at once; the
+                        content of up to jobs - 1 packages is retrieved while
+                        a package is republished.  The default is 1.
+
         -k              Keep the retrieved package content compressed, ignored
                         when republishing.  Should not be used with pkgsend.
 
@@ -342,6 +349,174 @@ def add_hashes_to_multi(mfst, multi):
                         multi.add_action(a)
                         hashes.add(a.hash)
 
+def link_local_files(mfst, src_store, dst_store, multi, progtrack, methods,
+    linked):
+        """Places the files of the package described by the given manifest in
+        the FileManager 'dst_store' by linking them from the FileManager
+        'src_store' of a repository on the local system, and adds the hashes
+        of any that can't be placed that way to the multi object instead.
+
+        'methods' is a list of the names of the FileManager methods to place
+        files with, in order of preference.  A method is removed from the list
+        once the filesystem is found not to support it; if a method fails for
+        a single file (e.g. because of its link count, or because the user
+        isn't allowed to link to it), the next one is tried for that file.
+
+        The content of placed files isn't verified here; the path of each is
+        added to the dictionary 'linked', mapped to its action, so that any
+        found to be invalid by the verification of the target repository can
+        be removed and retrieved instead."""
+
+        def place(a, fhash):
+                spath = src_store.lookup(fhash)
+                if not spath:
+                        return False
+                for m in methods[:]:
+                        try:
+                                dpath = getattr(dst_store, m)(fhash, spath)
+                        except apx.PermissionsException:
+                                # For example, Linux doesn't allow users to
+                                # link to files they don't own if
+                                # fs.protected_hardlinks is set.
+                                continue
+                        except EnvironmentError as e:
+                                if e.errno in (errno.EMLINK, errno.EPERM,
+                                    errno.EACCES):
+                                        continue
+                                if e.errno not in (errno.EXDEV, errno.ENOTSUP,
+                                    errno.EOPNOTSUPP, errno.ENOSYS):
+                                        raise
+                                methods.remove(m)
+                                continue
+
+                        linked[dpath] = a
+                        return True
+                return False
+
+        hashes = set()
+        for a in mfst.gen_actions():
+                if not a.has_payload or a.hash in hashes:
+                        continue
+                hashes.add(a.hash)
+
+                nfiles = 1
+                nbytes = get_pkg_otw_size(a)
+                placed = place(a, a.hash)
+                if placed and a.name == "signature":
+                        for c in a.get_chain_certs(least_preferred=True):
+                                if not place(a, c):
+                                        placed = False
+                                        break
+                                nfiles += 1
+                                nbytes += int(a.get_chain_csize(c))
+                if placed:
+                        progtrack.download_add_progress(nfiles, nbytes,
+                            cachehit=True)
+                else:
+                        multi.add_action(a)
+
+def _rm_cached_files(mfst):
+        """Removes the cached copies of the files of the package described by
+        the given manifest."""
+
+        for cache in xport_cfg.get_caches(readonly=False):
+                for a in mfst.gen_actions():
+                        if a.has_payload:
+                                cache.remove(a.hash)
+                        if a.name == "signature":
+                                for fp in a.get_chain_certs(
+                                    least_preferred=True):
+                                        cache.remove(fp)
+
+class _SerialTracker(object):
+        """A wrapper for a progress tracker that allows it to be shared by
+        several threads by serializing calls to its methods."""
+
+        def __init__(self, tracker):
+                self.__tracker = tracker
+                self.__lock = threading.RLock()
+
+        def __getattr__(self, name):
+                attr = getattr(self.__tracker, name)
+                if not callable(attr):
+                        return attr
+
+                def serialized(*args, **kwargs):
+                        with self.__lock:
+                                return attr(*args, **kwargs)
+                return serialized
+
+def _gen_downloaded_pkgs(src_pub, pkgs, fmappings, decompress, rm_cached,
+    tracker, jobs):
+        """Retrieves the files of each package in 'pkgs' to its package
+        directory and yields its FMRI once they have been retrieved.  If
+        'rm_cached' is True, the cached copies of the files are removed once
+        they have been copied to the package directory.
+
+        If 'jobs' is greater than one, the files are retrieved by a separate
+        thread so that the caller may process each package while the files
+        for up to 'jobs' - 1 of the packages that follow it are retrieved.
+
+        The start of the republication of each package is reported to
+        'tracker' by the calling thread just before its FMRI is yielded; the
+        retrieval of the packages ahead is only reported as download
+        progress."""
+
+        def download(nf):
+                global download_start
+
+                mfile = xport.multi_file_ni(src_pub, xport_cfg.get_pkg_dir(nf),
+                    decompress, tracker)
+                add_hashes_to_multi(fmappings[nf], mfile)
+                if mfile:
+                        download_start = True
+                        mfile.wait_files()
+                if rm_cached:
+                        try:
+                                _rm_cached_files(fmappings[nf])
+                        except EnvironmentError as e:
+                                raise apx._convert_error(e)
+
+        if jobs < 2:
+                for nf in pkgs:
+                        tracker.republish_start_pkg(nf)
+                        download(nf)
+                        yield nf
+                return
+
+        done = queue.Queue()
+        # Each package is retrieved only once the number of packages retrieved
+        # but not yet processed by the caller is less than this limit.
+        ahead = threading.Semaphore(jobs - 1)
+        stop = threading.Event()
+
+        def run():
+                try:
+                        for nf in pkgs:
+                                ahead.acquire()
+                                if stop.is_set():
+                                        return
+                                download(nf)
+                                done.put((nf, None))
+                except:
+                        done.put((None, sys.exc_info()))
+
+        t = threading.Thread(target=run, name="pkgrecv-download")
+        t.daemon = True
+        t.start()
+        try:
+                for i in range(len(pkgs)):
+                        nf, exc_info = done.get()
+                        if exc_info:
+                                six.reraise(*exc_info)
+                        ahead.release()
+                        tracker.republish_start_pkg(nf)
+                        yield nf
+        finally:
+                stop.set()
+                ahead.release()
+                t.join()
+
 def prune(fmri_list, all_versions, all_timestamps):
         """Returns a filtered version of fmri_list based on the provided
         parameters."""
@@ -402,6 +577,7 @@ def main_func():
         all_timestamps = True
         all_versions = False
         dry_run = False
+        jobs = 1
         keep_compressed = False
         list_newest = False
         recursive = False
@@ -428,7 +604,7 @@ def main_func():
         src_uri = os.environ.get("PKG_SRC", None)
 
         try:
-                opts, pargs = getopt.getopt(sys.argv[1:], "ac:D:d:hkm:np:rs:v",
+                opts, pargs = getopt.getopt(sys.argv[1:], "ac:D:d:hj:km:np:rs:v",
                     ["cert=", "key=", "dcert=", "dkey=", "mog-file=", "newest",
                     "raw", "debug=", "clone"])
         except getopt.GetoptError as e:
@@ -457,6 +633,13 @@ def main_func():
                         DebugValues.set_value(key, value)
                 elif opt == "-h":
                         usage(retcode=0)
+                elif opt == "-j":
+                        try:
+                                jobs = int(arg)
+                        except ValueError:
+                                jobs = 0
+                        if jobs < 1:
+                                usage(_("-j must be a positive integer."))
                 elif opt == "-k":
                         keep_compressed = True
                 elif opt == "-m":
@@ -530,6 +713,9 @@ def main_func():
         if clone and pargs:
                 usage(_("--clone does not support FMRI patterns"))
 
+        if jobs > 1 and (clone or archive):
+                usage(_("-j can not be used with --clone or -a.\n"))
+
         if publishers and not clone:
                 usage(_("-p can only be used with --clone.\n"))
 
@@ -574,7 +760,7 @@ def main_func():
                 return archive_pkgs(*args)
 
         # Normal package transfer allows operations on a per-package basis.
-        return transfer_pkgs(*args)
+        return transfer_pkgs(*args, jobs=jobs)
 
 def check_processed(any_matched, any_unmatched, total_processed):
         # Reduce unmatched patterns to those that were unmatched for all
@@ -974,6 +1160,7 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
         deleted_pkgs = False
         old_c_root = {}
         del_search_index = set()
+        linked = {}
 
         # Turn target into a valid URI.
         target = publisher.RepositoryURI(misc.parse_uri(target))
@@ -991,6 +1178,21 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                 txt += _("To create a repository, use the pkgrepo command.")
                 abort(err=txt)
 
+        # If the source is a repository on the local system, the files of
+        # the packages to add are linked from it instead of being retrieved
+        # through the transport.  If that isn't possible, they're cloned
+        # instead (see portable.clonefile()), or else retrieved as usual.
+        src_repo = None
+        link_methods = ["link", "clone"]
+        if src_uri.startswith("file://"):
+                try:
+                        src_repo = sr.Repository(read_only=True,
+                            root=publisher.RepositoryURI(
+                            src_uri).get_pathname())
+                except sr.RepositoryError:
+                        # Most likely a package archive.
+                        pass
+
         def copy_catalog(src_cat_root, pub):
                 # Copy catalog files.
                 c_root = repo.get_pub_rstore(pub).catalog_root
@@ -1003,7 +1205,9 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                             prefix='catalog-')
                         shutil.rmtree(old_c_root)
                         shutil.move(c_root, old_c_root)
-                        shutil.copytree(src_cat_root, c_root)
+                        # The source catalog was retrieved to a temporary
+                        # directory, so it can be moved into place.
+                        shutil.move(src_cat_root, c_root)
                 except Exception as e:
                         abort(err=_("Unable to copy catalog files: {0}").format(
                             e))
@@ -1228,13 +1432,27 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
 
                 tracker.download_set_goal(len(to_add), get_files, get_bytes)
 
+                src_store = None
+                if src_repo:
+                        try:
+                                src_store = src_repo.get_pub_rstore(
+                                    src_pub.prefix).cache_store
+                        except sr.RepositoryError:
+                                pass
+                dst_store = repo.get_pub_rstore(src_pub.prefix).cache_store
+
                 # Retrieve package files.
                 for f, i in to_add:
                         tracker.download_start_pkg(f)
                         mfile = xport.multi_file_ni(src_pub, None,
                             progtrack=tracker)
                         m = get_manifest(f, xport_cfg)
-                        add_hashes_to_multi(m, mfile)
+                        if src_store and link_methods:
+                                link_local_files(m, src_store, dst_store,
+                                    mfile, tracker, link_methods,
+                                    linked.setdefault(src_pub, {}))
+                        else:
+                                add_hashes_to_multi(m, mfile)
 
                         if mfile:
                                 mfile.wait_files()
@@ -1253,9 +1471,7 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                 error(_("One or more packages could not be retrieved:\n\n{0}").
                     format("\n".join(str(im) for im in invalid_manifests)))
 
-        ret = 0
-        # Run pkgrepo verify to check repo.
-        if total_processed:
+        def verify_target():
                 msg(_("\n\nVerifying repository contents."))
                 cmd = os.path.join(os.path.dirname(misc.api_cmdpath()),
                     "pkgrepo")
@@ -1263,11 +1479,61 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                     target.get_pathname(), '--disable', 'dependency']
 
                 try:
-                        ret = subprocess.call(args)
+                        return subprocess.call(args)
                 except OSError as e:
                         raise RuntimeError("cannot execute {0}: {1}".format(
                             args, e))
 
+        ret = 0
+        # Run pkgrepo verify to check repo.
+        if total_processed:
+                ret = verify_target()
+
+        # Files linked from a local source repository aren't verified as
+        # they're placed.  If any of them were found to be invalid, remove
+        # them and retrieve them through the transport instead (which
+        # verifies their content), then verify the repository again.
+        if ret and linked:
+                vtracker = progress.NullProgressTracker()
+                refetch = False
+                for src_pub, paths in linked.items():
+                        bad = set()
+                        try:
+                                for err, path, m, details in repo.verify(
+                                    pubs=[repo.get_publisher(src_pub.prefix)],
+                                    progtrack=vtracker):
+                                        if path in paths:
+                                                bad.add(path)
+                        except sr.RepositoryError:
+                                # Already reported by pkgrepo verify.
+                                bad = set()
+                        if not bad:
+                                continue
+
+                        refetch = True
+                        for path in bad:
+                                os.remove(path)
+                        xport_cfg.clear_caches(shared=True)
+                        xport_cfg.add_cache(
+                            repo.get_pub_rstore(src_pub.prefix).file_root,
+                            readonly=False)
+                        mfile = xport.multi_file_ni(src_pub, None,
+                            progtrack=vtracker)
+                        hashes = set()
+                        for path in bad:
+                                a = paths[path]
+                                if a.hash not in hashes:
+                                        mfile.add_action(a)
+                                        hashes.add(a.hash)
+                        try:
+                                mfile.wait_files()
+                        except apx.TransportError as e:
+                                error(str(e))
+                                refetch = False
+                                break
+                if refetch:
+                        ret = verify_target()
+
         # Cleanup. If verification was ok, remove backup copy of old catalog.
         # If not, move old catalog back into place and remove messed up catalog.
         for pub in modified_pubs:
@@ -1313,9 +1579,10 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
 
 def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
     keep_compressed, raw, recursive, dry_run, verbose, dest_xport_cfg, src_uri,
-    dkey, dcert, mog_files):
+    dkey, dcert, mog_files, jobs=1):
         """Retrieve source package data and optionally republish it as each
-        package is retrieved.
+        package is retrieved.  If 'jobs' is greater than one, the data for up
+        to 'jobs' - 1 packages is retrieved while each package is republished.
         """
 
         global cache_dir, download_start, xport, xport_cfg, dest_xport, targ_pub
@@ -1428,6 +1695,18 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                         msg(_("Retrieving and evaluating {0:d} package(s)...").format(
                             npkgs))
 
+                # Retrieve the manifests not already stored in bulk, rather
+                # than requesting each in turn below.  Any that can't be
+                # prefetched will be retrieved individually.  Progress is
+                # reported as each manifest is evaluated below instead.
+                ptracker = progress.NullProgressTracker()
+                ptracker.set_major_phase(ptracker.PHASE_UTILITY)
+                xport.prefetch_manifests([
+                    (f, None)
+                    for f in matches
+                    if not os.path.exists(xport_cfg.get_pkg_pathname(f))
+                ], progtrack=ptracker)
+
                 tracker.manifest_fetch_start(npkgs)
 
                 pkgs_to_get = []
@@ -1580,17 +1859,21 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                         # compressed in the source.
                         keep_compressed, hashes = dest_xport.get_transfer_info(
                             new_targ_pubs[pkgs_to_get[0].publisher])
-                for nf in pkgs_to_get:
-                        tracker.republish_start_pkg(nf)
+
+                if jobs > 1:
+                        # The tracker is shared with the thread retrieving
+                        # package content.
+                        tracker = _SerialTracker(tracker)
+                # If cache_dir is listed in tmpdirs, then it's safe to dump
+                # cache contents once they've been retrieved.  Otherwise, it's a
+                # user cache directory and shouldn't be dumped.
+                downloaded = _gen_downloaded_pkgs(src_pub, pkgs_to_get,
+                    fmappings, not keep_compressed,
+                    republish and cache_dir in tmpdirs, tracker, jobs)
+                for nf in downloaded:
                         # Processing republish.
                         nm = fmappings[nf]
                         pkgdir = xport_cfg.get_pkg_dir(nf)
-                        mfile = xport.multi_file_ni(src_pub, pkgdir,
-                            not keep_compressed, tracker)
-                        add_hashes_to_multi(nm, mfile)
-                        if mfile:
-                                download_start = True
-                                mfile.wait_files()
 
                         if not republish:
                                 # Nothing more to do for this package.
@@ -1673,23 +1956,17 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                                 # Always defer catalog update.
                                 t.close(add_to_catalog=False)
                         except trans.TransactionError as e:
+                                downloaded.close()
                                 abort(err=e)
 
-                        # Dump data retrieved so far after each successful
-                        # republish to conserve space.
+                        # Dump data retrieved for this package after each
+                        # successful republish to conserve space.  Data
+                        # retrieved for the packages that follow it is kept.
                         try:
-                                shutil.rmtree(dest_xport_cfg.incoming_root)
                                 shutil.rmtree(pkgdir)
-                                if cache_dir in tmpdirs:
-                                        # If cache_dir is listed in tmpdirs,
-                                        # then it's safe to dump cache contents.
-                                        # Otherwise, it's a user cache directory
-                                        # and shouldn't be dumped.
-                                        shutil.rmtree(cache_dir)
-                                        misc.makedirs(cache_dir)
                         except EnvironmentError as e:
+                                downloaded.close()
                                 raise apx._convert_error(e)
-                        misc.makedirs(dest_xport_cfg.incoming_root)
 
                         processed += 1
                         tracker.republish_end_pkg(nf)
@@ -36,8 +36,11 @@ import time
 import unittest
 
 import pkg.client.api as api
+import pkg.client.api_errors as api_errors
 import pkg.client.publisher as publisher
 
+from pkg.client import global_settings
+
 LIST_ALL = api.ImageInterface.LIST_ALL
 
 class TestApiRefresh(pkg5unittest.ManyDepotTestCase):
@@ -211,6 +214,96 @@ class TestApiRefresh(pkg5unittest.ManyDepotTestCase):
                 self.assertEqual(ts1, ts2)
 
 
+class TestApiConcurrentRefresh(pkg5unittest.ManyDepotTestCase):
+
+        # restart depos for every test.
+        persistent_setup = False
+
+        pubs = [
+            "test1",
+            "test2",
+            "test3",
+        ]
+
+        def setUp(self):
+                pkg5unittest.ManyDepotTestCase.setUp(self, self.pubs,
+                    start_depots=True, image_count=2)
+
+                self.durl = []
+                self.rurl = []
+                for i, pub in enumerate(self.pubs):
+                        self.durl.append(self.dcs[i + 1].get_depot_url())
+                        self.rurl.append(self.dcs[i + 1].get_repo_url())
+                        self.pkgsend_bulk(self.rurl[i], """
+                            open foo{0:d}@1.0,5.11-0
+                            close""".format(i))
+
+        def __get_pkg_names(self, api_obj):
+                return sorted(
+                    "{0}/{1}".format(pfmri[0], pfmri[1])
+                    for pfmri, summ, cats, states, attrs in
+                    api_obj.get_pkg_list(LIST_ALL)
+                )
+
+        def test_concurrent_refresh(self):
+                """Verify that refreshing several publishers at once yields
+                the same catalog data as refreshing them one at a time, and
+                that publishers whose origin is unreachable are still
+                handled as before."""
+
+                api_obj = self.image_create(self.durl[0], prefix=self.pubs[0])
+                for i in (1, 2):
+                        repo = publisher.Repository(origins=[self.durl[i]])
+                        api_obj.add_publisher(publisher.Publisher(self.pubs[i],
+                            repository=repo))
+
+                expected = ["test1/foo0", "test2/foo1", "test3/foo2"]
+                api_obj.refresh(full_refresh=True)
+                self.assertEqual(self.__get_pkg_names(api_obj), expected)
+
+                # Publish new packages and verify that an incremental
+                # refresh finds all of them.
+                for i, pub in enumerate(self.pubs):
+                        self.pkgsend_bulk(self.rurl[i], """
+                            open bar{0:d}@1.0,5.11-0
+                            close""".format(i))
+                expected = sorted(expected +
+                    ["test1/bar0", "test2/bar1", "test3/bar2"])
+                api_obj.refresh(immediate=True)
+                self.assertEqual(self.__get_pkg_names(api_obj), expected)
+
+                # Compare against a serial refresh of another image.
+                global_settings.client_concurrent_refresh = False
+                try:
+                        self.set_image(1)
+                        api_obj2 = self.image_create(self.durl[0],
+                            prefix=self.pubs[0])
+                        for i in (1, 2):
+                                repo = publisher.Repository(
+                                    origins=[self.durl[i]])
+                                api_obj2.add_publisher(publisher.Publisher(
+                                    self.pubs[i], repository=repo))
+                        api_obj2.refresh(full_refresh=True)
+                        self.assertEqual(self.__get_pkg_names(api_obj2),
+                            expected)
+                finally:
+                        global_settings.client_concurrent_refresh = True
+                        self.set_image(0)
+
+                # Make one of the origins unreachable; the remaining
+                # publishers should still be refreshed.
+                self.dcs[2].stop()
+                self.pkgsend_bulk(self.rurl[2], """
+                    open baz2@1.0,5.11-0
+                    close""")
+                api_obj.refresh(immediate=True)
+                self.assertEqual(self.__get_pkg_names(api_obj),
+                    sorted(expected + ["test3/baz2"]))
+
+                self.assertRaises(api_errors.CatalogRefreshException,
+                    api_obj.refresh, immediate=True, ignore_unreachable=False)
+
+
 if __name__ == "__main__":
         unittest.main()
 
@@ -45,6 +45,7 @@ import pkg.fmri as fmri
 import pkg.indexer as indexer
 import pkg.portable as portable
 import pkg.search_storage as ss
+from pkg.choose import choose
 from pkg.misc import force_str
 
 
@@ -1974,6 +1975,112 @@ class TestApiSearchBasicsP(TestApiSearchBasics):
                 self.assertEqual(new_tok_len, tok_len + 1)
                 self.assertEqual(new_main_len, main_len + 1)
 
+        def test_token_index(self):
+                """Checks that the token index is written when the index is
+                updated, that it's added to an index which lacks it, and that
+                search gives the same results with and without it."""
+
+                durl = self.dc.get_depot_url()
+                ind_dir = self._get_repo_index_dir()
+                ti_file = os.path.join(ind_dir, ss.TOKEN_INDEX_FILE)
+
+                self.pkgsend_bulk(durl, self.example_pkg10)
+                self.assertTrue(os.path.exists(ti_file))
+                api_obj = self.image_create(durl)
+                self._run_remote_tests(api_obj)
+
+                # An index which predates the token index is searched using
+                # the token byte offset file.
+                portable.remove(ti_file)
+                self._run_remote_tests(api_obj)
+
+                # The token index is added the next time the index is
+                # refreshed, and any in an older format is removed.
+                for name in ss.OLD_TOKEN_INDEX_FILES:
+                        open(os.path.join(ind_dir, name), "wb").close()
+                repo = self.dc.get_repo()
+                repo.refresh_index()
+                self.assertTrue(os.path.exists(ti_file))
+                for name in ss.OLD_TOKEN_INDEX_FILES:
+                        self.assertFalse(os.path.exists(os.path.join(ind_dir,
+                            name)))
+                self._run_remote_tests(api_obj)
+
+                # The same holds for the image's index; the token index is
+                # added by the next update of the index.
+                self._api_install(api_obj, ["example_pkg"])
+                index_dir, index_dir_tmp = self._get_index_dirs()
+                ti_file = os.path.join(index_dir, ss.TOKEN_INDEX_FILE)
+                self.assertTrue(os.path.exists(ti_file))
+                self._run_local_tests(api_obj)
+
+                portable.remove(ti_file)
+                api_obj.reset()
+                self._run_local_tests(api_obj)
+
+                self._api_uninstall(api_obj, ["example_pkg"])
+                self.assertTrue(os.path.exists(ti_file))
+                self._run_local_empty_tests(api_obj)
+
+        def test_token_index_glob(self):
+                """Checks that the glob searches of the token index, which are
+                narrowed using the trigrams of the indexed tokens, match the
+                same tokens as a scan of every token."""
+
+                toks = sorted([
+                    "usr/lib/libc.so.1", "usr/lib/libm.so.1", "usr/bin/cat",
+                    "Foo.Bar", "foobar", "FOOBAZ", "tok[1]", "a?b", "ab",
+                    u"caf\u00e9", u"CAF\u00c9", u"na\u00efve/libc.so.1",
+                    u"Stra\u00dfe", "STRASSE",
+                ])
+                ind_dir = os.path.join(self.test_root, "token_index")
+                os.makedirs(ind_dir)
+                ti = ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+                ti.open_out_file(ind_dir, 1)
+                for i, tok in enumerate(toks):
+                        ti.write_entity(tok, i, [])
+                ti.write_dict_file(ind_dir, 1)
+                ti.close_file_handle()
+
+                ti = ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+                ss.consistent_open([ti], ind_dir)
+                ti.read_dict_file()
+                ti.close_file_handle()
+                for pat in ("*lib*", "*libc*", "*LIBC*", "*.so.1",
+                    "*[cm].so.1", "*[!c].so.1", "*oo[bB]a*", "*oob[", "[",
+                    "*[lib", "*ok[1]*", "*ok[[]1]*", "*?b", "*caf*",
+                    u"*af\u00e9*", u"*AF\u00c9*", u"*\u00efve*",
+                    u"*ra\u00dfe", "*RASSE", "*bar", "*BAR", "f*bar",
+                    "us*lib*so*"):
+                        for cs in (True, False):
+                                self.assertEqual(
+                                    sorted(choose(toks, pat, cs)),
+                                    sorted(ti.get_token(i)
+                                    for i in ti.find_glob(pat, cs)))
+
+        def test_parallel_rebuild(self):
+                """Checks that search indexes rebuilt using several processes
+                give the same results as those built using one."""
+
+                durl = self.dc.get_depot_url()
+                repo_path = self.dc.get_repodir()
+                self.pkgsend_bulk(durl, self.example_pkg10)
+                self.pkgsend_bulk(durl, self.another_pkg10)
+                self.pkgsend_bulk(durl, self.fat_pkg10)
+                api_obj = self.image_create(durl)
+                self._run_remote_tests(api_obj)
+
+                self.pkgrepo("rebuild --no-catalog -j 3 -s {0}".format(
+                    repo_path))
+                self._run_remote_tests(api_obj)
+
+                # The number of processes must be positive, and can't be
+                # given for network repositories.
+                self.pkgrepo("rebuild --no-catalog -j 0 -s {0}".format(
+                    repo_path), exit=2)
+                self.pkgrepo("rebuild --no-catalog -j 3 -s {0}".format(durl),
+                    exit=2)
+
         def test_bug_983(self):
                 """Test for known bug 983."""
                 durl = self.dc.get_depot_url()
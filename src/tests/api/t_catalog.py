@@ -1119,6 +1119,127 @@ class TestCatalog(pkg5unittest.Pkg5TestCase):
                         self.assertFalse(fname.startswith("catalog.") or \
                             fname.startswith("update."))
 
+        def test_11_binary(self):
+                """Verify that catalogs using binary sidecars return the same
+                results as the JSON catalog parts, that entries can still be
+                updated, and that stale sidecars are ignored."""
+
+                cpath = self.create_test_dir("test-11")
+                self.c.meta_root = cpath
+                self.c.save()
+
+                # Write the same catalog again, this time with sidecars.
+                bpath = self.create_test_dir("test-11-bin")
+                nc = catalog.Catalog(meta_root=bpath, binary=True, sign=False)
+                nc.append(self.c)
+                nc.finalize()
+                nc.save()
+                self.assertTrue(os.path.exists(os.path.join(bpath,
+                    "catalog.base.C.bin")))
+
+                jc = catalog.Catalog(meta_root=cpath)
+                bc = catalog.Catalog(meta_root=bpath, binary=True)
+                for args in ({}, { "last": True }, { "ordered": True },
+                    { "ordered": True, "pubs": ["extra", "opensolaris.org"] },
+                    { "pubs": ["extra"] }):
+                        self.assertEqual(
+                            sorted(bc.fmris(objects=False, **args)),
+                            sorted(jc.fmris(objects=False, **args)))
+                        if args.get("ordered"):
+                                self.assertEqual(list(bc.tuples(**args)),
+                                    list(jc.tuples(**args)))
+
+                # Retrieving entries shouldn't require the part to be loaded.
+                base = bc.get_part("catalog.base.C", must_exist=True)
+                for f in jc.fmris():
+                        self.assertEqual(bc.get_entry(f), jc.get_entry(f))
+                self.assertEqual(bc.get_entry(fmri.PkgFmri(
+                    "pkg://extra/nosuchpkg@1.0")), None)
+
+                # Neither should any of the other per-stem or summary
+                # operations.
+                for name in ("apkg", "test", "zpkg", "nosuchpkg"):
+                        self.assertEqual(list(bc.entries_by_version(name)),
+                            list(jc.entries_by_version(name)))
+                        self.assertEqual(list(bc.fmris_by_version(name)),
+                            list(jc.fmris_by_version(name)))
+                self.assertEqual(bc.names(), jc.names())
+                self.assertEqual(list(bc.pkg_names()), list(jc.pkg_names()))
+                self.assertEqual(list(bc.pkg_names(pubs=["extra"])),
+                    list(jc.pkg_names(pubs=["extra"])))
+                self.assertEqual(sorted(bc.publishers()),
+                    sorted(jc.publishers()))
+                self.assertEqual(sorted(bc.get_package_counts_by_pub()),
+                    sorted(jc.get_package_counts_by_pub()))
+                self.assertEqual(base.get_package_counts(),
+                    (jc.package_count, jc.package_version_count))
+                self.assertFalse(base.loaded)
+
+                # Entries updated in-place must be retained when saved.
+                f = fmri.PkgFmri("pkg://opensolaris.org/"
+                    "test@1.0,5.11-1:20000101T120000Z")
+                bc.update_entry({ "states": [1] }, pfmri=f)
+                self.assertEqual(list(bc.fmris()), list(jc.fmris()))
+                bc.save()
+
+                bc = catalog.Catalog(meta_root=bpath, binary=True)
+                self.assertEqual(bc.get_entry(f)["metadata"], { "states": [1] })
+                self.assertEqual(list(bc.fmris()), list(jc.fmris()))
+
+                # A sidecar that doesn't match its JSON part must be ignored.
+                bc.update_entry(None, pfmri=f)
+                base = bc.get_part("catalog.base.C", must_exist=True)
+                base.binary = False
+                bc.save()
+                bc = catalog.Catalog(meta_root=bpath, binary=True)
+                self.assertTrue("metadata" not in bc.get_entry(f))
+                self.assertTrue(bc.get_part("catalog.base.C").loaded)
+
+                # Verify destroy removes the sidecars.
+                bc.destroy()
+                self.assertFalse(os.path.exists(os.path.join(bpath,
+                    "catalog.base.C.bin")))
+
+        def test_12_validated_save(self):
+                """Verify that catalog parts stored pending validation only
+                replace the existing part if their signatures match."""
+
+                cpath = self.create_test_dir("test-12")
+                c = catalog.Catalog(meta_root=cpath)
+                c.add_package(fmri.PkgFmri("pkg://opensolaris.org/"
+                    "test@1.0,5.11-1:20000101T120000Z"))
+                c.save()
+
+                base = c.get_part("catalog.base.C", must_exist=True)
+                with open(base.pathname, "rb") as f:
+                        old_data = f.read()
+                old_sigs = base.signatures
+
+                base.add(fmri.PkgFmri("pkg://opensolaris.org/"
+                    "test@2.0,5.11-1:20000101T120000Z"))
+                self.assertRaises(api_errors.BadCatalogSignatures, base.save,
+                    signatures=old_sigs)
+                self.assertFalse(os.path.exists(base.pending_pathname))
+                with open(base.pathname, "rb") as f:
+                        self.assertEqual(f.read(), old_data)
+
+                # Generate the expected signatures using a copy of the part.
+                nc = catalog.Catalog(meta_root=self.create_test_dir("test-12a"))
+                for f in base.fmris():
+                        nc.add_package(f)
+                nc.save()
+                new_sigs = nc.get_part("catalog.base.C").signatures
+                self.assertNotEqual(new_sigs, old_sigs)
+                base.save(signatures=new_sigs)
+                with open(base.pathname, "rb") as f:
+                        self.assertEqual(f.read(), old_data)
+
+                base.commit()
+                self.assertFalse(os.path.exists(base.pending_pathname))
+                base = catalog.CatalogPart("catalog.base.C", meta_root=cpath)
+                base.validate(signatures=new_sigs)
+                self.assertEqual(len(list(base.fmris())), 2)
+
         def test_legacy_description(self):
                 """Test that gen_packages does not traceback when a package
                 uses the legacy style of declaring package description metadata."""
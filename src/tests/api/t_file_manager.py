@@ -332,6 +332,52 @@ class TestFileManager(pkg5unittest.Pkg5TestCase):
                             "new-{0}".format(fhash)))
                         f.close()
 
+        def test_4_link_clone(self):
+                """Verify that link and clone place a file without removing
+                its source, and leave an existing file in place."""
+
+                hash1 = "584b6ab7d7eb446938a02e57101c3a2fecbfb3cb"
+                hash2 = "994b6ab7d7eb446938a02e57101c3a2fecbfb3cc"
+                hash3 = "cc1f76cdad188714d1c3b92a4eebb4ec7d646166"
+
+                src = os.path.join(self.test_root, "src")
+                with open(src, "wb") as f:
+                        f.write(b"content")
+                os.chmod(src, 0o444)
+
+                fm = file_manager.FileManager(self.base_dir, False)
+                p = fm.link(hash1, src)
+                self.assertEqual(p, fm.lookup(hash1))
+                self.assertTrue(os.path.samefile(p, src))
+
+                try:
+                        p = fm.clone(hash2, src)
+                except EnvironmentError:
+                        # Neither a reflink nor an in-kernel copy is possible
+                        # here; nothing must be left behind.
+                        self.assertEqual(list(fm.walk()), [hash1])
+                else:
+                        self.assertEqual(p, fm.lookup(hash2))
+                        self.assertFalse(os.path.samefile(p, src))
+                        with open(p, "rb") as f:
+                                self.assertEqual(f.read(), b"content")
+                        self.assertEqual(os.stat(p).st_mode & 0o777, 0o444)
+                self.assertTrue(os.path.isfile(src))
+
+                # Existing files are left alone.
+                other = os.path.join(self.test_root, "other")
+                with open(other, "wb") as f:
+                        f.write(b"other")
+                self.assertEqual(fm.link(hash1, other), fm.lookup(hash1))
+                with open(fm.lookup(hash1), "rb") as f:
+                        self.assertEqual(f.read(), b"content")
+                self.assertTrue(os.path.isfile(other))
+
+                fm = file_manager.FileManager(self.base_dir, True)
+                self.check_exception(fm.link,
+                    file_manager.NeedToModifyReadOnlyFileManager,
+                    ["create", hash3], hash3, other)
+
 if __name__ == "__main__":
         unittest.main()
 
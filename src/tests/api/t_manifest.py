@@ -459,6 +459,76 @@ dir owner=root path=fm group=bin mode=0755 facet.multi=true \\
                 m1.exclude_content([v.allow_action, lambda x, publisher: True])
                 self.assertEqual(len(list(m1.gen_actions_by_type("dir"))), 1)
 
+        def test_action_cache(self):
+                """Verify that the actions parsed from the cache files of a
+                factored manifest are reused, and that changes to the actions
+                or the files are not."""
+
+                contents = """\
+                    set name=pkg.fmri value=pkg:/bar@1
+                    file 1234 path=a owner=root group=bin mode=0644 alias=x alias=y
+                    file 5678 path=b owner=root group=bin mode=0644
+                """
+                cache = manifest.FactoredManifest.action_cache
+                cache.clear()
+                manifest.FactoredManifest("bar@1", self.cache_dir,
+                    contents=contents)
+
+                def gen_files():
+                        m = manifest.FactoredManifest("bar@1", self.cache_dir)
+                        return list(m.gen_actions_by_type("file"))
+
+                acts = gen_files()
+                self.assertEqual((cache.hits, cache.misses), (0, 1))
+                self.assertEqual([str(a) for a in acts], [
+                    "file 1234 alias=x alias=y group=bin mode=0644 owner=root "
+                    "path=a",
+                    "file 5678 group=bin mode=0644 owner=root path=b",
+                ])
+                cpath = os.path.join(self.cache_dir, "manifest.file")
+                self.assertTrue(os.path.exists(cpath + ".bin"))
+
+                # The actions are new each time.
+                acts[0].attrs["alias"].append("z")
+                acts[0].attrs["mode"] = "0600"
+                acts[0].hash = "4321"
+                self.assertEqual([str(a) for a in gen_files()], [
+                    "file 1234 alias=x alias=y group=bin mode=0644 owner=root "
+                    "path=a",
+                    "file 5678 group=bin mode=0644 owner=root path=b",
+                ])
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+                self.assertTrue("50.0% hit ratio" in str(cache))
+
+                # The binary form of the file is used if the actions aren't
+                # cached...
+                cache.clear()
+                self.assertEqual(len(gen_files()), 2)
+                self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+                # ...but neither is used once the file has changed.
+                with open(cpath, "w") as f:
+                        f.write("file 9999 group=bin mode=0644 owner=root "
+                            "path=c\n")
+                self.assertEqual([str(a) for a in gen_files()],
+                    ["file 9999 group=bin mode=0644 owner=root path=c"])
+                cache.clear()
+                self.assertEqual([str(a) for a in gen_files()],
+                    ["file 9999 group=bin mode=0644 owner=root path=c"])
+
+                # The least recently used entries are dropped once the cache
+                # is full.
+                small = manifest.ActionCache(4)
+                small.add("a", [1])
+                small.add("b", [2])
+                self.assertEqual(small.get("a"), [1])
+                small.add("c", [])
+                self.assertEqual(small.get("b"), None)
+                self.assertEqual(small.get("a"), [1])
+                self.assertEqual(small.get("c"), [])
+                small.add("d", [1, 2, 3, 4])
+                self.assertEqual(small.get("a"), [1])
+
         def test_store_to_disk(self):
                 """Verfies that a FactoredManifest gets force-loaded before it
                 gets stored to disk."""
@@ -30,6 +30,7 @@ if __name__ == "__main__":
 import pkg5unittest
 
 import ctypes
+import gzip
 import os
 import shutil
 import stat
@@ -38,9 +39,11 @@ import sys
 import tempfile
 import unittest
 
+import pkg.digest as digest
 import pkg.misc as misc
 import pkg.actions as action
 from pkg.actions.generic import Action
+from pkg.pkggzip import PkgGzipFile
 
 class TestMisc(pkg5unittest.Pkg5TestCase):
 
@@ -88,6 +91,82 @@ class TestMisc(pkg5unittest.Pkg5TestCase):
                 self.assertTrue(misc.valid_pub_url(
                     "http://pkg.opensolaris.org/dev"))
 
+        def test_compute_data_attrs(self):
+                """Verify that compute_data_attrs computes the same hashes and
+                compressed data as get_data_digest and
+                compute_compressed_attrs."""
+
+                data = os.urandom(300000) + b"\0" * 300000
+                path = os.path.join(self.test_root, "data")
+                with open(path, "wb") as f:
+                        f.write(data)
+                hash_attrs = digest.DEFAULT_HASH_ATTRS + [
+                    "{0}:{1}".format(digest.EXTRACT_FILE, digest.PREFERRED_HASH)
+                ]
+
+                ehashes, dummy = misc.get_data_digest(path, length=len(data),
+                    hash_attrs=hash_attrs, hash_algs=digest.HASH_ALGS)
+                ecsize, echashes = misc.compute_compressed_attrs("expected",
+                    data=open(path, "rb"), size=len(data),
+                    compress_dir=self.test_root)
+
+                blocks = []
+                cpath = os.path.join(self.test_root, "actual")
+                hashes, csize, chashes = misc.compute_data_attrs(
+                    open(path, "rb"), len(data), hash_attrs, digest.HASH_ALGS,
+                    compress_path=cpath, tee=blocks.append)
+                self.assertEqual(hashes, ehashes)
+                self.assertEqual(csize, ecsize)
+                self.assertEqual(chashes, echashes)
+                self.assertEqual(b"".join(blocks), data)
+                with open(cpath, "rb") as f:
+                        self.assertEqual(len(f.read()), int(csize))
+
+                # Without a path, the compressed data is discarded.
+                self.assertEqual(misc.compute_data_attrs(open(path, "rb"),
+                    len(data), hash_attrs, digest.HASH_ALGS),
+                    (hashes, csize, chashes))
+
+        def test_compress_level(self):
+                """Verify that payloads are compressed at the level given, that
+                a payload which barely compresses is stored without being
+                compressed if its compression is probed, and that the result
+                is a gzip file either way."""
+
+                text = b"compressible " * 20000
+                noise = os.urandom(len(text))
+                self.assertEqual(misc.get_compress_level(text, 6, True), 6)
+                self.assertEqual(misc.get_compress_level(noise, 6, True), 0)
+                self.assertEqual(misc.get_compress_level(noise, 6, False), 6)
+
+                for data, level, probe, stored in ((text, 9, True, False),
+                    (text, 0, False, True), (noise, 9, True, True),
+                    (noise, 1, False, False)):
+                        path = os.path.join(self.test_root, "compressed")
+                        csize, chashes = misc.compute_compressed_attrs(
+                            "compressed", data=data, size=len(data),
+                            compress_dir=self.test_root, compress_level=level,
+                            compress_probe=probe)
+                        self.assertEqual(csize, str(os.stat(path).st_size))
+                        self.assertTrue(
+                            PkgGzipFile.test_is_pkggzipfile(path))
+                        with gzip.open(path) as f:
+                                self.assertEqual(f.read(), data)
+                        if stored:
+                                self.assertTrue(int(csize) > len(data))
+                        elif data is text:
+                                self.assertTrue(int(csize) < len(data) // 10)
+
+                        # The data is compressed the same way when it's read
+                        # from a file.
+                        with open(path, "wb") as f:
+                                f.write(data)
+                        hashes, dcsize, dchashes = misc.compute_data_attrs(
+                            open(path, "rb"), len(data), ["hash"],
+                            digest.HASH_ALGS, compress_level=level,
+                            compress_probe=probe)
+                        self.assertEqual((dcsize, dchashes), (csize, chashes))
+
         def test_out_of_memory(self):
                 """Verify that misc.out_of_memory doesn't raise an exception
                 and displays the amount of memory that was in use."""
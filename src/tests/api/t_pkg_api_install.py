@@ -34,15 +34,19 @@ import time
 import sys
 import unittest
 import pkg.client.api_errors as api_errors
+import pkg.client.image as image
 import pkg.client.progress as progress
 import pkg.client.publisher as publisher
 import pkg.fmri as fmri
+import pkg.json as json
 import pkg.manifest as manifest
 import pkg.misc as misc
 import pkg.portable as portable
 import stat
 import shutil
+import struct
 
+from pkg.client import global_settings
 from pkg.client.debugvalues import DebugValues
 from six.moves.urllib.parse import urlunparse
 from six.moves.urllib.request import pathname2url
@@ -1153,6 +1157,393 @@ class TestPkgApiInstall(pkg5unittest.SingleDepotTestCase):
                 assert not os.path.exists(mdir), \
                     "manifest directory '{0}' exists!".format(mdir)
 
+        def test_solver_cache(self):
+                """Verify that the solver cache is created and used by
+                subsequent operations as expected."""
+
+                bar10 = """
+                    open bar@1.0,5.11-0
+                    add depend type=require fmri=pkg:/foo@1.0
+                    close """
+                foo11 = """
+                    open foo@1.1,5.11-0
+                    close """
+
+                self.pkgsend_bulk(self.rurl, (self.foo10, bar10))
+                api_obj = self.image_create(self.rurl)
+                cpath = os.path.join(api_obj.img.imgdir, "cache",
+                    "solver.cache")
+
+                def plan_install(pkgs):
+                        api_obj.reset()
+                        for pd in api_obj.gen_plan_install(pkgs):
+                                continue
+                        return set(
+                            str(dest.get_pkg_stem(anarchy=True))
+                            for src, dest in api_obj.describe().plan_desc
+                        )
+
+                def read_cache():
+                        with open(cpath, "r") as f:
+                                lines = f.readlines()
+                        return json.loads(lines[0]), dict(
+                            json.loads(l) for l in lines[1:])
+
+                # Planning an operation should cache the data for the
+                # packages evaluated by the solver.
+                self.assertEqual(plan_install(["bar"]),
+                    set(["pkg:/foo", "pkg:/bar"]))
+                self.assertTrue(os.path.exists(cpath))
+                hdr, pkgs = read_cache()
+                bar = [k for k in pkgs if k.startswith("test/bar@1.0")]
+                self.assertEqual(len(bar), 1)
+                (acts, excluded), variants = pkgs[bar[0]]
+                self.assertEqual(len(acts), 1)
+                self.assertTrue(acts[0].startswith("depend "))
+                self.assertEqual(excluded, [])
+
+                # Remove the dependency from the cached data for bar; if the
+                # cache is used, foo should no longer be part of the plan.
+                # A later line for a package replaces an earlier one.
+                pkgs[bar[0]][0] = [[], []]
+                with open(cpath, "a") as f:
+                        f.write(json.dumps([bar[0], pkgs[bar[0]]]) + "\n")
+                self.assertEqual(plan_install(["bar"]), set(["pkg:/bar"]))
+
+                # The cache was created for the current catalog, so it should
+                # not be rewritten; entries gathered by later plans are
+                # appended to it instead.
+                for k in list(pkgs):
+                        if not k.startswith("test/bar@"):
+                                del pkgs[k]
+                with open(cpath, "w") as f:
+                        f.write(json.dumps(hdr) + "\n")
+                        f.write(json.dumps([bar[0], pkgs[bar[0]]]) + "\n")
+                st = os.stat(cpath)
+                self.assertEqual(plan_install(["foo"]), set(["pkg:/foo"]))
+                nst = os.stat(cpath)
+                self.assertEqual(st.st_ino, nst.st_ino)
+                self.assertTrue(nst.st_size > st.st_size)
+                nhdr, npkgs = read_cache()
+                self.assertEqual(nhdr, hdr)
+                self.assertEqual(npkgs[bar[0]], pkgs[bar[0]])
+                self.assertTrue([k for k in npkgs if k.startswith("test/foo@")])
+
+                # An incomplete entry, as left by an interrupted append, is
+                # ignored along with any that follow it, and the cache is
+                # rewritten when entries are next added.
+                with open(cpath, "r") as f:
+                        lines = f.readlines()
+                with open(cpath, "w") as f:
+                        f.write(lines[0] + lines[1][:-10])
+                self.assertEqual(plan_install(["bar"]),
+                    set(["pkg:/foo", "pkg:/bar"]))
+                self.assertNotEqual(os.stat(cpath).st_ino, nst.st_ino)
+                hdr, pkgs = read_cache()
+                self.assertEqual(len(pkgs[bar[0]][0][0]), 1)
+
+                # The cache must not be used if disabled.
+                pkgs[bar[0]][0] = [[], []]
+                with open(cpath, "a") as f:
+                        f.write(json.dumps([bar[0], pkgs[bar[0]]]) + "\n")
+                global_settings.client_solver_cache = False
+                try:
+                        self.assertEqual(plan_install(["bar"]),
+                            set(["pkg:/foo", "pkg:/bar"]))
+                finally:
+                        global_settings.client_solver_cache = True
+
+                # Changing the catalog should invalidate the cache.
+                self.pkgsend_bulk(self.rurl, foo11)
+                api_obj.refresh(full_refresh=True)
+                self.assertEqual(plan_install(["bar"]),
+                    set(["pkg:/foo", "pkg:/bar"]))
+                nhdr, pkgs = read_cache()
+                self.assertNotEqual(nhdr, hdr)
+                self.assertEqual(len(pkgs[bar[0]][0][0]), 1)
+
+                # An unparseable cache should be ignored and replaced.
+                with open(cpath, "w") as f:
+                        f.write("garbage")
+                self.assertEqual(plan_install(["bar"]),
+                    set(["pkg:/foo", "pkg:/bar"]))
+                read_cache()
+
+        def test_action_threads(self):
+                """Verify that directories, files and links are installed and
+                updated correctly whether they are executed concurrently or
+                not."""
+
+                def tree(ver, owner):
+                        lines = ["open tree@{0},5.11-0".format(ver)]
+                        for d in ("a", "a/b", "a/b/c"):
+                                lines.append("add dir path={0} mode=0755 "
+                                    "owner=root group=bin".format(d))
+                        for i in range(16):
+                                # Files in delivered and implicit directories.
+                                for d in ("a/b/c", "x/y/z"):
+                                        lines.append("add file {0} "
+                                            "path={1}/f{2:d} mode=0644 "
+                                            "owner={3} group=bin".format(
+                                            self.misc_files[i % 4], d, i,
+                                            owner))
+                                lines.append("add link path=a/b/l{0:d} "
+                                    "target=c/f{0:d}".format(i))
+                        lines.append("add hardlink path=a/h target=b/c/f0")
+                        lines.append("close\n")
+                        return "\n".join(lines)
+
+                self.pkgsend_bulk(self.rurl, (tree("1.0", "root"),
+                    tree("1.1", "bin")))
+
+                try:
+                        for nthreads in (4, 1):
+                                global_settings.client_action_threads = \
+                                    nthreads
+                                api_obj = self.image_create(self.rurl)
+                                self.__do_install(api_obj, ["tree@1.0"])
+                                self.pkg("verify")
+                                self.__do_update(api_obj, ["tree@1.1"])
+                                self.pkg("verify")
+                                self.__do_uninstall(api_obj, ["tree"])
+                                self.pkg("verify")
+                                self.image_destroy()
+                finally:
+                        global_settings.client_action_threads = \
+                            global_settings.client_action_threads_default
+
+        def test_clone_cache(self):
+                """Verify that the content of installed files is added to and
+                cloned from the clone cache if one is configured, and cloned
+                from other images if they are configured."""
+
+                clone10 = """
+                    open clone@1.0,5.11-0
+                    add file tmp/motd path=etc/motd mode=0644 owner=root group=bin
+                    add file tmp/motd path=etc/issue mode=0644 owner=root group=bin
+                    close """
+
+                def install():
+                        api_obj = self.image_create(self.rurl)
+                        self.__do_install(api_obj, ["clone"])
+                        contents = []
+                        for name in ("motd", "issue"):
+                                with open(os.path.join(self.get_img_path(),
+                                    "etc", name)) as f:
+                                        contents.append(f.read())
+                        self.image_destroy()
+                        return contents
+
+                self.pkgsend_bulk(self.rurl, clone10)
+                cdir = os.path.join(self.test_root, "clone-cache")
+                os.environ["PKG_CLONE_CACHEDIR"] = cdir
+                try:
+                        self.assertEqual(install(), ["tmp/motd"] * 2)
+                        cached = [
+                            os.path.join(d, f)
+                            for d, dirnames, files in os.walk(cdir)
+                            for f in files
+                        ]
+                        if not cached:
+                                raise pkg5unittest.TestSkippedException(
+                                    "Neither reflinks nor in-kernel copies "
+                                    "are supported here.")
+                        self.assertEqual(len(cached), 1)
+
+                        # Content in the cache which doesn't match the hash
+                        # of the file is ignored (even if its size matches),
+                        # and is replaced by the downloaded content.
+                        for content in ("tmp/MOTD", "tmp/motd.bad", ""):
+                                os.chmod(cached[0], misc.PKG_FILE_MODE)
+                                with open(cached[0], "w") as f:
+                                        f.write(content)
+                                self.assertEqual(install(), ["tmp/motd"] * 2)
+                                with open(cached[0]) as f:
+                                        self.assertEqual(f.read(), "tmp/motd")
+
+                        # Content which can be written by other users is
+                        # ignored as well, and is replaced by a read-only
+                        # copy.
+                        os.chmod(cached[0], 0o666)
+                        self.assertEqual(install(), ["tmp/motd"] * 2)
+                        self.assertEqual(stat.S_IMODE(
+                            os.stat(cached[0]).st_mode), misc.PKG_RO_FILE_MODE)
+                finally:
+                        del os.environ["PKG_CLONE_CACHEDIR"]
+
+                # Files installed in the images listed in PKG_CLONE_IMAGES are
+                # cloned if their content matches; others are ignored.
+                srcroot = os.path.join(self.test_root, "clone-src")
+                self.__do_install(self.image_create(self.rurl,
+                    img_path=srcroot), ["clone"])
+                os.environ["PKG_CLONE_IMAGES"] = srcroot
+                try:
+                        self.assertEqual(install(), ["tmp/motd"] * 2)
+                        for content in ("tmp/MOTD", ""):
+                                with open(os.path.join(srcroot, "etc",
+                                    "motd"), "w") as f:
+                                        f.write(content)
+                                self.assertEqual(install(),
+                                    ["tmp/motd"] * 2)
+                finally:
+                        del os.environ["PKG_CLONE_IMAGES"]
+                        self.image_destroy(img_path=srcroot)
+
+        def test_fast_lookups(self):
+                """Verify that the fast lookups database is updated for the
+                packages changed by an operation, and that the result is the
+                same as if it had been rebuilt from scratch."""
+
+                lookups = """
+                    open shared@1.0,5.11-0
+                    add dir path=usr mode=0755 owner=root group=bin
+                    add dir path=usr/share mode=0755 owner=root group=bin
+                    add file tmp/motd path=usr/share/motd mode=0644 owner=root group=bin
+                    close
+                    open shared@2.0,5.11-0
+                    add dir path=usr mode=0755 owner=root group=bin
+                    add file tmp/motd path=usr/share/motd mode=0644 owner=root group=bin
+                    add link path=usr/share/issue target=motd
+                    close
+                    open other@1.0,5.11-0
+                    add dir path=usr mode=0755 owner=root group=bin
+                    add dir path=usr/share mode=0755 owner=root group=bin
+                    add dir path=opt mode=0755 owner=root group=bin facet.doc=true
+                    add link path=usr/share/doc target=motd
+                    close
+                    open alone@1.0,5.11-0
+                    add dir path=usr/lib mode=0755 owner=root group=bin
+                    close """
+
+                self.pkgsend_bulk(self.rurl, lookups)
+                api_obj = self.image_create(self.rurl)
+                cdir = os.path.join(api_obj.img.imgdir, "cache")
+
+                def read_lookups():
+                        contents = []
+                        for name in ("actions.stripped", "actions.offsets",
+                            "keys.conflicting"):
+                                with open(os.path.join(cdir, name),
+                                    "rb") as f:
+                                        lines = f.readlines()
+                                # Leave out the timestamp.
+                                if name != "keys.conflicting":
+                                        del lines[1]
+                                contents.append(lines)
+                        return contents
+
+                def add_bad_key():
+                        with open(os.path.join(cdir, "keys.conflicting"),
+                            "a") as f:
+                                f.write("bogus\n")
+
+                def check(bad):
+                        updated = read_lookups()
+                        self.assertEqual(b"bogus\n" in updated[2], bad)
+                        if bad:
+                                updated[2].remove(b"bogus\n")
+                        api_obj.img._create_fast_lookups()
+                        self.assertEqual(updated, read_lookups())
+
+                self.__do_install(api_obj, ["shared@1.0"])
+                check(False)
+
+                # Keys which weren't affected by an operation are kept as is;
+                # the bogus key must only be dropped if the database is
+                # rebuilt.
+                for op, pkgs in (
+                    (self.__do_install, ["other", "alone"]),
+                    (self.__do_update, ["shared@2.0"]),
+                    (self.__do_uninstall, ["alone"])):
+                        add_bad_key()
+                        op(api_obj, pkgs)
+                        check(True)
+
+                add_bad_key()
+                api_obj.reset()
+                for pd in api_obj.gen_plan_change_varcets(
+                    facets={"facet.doc": False}):
+                        continue
+                api_obj.prepare()
+                try:
+                        api_obj.execute_plan()
+                except api_errors.WrapSuccessfulIndexingException:
+                        pass
+                check(False)
+
+                add_bad_key()
+                self.__do_uninstall(api_obj, ["shared"])
+                check(True)
+
+                # The database is rebuilt if it doesn't exist.
+                api_obj.img._remove_fast_lookups()
+                self.__do_uninstall(api_obj, ["other"])
+                check(False)
+
+                # The database is rebuilt if its index is truncated.
+                opath = os.path.join(cdir, "actions.offsets")
+                with open(opath, "rb") as f:
+                        data = f.read()
+                with open(opath, "wb") as f:
+                        f.write(data[:len(data) // 2])
+                self.__do_install(api_obj, ["alone"])
+                check(False)
+
+        def test_action_offsets(self):
+                """Verify that the offsets of the actions in the fast lookups
+                database are found by the index as written."""
+
+                entries = [
+                    ("dir", "usr", 10, 3),
+                    ("dir", "usr/bin", 60, 1),
+                    ("dirx", "a", 80, 2),
+                    ("file", "usr/bin/z", 120, 1),
+                    ("file", "usr/bin/\u00e9t\u00e9", 200, 1),
+                    ("link", "usr/bin/a", 250, 4),
+                ]
+                path = os.path.join(self.test_root, "actions.offsets")
+                for written in (entries, []):
+                        with open(path, "wb") as f:
+                                f.write(b"VERSION 3\n1234\n")
+                                image.ActionOffsets.write(f,
+                                    reversed(written))
+
+                        offsets = image.ActionOffsets(path)
+                        self.assertEqual(offsets.version, "VERSION 3")
+                        self.assertEqual(offsets.timestamp, "1234")
+                        self.assertEqual(len(offsets), len(written))
+                        self.assertEqual(list(offsets), written)
+                        for name, key, off, cnt in written:
+                                self.assertEqual(offsets.get((name, key)),
+                                    (off, cnt))
+                        for k in (("dir", "usr/b"), ("dir", "usr/bin/"),
+                            ("dirx", ""), ("a", "usr"), ("zone", "usr"),
+                            ("file", "usr/bin/\u00e9t")):
+                                self.assertEqual(offsets.get(k), None)
+                                self.assertEqual(offsets.get(k, 1), 1)
+
+                # A truncated or corrupt index is rejected when it is opened.
+                with open(path, "wb") as f:
+                        f.write(b"VERSION 3\n1234\n")
+                        image.ActionOffsets.write(f, entries)
+                with open(path, "rb") as f:
+                        data = f.read()
+                hdrlen = len(b"VERSION 3\n1234\n")
+                for corrupt in [data[:n] for n in range(hdrlen,
+                    len(data))] + [data + b"\0",
+                    data[:hdrlen] + b"\377" * 8 + data[hdrlen + 8:]]:
+                        with open(path, "wb") as f:
+                                f.write(corrupt)
+                        self.assertRaises(struct.error, image.ActionOffsets,
+                            path)
+
+                # An index in the older text format isn't mapped.
+                with open(path, "w") as f:
+                        f.write("VERSION 2\n1234\ndir 10 3 usr\n")
+                offsets = image.ActionOffsets(path)
+                self.assertEqual(offsets.version, "VERSION 2")
+                self.assertEqual(len(offsets), 0)
+
 
 class TestActionExecutionErrors(pkg5unittest.SingleDepotTestCase):
         """This set of tests is intended to verify that the client API will
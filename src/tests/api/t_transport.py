@@ -0,0 +1,193 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+from . import testutils
+if __name__ == "__main__":
+        testutils.setup_environment("../../../proto")
+import pkg5unittest
+
+import base64
+import os
+import pycurl
+import unittest
+
+import pkg.client.publisher as publisher
+import pkg.client.transport.engine as engine
+import pkg.client.transport.stats as stats
+import pkg.client.transport.transport as transport
+import pkg.fmri as fmri
+import pkg.manifest as man
+
+from pkg.client import global_settings
+
+
+class TestRepoStatsWindows(pkg5unittest.Pkg5TestCase):
+
+        def test_windows(self):
+                """Verify that the chunk and connection windows of a
+                repository shrink by half when a chunk fails, and grow back
+                while chunks succeed, within their bounds."""
+
+                rs = stats.RepoStats(publisher.RepositoryURI(
+                    "http://localhost"))
+                self.assertEqual(rs.chunk_window, stats.CHUNK_MAX)
+                self.assertEqual(rs.conn_share, 1)
+
+                rs.record_chunk(False)
+                self.assertEqual(rs.chunk_window, stats.CHUNK_MAX)
+                self.assertEqual(rs.conn_share, 1)
+
+                rs.record_chunk(True)
+                self.assertEqual(rs.chunk_window, stats.CHUNK_MAX // 2)
+                self.assertEqual(rs.conn_share,
+                    (stats.CONN_MAX // 2) / float(stats.CONN_MAX))
+
+                for i in range(20):
+                        rs.record_chunk(True)
+                self.assertEqual(rs.chunk_window, stats.CHUNK_MIN)
+                self.assertEqual(rs.conn_share, 1 / float(stats.CONN_MAX))
+
+                rs.record_chunk(False)
+                self.assertEqual(rs.chunk_window, 2 * stats.CHUNK_MIN)
+                self.assertEqual(rs.conn_share, 2 / float(stats.CONN_MAX))
+
+
+class TestTransferSplit(pkg5unittest.ManyDepotTestCase):
+
+        # The same publisher, served by two depots.
+        pubs = ["test1", "test1"]
+
+        def setUp(self):
+                pkg5unittest.ManyDepotTestCase.setUp(self, self.pubs,
+                    start_depots=True)
+
+                # Files too large to be retrieved in batches.
+                nfiles = 12
+                self.make_misc_files(dict(
+                    ("f{0:d}".format(i), base64.b64encode(
+                    os.urandom(100000)).decode("ascii"))
+                    for i in range(nfiles)
+                ))
+                pkg = "open big@1.0\n"
+                for i in range(nfiles):
+                        pkg += "add file f{0:d} mode=0644 owner=root " \
+                            "group=bin path=f{0:d}\n".format(i)
+                pkg += "close\n"
+                self.durls = []
+                for dc in self.dcs.values():
+                        self.durls.append(dc.get_depot_url())
+                        self.pfmri = fmri.PkgFmri(self.pkgsend_bulk(
+                            dc.get_depot_url(), pkg)[0])
+                        self.repodir = dc.get_repodir()
+
+        def test_split(self):
+                """Verify that once the transfer speed of several mirrors is
+                known, the files of a chunk are retrieved from all of them at
+                once."""
+
+                xport, xport_cfg = transport.setup_transport()
+                xport_cfg.incoming_root = os.path.join(self.test_root,
+                    "incoming")
+                pub = transport.setup_publisher(self.durls, "test1", xport,
+                    xport_cfg)
+
+                repo = self.get_repo(self.repodir, read_only=True)
+                m = man.Manifest(self.pfmri)
+                m.set_content(pathname=repo.manifest(self.pfmri))
+
+                # Both repositories are equally fast.
+                ruris = [
+                    publisher.TransportRepoURI(u)
+                    for u in self.durls
+                ]
+                xport.stats.get_repostats(ruris)
+                for ruri in ruris:
+                        xport.stats[ruri.key()].record_progress(1024, 1)
+
+                final = os.path.join(self.test_root, "final")
+                os.makedirs(final)
+                mfile = xport.multi_file_ni(pub, final)
+                for a in m.gen_actions_by_type("file"):
+                        mfile.add_action(a)
+                mfile.wait_files()
+
+                for a in m.gen_actions_by_type("file"):
+                        with open(os.path.join(final, a.hash), "rb") as f:
+                                with open(repo.file(a.hash), "rb") as rf:
+                                        self.assertEqual(f.read(), rf.read())
+                # Each repository sent at least one of the files.
+                csize = min(
+                    int(a.attrs["pkg.csize"])
+                    for a in m.gen_actions_by_type("file")
+                )
+                for ruri in ruris:
+                        self.assertTrue(
+                            xport.stats[ruri.key()].bytes_xfr > csize)
+
+        def test_http2_fallback(self):
+                """Verify that files are retrieved over HTTP/1.1 if HTTP/2 is
+                requested, but pycurl lacks something that is needed to
+                multiplex transfers."""
+
+                class NoPipewait(object):
+                        def __getattr__(self, name):
+                                if name == "PIPEWAIT":
+                                        raise AttributeError(name)
+                                return getattr(pycurl, name)
+
+                repo = self.get_repo(self.repodir, read_only=True)
+                m = man.Manifest(self.pfmri)
+                m.set_content(pathname=repo.manifest(self.pfmri))
+
+                http2 = global_settings.client_http2
+                global_settings.client_http2 = True
+                engine.pycurl = NoPipewait()
+                try:
+                        self.assertFalse(engine.http2_supported())
+
+                        xport, xport_cfg = transport.setup_transport()
+                        xport_cfg.incoming_root = os.path.join(self.test_root,
+                            "incoming")
+                        pub = transport.setup_publisher(self.durls[:1],
+                            "test1", xport, xport_cfg)
+                        final = os.path.join(self.test_root, "final")
+                        os.makedirs(final)
+                        mfile = xport.multi_file_ni(pub, final)
+                        for a in m.gen_actions_by_type("file"):
+                                mfile.add_action(a)
+                        mfile.wait_files()
+                finally:
+                        engine.pycurl = pycurl
+                        global_settings.client_http2 = http2
+
+                for a in m.gen_actions_by_type("file"):
+                        with open(os.path.join(final, a.hash), "rb") as f:
+                                with open(repo.file(a.hash), "rb") as rf:
+                                        self.assertEqual(f.read(), rf.read())
+
+
+if __name__ == "__main__":
+        unittest.main()
@@ -30,18 +30,20 @@ if __name__ == "__main__":
 import pkg5unittest
 
 import datetime
+import json
 import os
 import shutil
 import six
 import sys
+import tarfile
 import tempfile
 import time
 import unittest
 
 from six.moves import http_client
 from six.moves.urllib.error import HTTPError, URLError
-from six.moves.urllib.parse import quote, urljoin
-from six.moves.urllib.request import urlopen
+from six.moves.urllib.parse import quote, urlencode, urljoin
+from six.moves.urllib.request import Request, urlopen
 
 import pkg.client.publisher as publisher
 import pkg.depotcontroller as dc
@@ -487,6 +489,193 @@ class TestPkgDepot(pkg5unittest.SingleDepotTestCase):
 
                 res = urlopen(repourl)
 
+        def test_file_attrs(self):
+                """Verify that the compressed attributes returned for files by
+                the depot are cached when the files are published, and are
+                recomputed if the files change."""
+
+                depot_url = self.dc.get_depot_url()
+                pfmri = fmri.PkgFmri(self.pkgsend_bulk(depot_url,
+                    self.quux10)[0])
+
+                repodir = self.dc.get_repodir()
+                repo = self.get_repo(repodir, read_only=True)
+                m = man.Manifest(pfmri)
+                m.set_content(pathname=repo.manifest(pfmri))
+                fas = list(m.gen_actions_by_type("file"))
+                self.assertEqual(len(fas), 2)
+
+                # The attributes should have been cached by publication.
+                adir = os.path.join(repodir, "publisher", "test",
+                    "file-attrs")
+                self.assertEqual(len([f for d, ds, fs in os.walk(adir)
+                    for f in fs]), len(fas))
+
+                def get_attrs(fhash):
+                        req = Request(urljoin(depot_url,
+                            "file/2/{0}".format(fhash)))
+                        req.get_method = lambda: "HEAD"
+                        hdrs = urlopen(req).info()
+                        attrs = {}
+                        for i in range(len(fas)):
+                                hdr = hdrs.get("X-Ipkg-Attr-{0:d}".format(i))
+                                if hdr:
+                                        k, v = hdr.split("=", 1)
+                                        attrs[k] = v
+                        return attrs
+
+                for a in fas:
+                        attrs = get_attrs(a.hash)
+                        self.assertTrue(attrs)
+                        for k, v in attrs.items():
+                                self.assertTrue(v in a.attrlist(k))
+
+                # If a file's content changes, its attributes are recomputed.
+                src = repo.file(fas[1].hash)
+                dst = repo.file(fas[0].hash)
+                shutil.copy(src, dst)
+                st = os.stat(dst)
+                os.utime(dst, (st.st_atime, st.st_mtime + 10))
+                attrs = get_attrs(fas[0].hash)
+                self.assertTrue(attrs)
+                for k, v in attrs.items():
+                        self.assertTrue(v in fas[1].attrlist(k))
+
+        def test_search_cache(self):
+                """Verify that repeated searches are answered from the
+                depot's search cache, that the cache statistics are reported
+                by status/0, and that the cache is discarded when the search
+                index is updated."""
+
+                depot_url = self.dc.get_depot_url()
+                repodir = self.dc.get_repodir()
+                self.pkgsend_bulk(depot_url, self.foo10)
+                self.wait_repo(repodir)
+
+                def search(token):
+                        return urlopen(urljoin(depot_url,
+                            "search/1/False_2_None_None_{0}".format(
+                            quote(token, "")))).read()
+
+                def get_stats():
+                        status = json.loads(misc.force_str(urlopen(urljoin(
+                            depot_url, "status/0")).read()))
+                        return status["repository"]["publishers"]["test"][
+                            "search-cache"]
+
+                res = search("foo/foo")
+                stats = get_stats()
+                self.assertEqual(search("foo/foo"), res)
+                nstats = get_stats()
+                self.assertEqual(nstats["hits"], stats["hits"] + 1)
+                self.assertEqual(nstats["misses"], stats["misses"])
+                self.assertTrue(nstats["entries"] > 0)
+
+                # Once the index has been updated, the search must be done
+                # again.
+                self.pkgsend_bulk(depot_url, self.bar10)
+                self.wait_repo(repodir)
+                stats = nstats
+                self.assertEqual(search("foo/foo"), res)
+                nstats = get_stats()
+                self.assertEqual(nstats["hits"], stats["hits"])
+                self.assertEqual(nstats["misses"], stats["misses"] + 1)
+
+        def test_filelist(self):
+                """Verify that the filelist operation returns a tar stream of
+                the requested files as stored in the repository, omitting
+                unknown files, and that clients use it to retrieve small
+                files."""
+
+                depot_url = self.dc.get_depot_url()
+                pfmri = fmri.PkgFmri(self.pkgsend_bulk(depot_url,
+                    self.quux10)[0])
+
+                repo = self.get_repo(self.dc.get_repodir(), read_only=True)
+                m = man.Manifest(pfmri)
+                m.set_content(pathname=repo.manifest(pfmri))
+                hashes = [a.hash for a in m.gen_actions_by_type("file")]
+                missing = "0" * 40
+
+                data = urlencode([(i, h) for i, h in enumerate(hashes +
+                    [missing])])
+                tf = tarfile.open(mode="r|", fileobj=urlopen(urljoin(depot_url,
+                    "filelist/1/"), misc.force_bytes(data)))
+                members = {}
+                for ti in tf:
+                        members[ti.name] = tf.extractfile(ti).read()
+                self.assertEqualDiff(sorted(hashes), sorted(members))
+                for h in hashes:
+                        with open(repo.file(h), "rb") as f:
+                                self.assertEqual(members[h], f.read())
+
+                # Only POST is allowed.
+                try:
+                        urlopen(urljoin(depot_url, "filelist/1/"))
+                except HTTPError as e:
+                        self.assertEqual(e.code,
+                            http_client.METHOD_NOT_ALLOWED)
+                else:
+                        self.fail("GET of filelist/1 succeeded")
+
+                # The client retrieves the package's files with a single
+                # filelist request.
+                rpath = os.path.join(self.test_root, "recv")
+                self.create_repo(rpath)
+                self.pkgrecv(depot_url, "-d {0} quux".format(rpath))
+                rrepo = self.get_repo(rpath, read_only=True)
+                for h in hashes:
+                        with open(rrepo.file(h), "rb") as f:
+                                self.assertEqual(members[h], f.read())
+                with open(self.dc.get_logpath(), "r") as f:
+                        log = f.read()
+                self.assertEqual(len([l for l in log.splitlines()
+                    if "POST " in l and "/filelist/1/" in l]), 2)
+                for h in hashes:
+                        self.assertTrue("/file/1/{0}".format(h) not in log)
+                        self.assertTrue("/file/0/{0}".format(h) not in log)
+
+        def test_sendfile(self):
+                """Verify that files and manifests sent by the depot using
+                sendfile(2), whole or as a byte range, match their content in
+                the repository."""
+
+                depot_url = self.dc.get_depot_url()
+                pfmri = fmri.PkgFmri(self.pkgsend_bulk(depot_url,
+                    self.quux10)[0])
+
+                repo = self.get_repo(self.dc.get_repodir(), read_only=True)
+                m = man.Manifest(pfmri)
+                m.set_content(pathname=repo.manifest(pfmri))
+                paths = [
+                    ("file/0/{0}".format(a.hash), repo.file(a.hash))
+                    for a in m.gen_actions_by_type("file")
+                ]
+                paths.append(("manifest/0/{0}".format(
+                    pfmri.get_url_path()), repo.manifest(pfmri)))
+
+                for op, fpath in paths:
+                        with open(fpath, "rb") as f:
+                                content = f.read()
+                        self.assertTrue(len(content) > 20)
+
+                        res = urlopen(urljoin(depot_url, op))
+                        self.assertEqual(res.getcode(), http_client.OK)
+                        self.assertEqual(int(res.info()["Content-Length"]),
+                            len(content))
+                        self.assertEqual(res.read(), content)
+
+                        req = Request(urljoin(depot_url, op))
+                        req.add_header("Range", "bytes=10-19")
+                        res = urlopen(req)
+                        self.assertEqual(res.getcode(),
+                            http_client.PARTIAL_CONTENT)
+                        self.assertEqual(res.info()["Content-Range"],
+                            "bytes 10-19/{0:d}".format(len(content)))
+                        self.assertEqual(int(res.info()["Content-Length"]),
+                            10)
+                        self.assertEqual(res.read(), content[10:20])
+
         def test_publisher_prefix(self):
                 """Test that various publisher prefixes can be understood
                 by CherryPy's dispatcher."""
@@ -561,6 +750,26 @@ class TestDepotController(pkg5unittest.CliTestCase):
                 self.__dc.set_cfg_file(cfg_file)
                 self.__dc.start()
 
+        def test_search_cache_size(self):
+                """Verify that the search cache can be disabled, and that a
+                negative size prevents the depot from starting."""
+
+                cfg_file = os.path.join(self.test_root, "cfg_search")
+                self.__dc.set_port(self.next_free_port)
+                self.__dc.set_cfg_file(cfg_file)
+                for size, valid in ((0, True), (-1, False)):
+                        with open(cfg_file, "w") as f:
+                                f.write("[pkg]\nsearch_cache_size = "
+                                    "{0:d}\n".format(size))
+                        if valid:
+                                self.__dc.start()
+                                self.assertTrue(self.__dc.is_alive())
+                                self.__dc.stop()
+                        else:
+                                self.assertTrue(
+                                    self.__dc.start_expected_fail())
+                                self.assertFalse(self.__dc.is_alive())
+
         def test_writable_root(self):
                 """Tests whether the index and feed cache file are written to
                 the writable root parameter."""
@@ -1543,6 +1543,110 @@ file elftest.so.1 mode=0755 owner=root group=bin path=bin/true
                 # publishers.
                 self.pkgrecv(self.durl1, "-d {0} '*'".format(self.durl2))
 
+        def test_18_jobs(self):
+                """Verify that packages received with -j, which retrieves
+                packages while others are republished, are identical to the
+                originals."""
+
+                self.pkgrecv(self.durl1, "-j 0 -d {0} '*'".format(self.durl2),
+                    exit=2)
+                self.pkgrecv(self.durl1, "-j foo -d {0} '*'".format(self.durl2),
+                    exit=2)
+                self.pkgrecv(self.durl1, "-j 2 --clone -d {0}".format(
+                    self.dpath2), exit=2)
+
+                orepo = self.get_repo(self.dpath1)
+                for jobs in (2, 4):
+                        npath = tempfile.mkdtemp(dir=self.test_root)
+                        self.create_repo(npath, properties={
+                            "publisher": { "prefix": "test1" } })
+                        self.pkgrecv(self.durl1, "-j {0:d} -d file://{1} "
+                            "'*'".format(jobs, npath))
+
+                        # The republication of each package is reported once
+                        # the previous one is done, even though the packages
+                        # that follow were retrieved in the meantime.
+                        repub = [l for l in self.output.splitlines()
+                            if "Republish:" in l]
+                        self.assertEqual(len(repub), len(self.published))
+                        for l in repub:
+                                self.assertEqual(l.count("Republish:"), 1)
+                                self.assertTrue(l.endswith("Done"), l)
+
+                        nrepo = self.get_repo(npath)
+                        for p in self.published:
+                                f = fmri.PkgFmri(p, None)
+                                self.assertEqual(misc.get_data_digest(
+                                    orepo.manifest(f),
+                                    hash_func=DEFAULT_HASH_FUNC),
+                                    misc.get_data_digest(nrepo.manifest(f),
+                                    hash_func=DEFAULT_HASH_FUNC))
+
+                                m = manifest.Manifest()
+                                m.set_content(pathname=nrepo.manifest(f))
+                                for a in m.gen_actions_by_types(("file",
+                                    "license")):
+                                        self.assertEqual(misc.get_data_digest(
+                                            orepo.file(a.hash),
+                                            hash_func=DEFAULT_HASH_FUNC),
+                                            misc.get_data_digest(
+                                            nrepo.file(a.hash),
+                                            hash_func=DEFAULT_HASH_FUNC))
+
+        def test_19_clone_local(self):
+                """Verify that cloning a repository on the local system links
+                its files into the target rather than copying them."""
+
+                self.pkgrecv(self.dpath1, "--clone -d {0}".format(self.dpath2))
+                ret = subprocess.call(["/usr/bin/gdiff", "-Naur", "-x",
+                    "index", "-x", "trans", self.dpath1, self.dpath2])
+                self.assertTrue(ret==0)
+
+                orepo = self.get_repo(self.dpath1)
+                nrepo = self.get_repo(self.dpath2)
+                for p in self.published:
+                        m = manifest.Manifest()
+                        m.set_content(pathname=nrepo.manifest(
+                            fmri.PkgFmri(p, None)))
+                        for a in m.gen_actions_by_types(("file", "license")):
+                                self.assertTrue(os.path.samefile(
+                                    orepo.file(a.hash), nrepo.file(a.hash)))
+
+        def test_20_clone_local_corrupt(self):
+                """Verify that cloning a repository on the local system fails
+                if one of its files is corrupt, and that the corrupt file isn't
+                left in the target."""
+
+                spath = os.path.join(self.test_root, "corrupt")
+                shutil.copytree(self.dpath1, spath)
+                srepo = self.get_repo(spath)
+                m = manifest.Manifest()
+                m.set_content(pathname=srepo.manifest(
+                    fmri.PkgFmri(self.published[0], None)))
+                a = next(m.gen_actions_by_types(("file", "license")))
+                bad_path = srepo.file(a.hash)
+                with open(bad_path, "rb") as f:
+                        content = f.read()
+                portable.remove(bad_path)
+                with open(bad_path, "wb") as f:
+                        f.write(zlib.compress(b"corrupt"))
+
+                self.pkgrecv(spath, "--clone -d {0}".format(self.dpath2),
+                    exit=1)
+                for d, dirnames, files in os.walk(self.dpath2):
+                        for name in files:
+                                self.assertFalse(os.path.samefile(bad_path,
+                                    os.path.join(d, name)))
+
+                # Once the source is repaired, the clone can be retried.
+                portable.remove(bad_path)
+                with open(bad_path, "wb") as f:
+                        f.write(content)
+                self.pkgrecv(spath, "--clone -d {0}".format(self.dpath2))
+                ret = subprocess.call(["/usr/bin/gdiff", "-Naur", "-x",
+                    "index", "-x", "trans", spath, self.dpath2])
+                self.assertTrue(ret==0)
+
 class TestPkgrecvHTTPS(pkg5unittest.HTTPSTestClass):
 
         example_pkg10 = """
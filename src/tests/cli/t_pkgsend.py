@@ -28,6 +28,7 @@ if __name__ == "__main__":
 import pkg5unittest
 
 import grp
+import gzip
 import os
 import pkg.fmri as fmri
 import pkg.manifest as manifest
@@ -1495,6 +1496,160 @@ file elftest.so.1 mode=0755 owner=root group=bin path=bin/true pkg.size=ignored
                 self.assertNotEqual(a.attrs['elfhash'], 'ignored')
                 self.assertNotEqual(a.attrs['pkg.content-hash'][0], 'ignored')
 
+        def test_29_publish_jobs(self):
+                """Verify that 'pkgsend publish -j' publishes the same package
+                as publishing one action at a time."""
+
+                rootdir = os.path.join(self.test_root, "jobs")
+                files = {}
+                lines = ["set name=pkg.fmri value=pkg://test/jobs@1.0"]
+                for i in range(20):
+                        # Some of the files have the same content, and one is
+                        # empty.
+                        fname = "f{0:d}".format(i)
+                        files[fname] = \
+                            "content {0:d}\n".format(i % 7) * i * 100
+                        lines.append("file {0} mode=0644 owner=root group=bin "
+                            "path=opt/{0}".format(fname))
+                        lines.append("dir mode=0755 owner=root group=bin "
+                            "path=opt/d{0:d}".format(i))
+                self.make_misc_files(files, prefix="jobs")
+                mfpath = os.path.join(self.test_root, "jobs.p5m")
+                with open(mfpath, "w") as mf:
+                        mf.write("\n".join(lines) + "\n")
+
+                mans = []
+                for jobs in (1, 3):
+                        rpath = os.path.join(self.test_root,
+                            "repo{0:d}".format(jobs))
+                        self.create_repo(rpath, properties={ "publisher": {
+                            "prefix": "test" } })
+                        ret, pfmri = self.pkgsend(rpath,
+                            "publish -j {0:d} -d {1} {2}".format(jobs, rootdir,
+                            mfpath))
+                        repo = self.get_repo(rpath)
+                        m = manifest.Manifest()
+                        m.set_content(pathname=repo.manifest(pfmri))
+                        for a in m.gen_actions_by_type("file"):
+                                self.assertTrue(os.path.exists(
+                                    repo.file(a.hash)))
+                        # The timestamps of the packages differ.
+                        mans.append([
+                            str(a) for a in m.gen_actions()
+                            if a.name != "set" or
+                            a.attrs["name"] != "pkg.fmri"
+                        ])
+                self.assertEqualDiff(mans[0], mans[1])
+
+                self.pkgsend(self.dc.get_repodir(),
+                    "publish -j 0 -d {0} {1}".format(rootdir, mfpath), exit=2)
+
+        def test_30_compression_policy(self):
+                """Verify that payloads are compressed as the compression
+                policy of the publisher in the repository configuration
+                says."""
+
+                rootdir = os.path.join(self.test_root, "policy")
+                text = "compressible\n" * 10000
+                noise = os.urandom(100000)
+                self.make_misc_files({ "text": text }, prefix="policy")
+                with open(os.path.join(rootdir, "noise"), "wb") as f:
+                        f.write(noise)
+                mfpath = os.path.join(self.test_root, "policy.p5m")
+                with open(mfpath, "w") as mf:
+                        mf.write("""\
+set name=pkg.fmri value=pkg://test/policy@1.0
+file text mode=0644 owner=root group=bin path=opt/text
+file noise mode=0644 owner=root group=bin path=opt/noise
+""")
+
+                def publish(http=False, disable_ops=None, **props):
+                        rpath = os.path.join(self.test_root, "repo")
+                        shutil.rmtree(rpath, True)
+                        props["publisher"] = { "prefix": "test" }
+                        self.create_repo(rpath, properties=props)
+                        target = rpath
+                        if http:
+                                # Publish through a depot serving the
+                                # repository.
+                                self.dc.stop()
+                                self.dc.set_repodir(rpath)
+                                if disable_ops:
+                                        self.dc.set_disable_ops(disable_ops)
+                                else:
+                                        self.dc.unset_disable_ops()
+                                self.dc.start()
+                                target = self.dc.get_depot_url()
+                        try:
+                                ret, pfmri = self.pkgsend(target,
+                                    "publish -d {0} {1}".format(rootdir,
+                                    mfpath))
+                        finally:
+                                if http:
+                                        self.dc.stop()
+                        repo = self.get_repo(rpath)
+                        m = manifest.Manifest()
+                        m.set_content(pathname=repo.manifest(pfmri))
+                        csizes = {}
+                        for a in m.gen_actions_by_type("file"):
+                                path = repo.file(a.hash)
+                                csizes[a.attrs["path"]] = int(
+                                    a.attrs["pkg.csize"])
+                                self.assertEqual(csizes[a.attrs["path"]],
+                                    os.stat(path).st_size)
+                                with gzip.open(path) as f:
+                                        self.assertEqual(len(f.read()),
+                                            int(a.attrs["pkg.size"]))
+                        return csizes
+
+                def csizes(text_level, noise_level):
+                        return dict(
+                            (path, int(misc.compute_compressed_attrs(path,
+                            data=data, size=len(data),
+                            compress_level=level)[0]))
+                            for path, data, level in (
+                                ("opt/text", text.encode(), text_level),
+                                ("opt/noise", noise, noise_level))
+                        )
+
+                # By default, everything is compressed at level 9.
+                self.assertEqual(publish(), csizes(9, 9))
+
+                # Payloads which barely compress are stored; the level of the
+                # others is unchanged.
+                self.assertEqual(publish(repository={
+                    "compression-probe": True }), csizes(9, 0))
+
+                # The policy of the publisher overrides that of the
+                # repository.
+                self.assertEqual(publish(repository={
+                    "compression-probe": True }, compression_test={
+                    "level": 1, "probe": False }), csizes(1, 1))
+
+                # Payloads published over HTTP follow the policy of the depot's
+                # repository as well.
+                self.assertEqual(publish(http=True), csizes(9, 9))
+                self.assertEqual(publish(http=True, repository={
+                    "compression-level": 0 }), csizes(0, 0))
+                self.assertEqual(publish(http=True, repository={
+                    "compression-probe": True }, compression_test={
+                    "level": 1, "probe": False }), csizes(1, 1))
+
+                # Depots which don't provide the policy get payloads compressed
+                # at the default level.
+                self.assertEqual(publish(http=True,
+                    disable_ops=["compression"], repository={
+                    "compression-level": 0 }), csizes(9, 9))
+                self.dc.unset_disable_ops()
+
+                # Levels outside of the range 0-9 are rejected.
+                rpath = os.path.join(self.test_root, "repo")
+                for level in (-1, 10):
+                        self.pkgrepo("set -s {0} repository/compression-level="
+                            "{1:d}".format(rpath, level), exit=1)
+                        self.pkgrepo("set -s {0} compression_test/level="
+                            "{1:d}".format(rpath, level), exit=1)
+
 
 class TestPkgsendHardlinks(pkg5unittest.CliTestCase):
 
@@ -0,0 +1,160 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+#
+# catalogbench - benchmark cold catalog operations using JSON catalog parts
+# and binary catalog part sidecars
+#
+# The single package lookups (get_entry() and entries_by_version()) are what
+# operations such as 'pkg list <pkg>' and 'pkg info <pkg>' rely on; with
+# binary sidecars only the entries for the requested package stem are loaded,
+# so the memory used by each lookup is reported as well.
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import pkg.catalog as catalog
+import pkg.fmri as fmri
+import pkg.misc as misc
+
+def usage():
+        print("usage: catalogbench.py [-n npkgs] [-v nversions] [-r rounds]",
+            file=sys.stderr)
+        sys.exit(2)
+
+def get_rss():
+        """Return the resident set size of the current process in KiB."""
+
+        psinfo = misc.ProcFS.psinfo()
+        if psinfo is not None:
+                return psinfo.pr_rssize
+
+        # Not Solaris; fall back to the Linux interface.
+        with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * \
+                    (os.sysconf("SC_PAGE_SIZE") // 1024)
+
+def measure_rss(root, binary, stmt, f):
+        """Print the amount of memory used to open the catalog at 'root' and
+        execute 'stmt' in a child process."""
+
+        pid = os.fork()
+        if pid != 0:
+                os.waitpid(pid, 0)
+                return
+
+        start = get_rss()
+        cat = catalog.Catalog(meta_root=root, read_only=True, binary=binary)
+        eval(stmt)
+        print("{0:>20d} {1:>8} KiB used by {2}".format(get_rss() - start,
+            binary and "binary" or "json", stmt))
+        os._exit(0)
+
+def build_catalog(meta_root, npkgs, nversions, binary):
+        """Create a synthetic catalog with 'npkgs' package stems, each with
+        'nversions' versions, in 'meta_root'."""
+
+        cat = catalog.Catalog(batch_mode=True, meta_root=meta_root,
+            sign=False, binary=binary)
+        for i in range(npkgs):
+                for v in range(nversions):
+                        f = fmri.PkgFmri("pkg://bench/pkg/bench{0:d}@"
+                            "0.5.11,5.11-0.{1:d}:20200101T000000Z".format(i, v))
+                        cat.add_package(f, metadata={
+                            "states": [2, 3],
+                            "last-install": "20200101T000000Z",
+                        })
+        cat.finalize()
+        cat.save()
+
+if __name__ == "__main__":
+        npkgs = 20000
+        nversions = 5
+        rounds = 5
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "n:r:v:")
+                for opt, arg in opts:
+                        if opt == "-n":
+                                npkgs = int(arg)
+                        elif opt == "-r":
+                                rounds = int(arg)
+                        elif opt == "-v":
+                                nversions = int(arg)
+        except (getopt.GetoptError, ValueError):
+                usage()
+
+        lookup = "pkg://bench/pkg/bench{0:d}@0.5.11,5.11-0.{1:d}:" \
+            "20200101T000000Z".format(npkgs // 2, nversions - 1)
+
+        benches = [
+            [ "cold fmris()", """list(cat.fmris())""" ],
+            [ "cold fmris(last=True)", """list(cat.fmris(last=True))""" ],
+            [ "cold get_entry()", """cat.get_entry(f)""" ],
+            [ "cold entries_by_version()",
+                """list(cat.entries_by_version(f.pkg_name))""" ],
+        ]
+
+        try:
+                for binary in (False, True):
+                        root = tempfile.mkdtemp(prefix="catalogbench.")
+                        try:
+                                build_catalog(root, npkgs, nversions, binary)
+                                fmt = binary and "binary" or "json"
+                                for name, stmt in benches:
+                                        # The catalog is re-opened on every
+                                        # round so that no data is cached.
+                                        setup = """
+import pkg.catalog as catalog
+import pkg.fmri as fmri
+cat = catalog.Catalog(meta_root="{0}", read_only=True, binary={1})
+f = fmri.PkgFmri("{2}")
+""".format(root, binary, lookup)
+                                        t = min(timeit.Timer(stmt, setup).repeat(
+                                            rounds, 1))
+                                        print("{0:>20f} {1:>8} {2} ({3:d} "
+                                            "packages, {4:d} versions)".format(
+                                            t, fmt, name, npkgs,
+                                            npkgs * nversions))
+
+                                f = fmri.PkgFmri(lookup)
+                                for name, stmt in benches[2:]:
+                                        measure_rss(root, binary, stmt, f)
+                        finally:
+                                shutil.rmtree(root, True)
+        except KeyboardInterrupt:
+                sys.exit(0)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
@@ -0,0 +1,143 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+#
+# depotbench - generate load against the file/0 operation of a running depot
+#
+# 'nclients' threads each retrieve every file in the list of file hashes
+# 'rounds' times over a single persistent (keep-alive) connection, and the
+# number of requests and bytes transferred per second are reported.  With
+# -R, each request is for a single range of 'range' bytes from the middle
+# of the file instead.
+#
+# The list of hashes is read from standard input, one per line; e.g. for a
+# file-system based repository:
+#
+#     find <repo>/publisher/<pub>/file -type f | xargs -n1 basename | \
+#         depotbench.py -c 8 http://localhost:10000/<pub>
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import sys
+import threading
+import time
+
+from six.moves import http_client
+from six.moves.urllib.parse import urlparse
+
+def usage():
+        print("usage: depotbench.py [-c nclients] [-r rounds] [-R range] "
+            "depot_url < hashes", file=sys.stderr)
+        sys.exit(2)
+
+def client(url, hashes, rounds, rlen, results):
+        """Retrieve each file in 'hashes' from the depot at 'url' 'rounds'
+        times, and append the number of requests made and bytes received to
+        'results'."""
+
+        u = urlparse(url)
+        if u.scheme == "https":
+                conn = http_client.HTTPSConnection(u.netloc)
+        else:
+                conn = http_client.HTTPConnection(u.netloc)
+        base = u.path.rstrip("/")
+
+        nreqs = 0
+        nbytes = 0
+        for i in range(rounds):
+                for h in hashes:
+                        headers = {}
+                        if rlen:
+                                headers["Range"] = "bytes=-{0:d}".format(rlen)
+                        conn.request("GET", "{0}/file/0/{1}".format(base, h),
+                            headers=headers)
+                        resp = conn.getresponse()
+                        body = resp.read()
+                        if resp.status not in (http_client.OK,
+                            http_client.PARTIAL_CONTENT):
+                                raise RuntimeError("{0}: {1:d} {2}".format(h,
+                                    resp.status, resp.reason))
+                        nreqs += 1
+                        nbytes += len(body)
+        conn.close()
+        results.append((nreqs, nbytes))
+
+if __name__ == "__main__":
+        nclients = 4
+        rounds = 10
+        rlen = 0
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "c:r:R:")
+                for opt, arg in opts:
+                        if opt == "-c":
+                                nclients = int(arg)
+                        elif opt == "-r":
+                                rounds = int(arg)
+                        elif opt == "-R":
+                                rlen = int(arg)
+        except (getopt.GetoptError, ValueError):
+                usage()
+        if len(pargs) != 1:
+                usage()
+
+        hashes = [l.strip() for l in sys.stdin if l.strip()]
+        if not hashes:
+                usage()
+
+        results = []
+        threads = [
+            threading.Thread(target=client, args=(pargs[0], hashes, rounds,
+                rlen, results))
+            for i in range(nclients)
+        ]
+
+        try:
+                start = time.time()
+                for t in threads:
+                        t.start()
+                for t in threads:
+                        t.join()
+                elapsed = time.time() - start
+        except KeyboardInterrupt:
+                sys.exit(0)
+
+        if len(results) != nclients:
+                # A client failed; its exception has already been printed.
+                sys.exit(1)
+
+        nreqs = sum(r[0] for r in results)
+        nbytes = sum(r[1] for r in results)
+        print("{0:>20f} requests/s ({1:d} clients, {2:d} requests)".format(
+            nreqs / elapsed, nclients, nreqs))
+        print("{0:>20f} MB/s ({1:d} bytes)".format(
+            nbytes / elapsed / (1024 * 1024), nbytes))
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
@@ -0,0 +1,169 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+#
+# incorpbench - benchmark the solver on a synthetic catalog consisting of
+# many incorporations
+#
+# The catalog contains 'nincs' incorporations, each of which incorporates
+# (at any branch of version 1.0) and requires 'npkgs' packages, and an
+# 'entire' package that incorporates and requires an exact version of every
+# incorporation.  Each package has 'nversions' versions.
+# The oldest version of every package is installed, and an update to the
+# newest version of 'entire' is solved; this exercises the whole of
+# solve_install(), including the iterative minimization of the solution.
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import gettext
+import shutil
+import sys
+import tempfile
+import time
+
+import pkg.catalog as catalog
+import pkg.client.pkg_solver as pkg_solver
+import pkg.client.progress as progress
+import pkg.fmri as fmri
+import pkg.manifest as manifest
+import pkg.variant as variant
+
+VERSION = "1.0,5.11-0.{0:d}:20200101T000000Z"
+
+def usage():
+        print("usage: incorpbench.py [-i nincs] [-p npkgs] [-v nversions] "
+            "[-r rounds]", file=sys.stderr)
+        sys.exit(2)
+
+def gen_packages(nincs, npkgs, nversions):
+        """Generate tuples of (FMRI, dependency actions) for each package in
+        the synthetic catalog."""
+
+        def deps(stem, ver):
+                return [
+                    "depend type=incorporate fmri={0}@{1}".format(stem, ver),
+                    "depend type=require fmri={0}".format(stem),
+                ]
+
+        for v in range(nversions):
+                acts = []
+                for i in range(nincs):
+                        inc = "inc/inc{0:d}".format(i)
+                        acts.extend(deps(inc, VERSION.format(v)))
+
+                        iacts = []
+                        for p in range(npkgs):
+                                stem = "pkg{0:d}.{1:d}".format(i, p)
+                                iacts.extend(deps(stem, "1.0"))
+                                yield fmri.PkgFmri("pkg://bench/{0}@{1}".format(
+                                    stem, VERSION.format(v))), []
+                        yield fmri.PkgFmri("pkg://bench/{0}@{1}".format(inc,
+                            VERSION.format(v))), iacts
+                yield fmri.PkgFmri("pkg://bench/entire@{0}".format(
+                    VERSION.format(v))), acts
+
+def build_catalog(meta_root, nincs, npkgs, nversions):
+        """Create the synthetic catalog in 'meta_root' and return the dict
+        of installed package FMRIs indexed by stem."""
+
+        installed = {}
+        cat = catalog.Catalog(batch_mode=True, meta_root=meta_root,
+            sign=False)
+        for f, acts in gen_packages(nincs, npkgs, nversions):
+                m = manifest.Manifest(f)
+                m.set_content(content="\n".join(acts))
+                cat.add_package(f, manifest=m)
+                if f.pkg_name not in installed:
+                        installed[f.pkg_name] = f
+        cat.finalize()
+        cat.save()
+        return installed
+
+def solve(root, installed, nversions):
+        """Solve an update of 'entire' to its newest version and return the
+        time taken and the solver's description of the operation."""
+
+        cat = catalog.Catalog(meta_root=root, read_only=True)
+        variants = variant.Variants({ "variant.arch": "i386" })
+        excludes = [variants.allow_action]
+
+        start = time.time()
+        solver = pkg_solver.PkgSolver(cat, installed,
+            { "bench": (1, True, True) }, variants, set(), None,
+            progress.NullProgressTracker())
+        f = fmri.PkgFmri("pkg://bench/entire@{0}".format(
+            VERSION.format(nversions - 1)))
+        solver.solve_install([], { f.pkg_name: [f] }, excludes=excludes)
+        return time.time() - start, str(solver)
+
+if __name__ == "__main__":
+        gettext.install("pkg", "/usr/share/locale")
+
+        nincs = 1000
+        npkgs = 1
+        nversions = 3
+        rounds = 3
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "i:p:r:v:")
+                for opt, arg in opts:
+                        if opt == "-i":
+                                nincs = int(arg)
+                        elif opt == "-p":
+                                npkgs = int(arg)
+                        elif opt == "-r":
+                                rounds = int(arg)
+                        elif opt == "-v":
+                                nversions = int(arg)
+        except (getopt.GetoptError, ValueError):
+                usage()
+
+        # See ImagePlan.__run_solver().
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 3000))
+
+        root = tempfile.mkdtemp(prefix="incorpbench.")
+        try:
+                installed = build_catalog(root, nincs, npkgs, nversions)
+                results = [
+                    solve(root, installed, nversions)
+                    for i in range(rounds)
+                ]
+                t, desc = min(results)
+                print("{0:>20f} solve_install ({1:d} incorporations, {2:d} "
+                    "packages, {3:d} versions)".format(t, nincs,
+                    nincs * (npkgs + 1) + 1,
+                    (nincs * (npkgs + 1) + 1) * nversions))
+                print(desc)
+        except KeyboardInterrupt:
+                sys.exit(0)
+        finally:
+                shutil.rmtree(root, True)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
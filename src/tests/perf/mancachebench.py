@@ -0,0 +1,141 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+#
+# mancachebench - benchmark walking the file and directory actions of
+# factored manifests by parsing their cache files, by loading the binary form
+# of the cache files, and from the in-memory action cache
+#
+# Each round walks every manifest the way planning walks the installed
+# manifests, creating a new FactoredManifest for each one.
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pkg.manifest as manifest
+
+def usage():
+        print("usage: mancachebench.py [-n npkgs] [-a nactions] [-r rounds]",
+            file=sys.stderr)
+        sys.exit(2)
+
+def build_manifests(root, npkgs, nactions):
+        """Create 'npkgs' factored manifests, each with 'nactions' file and
+        directory actions, in 'root'."""
+
+        for i in range(npkgs):
+                lines = ["set name=pkg.fmri value=pkg:/bench/pkg{0:d}@1.0".format(
+                    i)]
+                for j in range(nactions):
+                        if j % 5 == 0:
+                                lines.append("dir group=bin mode=0755 "
+                                    "owner=root path=opt/pkg{0:d}/d{1:d}".format(
+                                    i, j))
+                                continue
+                        lines.append("file {2:040x} group=bin mode=0644 "
+                            "owner=root path=opt/pkg{0:d}/d{1:d}/f "
+                            "pkg.csize=1234 pkg.size=5678 "
+                            "variant.arch=i386".format(i, j - j % 5, j))
+                manifest.FactoredManifest("bench/pkg{0:d}@1.0".format(i),
+                    os.path.join(root, str(i)), contents="\n".join(lines))
+
+def walk(root, npkgs):
+        """Walk the file and directory actions of every manifest in 'root'
+        and return the time taken."""
+
+        start = time.time()
+        for i in range(npkgs):
+                m = manifest.FactoredManifest("bench/pkg{0:d}@1.0".format(i),
+                    os.path.join(root, str(i)))
+                for atype in ("file", "dir"):
+                        for a in m.gen_actions_by_type(atype):
+                                pass
+        return time.time() - start
+
+def remove_bin(root):
+        for dirpath, dirnames, filenames in os.walk(root):
+                for f in filenames:
+                        if f.endswith(".bin"):
+                                os.unlink(os.path.join(dirpath, f))
+
+if __name__ == "__main__":
+        gettext.install("pkg", "/usr/share/locale")
+
+        npkgs = 200
+        nactions = 200
+        rounds = 5
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "a:n:r:")
+                for opt, arg in opts:
+                        if opt == "-a":
+                                nactions = int(arg)
+                        elif opt == "-n":
+                                npkgs = int(arg)
+                        elif opt == "-r":
+                                rounds = int(arg)
+        except (getopt.GetoptError, ValueError):
+                usage()
+
+        cache = manifest.FactoredManifest.action_cache
+        root = tempfile.mkdtemp(prefix="mancachebench.")
+        try:
+                build_manifests(root, npkgs, nactions)
+
+                text = []
+                binary = []
+                memory = []
+                for i in range(rounds):
+                        # Walking without the binary files writes them.
+                        remove_bin(root)
+                        cache.clear()
+                        text.append(walk(root, npkgs))
+                        cache.clear()
+                        binary.append(walk(root, npkgs))
+                        memory.append(walk(root, npkgs))
+
+                for name, times in (("text", text), ("binary", binary),
+                    ("action cache", memory)):
+                        print("{0:>20f} {1} ({2:d} packages, {3:d} "
+                            "actions)".format(min(times), name, npkgs,
+                            npkgs * nactions))
+                print(cache)
+        except KeyboardInterrupt:
+                sys.exit(0)
+        finally:
+                shutil.rmtree(root, True)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
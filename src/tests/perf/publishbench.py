@@ -0,0 +1,146 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+#
+# publishbench - benchmark publishing a package with many files to a
+# filesystem repository, the way 'pkgsend publish -j jobs' does
+#
+# Each round publishes the package to a new repository, so every file is
+# hashed, compressed and stored.
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import gettext
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import pkg.actions as actions
+import pkg.client.transport.transport as transport
+import pkg.publish.transaction as trans
+import pkg.server.repository as sr
+
+def usage():
+        print("usage: publishbench.py [-n nfiles] [-j jobs[,jobs...]] "
+            "[-r rounds]", file=sys.stderr)
+        sys.exit(2)
+
+def build_proto(root, nfiles):
+        """Create 'nfiles' files, of up to 64k of text, in 'root' and return the
+        manifest lines of the package delivering them."""
+
+        words = [
+            "".join(random.choice("abcdefghij") for i in range(8))
+            for j in range(1000)
+        ]
+        lines = []
+        for i in range(nfiles):
+                d = "d{0:d}".format(i // 100)
+                if i % 100 == 0:
+                        os.mkdir(os.path.join(root, d))
+                        lines.append("dir group=bin mode=0755 owner=root "
+                            "path=opt/{0}".format(d))
+                path = "{0}/f{1:d}".format(d, i)
+                with open(os.path.join(root, path), "w") as f:
+                        f.write(" ".join(random.choice(words)
+                            for j in range(random.randint(1, 7200))))
+                lines.append("file {0} group=bin mode=0644 owner=root "
+                    "path=opt/{0}".format(path))
+        return lines
+
+def publish(root, lines, repodir, jobs):
+        """Publish the package described by 'lines' from 'root' to a new
+        repository at 'repodir' and return the time taken."""
+
+        sr.repository_create(repodir, properties={
+            "publisher": { "prefix": "bench" } })
+        repo_uri = "file://" + repodir
+        xport, xport_cfg = transport.setup_transport()
+        pub = transport.setup_publisher(repo_uri, "bench", xport, xport_cfg,
+            remote_prefix=True)
+
+        start = time.time()
+        t = trans.Transaction(repo_uri, pkg_name="bench@1.0", xport=xport,
+            pub=pub)
+        t.open()
+        queued = []
+        for l in lines:
+                a = actions.fromstr(l)
+                path = None
+                if a.has_payload:
+                        path = actions.set_action_data(a.hash, a,
+                            basedirs=[root])[0]
+                queued.append((a, path))
+        t.add_actions(queued, jobs=jobs)
+        t.close(add_to_catalog=False)
+        return time.time() - start
+
+if __name__ == "__main__":
+        gettext.install("pkg", "/usr/share/locale")
+
+        nfiles = 20000
+        jobs = [1, 2, 4]
+        rounds = 3
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "j:n:r:")
+                for opt, arg in opts:
+                        if opt == "-j":
+                                jobs = [int(j) for j in arg.split(",")]
+                        elif opt == "-n":
+                                nfiles = int(arg)
+                        elif opt == "-r":
+                                rounds = int(arg)
+        except (getopt.GetoptError, ValueError):
+                usage()
+
+        root = tempfile.mkdtemp(prefix="publishbench.")
+        try:
+                proto = os.path.join(root, "proto")
+                os.mkdir(proto)
+                lines = build_proto(proto, nfiles)
+
+                for j in jobs:
+                        times = []
+                        for i in range(rounds):
+                                repodir = os.path.join(root, "repo")
+                                times.append(publish(proto, lines, repodir, j))
+                                shutil.rmtree(repodir)
+                        print("{0:>20f} {1:d} jobs ({2:d} files)".format(
+                            min(times), j, nfiles))
+        except KeyboardInterrupt:
+                sys.exit(0)
+        finally:
+                shutil.rmtree(root, True)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
@@ -0,0 +1,199 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+#
+# searchbench - compare the token lookups done by TermQuery using the token
+# byte offset file with those using the binary token index
+#
+# A synthetic index of 'ntokens' tokens is written, and the time taken to
+# load each kind of token dictionary, and to find and decode the entries for
+# exact, prefix and infix glob terms, with and without case sensitivity, and
+# for a suffix glob term, is reported.
+# Each query is run 'rounds' times and the best time is reported.
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pkg.search_storage as ss
+from pkg.choose import choose
+
+def usage():
+        print("usage: searchbench.py [-n ntokens] [-r rounds]",
+            file=sys.stderr)
+        sys.exit(2)
+
+def gen_tokens(ntokens):
+        """Generate sorted tokens and their entries, in the form written to the
+        main dictionary."""
+
+        toks = set()
+        for i in range(ntokens):
+                if i % 3 == 0:
+                        toks.add("usr/lib/lib{0:d}.so.1".format(i))
+                elif i % 3 == 1:
+                        toks.add("Token{0:d}".format(i))
+                else:
+                        toks.add("tok{0:d}".format(i))
+        for i, t in enumerate(sorted(toks)):
+                yield t, [("file", [("path", [(t, [(i % 1000, [i * 40])])])])]
+
+def build_index(d, ntokens):
+        """Write the main dictionary, the token byte offset file and the token
+        index to 'd'."""
+
+        md = ss.IndexStoreMainDict(ss.MAIN_FILE)
+        tbo = ss.IndexStoreDictMutable(ss.BYTE_OFFSET_FILE)
+        ti = ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE)
+
+        md.write_dict_file(d, 1)
+        fh = open(os.path.join(d, ss.MAIN_FILE), "a")
+        tbo.open_out_file(d, 1)
+        ti.open_out_file(d, 1)
+        for tok, entries in gen_tokens(ntokens):
+                off = fh.tell()
+                tbo.write_entity(tok, off)
+                ti.write_entity(tok, off, entries)
+                fh.write(md.transform_main_dict_line(tok, entries))
+        fh.close()
+        tbo.close_file_handle()
+        ti.write_dict_file(d, 1)
+        ti.close_file_handle()
+
+def open_store(d, store):
+        ss.consistent_open([store], d)
+        store.read_dict_file()
+        store.close_file_handle()
+        return store
+
+def ascii_search(d, tbo, term, case_sensitive):
+        """Search as TermQuery does using the token byte offset file."""
+
+        if "*" in term or not case_sensitive:
+                offs = [
+                    tbo.get_id(m)
+                    for m in choose(tbo.get_keys(), term, case_sensitive)
+                ]
+        elif tbo.has_entity(term):
+                offs = [tbo.get_id(term)]
+        else:
+                offs = []
+        md = ss.IndexStoreMainDict(ss.MAIN_FILE)
+        ss.consistent_open([md], d)
+        fh = md.get_file_handle()
+        res = []
+        for o in sorted(offs):
+                fh.seek(o)
+                res.append(md.parse_main_dict_line(fh.readline()))
+        md.close_file_handle()
+        return res
+
+def binary_search(d, ti, term, case_sensitive):
+        """Search as TermQuery does using the token index."""
+
+        if "*" in term or not case_sensitive:
+                idxs = ti.find_glob(term, case_sensitive)
+        else:
+                i = ti.lookup(term)
+                idxs = [] if i is None else [i]
+        # TermQuery also opens the main dictionary.
+        md = ss.IndexStoreMainDict(ss.MAIN_FILE)
+        ss.consistent_open([md], d)
+        res = [(ti.get_token(i), ti.get_entries(i)) for i in idxs]
+        md.close_file_handle()
+        return res
+
+def best(rounds, func, *args):
+        times = []
+        for i in range(rounds):
+                start = time.time()
+                res = func(*args)
+                times.append(time.time() - start)
+        return min(times), res
+
+if __name__ == "__main__":
+        gettext.install("pkg", "/usr/share/locale")
+
+        ntokens = 100000
+        rounds = 5
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "n:r:")
+                for opt, arg in opts:
+                        if opt == "-n":
+                                ntokens = int(arg)
+                        elif opt == "-r":
+                                rounds = int(arg)
+        except (getopt.GetoptError, ValueError):
+                usage()
+
+        d = tempfile.mkdtemp(prefix="searchbench.")
+        try:
+                build_index(d, ntokens)
+
+                t_ascii, tbo = best(rounds, open_store, d,
+                    ss.IndexStoreDictMutable(ss.BYTE_OFFSET_FILE))
+                t_bin, ti = best(rounds, open_store, d,
+                    ss.IndexStoreTokenIndex(ss.TOKEN_INDEX_FILE))
+                print("{0:>20} {1:>12} {2:>12} ({3:d} tokens)".format("",
+                    "ascii", "binary", ti.get_token_count()))
+                print("{0:>20} {1:>12f} {2:>12f}".format("load", t_ascii,
+                    t_bin))
+
+                for label, term, cs in (
+                    ("exact", "tok50000", True),
+                    ("missing", "tok50000x", True),
+                    ("prefix", "tok5000*", True),
+                    ("prefix (-I)", "TOK5000*", False),
+                    ("infix glob", "*5000*", True),
+                    ("infix glob (-I)", "*LIB5000*", False),
+                    ("suffix glob", "*.so.1", True),
+                ):
+                        t_ascii, r_ascii = best(rounds, ascii_search, d, tbo,
+                            term, cs)
+                        t_bin, r_bin = best(rounds, binary_search, d, ti,
+                            term, cs)
+                        if sorted(r_ascii) != sorted(r_bin):
+                                raise RuntimeError("results differ for "
+                                    "{0}".format(term))
+                        print("{0:>20} {1:>12f} {2:>12f} ({3:d} "
+                            "matches)".format(label, t_ascii, t_bin,
+                            len(r_bin)))
+        except KeyboardInterrupt:
+                sys.exit(0)
+        finally:
+                shutil.rmtree(d, True)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
@@ -0,0 +1,163 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+#
+# solverbench - benchmark solver runs without a solver cache, with a cold
+# (empty) solver cache, and with a warm solver cache
+#
+# Each run installs a package which transitively depends on every other
+# package in a synthetic catalog, so the solver has to evaluate the
+# dependencies and variants of every package version.
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pkg.catalog as catalog
+import pkg.client.pkg_solver as pkg_solver
+import pkg.client.progress as progress
+import pkg.fmri as fmri
+import pkg.manifest as manifest
+import pkg.variant as variant
+
+PKG_NAME = "pkg://bench/bench/pkg{0:d}@0.5.11,5.11-0.{1:d}:20200101T000000Z"
+
+def usage():
+        print("usage: solverbench.py [-n npkgs] [-v nversions] [-r rounds]",
+            file=sys.stderr)
+        sys.exit(2)
+
+def build_catalog(meta_root, npkgs, nversions):
+        """Create a synthetic catalog with 'npkgs' package stems, each with
+        'nversions' versions, in 'meta_root'.  Each package depends on the
+        next three packages, one of them only for the sparc variant."""
+
+        cat = catalog.Catalog(batch_mode=True, meta_root=meta_root,
+            sign=False)
+        for i in range(npkgs):
+                for v in range(nversions):
+                        f = fmri.PkgFmri(PKG_NAME.format(i, v))
+                        lines = [
+                            "set name=pkg.fmri value={0}".format(f),
+                            "set name=variant.arch value=i386 value=sparc",
+                        ]
+                        for n, arch in ((i + 1, None), (i + 2, None),
+                            (i + 3, "sparc")):
+                                if n >= npkgs:
+                                        continue
+                                dep = "depend type=require " \
+                                    "fmri=bench/pkg{0:d}@0.5.11".format(n)
+                                if arch:
+                                        dep += " variant.arch={0}".format(arch)
+                                lines.append(dep)
+                        m = manifest.Manifest(f)
+                        m.set_content(content="\n".join(lines))
+                        cat.add_package(f, manifest=m)
+        cat.finalize()
+        cat.save()
+
+def solve(root, nversions, cache_path):
+        """Solve an install of the first package in the catalog at 'root'
+        and return the time taken, using the solver cache at 'cache_path' if
+        it is not None."""
+
+        start = time.time()
+        cat = catalog.Catalog(meta_root=root, read_only=True)
+        variants = variant.Variants({ "variant.arch": "i386" })
+        excludes = [variants.allow_action]
+
+        cache = None
+        if cache_path:
+                cache = pkg_solver.SolverCache(cache_path, cat, excludes,
+                    sorted(variants.items()))
+
+        solver = pkg_solver.PkgSolver(cat, {}, { "bench": (1, True, True) },
+            variants, set(), None, progress.NullProgressTracker(),
+            cache=cache)
+        f = fmri.PkgFmri(PKG_NAME.format(0, nversions - 1))
+        solver.solve_install([], { f.pkg_name: [f] }, excludes=excludes)
+        if cache:
+                cache.save()
+        return time.time() - start
+
+if __name__ == "__main__":
+        gettext.install("pkg", "/usr/share/locale")
+
+        npkgs = 500
+        nversions = 5
+        rounds = 5
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "n:r:v:")
+                for opt, arg in opts:
+                        if opt == "-n":
+                                npkgs = int(arg)
+                        elif opt == "-r":
+                                rounds = int(arg)
+                        elif opt == "-v":
+                                nversions = int(arg)
+        except (getopt.GetoptError, ValueError):
+                usage()
+
+        # The solver may require significant recursion for long dependency
+        # chains; see ImagePlan.__run_solver().
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 3000))
+
+        root = tempfile.mkdtemp(prefix="solverbench.")
+        try:
+                build_catalog(root, npkgs, nversions)
+                cache_path = os.path.join(root, "solver.cache")
+
+                nocache = []
+                cold = []
+                warm = []
+                for i in range(rounds):
+                        nocache.append(solve(root, nversions, None))
+                        if os.path.exists(cache_path):
+                                os.unlink(cache_path)
+                        cold.append(solve(root, nversions, cache_path))
+                        warm.append(solve(root, nversions, cache_path))
+
+                for name, times in (("no cache", nocache),
+                    ("cold cache", cold), ("warm cache", warm)):
+                        print("{0:>20f} {1} ({2:d} packages, {3:d} "
+                            "versions)".format(min(times), name, npkgs,
+                            npkgs * nversions))
+        except KeyboardInterrupt:
+                sys.exit(0)
+        finally:
+                shutil.rmtree(root, True)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
@@ -0,0 +1,166 @@
+#!/usr/bin/python3.5
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright 2020 OmniOS Community Edition (OmniOSce) Association.
+#
+
+#
+# xferbench - compare the rate at which the client transport engine retrieves
+# files from a depot over HTTP/1.1 and over multiplexed HTTP/2 connections
+#
+# Every file in the list of file hashes is retrieved 'rounds' times through
+# the file/0 operation, first with HTTP/2 disabled and then with it enabled,
+# and the number of files and bytes transferred per second are reported for
+# each.  The list of hashes is read from standard input, one per line.
+#
+# pkg.depotd only speaks HTTP/1.1, so a stand-in depot which can also speak
+# HTTP/2 is made by placing a TLS terminating proxy in front of it, which
+# limits the number of connections made to the depot to fewer than the number
+# of depot threads; e.g.:
+#
+#     /usr/lib/pkg.depotd -d <repo> -p 10000 &
+#     openssl req -x509 -newkey rsa:2048 -nodes -subj /CN=localhost \
+#         -keyout key.pem -out cert.pem
+#     nghttpx -f127.0.0.1,8443 -b127.0.0.1,10000 \
+#         --backend-connections-per-frontend=20 key.pem cert.pem &
+#     find <repo>/publisher/<pub>/file -type f | xargs -n1 basename | \
+#         xferbench.py -C cert.pem https://localhost:8443/<pub>
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pkg.client.publisher as publisher
+import pkg.client.transport.engine as engine
+import pkg.client.transport.transport as transport
+from pkg.client import global_settings
+from pkg.client.debugvalues import DebugValues
+
+def usage():
+        print("usage: xferbench.py [-c max_conn] [-r rounds] [-s max_streams] "
+            "[-C cafile] depot_url < hashes", file=sys.stderr)
+        sys.exit(2)
+
+class BenchTransport(transport.Transport):
+        """A transport which trusts the certificates in 'cafile'."""
+
+        def __init__(self, cafile):
+                transport.Transport.__init__(self,
+                    transport.GenericTransportCfg())
+                self.__cadir = os.path.dirname(os.path.abspath(cafile))
+
+        def get_ca_dir(self):
+                return self.__cadir
+
+def fetch(xport, repouri, hashes, rounds, max_conn, d):
+        """Retrieve each file in 'hashes' from 'repouri' 'rounds' times using
+        a new transport engine, and return the number of files and bytes
+        received, and the time taken."""
+
+        eng = engine.CurlTransportEngine(xport, max_conn=max_conn)
+        base = repouri.uri.rstrip("/")
+        nfiles = 0
+        nbytes = 0
+        start = time.time()
+        for i in range(rounds):
+                for h in hashes:
+                        eng.add_url("{0}/file/0/{1}".format(base, h),
+                            filepath=os.path.join(d, h), repourl=base,
+                            failonerror=True)
+                while eng.pending:
+                        eng.run()
+                        failures = eng.check_status()
+                        if failures:
+                                raise failures[0]
+                for h in hashes:
+                        nbytes += os.stat(os.path.join(d, h)).st_size
+                        os.unlink(os.path.join(d, h))
+                nfiles += len(hashes)
+        elapsed = time.time() - start
+        eng.shutdown()
+        return nfiles, nbytes, elapsed
+
+if __name__ == "__main__":
+        gettext.install("pkg", "/usr/share/locale")
+
+        max_conn = 20
+        rounds = 1
+        cafile = None
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "c:r:s:C:")
+                for opt, arg in opts:
+                        if opt == "-c":
+                                max_conn = int(arg)
+                        elif opt == "-r":
+                                rounds = int(arg)
+                        elif opt == "-s":
+                                global_settings.client_http2_max_streams = \
+                                    int(arg)
+                        elif opt == "-C":
+                                cafile = arg
+        except (getopt.GetoptError, ValueError):
+                usage()
+        if len(pargs) != 1:
+                usage()
+
+        hashes = [l.strip() for l in sys.stdin if l.strip()]
+        if not hashes:
+                usage()
+
+        if cafile:
+                DebugValues["ssl_ca_file"] = cafile
+                xport = BenchTransport(cafile)
+        else:
+                xport, xport_cfg = transport.setup_transport()
+        repouri = publisher.TransportRepoURI(pargs[0])
+        xport.stats.get_repostats([repouri])
+
+        if not engine.http2_supported():
+                print("libcurl does not support HTTP/2", file=sys.stderr)
+
+        d = tempfile.mkdtemp(prefix="xferbench.")
+        try:
+                for label, http2 in (("HTTP/1.1", False), ("HTTP/2", True)):
+                        global_settings.client_http2 = http2
+                        nfiles, nbytes, elapsed = fetch(xport, repouri,
+                            hashes, rounds, max_conn, d)
+                        print("{0:>10} {1:>12f} files/s {2:>10f} MB/s "
+                            "({3:d} files, {4:d} bytes)".format(label,
+                            nfiles / elapsed, nbytes / elapsed / (1024 * 1024),
+                            nfiles, nbytes))
+        except KeyboardInterrupt:
+                sys.exit(0)
+        finally:
+                shutil.rmtree(d, True)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker